@@ -152,3 +152,84 @@ LOGGING = {
         },
     }
 }
+
+# ----- Sensor Reading Database settings
+
+# SQLite settings used for connections to the sensor reading database.  Connections
+# are reused by all requests handled by one thread.  In WAL journal mode, report
+# and API reads do not block behind ingest commits, and the reverse.  See the
+# SQLite PRAGMA documentation for the meaning of these values.
+BMSAPP_READING_DB_JOURNAL_MODE = 'WAL'
+BMSAPP_READING_DB_SYNCHRONOUS = 'NORMAL'
+BMSAPP_READING_DB_BUSY_TIMEOUT = 30000      # milliseconds to wait for a lock
+BMSAPP_READING_DB_MMAP_SIZE = 268435456     # bytes of memory-mapped I/O
+BMSAPP_READING_DB_CACHE_SIZE = -65536       # negative values are KiB of page cache
+
+# Storage engine used when a new reading database is created: 'table_per_sensor'
+# stores each sensor's readings in its own table; 'single_table' stores all readings
+# in one table keyed by an integer sensor key.  Use the 'migrate_reading_storage'
+# script to convert an existing reading database.
+BMSAPP_READING_DB_STORAGE = 'table_per_sensor'
+
+# Number of shard files that the sensors of a new reading database are spread across.
+# SQLite allows one writer at a time per database file, so readings for sensors in
+# different shards can be stored in parallel.  Each shard is a complete reading
+# database in a 'shard_NN' directory next to the main file.  A value of 1 keeps all
+# readings in one file.  Existing databases are not changed; use the
+# 'migrate_reading_storage' script to convert one.
+BMSAPP_READING_DB_SHARDS = 1
+
+# How a new sensor's shard is chosen: 'hash' uses a hash of the Sensor ID, 'building'
+# keeps the sensors of a building together (sensors not yet assigned to a building
+# use the hash).
+BMSAPP_READING_DB_SHARD_BY = 'hash'
+
+# Readings older than this many days are moved out of the reading database into
+# compressed Parquet files, one per sensor per month, in a directory next to the
+# reading database ('bms_data_archive' for the standard database).  The cutoff is
+# rounded back to the start of a month.  Archived readings are still returned by
+# the reading queries.  Set to None to disable archiving.
+BMSAPP_READING_ARCHIVE_DAYS = None
+
+# Number of seconds the latest reading of a sensor, read from the '_latest' table of
+# the reading database, is cached in each process.  Readings stored by the process
+# are seen immediately; readings stored by other processes are seen after the
+# cached value expires.  Set to 0 to disable the cache.
+BMSAPP_READING_DB_LATEST_CACHE_SECONDS = 0
+
+# Number of seconds the transform settings of a Sensor, and the list of Sensors that
+# have Alert Conditions, are cached in each process for handling incoming readings.
+# Changes saved through this process clear the cache right away; changes saved by
+# other processes are seen after this time.
+BMSAPP_SENSOR_CACHE_SECONDS = 60
+
+# Number of worker threads in each process that check the Alert Conditions of Sensors
+# that have received new readings.
+BMSAPP_NEW_READING_HOOK_WORKERS = 4
+
+# If True, the reading store views only parse the posted readings and append them to a
+# durable spool file, and the 'spool_writer' script stores them in the reading database
+# in large batches.  Run the script as a long-running service:
+#     manage.py runscript spool_writer
+# The main_cron script also drains the spool if that service is not running.
+BMSAPP_INGEST_SPOOL = False
+# Path to the spool file.  None uses 'ingest_spool.sqlite' in the reading database
+# 'data' directory.
+BMSAPP_INGEST_SPOOL_FILE = None
+# The writer stores a batch when this many readings are waiting, or when the oldest
+# waiting reading has waited BMSAPP_INGEST_SPOOL_FLUSH_SECONDS, whichever comes first.
+BMSAPP_INGEST_SPOOL_FLUSH_READINGS = 5000
+BMSAPP_INGEST_SPOOL_FLUSH_SECONDS = 2.0
+
+# If True, each process buffers the LoRa gateway diagnostic records in memory and
+# appends them to the LoRa diagnostic database in batches.  If False, or if the
+# database cannot be written, records go through the rotating gateway log files,
+# which are copied into the database every 30 seconds.
+BMSAPP_LORA_DIAG_BUFFERED = True
+# A batch is stored when this many records are waiting, or when the oldest waiting
+# record has waited BMSAPP_LORA_DIAG_FLUSH_SECONDS, whichever comes first.
+BMSAPP_LORA_DIAG_FLUSH_RECORDS = 5000
+BMSAPP_LORA_DIAG_FLUSH_SECONDS = 30.0
+# Maximum number of records buffered in each process.  When the buffer is full,
+# new records are written to the gateway log files.
+BMSAPP_LORA_DIAG_MAX_RECORDS = 50000
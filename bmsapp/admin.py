@@ -6,7 +6,7 @@ from bmsapp.models import Building, Sensor, SensorGroup, BldgToSensor, Dashboard
 from bmsapp.models import MultiBuildingChart, ChartBuildingInfo, CustomReport
 from bmsapp.models import Organization, BuildingGroup, BuildingMode
 from bmsapp.models import AlertCondition, AlertRecipient, AlertRecipientGroup, PeriodicScript
-from bmsapp.models import FuelRate, ElectricRate
+from bmsapp.models import FuelRate, ElectricRate, RetentionPolicy
 from django.contrib import admin
 from django.contrib import messages
 from django.forms import TextInput, Textarea
@@ -350,6 +350,10 @@ class FuelRateAdmin(admin.ModelAdmin):
 class ElectricRateAdmin(admin.ModelAdmin):
     list_display = ('title',)
 
+@admin.register(RetentionPolicy)
+class RetentionPolicyAdmin(admin.ModelAdmin):
+    list_display = ('title', 'raw_days', 'average1_minutes', 'average1_days', 'average2_minutes')
+
 from django.contrib.admin.models import LogEntry
 from django.utils.html import format_html
 
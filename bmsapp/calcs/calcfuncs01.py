@@ -253,14 +253,9 @@ class CalcReadingFuncs_01(calcreadings.CalcReadingFuncs_base):
         
         # get the On/Off values starting two hours prior to this in order to capture at least
         # one state change prior to last_ts.  Put these in a Pandas series
-        ts_state = []
-        state = []
-        for rec in self.db.rowsForOneID(onOffID, start_tm=last_ts - 7200):
-            ts_state.append(rec['ts'])
-            if state_xform_func:
-                state.append(state_xform_func(rec['val']))
-            else:
-                state.append(rec['val'])
+        ts_state, state = self.db.arraysForOneID(onOffID, start_ts=last_ts - 7200)
+        if state_xform_func:
+            state = [state_xform_func(val) for val in state]
         states = pd.Series(state, index=ts_state)
         
         # must be at least two records to produce runtime data
@@ -40,14 +40,9 @@ class CalculateReadings:
         Returns timestamp and values numpy arrays for the sensor with an
         ID of 'sensorID' and having timestamps greater than 'start_ts'.
         """
-        ts = []
-        vals = []
         # in statement below, need to add 1 second to start_ts because the
-        # 'rowsForOneID' method uses a >= test.
-        for flds in self.db.rowsForOneID(sensorID, start_tm=start_ts+1):
-            ts.append(flds['ts'])
-            vals.append(flds['val'])
-        return np.array(ts), np.array(vals)
+        # 'arraysForOneID' method uses a >= test.
+        return self.db.arraysForOneID(sensorID, start_ts=start_ts+1)
 
     
     def getDFofSyncedValues(self, input_ids, calc_id=None, earliest_time=0):
@@ -238,7 +233,7 @@ class CalculateReadings:
             vals = list(map(float, vals))
         
         # insert the records into the database.
-        self.db.insert_reading(ts, len(ts)*[calc_id], vals)  
+        self.db.insert_reading_batch(ts, len(ts)*[calc_id], vals)
             
         return len(ts)
     
@@ -5,17 +5,55 @@ Transform functions for scaling and transforming sensor readings
 
 from math import *
 import sys
+import inspect
 import logging
+import functools
 import yaml
-
-from bmsapp import models
+import numpy as np
 
 # Make a logger for this module
 _logger = logging.getLogger('bms.' + __name__)
 
 
+# NumPy versions of the one-argument 'math' functions, used in place of them when an
+# expression is applied to an array of values.
+ARRAY_MATH = {name: getattr(np, name) for name in
+              ('sqrt', 'exp', 'log', 'log10', 'sin', 'cos', 'tan', 'floor', 'ceil', 'fabs', 'degrees', 'radians')}
+
+@functools.lru_cache(maxsize=1024)
+def load_params(trans_params):
+    '''
+    Returns the dictionary of transform parameters in the YAML string 'trans_params'
+    (an empty dictionary for an empty string).  Each distinct string is only parsed
+    once; the returned dictionary is shared, so it must not be modified.
+    '''
+    params = yaml.load(trans_params, Loader=yaml.FullLoader)
+    return {} if params is None else params
+
+@functools.lru_cache(maxsize=1024)
+def compile_expression(expression):
+    '''
+    Returns the code object for the Python expression string 'expression'.  Each
+    distinct expression is only compiled once.
+    '''
+    return compile(expression, '<transform>', 'eval')
+
+@functools.lru_cache(maxsize=1)
+def expression_params():
+    '''
+    Returns a dictionary of the parameters accepted by an expression transform and
+    their default values (see Transformer._eval_expression()).
+    '''
+    sig = inspect.signature(Transformer._eval_expression)
+    return {name: p.default for name, p in sig.parameters.items() if p.default is not p.empty}
+
+
 class Transformer:
 
+    # Transform functions that give the same results when the 'ts' and 'val' arguments
+    # are NumPy arrays of readings.  See transform_values().
+    ARRAY_FUNCS = ('linear',)
+
     def __init__(self, db=None):
         '''
         Creates Transforms object.  'db' is the a bmsdata.BMSdata object that gives
@@ -36,16 +74,75 @@ class Transformer:
         All three elements of the reading--ts, id, and val--can be transformed by the function.
         '''
         
-        params = yaml.load(trans_params, Loader=yaml.FullLoader)
-        if params is None:
-            params = {}    # substitute an empty dictionary for empty parameter string
+        params = load_params(trans_params)
         if hasattr(self, trans_func.strip()):
             the_func = getattr(self, trans_func.strip())
             return the_func(ts, id, val, **params)
         else:
             # the transform must be a general expression.
             return self._eval_expression(ts, id, val, trans_func, **params)
-            
+
+    def transform_values(self, ts, id, vals, trans_func, trans_params):
+        '''
+        Batch version of transform_value() for many readings of the sensor 'id'.  'ts' and
+        'vals' are equal-length sequences or NumPy arrays of the timestamps and values.
+        Returns a list of the transformed (ts, id, val) tuples, the same as calling
+        transform_value() for each reading in order.  The functions in ARRAY_FUNCS and
+        expressions that do not use 'rate' are applied to the whole array of values at
+        once, with the common 'math' functions replaced by their NumPy versions (see
+        ARRAY_MATH).  Other transforms, expressions that can't be applied to an array
+        (for example, ones using 'if') or that have unknown parameters, and readings
+        whose array result is NaN or infinite although their value is finite, are
+        transformed one reading at a time; a reading whose transform raises an exception
+        is then logged and left out.
+        '''
+        ts = list(ts.tolist() if isinstance(ts, np.ndarray) else ts)
+        vals = list(vals.tolist() if isinstance(vals, np.ndarray) else vals)
+        func_name = trans_func.strip()
+        expr_clean = func_name.lower()
+        params = load_params(trans_params)
+        is_array_func = func_name in self.ARRAY_FUNCS
+        # an expression with unknown parameters raises a TypeError for each reading below
+        is_array_expr = (not hasattr(self, func_name) and 'rate' not in expr_clean and
+                         set(params) <= set(expression_params()))
+        new_vals = None
+        if len(vals) > 1 and (is_array_func or is_array_expr):
+            try:
+                ts_arr = np.array(ts)
+                val_arr = np.array(vals, dtype=float)
+                with np.errstate(all='ignore'):
+                    if is_array_func:
+                        new_ts, _, new_vals = getattr(self, func_name)(ts_arr, id, val_arr, **params)
+                    else:
+                        namespace = dict(ARRAY_MATH)
+                        namespace.update(expression_params())
+                        namespace.update(params)
+                        namespace.update(self=self, ts=ts_arr, id=id, val=val_arr, expression=trans_func)
+                        new_ts, new_vals = ts_arr, eval(compile_expression(expr_clean), globals(), namespace)
+                new_ts = np.broadcast_to(np.asarray(new_ts), val_arr.shape).tolist()
+                new_vals = np.broadcast_to(np.asarray(new_vals, dtype=float), val_arr.shape)
+                # A non-finite result from a finite value is where the 'math' functions and
+                # Python arithmetic raise (e.g. 1/0 or sqrt(-1)); redo those readings below.
+                redo = (~np.isfinite(new_vals) & np.isfinite(val_arr)).tolist()
+                new_vals = new_vals.tolist()
+                if not any(redo):
+                    return list(zip(new_ts, [id] * len(vals), new_vals))
+            except Exception:
+                # not an array expression; transform the readings one at a time below
+                new_vals = None
+
+        results = []
+        for i, (one_ts, one_val) in enumerate(zip(ts, vals)):
+            if new_vals is not None and not redo[i]:
+                results.append((new_ts[i], id, new_vals[i]))
+                continue
+            try:
+                results.append(self.transform_value(one_ts, id, one_val, trans_func, trans_params))
+            except Exception:
+                _logger.exception('Error transforming %s, %s, %s' % (one_ts, id, one_val))
+        return results
+
+
     def _eval_expression(self, ts, id, val, expression, 
                          rollover=2**16,
                          max_rate=5.0,
@@ -87,17 +184,17 @@ class Transformer:
             raw_id = id + '_raw'
             val_conv = val          # default is no transform of the value
 
-            # get the Sensor object, if available, to see if there is a transform function to apply
-            # to the raw count
-            sensors = models.Sensor.objects.filter( sensor_id=raw_id )
-            if len(sensors) > 0: 
-                # look at the first sensor (there only should be one).  Don't do a transform if this
-                # is a calculated field
-                if not sensors[0].is_calculated:
-                    transform_func = sensors[0].tran_calc_function
+            # get the Sensor fields, if available, to see if there is a transform function to apply
+            # to the raw count.  Imported here to avoid a circular import.
+            from bmsapp.storereads import transform_cache
+            sensor = transform_cache.get(raw_id)
+            if sensor is not None:
+                # Don't do a transform if this is a calculated field
+                is_calculated, transform_func, _ = sensor
+                if not is_calculated:
                     transform_func = transform_func.strip().lower()
                     if len(transform_func):
-                        val_conv = eval(transform_func)
+                        val_conv = eval(compile_expression(transform_func))
 
             self.db.insert_reading(ts, raw_id, val_conv)
 
@@ -147,7 +244,7 @@ class Transformer:
                 
                 # Stamp the reading at the average of the current and last
                 # timestamp.
-                return int((ts + last_ts)/2.0), id, eval(expr_clean)
+                return int((ts + last_ts)/2.0), id, eval(compile_expression(expr_clean))
                 
             else:
                 # there was no last reading in database
@@ -156,7 +253,7 @@ class Transformer:
             
         else:
             # Just a simple transformation of the value
-            return ts, id, eval(expr_clean)
+            return ts, id, eval(compile_expression(expr_clean))
         
 
     # ******** Add Transform Functions below Here *********
@@ -95,16 +95,11 @@ def histogram_from_series(pandas_series):
     # to 4 significant figures
     return list(zip(avg_bins, cts))
 
-def resample_timeseries(pandas_dataframe, averaging_hours, use_rolling_averaging=False, drop_na=True, interp_method='pad'):
+def averaging_params(averaging_hours):
     '''
-    Returns a new pandas dataframe that is resampled at the specified "averaging_hours"
-    interval.  If the 'averaging_hours' parameter is fractional, the averaging time 
-    period is truncated to the lesser minute.
-    If 'drop_na' is True, rows with any NaN values are dropped.
-    
-    For some reason the pandas resampling sometimes fails if the datetime index is timezone aware...
+    Returns a dictionary holding the pandas resampling 'rule' and the index label
+    offset 'loffset' used to average readings over 'averaging_hours' hours.
     '''
-
     interval_lookup = {
         0.5: {'rule':'30min', 'loffset': '15min'}, 
         1: {'rule': '1H', 'loffset': '30min'},
@@ -116,7 +111,19 @@ def resample_timeseries(pandas_dataframe, averaging_hours, use_rolling_averaging
         720: {'rule': '1M', 'loffset': '16D'},
         8760: {'rule': 'AS', 'loffset': '6M'}
         }
-    params = interval_lookup.get(averaging_hours, {'rule':str(int(averaging_hours * 60)) + 'min', 'loffset':str(int(averaging_hours * 30)) + 'min'})
+    return interval_lookup.get(averaging_hours, {'rule':str(int(averaging_hours * 60)) + 'min', 'loffset':str(int(averaging_hours * 30)) + 'min'})
+
+def resample_timeseries(pandas_dataframe, averaging_hours, use_rolling_averaging=False, drop_na=True, interp_method='pad'):
+    '''
+    Returns a new pandas dataframe that is resampled at the specified "averaging_hours"
+    interval.  If the 'averaging_hours' parameter is fractional, the averaging time 
+    period is truncated to the lesser minute.
+    If 'drop_na' is True, rows with any NaN values are dropped.
+    
+    For some reason the pandas resampling sometimes fails if the datetime index is timezone aware...
+    '''
+
+    params = averaging_params(averaging_hours)
 
     if not use_rolling_averaging:
         # apply averaging weighted by duration
@@ -135,6 +142,23 @@ def resample_timeseries(pandas_dataframe, averaging_hours, use_rolling_averaging
 
     return dfResampled
 
+def resample_from_rollups(reading_db, sensor_id, averaging_hours, start_ts=None, end_ts=None, tz=None, drop_na=True):
+    '''
+    Returns the readings of 'sensor_id' averaged over 'averaging_hours' hours, like
+    resample_timeseries() applied to reading_db.dataframeForOneID(), but built from
+    the hourly and daily rollups of the Reading database 'reading_db'.  Long time
+    ranges are much faster this way.  Returns None if the averaging period is shorter
+    than one hour or the rollups can't be used for the request; the caller then needs
+    to resample the raw readings.
+    '''
+    if averaging_hours < 1:
+        return None
+    params = averaging_params(averaging_hours)
+    dfResampled = reading_db.dataframeFromRollups(sensor_id, params['rule'], params['loffset'], start_ts, end_ts, tz)
+    if dfResampled is not None and drop_na:
+        dfResampled = dfResampled.dropna()
+    return dfResampled
+
 def weighted_resample_timeseries(pandas_dataframe, averaging, offset, interp_method='pad'):
     '''
     Returns a new pandas dataframe that is resampled at the specified
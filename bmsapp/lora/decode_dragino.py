@@ -2,84 +2,110 @@
 See Javascript LHT65 decoder at:  http://www.dragino.com/downloads/index.php?dir=LHT65/payload_decode/
 """
 import math
-from typing import Dict, Any
+import struct
+from typing import Dict, Any, List
+
+import numpy as np
+
 from .decode_utils import bin16dec, bin8dec
 
+# Precompiled big-endian layouts of the fixed parts of the payloads.
+# LHT65: battery, internal temperature, humidity, external sensor type.
+LHT65 = struct.Struct('>HhHB')
+# LT-22222-L: AV1, AV2 and AC1 channels, digital inputs, mode.
+BOAT_LT2 = struct.Struct('>HHHxxBxB')
+# LWL01, LDDS20 and LDDS75: battery and status word, measurement.
+STATUS_WORDS = struct.Struct('>HH')
+# LSN50: battery, temperature, analog input, status and mode.
+LSN50 = struct.Struct('>HHHB')
+UINT16 = struct.Struct('>H')
+INT16 = struct.Struct('>h')
+UINT32 = struct.Struct('>I')
+
+# NumPy record layout of the start of an LHT65 payload, used by decode_lht65_batch().
+LHT65_DTYPE = {'names': ['bat', 'temp', 'hum', 'ext_type', 'ext'],
+               'formats': ['>u2', '>i2', '>u2', 'u1', '>u2'],
+               'offsets': [0, 2, 4, 6, 7]}
+
 def decode_lht65(data: bytes) -> Dict[str, Any]:
     """Returns a dictionary of enginerring values decoded from a Dragino LHT65 Uplink Payload.
     The payload 'data' is a byte array.
     Converts temperatures to Fahrenheit instead of Celsius like the original Dragino decoder.
     Kept naming of results elements consistent with the Elsys decoder.
     """
-
-    # holds the dictionary of results
-    res = {}
-    int16 = lambda ix: data[ix] << 8 | data[ix + 1]
-
-    # Each of the functions below decodes one sensor type.  The function access the 'data' byte
-    # array parameter from the enclosing 'decode' function.  The following functions also add
-    # key/value elements to the 'res' results dictionary.
-    
-    def temp_int():
-        temp = int16(2)
-        temp = bin16dec(temp) / 100
-        res['temperature'] = temp * 1.8 + 32.0
-
-    def humidity():
-        res['humidity'] = int16(4) / 10
-
-    def vdd():
-        res['vdd'] = (int16(0) & 0x3FFF) / 1000
-
-    def temp_ext():
-        temp = int16(7)
-        # if there is no external temperature sensor connected, the above will return 0x7FFF.
-        # Don't set an output in this case.
-        if temp == 0x7FFF:
-            return
-        temp = bin16dec(temp) / 100
-        res['extTemperature'] = temp * 1.8 + 32.0
-
-    def digital():
-        res['digital'] = data[7]
-        # indicates if transmission was due to an interrupt on the external digital input.
-        res['interrupt'] = data[8]
-
-    def light():
-        res['light'] = int16(7)
-
-    def analog():
-        res['analog'] = int16(7) / 1000
-
-    def pulse():
-        res['pulse'] = int16(7)
-
     # Always decode the internal sensors
-    temp_int()
-    humidity()
-    vdd()
+    bat, temp, hum, ext_sensor = LHT65.unpack_from(data)
+    res = {
+        'temperature': temp / 100 * 1.8 + 32.0,
+        'humidity': hum / 10,
+        'vdd': (bat & 0x3FFF) / 1000,
+    }
 
     # Get the type of external sensor
     # The MSBit indicates whether the cable is OK:  0 = cable OK, 1 = not connected
     # We're masking it here and not transmitting it.
-    ext_sensor = data[6] & 0x7F    
+    ext_sensor &= 0x7F
 
     if ext_sensor == 0:
         # no external sensor
         pass
     elif ext_sensor == 1:
-        temp_ext()
+        # if there is no external temperature sensor connected, the value is 0x7FFF.
+        # Don't set an output in this case.
+        temp = INT16.unpack_from(data, 7)[0]
+        if temp != 0x7FFF:
+            res['extTemperature'] = temp / 100 * 1.8 + 32.0
     elif ext_sensor == 4:
-        digital()
+        res['digital'] = data[7]
+        # indicates if transmission was due to an interrupt on the external digital input.
+        res['interrupt'] = data[8]
     elif ext_sensor == 5:
-        light()
+        res['light'] = UINT16.unpack_from(data, 7)[0]
     elif ext_sensor == 6:
-        analog()
+        res['analog'] = UINT16.unpack_from(data, 7)[0] / 1000
     elif ext_sensor == 7:
-        pulse()
+        res['pulse'] = UINT16.unpack_from(data, 7)[0]
 
     return res
 
+def decode_lht65_batch(payloads: List[bytes]) -> List[Dict[str, Any]]:
+    """Batch version of decode_lht65() for a list of payloads.  Payloads of the same
+    length are decoded together with one NumPy record array; the results are the same
+    as decoding them one at a time.
+    """
+    results = [None] * len(payloads)
+    by_length = {}
+    for ix, data in enumerate(payloads):
+        by_length.setdefault(len(data), []).append(ix)
+    for length, ixs in by_length.items():
+        if length < 9:
+            # too short for the record layout
+            for ix in ixs:
+                results[ix] = decode_lht65(payloads[ix])
+            continue
+        recs = np.frombuffer(b''.join(payloads[ix] for ix in ixs), dtype=np.dtype(dict(LHT65_DTYPE, itemsize=length)))
+        temps = (recs['temp'] / 100 * 1.8 + 32.0).tolist()
+        hums = (recs['hum'] / 10).tolist()
+        vdds = ((recs['bat'] & 0x3FFF) / 1000).tolist()
+        ext_types = (recs['ext_type'] & 0x7F).tolist()
+        exts = recs['ext'].tolist()
+        for ix, temp, hum, vdd, ext_sensor, ext in zip(ixs, temps, hums, vdds, ext_types, exts):
+            res = {'temperature': temp, 'humidity': hum, 'vdd': vdd}
+            if ext_sensor == 1:
+                if ext != 0x7FFF:
+                    res['extTemperature'] = bin16dec(ext) / 100 * 1.8 + 32.0
+            elif ext_sensor == 4:
+                res['digital'] = ext >> 8
+                res['interrupt'] = ext & 0xFF
+            elif ext_sensor == 5:
+                res['light'] = ext
+            elif ext_sensor == 6:
+                res['analog'] = ext / 1000
+            elif ext_sensor == 7:
+                res['pulse'] = ext
+            results[ix] = res
+    return results
+
 def decode_boat_lt2(data: bytes) -> Dict[str, Any]:
     """Decodes the values from a Dragino LT-22222-L sensor, configured
     to do boat monitoring.  The inputs on the LT-22222-L are wired as 
@@ -100,22 +126,22 @@ def decode_boat_lt2(data: bytes) -> Dict[str, Any]:
 
     # holds the dictionary of results
     res = {}
-    int16 = lambda ix: data[ix] << 8 | data[ix + 1]
+    av1, av2, ac1, digital, mode = BOAT_LT2.unpack_from(data)
 
-    if (data[10] & 0x3f) != 1:
+    if (mode & 0x3f) != 1:
         # not in Mode = 1, return with no values
         return res
 
     # ------- Shore Power
-    shoreV = int16(0) / 1000.     # voltage from wall wart in Volts
+    shoreV = av1 / 1000.     # voltage from wall wart in Volts
     res['shorePower'] = 1 if shoreV > 2.9 and shoreV < 7.0 else 0
 
     # ---- Battery voltage
-    batV = int16(2) / 1000.
+    batV = av2 / 1000.
     res['batteryV'] = batV
 
     # ---- Thermistor Temperatuare sensor
-    thermMA = int16(4) / 1000.     # current through thermistor in mA
+    thermMA = ac1 / 1000.     # current through thermistor in mA
 
     # if the thermistor is not present, this current will be low, and do not return
     # a temperature value
@@ -131,10 +157,10 @@ def decode_boat_lt2(data: bytes) -> Dict[str, Any]:
         
     # Digital Inputs have inverted logic, voltage across the input produces a 0.
     # -------- High Water Level
-    res['highWater'] = 0 if data[8] & 0x08 else 1
+    res['highWater'] = 0 if digital & 0x08 else 1
 
     # -------- Bilge Pump
-    res['bilgePump'] = 0 if data[8] & 0x10 else 1
+    res['bilgePump'] = 0 if digital & 0x10 else 1
 
     return res
 
@@ -143,58 +169,61 @@ def decode_lwl01(data: bytes) -> Dict[str, Any]:
     Sensor Uplink Payload.
     The payload 'data' is a byte array.
     """
-
-    # holds the dictionary of results
-    res = {}
-    int16 = lambda ix: data[ix] << 8 | data[ix + 1]
-
-    # Battery voltage
-    res['vdd'] = (int16(0) & 0x3FFF) / 1000
-
-    # Water Presence, 1 = Wet, 0 = Dry
-    res['water'] = 1 if data[0] & 0x40 else 0
-
-    return res
+    status = UINT16.unpack_from(data)[0]
+    return {
+        # Battery voltage
+        'vdd': (status & 0x3FFF) / 1000,
+        # Water Presence, 1 = Wet, 0 = Dry
+        'water': 1 if status & 0x4000 else 0,
+    }
 
 def decode_ldds(data: bytes) -> Dict[str, Any]:
     """Returns a dictionary of engineering values decoded from a Dragino distance measuring
     sensor, including the LDDS20 and the LDDS75.
     The payload 'data' is a byte array.
     """
-
-    # holds the dictionary of results
-    res = {}
-    int16 = lambda ix: data[ix] << 8 | data[ix + 1]
-
-    # Battery voltage
-    res['vdd'] = (int16(0) & 0x3FFF) / 1000
-
-    # Distance in inches
-    res['distance'] = int16(2) / 25.4
-
-    return res
+    status, distance = STATUS_WORDS.unpack_from(data)
+    return {
+        # Battery voltage
+        'vdd': (status & 0x3FFF) / 1000,
+        # Distance in inches
+        'distance': distance / 25.4,
+    }
+
+def decode_ldds_batch(payloads: List[bytes]) -> List[Dict[str, Any]]:
+    """Batch version of decode_ldds() for a list of payloads of the same length, decoded
+    with one NumPy array; other lists are decoded one payload at a time.
+    """
+    lengths = {len(data) for data in payloads}
+    if len(lengths) != 1 or min(lengths) < STATUS_WORDS.size:
+        return [decode_ldds(data) for data in payloads]
+    recs = np.frombuffer(b''.join(payloads), dtype=np.dtype({'names': ['status', 'distance'], 'formats': ['>u2', '>u2'],
+                                                             'offsets': [0, 2], 'itemsize': lengths.pop()}))
+    return [{'vdd': vdd, 'distance': distance}
+            for vdd, distance in zip(((recs['status'] & 0x3FFF) / 1000).tolist(), (recs['distance'] / 25.4).tolist())]
 
 def decode_lsn50(data: bytes) -> Dict[str, Any]:
     """Returns a dictionary of engineering values for the LSN50 sensor.
     The payload 'data' is a byte array.
     """
-    int16 = lambda ix: data[ix] << 8 | data[ix + 1]
+    word0, word2, word4, status = LSN50.unpack_from(data)
+    int16 = lambda ix: UINT16.unpack_from(data, ix)[0]
     temp16 = lambda ix: bin16dec(int16(ix)) * 0.18 + 32.0
 
     res = {}
-    mode = (data[6] & 0x7C) >> 2
+    mode = (status & 0x7C) >> 2
 
     if (mode != 2) and (mode != 31):
-        res['vdd'] = int16(0) / 1000.
-        res['extTemperature1'] = temp16(2)
-        res['analog0'] = int16(4) / 1000.
-        res['digital'] = 1 if (data[6] & 0x02) else 0
+        res['vdd'] = word0 / 1000.
+        res['extTemperature1'] = bin16dec(word2) * 0.18 + 32.0
+        res['analog0'] = word4 / 1000.
+        res['digital'] = 1 if (status & 0x02) else 0
         if mode != 6:
-            res['interrupt'] = data[6] & 0x01
-            res['door'] = 1 if data[6] & 0x80 else 0
+            res['interrupt'] = status & 0x01
+            res['door'] = 1 if status & 0x80 else 0
 
     if mode == 0:
-        if (data[9] << 8 | data[10]) == 0:
+        if int16(9) == 0:
             res['light'] = bin16dec(int16(7))
         else:
             res['temperatureSHT'] = temp16(7)
@@ -207,13 +236,13 @@ def decode_lsn50(data: bytes) -> Dict[str, Any]:
 
     elif mode == 2:
         res['vdd'] = data[11] / 10.
-        res['analog0'] = int16(0) / 1000.
-        res['analog1'] = int16(2) / 1000.
-        res['analog4'] = int16(4) / 1000.
-        res['digital'] = 1 if data[6] & 0x02 else 0
-        res['interrupt'] = data[6] & 0x01
-        res['door'] = 1 if data[6] & 0x80 else 0
-        if (data[9] << 8 | data[10]) == 0:
+        res['analog0'] = word0 / 1000.
+        res['analog1'] = word2 / 1000.
+        res['analog4'] = word4 / 1000.
+        res['digital'] = 1 if status & 0x02 else 0
+        res['interrupt'] = status & 0x01
+        res['door'] = 1 if status & 0x80 else 0
+        if int16(9) == 0:
             res['light'] = bin16dec(int16(7))
         else:
             res['temperatureSHT'] = temp16(7)
@@ -227,11 +256,11 @@ def decode_lsn50(data: bytes) -> Dict[str, Any]:
         res['weight'] = bin16dec(int16(7)) / 453.59
 
     elif mode == 5:
-        res['pulse'] = data[7] << 24 | data[8] << 16 | data[9] << 8 | data[10]
+        res['pulse'] = UINT32.unpack_from(data, 7)[0]
 
     elif mode == 31:
-        res['vdd'] = int16(0) / 1000.
-        res['extTemperature1'] = temp16(2)
+        res['vdd'] = word0 / 1000.
+        res['extTemperature1'] = bin16dec(word2) * 0.18 + 32.0
         res['extTemperature1_min'] = bin8dec(4) * 1.8 + 32.
         res['extTemperature1_max'] = bin8dec(5) * 1.8 + 32.
         res['temperatureSHT_min'] = bin8dec(7) * 1.8 + 32.
@@ -247,38 +276,45 @@ def decode_lsn50(data: bytes) -> Dict[str, Any]:
 
     return res
 
+# Sample payloads (hex) used by the tests below and by the 'lora' benchmark in
+# bmsapp/scripts/benchmark_readingdb.py.
+TEST_LHT65_CASES = (
+    ('CBF60B0D0376010ADD7FFF', {'temperature': 82.922, 'humidity': 88.6, 'vdd': 3.062, 'extTemperature': 82.05799999999999}),
+    ('CB040B55025A0401007FFF', {'temperature': 84.218, 'humidity': 60.2, 'vdd': 2.82, 'digital': 1, 'interrupt': 0}),
+    ('CB060B5B02770400017FFF', {'temperature': 84.326, 'humidity': 63.1, 'vdd': 2.822, 'digital': 0, 'interrupt': 1}),
+    ('CB030B2D027C0501917FFF', {'temperature': 83.49799999999999, 'humidity': 63.6, 'vdd': 2.819, 'light': 401}),
+    ('CB0B0B640272060B067FFF', {'temperature': 84.488, 'humidity': 62.6, 'vdd': 2.827, 'analog': 2.822}),
+    ('CBD50B0502E60700067FFF', {'temperature': 82.778, 'humidity': 74.2, 'vdd': 3.029, 'pulse': 6}),
+)
+
+TEST_BOAT_LT2_CASES = (
+    '300C1806012C0000FFFF01',
+    '300C180600BE000000FF01',
+    '300C180600BE000008FF01',
+    '300C180600BE000018FF01',
+    '300C18060000000018FF01',
+    '300C18060000000018FF02',
+)
+
+TEST_LSN50_CASES = (
+    '0ceeffab01490cffabffab',
+)
+
 def test_lht65():
-    cases = (
-        ('CBF60B0D0376010ADD7FFF', {'temperature': 82.922, 'humidity': 88.6, 'vdd': 3.062, 'extTemperature': 82.05799999999999}),
-        ('CB040B55025A0401007FFF', {'temperature': 84.218, 'humidity': 60.2, 'vdd': 2.82, 'digital': 1, 'interrupt': 0}),
-        ('CB060B5B02770400017FFF', {'temperature': 84.326, 'humidity': 63.1, 'vdd': 2.822, 'digital': 0, 'interrupt': 1}),
-        ('CB030B2D027C0501917FFF', {'temperature': 83.49799999999999, 'humidity': 63.6, 'vdd': 2.819, 'light': 401}),
-        ('CB0B0B640272060B067FFF', {'temperature': 84.488, 'humidity': 62.6, 'vdd': 2.827, 'analog': 2.822}),
-        ('CBD50B0502E60700067FFF', {'temperature': 82.778, 'humidity': 74.2, 'vdd': 3.029, 'pulse': 6}),
-    )
-    for dta, result in cases:
+    for dta, result in TEST_LHT65_CASES:
         res = decode_lht65(bytes.fromhex(dta))
         print(res)
         assert res == result
+    assert decode_lht65_batch([bytes.fromhex(dta) for dta, _ in TEST_LHT65_CASES]) == \
+        [result for _, result in TEST_LHT65_CASES]
 
 def test_boat_lt2():
-    cases = (
-        '300C1806012C0000FFFF01',
-        '300C180600BE000000FF01',
-        '300C180600BE000008FF01',
-        '300C180600BE000018FF01',
-        '300C18060000000018FF01',
-        '300C18060000000018FF02',
-    )
-    for dta in cases:
+    for dta in TEST_BOAT_LT2_CASES:
         res = decode_boat_lt2(bytes.fromhex(dta))
         print(res)
 
 def test_lsn50():
-    cases = (
-        '0ceeffab01490cffabffab',
-    )
-    for dta in cases:
+    for dta in TEST_LSN50_CASES:
         res = decode_lsn50(bytes.fromhex(dta))
         print(res)
 
@@ -1,8 +1,97 @@
 """Module for decoding the Payload from Elsys LoRaWAN sensors.
 See Javascript Elsys decoder at:  https://www.elsys.se/en/elsys-payload/
 """
-from typing import Dict, Any
-from .decode_utils import bin16dec, bin8dec
+import struct
+from typing import Dict, Any, List
+
+def _temp(res, temp):
+    # converts to Fahrenheit.
+    res['temperature'] = temp / 10 * 1.8 + 32.0
+
+def _acc(res, x, y, z):
+    res['accel_x'] = x / 63.0      # converts to Gs
+    res['accel_y'] = y / 63.0
+    res['accel_z'] = z / 63.0
+
+def _gps(res, lat_lo, lat_hi, long_lo, long_hi):
+    res['lat'] = (lat_lo | lat_hi << 16 | (0xFF << 24 if lat_hi & 0x80 else 0)) / 10000
+    res['long'] = (long_lo | long_hi << 16 | (0xFF << 24 if long_hi & 0x80 else 0)) / 10000
+
+def _ext_temp1(res, temp):
+    res['extTemperature'] = temp / 10 * 1.8 + 32.0
+
+def _ir_temp(res, i_temp, e_temp):
+    res['irIntTemperature'] = i_temp / 10 * 1.8 + 32.0
+    res['irExtTemperature'] = e_temp / 10 * 1.8 + 32.0
+
+def _grideye(res, ref, *pixels):
+    res['grideye'] = [ref + pixel / 10.0 for pixel in pixels]
+
+def _sound(res, peak, avg):
+    res['soundPeak'] = peak
+    res['soundAvg'] = avg
+
+def _ext_temp2(res, temp):
+    temp = temp / 10 * 1.8 + 32.0
+    exist_rd = res.get('extTemperature2')
+    if exist_rd is None:
+        # this is the first External Temperature 2 reading.
+        res['extTemperature2'] = temp
+    elif type(exist_rd) == list:
+        # the existing value is already a list of readings.  Append to it.
+        exist_rd.append(temp)
+    else:
+        # one existing reading. make a list.
+        res['extTemperature2'] = [exist_rd, temp]
+
+def _field(name, scale=None):
+    """Returns a function that stores a single unpacked value in the 'name' field,
+    divided by 'scale' if it is given.
+    """
+    if scale is None:
+        def store(res, val):
+            res[name] = val
+    else:
+        def store(res, val):
+            res[name] = val / scale
+    return store
+
+# Maps each sensor data type code to a three-tuple: the precompiled big-endian layout
+# of the sensor data that follows the type code, the number of bytes the sensor data
+# consumes, and the function that adds the decoded values to the results dictionary.
+# The grideye layout reads one byte more than it consumes, like the Elsys decoder.
+DECODERS = {
+    1: (struct.Struct('>h'), 2, _temp),
+    2: (struct.Struct('>B'), 1, _field('humidity')),
+    3: (struct.Struct('>bbb'), 3, _acc),
+    4: (struct.Struct('>H'), 2, _field('light')),
+    5: (struct.Struct('>B'), 1, _field('motion')),
+    6: (struct.Struct('>H'), 2, _field('co2')),
+    # changed from Elsys, result is in Volts not millivolts
+    7: (struct.Struct('>H'), 2, _field('vdd', 1000.)),
+    # changed from Elsys, result is in Volts not millivolts
+    8: (struct.Struct('>H'), 2, _field('analog', 1000.)),
+    9: (struct.Struct('<HBHB'), 6, _gps),
+    10: (struct.Struct('>H'), 2, _field('pulse')),
+    11: (struct.Struct('>I'), 4, _field('pulseAbs')),
+    12: (struct.Struct('>h'), 2, _ext_temp1),
+    13: (struct.Struct('>B'), 1, _field('digital')),
+    14: (struct.Struct('>H'), 2, _field('distance', 25.4)),   # convert to inches
+    15: (struct.Struct('>B'), 1, _field('accMotion')),
+    16: (struct.Struct('>hh'), 4, _ir_temp),
+    17: (struct.Struct('>B'), 1, _field('occupancy')),
+    18: (struct.Struct('>B'), 1, _field('waterleak')),
+    19: (struct.Struct('>65B'), 64, _grideye),
+    20: (struct.Struct('>I'), 4, _field('pressure', 1000)),
+    21: (struct.Struct('>BB'), 2, _sound),
+    22: (struct.Struct('>H'), 2, _field('pulse2')),
+    23: (struct.Struct('>I'), 4, _field('pulseAbs2')),
+    # changed from Elsys, result is in Volts not millivolts
+    24: (struct.Struct('>H'), 2, _field('analog2', 1000.)),
+    25: (struct.Struct('>h'), 2, _ext_temp2),
+    26: (struct.Struct('>B'), 1, _field('digital2')),
+    27: (struct.Struct('>I'), 4, _field('analogUv')),
+}
 
 def decode(data: bytes) -> Dict[str, Any]:
     """Returns a dictionary of enginerring values decoded from an Elsys Uplink Payload.
@@ -21,180 +110,15 @@ def decode(data: bytes) -> Dict[str, Any]:
     # holds the dictionary of results
     res = {}
 
-    def int16(ix: int) -> int:
-        """Returns a 16-bit integer from the 2 bytes starting at index 'ix' in data byte array.
-        """
-        return (data[ix] << 8) | (data[ix + 1])
-
-    # Each of the functions below decodes one sensor type.  The function access the 'data' byte
-    # array parameter from the enclosing 'decode' function.  The following functions also add
-    # key/value elements to the 'res' results dictionary.  Each function takes an index parameter,
-    # which is the index the 'data' array where the sensor data starts; although, the i position
-    # contains the sensor type indicator, so the actual data really starts at the i+1 position.
-    # Each of the functions returns the number of bytes consumed by the actual sensor data (not
-    # counting the 1 byte consumed by the sensor type identifier.)
-
-    def temp(i: int) -> int:
-        # converts to Fahrenheit.
-        temp = int16(i+1)
-        temp = bin16dec(temp) / 10
-        res['temperature'] = temp * 1.8 + 32.0
-        return 2
-
-    def rh(i: int) -> int:
-        res['humidity'] = data[i + 1]
-        return 1
-
-    def acc(i: int) -> int:
-        res['accel_x'] = bin8dec(data[i + 1]) / 63.0      # converts to Gs
-        res['accel_y'] = bin8dec(data[i + 2]) / 63.0
-        res['accel_z'] = bin8dec(data[i + 3]) / 63.0
-        return 3
-
-    def light(i: int) -> int:
-        res['light'] = int16(i+1)
-        return 2
-
-    def motion(i: int) -> int:
-        res['motion'] = (data[i + 1])
-        return 1
-
-    def co2(i: int) -> int:
-        res['co2'] = int16(i+1)
-        return 2
-
-    def vdd(i: int) -> int:
-        # changed from Elsys, result is in Volts not millivolts
-        res['vdd'] = int16(i+1) / 1000.
-        return 2
-
-    def analog1(i: int) -> int:
-        # changed from Elsys, result is in Volts not millivolts
-        res['analog'] = int16(i+1) / 1000.
-        return 2
-
-    def gps(i: int) -> int:
-        res['lat'] = (data[i + 1] | data[i + 2] << 8 | data[i + 3] << 16 | (0xFF << 24 if data[i + 3] & 0x80 else 0)) / 10000
-        res['long'] = (data[i + 4] | data[i + 5] << 8 | data[i + 6] << 16 | (0xFF << 24 if data[i + 6] & 0x80 else 0)) / 10000
-        return 6
-
-    def pulse1(i: int) -> int:
-        res['pulse'] = int16(i+1)
-        return 2
-
-    def pulse1_abs(i: int) -> int:
-        res['pulseAbs'] = (data[i + 1] << 24) | (data[i + 2] << 16) | (data[i + 3] << 8) | (data[i + 4])
-        return 4
-
-    def ext_temp1(i: int) -> int:
-        temp = int16(i+1)
-        temp = bin16dec(temp) / 10
-        res['extTemperature'] = temp * 1.8 + 32.0
-        return 2
-
-    def ext_digital(i: int) -> int:
-        res['digital'] = data[i + 1]
-        return 1
-
-    def ext_distance(i: int) -> int:
-        res['distance'] = int16(i+1) / 25.4   # convert to inches
-        return 2
-
-    def acc_motion(i: int) -> int:
-        res['accMotion'] = data[i + 1]
-        return 1
-
-    def ir_temp(i: int) -> int:
-        iTemp = int16(i+1)
-        iTemp = bin16dec(iTemp)
-        eTemp = int16(i + 3)
-        eTemp = bin16dec(eTemp)
-        res['irIntTemperature'] = iTemp / 10 * 1.8 + 32.0
-        res['irExtTemperature'] = eTemp / 10 * 1.8 + 32.0
-        return 4
-
-    def occupancy(i: int) -> int:
-        res['occupancy'] = data[i + 1]
-        return 1
-
-    def waterleak(i: int) -> int:
-        res['waterleak'] = data[i + 1]
-        return 1
-
-    def grideye(i: int) -> int:
-        ref = data[i+1]
-        res['grideye'] = [ref + data[i + 2 + j] / 10.0 for j in range(64)]
-        return 64
-
-    def pressure(i: int) -> int:
-        press = (data[i + 1] << 24) | (data[i + 2] << 16) | (data[i + 3] << 8) | (data[i + 4])
-        res['pressure'] = press / 1000
-        return 4
-
-    def sound(i: int) -> int:
-        res['soundPeak'] = data[i + 1]
-        res['soundAvg'] = data[i + 2]
-        return 2
-
-    def pulse2(i: int) -> int:
-        res['pulse2'] = int16(i+1)
-        return 2
-
-    def pulse2_abs(i: int) -> int:
-        res['pulseAbs2'] = (data[i + 1] << 24) | (data[i + 2] << 16) | (data[i + 3] << 8) | (data[i + 4])
-        return 4
-
-    def analog2(i: int) -> int:
-        # changed from Elsys, result is in Volts not millivolts
-        res['analog2'] = int16(i+1) / 1000.
-        return 2
-
-    def ext_temp2(i: int) -> int:
-        temp = int16(i+1)
-        temp = bin16dec(temp) / 10 * 1.8 + 32.0
-        try:
-            exist_rd =  res['extTemperature2']
-            # there already is a Temperature 2 reading, 
-            if type(exist_rd) == list:
-                # the existing value is already a list of readings.  Append to it.
-                res['extTemperature2'].append(temp)
-            else:
-                # one existing reading. make a list.
-                res['extTemperature2'] = [exist_rd, temp]
-        except:
-            # this is the first External Temperature 2 reading.
-            res['extTemperature2'] = temp
-        
-        return 2
-
-    def ext_digital2(i: int) -> int:
-        res['digital2'] = data[i + 1]
-        return 1
-
-    def ext_analog_uv(i: int) -> int:
-        res['analogUv'] = (data[i + 1] << 24) | (data[i + 2] << 16) | (data[i + 3] << 8) | (data[i + 4])
-        return 4
-
-    # list of deconding functions, in their type indicator order.
-    decode_funcs = [temp, rh, acc, light, motion, co2,
-        vdd, analog1, gps, pulse1, pulse1_abs, ext_temp1,
-        ext_digital, ext_distance, acc_motion, ir_temp,
-        occupancy, waterleak, grideye, pressure, sound,
-        pulse2, pulse2_abs, analog2, ext_temp2, ext_digital2,
-        ext_analog_uv]
-
-    # make a dictionary that maps a sensor data type code to a decoding function
-    decode_func_map = dict(zip(range(1, len(decode_funcs) + 1), decode_funcs))
-
     # index into payload byte array
     i = 0
     while i < len(data):
-        # retrieve the correct decoding function for a sensor of this type
-        cur_decode_func = decode_func_map[data[i]]
-        # the decoder function adds decoded values to the results dictionary, and it
-        # returns the number of bytes consumed by the decoded value.  Add 1 to account for the
-        # byte consumed the sensor type identifier.
-        i += cur_decode_func(i) + 1
+        # retrieve the layout and decoding function for a sensor of this type
+        layout, size, decode_func = DECODERS[data[i]]
+        # the decoding function adds the decoded values to the results dictionary.  The
+        # sensor data starts after the byte holding the sensor type identifier.
+        decode_func(res, *layout.unpack_from(data, i + 1))
+        i += size + 1
 
     # Some of the fields may give a list of values back.  Convert 
     # these into multiple fields with an underscore index at end of field name.
@@ -212,10 +136,22 @@ def decode(data: bytes) -> Dict[str, Any]:
 
     return res
 
+def decode_batch(payloads: List[bytes]) -> List[Dict[str, Any]]:
+    """Returns the decoded results for each Elsys Uplink Payload in the list 'payloads'.
+    Payloads are variable-length lists of sensor values, so they are decoded one at a time.
+    """
+    return [decode(data) for data in payloads]
+
+# Sample payload (hex) and its decoded values, used by test() and by the 'lora'
+# benchmark in bmsapp/scripts/benchmark_readingdb.py.
+TEST_PAYLOAD = '0100e202290400270506060308070d6219000119FFFF'
+TEST_RESULT = {'temperature': 72.68, 'humidity': 41, 'light': 39, 'motion': 6, 'co2': 776, 'vdd': 3.426,
+               'extTemperature2_0': 32.18, 'extTemperature2_1': 31.82}
+
 def test():
-    results = decode(bytes.fromhex('0100e202290400270506060308070d6219000119FFFF'))
+    results = decode(bytes.fromhex(TEST_PAYLOAD))
     print(results)
-    assert results == {'temperature': 72.68, 'humidity': 41, 'light': 39, 'motion': 6, 'co2': 776, 'vdd': 3.426, 'extTemperature2_0': 32.18, 'extTemperature2_1': 31.82}
+    assert results == TEST_RESULT
 
 if __name__ == "__main__":
     # To run this without import error, need to run "python -m lora.decode_elsys" from parent directory.
@@ -1,10 +1,10 @@
 """Module that decodes a LoRaWAN HTTP Integration payload into a field/value sensor
 reading dictionary for certain supported sensor types.
 """
-from typing import Dict, Any
+from typing import Dict, Any, List, Callable, NamedTuple, Optional, Tuple
+from functools import lru_cache
 import base64
 
-from dateutil.parser import parse
 
 from . import decode_elsys
 from . import decode_dragino
@@ -12,6 +12,126 @@ from . import decode_e5
 from . import decode_modbus
 
 from bmsapp.lora_diagnostics import store_things_uplink_diagnostics
+from bmsapp import timestamps
+
+# Fields of already-decoded Things payloads that are not sensor values.
+EXCLUDE_THINGS_FIELDS = ('event', )
+
+
+class PayloadDecoder(NamedTuple):
+    """A decoder for the raw payloads of one type of sensor.  The sensor type is
+    recognized from the lower case device ID: it starts with one of 'prefixes' or, if
+    'contains' is True, contains one of them anywhere.  Only payloads on 'port' are
+    sensor readings.  'decode' returns the fields decoded from one payload; if
+    'uses_payload_fields' is True it is also passed the already-decoded payload fields.
+    'decode_batch', if present, decodes a list of payloads at once.
+    """
+    prefixes: Tuple[str, ...]
+    port: int
+    decode: Callable
+    decode_batch: Optional[Callable] = None
+    contains: bool = False
+    uses_payload_fields: bool = False
+
+# The registered raw payload decoders, in the order they are checked.
+DECODERS: List[PayloadDecoder] = []
+
+def register(prefixes, port, decode, decode_batch=None, contains=False, uses_payload_fields=False):
+    """Adds a decoder to the end of DECODERS.  See PayloadDecoder for the parameters; a
+    single prefix can be given as a string, and a 'port' of None accepts every port.
+    """
+    if isinstance(prefixes, str):
+        prefixes = (prefixes, )
+    DECODERS.append(PayloadDecoder(tuple(prefixes), port, decode, decode_batch, contains, uses_payload_fields))
+    find_decoder.cache_clear()
+
+@lru_cache(maxsize=4096)
+def find_decoder(dev_id_lwr: str) -> Optional[PayloadDecoder]:
+    """Returns the first registered decoder for the lower case device ID 'dev_id_lwr',
+    or None if it is not a sensor type that has a decoder.
+    """
+    for dec in DECODERS:
+        if dec.contains:
+            if any(prefix in dev_id_lwr for prefix in dec.prefixes):
+                return dec
+        elif dev_id_lwr.startswith(dec.prefixes):
+            return dec
+    return None
+
+# if device_id contains "lht65" anywhere in it, use the lht65 decoder.  Only messages on
+# Port 2 are sensor readings (although haven't yet seen any other types of messages from
+# this sensor)
+register('lht65', 2, decode_dragino.decode_lht65, decode_dragino.decode_lht65_batch, contains=True)
+register('lwl01', None, decode_dragino.decode_lwl01)
+# if device_id starts with "ers" or "elsys" or "elt", use the elsys decoder.  Only
+# messages on Port 5 are sensor readings.
+register(('elsys', 'ers', 'elt'), 5, decode_elsys.decode, decode_elsys.decode_batch)
+register('boat-lt2', 2, decode_dragino.decode_boat_lt2)
+register('ldds', 2, decode_dragino.decode_ldds, decode_dragino.decode_ldds_batch)
+register('lsn50', 2, decode_dragino.decode_lsn50)
+register('rs485', 2, decode_modbus.decode, uses_payload_fields=True)
+register('e5', 8, decode_e5.decode_e5)
+
+def _things_fields(payload_fields):
+    """Returns the sensor values from the already-decoded Things payload fields.
+    """
+    fields = payload_fields.copy()
+    for ky in EXCLUDE_THINGS_FIELDS:
+        fields.pop(ky, None)      # deletes element without an error if not there
+    return fields
+
+def decode_fields(device_id: str, port: int, payload: bytes, payload_fields: Dict[str, Any]):
+    """Returns the sensor fields, as a dictionary or a list of tuples (see decode()),
+    decoded from the raw 'payload' received on 'port' from the device 'device_id'.  The
+    already-decoded 'payload_fields' are used if the device has no decoder or nothing
+    could be decoded.
+    """
+    fields = []      # default to no field data
+
+    # Note that many of the decoder functions return the sensor fields as a dictionary.
+    # Both a field dictionary and a field list can be accommodated.
+    try:
+        dec = find_decoder(device_id.lower())
+        if dec is not None:
+            if dec.port is None or port == dec.port:
+                if dec.uses_payload_fields:
+                    fields = dec.decode(payload, payload_fields)
+                else:
+                    fields = dec.decode(payload)
+        elif len(payload_fields) > 0:
+            # Unfamiliar sensor, so get data from already decoded payload_fields if
+            # present.
+            fields = _things_fields(payload_fields)
+
+        # sometimes people use device ID prefix that is not correct, no error occurs because the port
+        # is not correct, and we land here with values in the payload_fields but not in fields. Use
+        # the values in the payload_fields.  This fixed an ANTHC problem with a pressure sensor.
+        if len(fields) == 0 and len(payload_fields) > 0:
+            fields = _things_fields(payload_fields)
+
+    except:
+        # Failed at decoding raw payload.
+        pass
+
+    return fields
+
+def decode_payloads(device_id: str, port: int, payloads: List[bytes], payload_fields: Dict[str, Any] = None):
+    """Batch version of decode_fields() for a list of raw 'payloads' received on 'port'
+    from the same device.  The payloads are decoded together when the device's decoder
+    has a batch function.  Returns a list holding the fields for each payload.
+    'payload_fields' are the already-decoded fields, shared by all the payloads.
+    """
+    payload_fields = payload_fields or {}
+    dec = find_decoder(device_id.lower())
+    if dec is not None and dec.decode_batch is not None and len(payload_fields) == 0 and \
+            (dec.port is None or port == dec.port):
+        try:
+            return dec.decode_batch(payloads)
+        except:
+            # a payload could not be decoded; decode them one at a time so only that
+            # payload loses its values.
+            pass
+    return [decode_fields(device_id, port, payload, payload_fields) for payload in payloads]
 
 def decode(
         integration_payload: Dict[str, Any],
@@ -48,7 +168,7 @@ def decode(
         payload = base64.b64decode(integration_payload['payload_raw'])  # is a list of bytes now
 
         # Make UNIX timestamp for the record
-        ts = parse(integration_payload['metadata']['time']).timestamp()
+        ts = timestamps.timestamp(integration_payload['metadata']['time'])
         
         # Extract the strongest SNR across the gateways that received the transmission.
         try:
@@ -80,7 +200,7 @@ def decode(
         payload = base64.b64decode(msg['frm_payload'])  # is a list of bytes now
 
         # Make UNIX timestamp for the record
-        ts = parse(msg['received_at']).timestamp()
+        ts = timestamps.timestamp(msg['received_at'])
         
         # Extract the strongest SNR across the gateways that received the transmission.
         # SNR may not be present, so protect against that
@@ -107,62 +227,7 @@ def decode(
         'ts': ts,
     }
 
-    fields = []      # default to no field data
-    dev_id_lwr = device_id.lower()    # get variable for lower case device ID
-
-    # Note that many of the decoder functions below return the sensor fields as a dictionary.
-    # Both a field dictionary and a field list can be accommodated.  Further down in this
-    # function, a field dictionary is converted to a list of tuples.
-    try:
-        # dispatch to the right decoding function based on characters in the device_id.
-        # if device_id contains "lht65" anywhere in it, use the lht65 decoder
-        # if device_id starts with "ers" or "elsys" or "elt", use the elsys decoder
-        if 'lht65' in dev_id_lwr:
-            # only messages on Port 2 are sensor readings (although haven't yet seen 
-            # any other types of messages from this sensor)
-            if port == 2:
-                fields = decode_dragino.decode_lht65(payload)
-        elif dev_id_lwr.startswith('lwl01'):
-            fields = decode_dragino.decode_lwl01(payload)
-        elif dev_id_lwr.startswith('elsys') or (dev_id_lwr[:3] in ('ers', 'elt')):
-            # only messages on Port 5 are sensor readings
-            if port == 5:
-                fields = decode_elsys.decode(payload)
-        elif dev_id_lwr.startswith('boat-lt2'):
-            if port == 2:
-                fields = decode_dragino.decode_boat_lt2(payload)
-        elif dev_id_lwr.startswith('ldds'):
-            if port == 2:
-                fields = decode_dragino.decode_ldds(payload)
-        elif dev_id_lwr.startswith('lsn50'):
-            if port == 2:
-                fields = decode_dragino.decode_lsn50(payload)
-        elif dev_id_lwr.startswith('rs485'):
-            if port == 2:
-                fields = decode_modbus.decode(payload, payload_fields)   # may need payload_fields
-        elif dev_id_lwr.startswith('e5'):
-            if port == 8:
-                fields = decode_e5.decode_e5(payload)
-        elif len(payload_fields) > 0:
-            # Unfamiliar sensor, so get data from already decoded payload_fields if
-            # present.
-            EXCLUDE_THINGS_FIELDS = ('event', )    # fields not to include
-            fields = payload_fields.copy()
-            for ky in EXCLUDE_THINGS_FIELDS:
-                fields.pop(ky, None)      # deletes element without an error if not there
-
-        # sometimes people use device ID prefix that is not correct, no error occurs because the port
-        # is not correct, and we land here with values in the payload_fields but not in fields. Use
-        # the values in the payload_fields.  This fixed an ANTHC problem with a pressure sensor.
-        if len(fields) == 0 and len(payload_fields) > 0:
-            EXCLUDE_THINGS_FIELDS = ('event', )    # fields not to include
-            fields = payload_fields.copy()
-            for ky in EXCLUDE_THINGS_FIELDS:
-                fields.pop(ky, None)      # deletes element without an error if not there
-
-    except:
-        # Failed at decoding raw payload.
-        pass
+    fields = decode_fields(device_id, port, payload, payload_fields)
 
     # If the 'fields' variable is a dictionary, convert it to a list of tuples at this point.
     if type(fields) == dict:
@@ -1,54 +1,85 @@
 """SQL statements that operate on the LoRa Diagnostic database.
 
-These queries access the main Django SQLite database, without using
-Django's model paradigm. If BMON changes to a different type of Django
-database, the queries will need to be changed, and perhaps converted to
-using the Django model paradigm to make DataFrames, which are then 
-queried directly by DuckDB.
+The link between sensor device EUIs and buildings comes from the main Django
+database through Django models, as a DataFrame that is queried directly by DuckDB.
+The gateway to building mapping derived from it is kept in memory and rebuilt when
+building and sensor links change, or after GTW_TO_BLDG_SECONDS.
 """
-from bmsapp.models import path_to_django_db
+import time
+
+import pandas as pd
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from bmsapp import models
 from .db_connect import get_read_only_db_conn
+from . import partitions
+
+# Number of seconds the gateway to building mapping is kept before it is rebuilt
+# from the latest gateway records.
+GTW_TO_BLDG_SECONDS = 3600
+
+# Number of most recent records of each gateway used to find its strongest sensor.
+GTW_RECENT_RECORDS = 1000
 
-def ro_query(sql):
+# The in-memory gateway to building mapping and the time it was built.
+_gtw_to_bldg = None
+_gtw_to_bldg_time = 0.0
+
+def ro_query(sql, **frames):
     """Runs a read-only query on the diagnostic database and returns
     the results as a Pandas DataFrame. Will raise a Connection error
-    if no connection possible.  Attaches the main Django database as "bmon" and
-    makes it the current database.
+    if no connection possible.  Each DataFrame in 'frames' is available to the query
+    as a table named by its keyword.
     """
     try:
         with get_read_only_db_conn() as conn:
-            conn.sql(f"ATTACH '{path_to_django_db()}' AS bmon (TYPE sqlite)")
-            conn.sql("USE bmon")
+            for name, df in frames.items():
+                conn.register(name, df)
             return conn.sql(sql).df()
     except Exception as e:
         print(e)
 
+def eui_to_buildings():
+    """Returns a DataFrame linking the device EUI (root of sensor_id) of each sensor
+    associated with a building to a comma-separated list of those buildings.
+    """
+    links = pd.DataFrame(
+        list(models.BldgToSensor.objects.values_list('sensor__sensor_id', 'building__title')),
+        columns=['sensor_id', 'building']
+    )
+    links['device_eui'] = links['sensor_id'].str.split('_').str[0]
+    # There are many records with the same device EUI; combine the associated
+    # buildings together into a list.
+    return links.groupby('device_eui', as_index=False)['building'].agg(
+        lambda bldgs: ', '.join(sorted(set(bldgs)))
+    ).rename(columns={'building': 'building_list'})
+
+# This query gives the day of the oldest gateway record needed to find the most recent
+# GTW_RECENT_RECORDS records of every gateway, from the gateway_daily summary table.
+sql_recent_cutoff = f"""
+WITH cumulative AS (
+    SELECT
+        gateway_id,
+        day,
+        SUM(records) OVER (PARTITION BY gateway_id ORDER BY day DESC) AS cum_records
+    FROM gateway_daily
+)
+SELECT MIN(start_day) FROM (
+    SELECT coalesce(max(day) FILTER (WHERE cum_records >= {GTW_RECENT_RECORDS}), min(day)) AS start_day
+    FROM cumulative
+    GROUP BY gateway_id
+)
+"""
+
 # This query makes a With table available that has gateway_id matched
 # to a building (or buildings) holding the strongest signal sensor seen
 # by that gateway. The With table name is "gtw_to_bldg".
-# This query assumes the main Django database is attached as "bmon" and
-# has been set to current use.
+# This query assumes a "eui_to_bldgs" table linking device EUIs to building lists,
+# and the gateway records in "{recent_gateway}".
 sql_gtw_to_bldg = """
--- Links device EUI (root of sensor_id) to the building it's associated with
-WITH eui_to_bldg AS (
-    SELECT str_split(sen.sensor_id, '_')[1] AS device_eui, bldg.title as building
-    FROM bmsapp_bldgtosensor as btos
-    JOIN bmsapp_sensor as sen
-        ON btos.sensor_id = sen.id
-    JOIN bmsapp_building as bldg
-        ON btos.building_id = bldg.id
-),
-
--- There are many records with the same device EUI; combine the associated
--- buildings together into a list.
-eui_to_bldgs AS (
-    SELECT device_eui, string_agg(DISTINCT building, ', ') AS building_list
-    FROM eui_to_bldg
-    GROUP BY device_eui    
-),
-
 -- Gets the most recent 1000 records for each gateway from the diagnostic database
-recent_gateway_records AS (
+WITH recent_gateway_records AS (
 WITH ranked_rows AS (
     SELECT
         gateway_id,
@@ -58,14 +89,14 @@ WITH ranked_rows AS (
             PARTITION BY gateway_id
             ORDER BY ts DESC
         ) AS rn
-    FROM things.gateway
+    FROM ({recent_gateway})
 )
 SELECT
     gateway_id,
     device_eui,
     signal_rssi,
 FROM ranked_rows
-WHERE rn <= 1000
+WHERE rn <= {recent_records}
 ),
 
 -- For each gateway, rank by largest signal strength and then
@@ -77,11 +108,11 @@ FROM (
         gateway_id,
         device_eui,
         ROW_NUMBER() OVER (
-            PARTITION BY gateway_id 
+            PARTITION BY gateway_id
             ORDER BY signal_rssi DESC
         ) AS rn
     FROM recent_gateway_records
-    WHERE device_eui IN (SELECT DISTINCT device_eui FROM eui_to_bldg)
+    WHERE device_eui IN (SELECT DISTINCT device_eui FROM eui_to_bldgs)
 )
 WHERE rn = 1
 ),
@@ -95,17 +126,53 @@ JOIN eui_to_bldgs
 )
 """
 
+def gateway_to_building():
+    """Returns a DataFrame with the 'gateway_id' and 'building_list' columns, linking
+    each gateway to the buildings of the strongest signal sensor it recently heard.
+    Only the day tables holding the recent records of the gateways are read.
+    """
+    global _gtw_to_bldg, _gtw_to_bldg_time
+
+    gtw_to_bldg = _gtw_to_bldg
+    if gtw_to_bldg is not None and time.time() - _gtw_to_bldg_time < GTW_TO_BLDG_SECONDS:
+        return gtw_to_bldg
+
+    build_time = time.time()
+    with get_read_only_db_conn() as conn:
+        cutoff = conn.execute(sql_recent_cutoff).fetchone()[0]
+        days = [day for day in partitions.partitions(conn) if cutoff is not None and day >= cutoff]
+        conn.register('eui_to_bldgs', eui_to_buildings())
+        gtw_to_bldg = conn.sql(
+            sql_gtw_to_bldg.format(recent_gateway=partitions.union_sql(days), recent_records=GTW_RECENT_RECORDS) +
+            "SELECT gateway_id, building_list FROM gtw_to_bldg ORDER BY gateway_id"
+        ).df()
+
+    _gtw_to_bldg, _gtw_to_bldg_time = gtw_to_bldg, build_time
+    return gtw_to_bldg
+
+@receiver(post_save, sender=models.BldgToSensor)
+@receiver(post_delete, sender=models.BldgToSensor)
+@receiver(post_save, sender=models.Sensor)
+@receiver(post_delete, sender=models.Sensor)
+@receiver(post_save, sender=models.Building)
+@receiver(post_delete, sender=models.Building)
+def _links_changed(sender, **kwargs):
+    """Clears the gateway to building mapping when building and sensor links change.
+    """
+    global _gtw_to_bldg
+    _gtw_to_bldg = None
+
 def inoperative_gateways(time_cutoff_hours: float):
     """Returns a DataFrame of all the gateways that have not reported a
     sensor reading in the last 'time_cutoff_hours' hours. Gateway location,
     the time since last report, and the gateway ID are columns in the DataFrame.
     """
     df = ro_query(f"""
-    SELECT 
-        things.gateway.gateway_id,
-        now() - max(ts) AS time_since_last, 
-    FROM things.gateway
-    GROUP BY things.gateway.gateway_id
+    SELECT
+        gateway_id,
+        now() - max(last_ts) AS time_since_last,
+    FROM gateway_daily
+    GROUP BY gateway_id
     HAVING time_since_last > INTERVAL '{time_cutoff_hours} hours'
     ORDER BY time_since_last DESC;
     """)
@@ -116,7 +183,7 @@ def gateway_location():
     gateway based on the the sensor with the strongest signal that communicates
     through the gateway.
     """
-    return ro_query(
-        sql_gtw_to_bldg + \
-        "SELECT gateway_id, building_list as location FROM gtw_to_bldg ORDER BY gateway_id"
-        )
+    try:
+        return gateway_to_building().rename(columns={'building_list': 'location'})
+    except Exception as e:
+        print(e)
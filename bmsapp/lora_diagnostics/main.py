@@ -1,18 +1,25 @@
 """Main script for the Things API application. Receives and processes
-HTTP requests. Starts a thread that stores Things message data into a
-database.
+HTTP requests. Gateway records are buffered by a writer thread that stores them in
+the database in batches, or written to log files that are stored in the database
+by a separate thread.
 """
 import logging
 from pathlib import Path
 
 from concurrent_log_handler import ConcurrentTimedRotatingFileHandler
+from django.conf import settings
 
 from . import things_parser
+from .writer import make_writer
 
 def store_things_uplink_diagnostics(payload):
-    recs = things_parser.parse_uplink_gateway_diagnostics(payload)
-    for rec in recs:
-        gtw_logger.info(rec)
+    if diag_writer is not None:
+        recs = things_parser.parse_uplink_gateway_records(payload)
+        diag_writer.put(recs)
+    else:
+        recs = things_parser.parse_uplink_gateway_diagnostics(payload)
+        for rec in recs:
+            gtw_logger.info(rec)
 
     return {"message": f"OK, {len(recs)} records added"}
 
@@ -56,3 +63,15 @@ def setup_uplink_gateway_logger():
 # Set up the gateway uplink message logger.
 gtw_logger = setup_uplink_gateway_logger()
 
+# Set up the writer that buffers gateway records and stores them in the diagnostic
+# database in batches, unless disabled in settings. The gateway logger is its fallback.
+if getattr(settings, 'BMSAPP_LORA_DIAG_BUFFERED', True):
+    diag_writer = make_writer(
+        gtw_logger,
+        flush_records=getattr(settings, 'BMSAPP_LORA_DIAG_FLUSH_RECORDS', 5000),
+        flush_seconds=getattr(settings, 'BMSAPP_LORA_DIAG_FLUSH_SECONDS', 30.0),
+        max_records=getattr(settings, 'BMSAPP_LORA_DIAG_MAX_RECORDS', 50000),
+    )
+else:
+    diag_writer = None
+
@@ -0,0 +1,151 @@
+"""Day-partitioned storage of the gateway records in the diagnostic database.
+
+Records are stored in a separate table for each UTC day, named gateway_YYYYMMDD, so
+old records are removed by dropping whole tables. A "gateway" view is the union of
+all the day tables. The "gateway_daily" table summarizes each day table: the number
+of records and the last timestamp from each gateway. It is used to select only the
+day tables a query needs.
+"""
+import re
+import time
+from datetime import date, datetime, timedelta, timezone
+
+# Determines how recent of records to keep.
+DB_RETENTION = 90     # days
+
+# Column definitions of the gateway records.
+GATEWAY_COLUMNS_SQL = """
+    ts TIMESTAMPTZ,
+    device_eui VARCHAR,
+    frame_counter INTEGER,
+    gateway_id VARCHAR,
+    signal_snr FLOAT,
+    signal_rssi INT2,
+    data_rate VARCHAR
+"""
+
+# Expression giving the UTC day of a record.
+DAY_SQL = "CAST(timezone('UTC', ts) AS DATE)"
+
+# Name pattern of the day tables.
+PARTITION_PATTERN = re.compile(r'gateway_(\d{8})')
+
+# tracks epoch timestamp of when the DB was last cleaned of old records.
+last_cleaned = None
+
+
+def partition_name(day: date) -> str:
+    """Returns the name of the table holding the records from the UTC day 'day'.
+    """
+    return f"gateway_{day:%Y%m%d}"
+
+def partitions(conn):
+    """Returns a sorted list of the days that have a table in the diagnostic database
+    open on 'conn'.
+    """
+    days = []
+    for (name, ) in conn.execute("SELECT table_name FROM information_schema.tables "
+                                 "WHERE table_schema = 'main' AND table_type = 'BASE TABLE'").fetchall():
+        m = PARTITION_PATTERN.fullmatch(name)
+        if m:
+            days.append(datetime.strptime(m.group(1), '%Y%m%d').date())
+    return sorted(days)
+
+def union_sql(days):
+    """Returns a SELECT statement giving the records from the tables of the days
+    'days'. Gives no rows if 'days' is empty.
+    """
+    if len(days) == 0:
+        return "SELECT * FROM (SELECT NULL::TIMESTAMPTZ AS ts, NULL::VARCHAR AS device_eui, " \
+               "NULL::INTEGER AS frame_counter, NULL::VARCHAR AS gateway_id, NULL::FLOAT AS signal_snr, " \
+               "NULL::INT2 AS signal_rssi, NULL::VARCHAR AS data_rate) WHERE false"
+    return " UNION ALL ".join(f"SELECT * FROM {partition_name(day)}" for day in days)
+
+def refresh_view(conn):
+    """Recreates the "gateway" view over all of the day tables.
+    """
+    conn.execute(f"CREATE OR REPLACE VIEW gateway AS {union_sql(partitions(conn))}")
+
+def store_records(conn, load_sql):
+    """Stores new gateway records in the day tables, creating tables as needed, in one
+    transaction. 'load_sql' is a statement that loads the new records into the table
+    named by its "{table}" placeholder, e.g. "COPY {table} FROM 'gtw.log.1'".
+    """
+    conn.execute("BEGIN TRANSACTION")
+    try:
+        conn.execute(f"CREATE OR REPLACE TEMP TABLE new_gateway ({GATEWAY_COLUMNS_SQL})")
+        conn.execute(load_sql.format(table='new_gateway'))
+        existing = set(partitions(conn))
+        days = [day for (day, ) in conn.execute(
+            f"SELECT DISTINCT {DAY_SQL} FROM new_gateway WHERE ts IS NOT NULL").fetchall()]
+        for day in days:
+            table = partition_name(day)
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({GATEWAY_COLUMNS_SQL})")
+            conn.execute(f"INSERT INTO {table} SELECT * FROM new_gateway WHERE {DAY_SQL} = ?", [day])
+        conn.execute(f"""
+            INSERT INTO gateway_daily
+            SELECT {DAY_SQL} AS day, gateway_id, COUNT(*) AS records, MAX(ts) AS last_ts
+            FROM new_gateway
+            WHERE ts IS NOT NULL AND gateway_id IS NOT NULL
+            GROUP BY day, gateway_id
+            ON CONFLICT DO UPDATE SET
+                records = records + EXCLUDED.records,
+                last_ts = greatest(last_ts, EXCLUDED.last_ts)
+        """)
+        if set(days) - existing:
+            refresh_view(conn)
+        conn.execute("DROP TABLE new_gateway")
+        conn.execute("COMMIT")
+    except:
+        conn.execute("ROLLBACK")
+        raise
+
+def drop_old_partitions(conn, retention_days=DB_RETENTION):
+    """Drops the tables of the days more than 'retention_days' days before the
+    current UTC day. Returns the number of tables dropped.
+    """
+    cutoff = datetime.now(timezone.utc).date() - timedelta(days=retention_days)
+    old_days = [day for day in partitions(conn) if day < cutoff]
+    if old_days:
+        conn.execute("BEGIN TRANSACTION")
+        for day in old_days:
+            conn.execute(f"DROP TABLE {partition_name(day)}")
+        conn.execute("DELETE FROM gateway_daily WHERE day < ?", [cutoff])
+        # the view must not refer to the dropped tables
+        refresh_view(conn)
+        conn.execute("COMMIT")
+    return len(old_days)
+
+def prepare(conn):
+    """Creates the gateway_daily table and the gateway view in the diagnostic database
+    open on the read/write connection 'conn', if needed. Moves the records of an
+    unpartitioned gateway table, from before the records were partitioned, into day
+    tables. Drops old day tables every 24 hours.
+    """
+    global last_cleaned
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS gateway_daily (
+        day DATE,
+        gateway_id VARCHAR,
+        records BIGINT,
+        last_ts TIMESTAMPTZ,
+        PRIMARY KEY (day, gateway_id)
+        )"""
+    )
+
+    table_type = conn.execute("SELECT table_type FROM information_schema.tables "
+                              "WHERE table_schema = 'main' AND table_name = 'gateway'").fetchone()
+    if table_type is not None and table_type[0] == 'BASE TABLE':
+        conn.execute("ALTER TABLE gateway RENAME TO gateway_unpartitioned")
+        store_records(conn, "INSERT INTO {table} SELECT * FROM gateway_unpartitioned")
+        conn.execute("DROP TABLE gateway_unpartitioned")
+        table_type = None
+    if table_type is None:
+        refresh_view(conn)
+
+    # Check to see if database needs cleaning of old records. Clean every 24 hours.
+    if last_cleaned is None or (time.time() - last_cleaned) / 3600.0  > 24.0:
+        drop_old_partitions(conn)
+        last_cleaned = time.time()
+        print("LoRa Diagnostic Database cleaned.")
@@ -2,12 +2,12 @@
 uplink message.
 """
 
-def parse_uplink_gateway_diagnostics(things_uplink_message: dict):
+def parse_uplink_gateway_records(things_uplink_message: dict):
     """Parses the desirable gateway diagnostic information from a Things v3 JSON 
-    uplink message and returns comma-separated records for each gateway reached.
+    uplink message and returns a tuple for each gateway reached, holding the values
+    of the columns listed by "uplink_gateway_columns".
     """
     rec = things_uplink_message
-    gtw_recs = []  # holds gateway records
 
     dev_eui = rec["end_device_ids"]["dev_eui"]
     ctr = rec["uplink_message"]["f_cnt"]              # frame counter
@@ -15,23 +15,26 @@ def parse_uplink_gateway_diagnostics(things_uplink_message: dict):
     dr = rec["uplink_message"]["settings"]["data_rate"]["lora"]
     data_rate = f"SF{dr['spreading_factor']}BW{int(dr['bandwidth'] / 1000)}"
 
-    # add to list of gateway records
-    for gtw in rec["uplink_message"]["rx_metadata"]:
-        r = {}
-        r["gtw_id"] = gtw["gateway_ids"]["gateway_id"]
-        r["snr"] = gtw["snr"]
-        r["rssi"] = gtw["rssi"]
-        gtw_recs.append(r)
+    # make a record for each gateway
+    return [
+        (ts, dev_eui, ctr, gtw["gateway_ids"]["gateway_id"], gtw["snr"], gtw["rssi"], data_rate)
+        for gtw in rec["uplink_message"]["rx_metadata"]
+    ]
 
-    final_recs = []
-    for gtw in gtw_recs:
-        r = f"{ts},{dev_eui},{ctr},{gtw['gtw_id']},{gtw['snr']},{gtw['rssi']},{data_rate}"
-        final_recs.append(r)
+def format_gateway_record(gtw_rec):
+    """Returns the comma-separated text line for a gateway record returned by
+    "parse_uplink_gateway_records".
+    """
+    return ",".join(str(val) for val in gtw_rec)
 
-    return final_recs
+def parse_uplink_gateway_diagnostics(things_uplink_message: dict):
+    """Parses the desirable gateway diagnostic information from a Things v3 JSON 
+    uplink message and returns comma-separated records for each gateway reached.
+    """
+    return [format_gateway_record(r) for r in parse_uplink_gateway_records(things_uplink_message)]
 
 def uplink_gateway_columns():
-    """Returns the column names for the data returned by "parse_uplink_gateway_info"
+    """Returns the column names for the data returned by "parse_uplink_gateway_records"
     """
     return [
         "ts",
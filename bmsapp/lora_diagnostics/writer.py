@@ -0,0 +1,132 @@
+"""In-process writer of gateway diagnostic records. Records are buffered in memory
+and appended to the diagnostic database in batches by a background thread, when
+enough records are waiting or the oldest has waited long enough. If the database
+cannot be written, or the buffer is full, records are written to the gateway log
+file instead, and the log file watcher started in __init__.py stores them later.
+"""
+import time
+import atexit
+import threading
+
+import pandas as pd
+
+from .db_connect import get_rw_db_conn
+from .things_parser import uplink_gateway_columns, format_gateway_record
+from . import partitions
+
+
+class DiagnosticsWriter:
+    """Buffers gateway diagnostic records (tuples returned by
+    things_parser.parse_uplink_gateway_records) and appends them to the diagnostic
+    database from a daemon thread. 'fallback' is a function called with a list of
+    records that could not be buffered or stored.
+    """
+
+    def __init__(self, fallback, flush_records=5000, flush_seconds=30.0, max_records=50000, put_timeout=0.5):
+        """The buffer is flushed when it holds 'flush_records' records, or its oldest
+        record is 'flush_seconds' old. When it holds 'max_records' records, put()
+        waits up to 'put_timeout' seconds for a flush before sending the new records
+        to 'fallback'.
+        """
+        self.fallback = fallback
+        self.flush_records = flush_records
+        self.flush_seconds = flush_seconds
+        self.max_records = max(max_records, flush_records)
+        self.put_timeout = put_timeout
+        self.cond = threading.Condition()
+        self.records = []
+        self.oldest = None        # time the oldest buffered record was added
+        self.stopping = False
+        self.thread = None
+
+    def put(self, records):
+        """Adds the list of gateway records 'records' to the buffer.
+        """
+        if not records:
+            return
+        with self.cond:
+            if self.thread is None and not self.stopping:
+                self.thread = threading.Thread(target=self._run, name='lora-diagnostics-writer', daemon=True)
+                self.thread.start()
+            deadline = time.time() + self.put_timeout
+            while len(self.records) + len(records) > self.max_records and not self.stopping:
+                # backpressure: wait for the writer thread to make room
+                self.cond.notify_all()
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            if not self.stopping and len(self.records) + len(records) <= self.max_records:
+                if not self.records:
+                    # the writer thread times its next flush from this record
+                    self.oldest = time.time()
+                    self.cond.notify_all()
+                self.records += records
+                if len(self.records) >= self.flush_records:
+                    self.cond.notify_all()
+                return
+        # buffer is full or the writer has stopped
+        self.fallback(records)
+
+    def _take(self):
+        """Returns the buffered records and empties the buffer. Called holding 'cond'.
+        """
+        records, self.records, self.oldest = self.records, [], None
+        self.cond.notify_all()      # wakes put() calls waiting for room
+        return records
+
+    def _run(self):
+        """Flushes the buffer when it is large or old enough, until close() is called.
+        """
+        while True:
+            with self.cond:
+                while not self.stopping and (not self.records or (
+                        len(self.records) < self.flush_records and time.time() - self.oldest < self.flush_seconds)):
+                    self.cond.wait(self.flush_seconds if not self.records else
+                                   max(self.flush_seconds - (time.time() - self.oldest), 0.01))
+                if self.stopping:
+                    return
+                records = self._take()
+            self.flush(records)
+
+    def flush(self, records):
+        """Appends 'records' to the diagnostic database, or passes them to the fallback
+        function if that fails.
+        """
+        try:
+            df = pd.DataFrame(records, columns=uplink_gateway_columns())
+            with get_rw_db_conn() as conn:
+                partitions.prepare(conn)
+                conn.register('new_gateway_recs', df)
+                partitions.store_records(conn, "INSERT INTO {table} SELECT * FROM new_gateway_recs")
+        except Exception as e:
+            print(f"Error storing LoRa Diagnostic records, writing to log file: {e}")
+            self.fallback(records)
+
+    def close(self, timeout=10.0):
+        """Stops the writer thread and stores the records still buffered.
+        """
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+            thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+        with self.cond:
+            records = self._take()
+        if records:
+            self.flush(records)
+
+
+def make_writer(gtw_logger, **kwargs):
+    """Returns a DiagnosticsWriter that falls back to writing records to the gateway
+    log file through 'gtw_logger'. The writer is closed when the process exits.
+    'kwargs' are passed to the DiagnosticsWriter.
+    """
+    def log_records(records):
+        for rec in records:
+            gtw_logger.info(format_gateway_record(rec))
+
+    writer = DiagnosticsWriter(log_records, **kwargs)
+    atexit.register(writer.close)
+    return writer
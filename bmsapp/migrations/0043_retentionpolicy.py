@@ -0,0 +1,44 @@
+# Generated by Django 2.2.28 on 2026-10-18 03:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bmsapp', '0042_auto_20250424_0826'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetentionPolicy',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=80, unique=True)),
+                ('raw_days', models.PositiveIntegerField(default=90, verbose_name='Days to keep all readings')),
+                ('average1_minutes', models.PositiveIntegerField(default=15, verbose_name='Then average readings over periods of this many minutes')),
+                ('average1_days', models.PositiveIntegerField(blank=True, help_text='Leave blank to keep these averages forever.', null=True, verbose_name='and keep those averages for this many days')),
+                ('average2_minutes', models.PositiveIntegerField(blank=True, help_text='Only used if the first averages are not kept forever.  Leave blank to delete the readings instead.', null=True, verbose_name='Then average readings over periods of this many minutes, kept forever')),
+            ],
+            options={
+                'verbose_name_plural': 'retention policies',
+                'ordering': ['title'],
+            },
+        ),
+        migrations.AddField(
+            model_name='building',
+            name='retention_policy',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='bmsapp.RetentionPolicy'),
+        ),
+        migrations.AddField(
+            model_name='sensor',
+            name='retention_policy',
+            field=models.ForeignKey(blank=True, help_text='Leave blank to use the policy of the Unit or Building.', null=True, on_delete=django.db.models.deletion.SET_NULL, to='bmsapp.RetentionPolicy'),
+        ),
+        migrations.AddField(
+            model_name='unit',
+            name='retention_policy',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='bmsapp.RetentionPolicy'),
+        ),
+    ]
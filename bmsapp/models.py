@@ -45,6 +45,60 @@ class SensorGroup(models.Model):
         ordering = ['sort_order']
 
 
+class RetentionPolicy(models.Model):
+    '''
+    Determines how long sensor readings are kept at full resolution, and the averaged
+    resolutions they are reduced to after that.  A policy can be assigned to a Sensor,
+    to a Unit, or to a Building.  The compact_readings script applies the policies.
+    '''
+
+    # Name of the policy
+    title = models.CharField(max_length=80, unique=True)
+
+    # Days that all readings are kept
+    raw_days = models.PositiveIntegerField('Days to keep all readings', default=90)
+
+    # First averaging period and how long those averages are kept
+    average1_minutes = models.PositiveIntegerField(
+        'Then average readings over periods of this many minutes',
+        default=15
+    )
+    average1_days = models.PositiveIntegerField(
+        'and keep those averages for this many days',
+        blank=True,
+        null=True,
+        help_text='Leave blank to keep these averages forever.'
+    )
+
+    # Second averaging period, kept forever
+    average2_minutes = models.PositiveIntegerField(
+        'Then average readings over periods of this many minutes, kept forever',
+        blank=True,
+        null=True,
+        help_text='Only used if the first averages are not kept forever.  Leave blank to delete the readings instead.'
+    )
+
+    def __str__(self):
+        return self.title
+
+    class Meta:
+        ordering = ['title']
+        verbose_name_plural = 'retention policies'
+
+    def tiers(self):
+        '''Returns the policy as a list of (age in seconds, averaging period in seconds)
+        tuples, the form used by bmsapp.readingdb.retention.  Readings that are older than
+        the last tier and have no averaging period are deleted; the age of that tier is
+        returned with a period of None.
+        '''
+        day = 24 * 3600
+        tiers = [(self.raw_days * day, self.average1_minutes * 60)]
+        if self.average1_days is not None:
+            age = (self.raw_days + self.average1_days) * day
+            tiers.append((age, self.average2_minutes * 60 if self.average2_minutes else None))
+        return tiers
+
+
 class Unit(models.Model):
     '''
     A physical unit, e.g. "deg F", "gpm", for a sensor value.
@@ -56,6 +110,10 @@ class Unit(models.Model):
     # the type of physical quantity being measured, e.g. temperature, fluid flow, air flow, power
     measure_type = models.CharField("Measurement Type", max_length=30)
 
+    # Retention policy for the readings of sensors with this unit, unless the Sensor
+    # has its own policy.
+    retention_policy = models.ForeignKey(RetentionPolicy, models.SET_NULL, blank=True, null=True)
+
     def __str__(self):
         return '%s: %s' % (self.measure_type, self.label)
 
@@ -113,6 +171,12 @@ class Sensor(models.Model):
     # other field values.
     other_properties = models.TextField("Additional Properties to include when exporting data. YAML form, e.g. room: telecom closet", help_text="One property per line.  Name of Property, a colon, a space, and then the property value.", blank=True)
 
+    # Retention policy for this sensor's readings.  If blank, the policy of the sensor's
+    # Unit, or else of its Building, is used.  Readings are kept forever if none of
+    # those have a policy.
+    retention_policy = models.ForeignKey(RetentionPolicy, models.SET_NULL, blank=True, null=True,
+                                         help_text='Leave blank to use the policy of the Unit or Building.')
+
     def __str__(self):
         return self.sensor_id + ": " + self.title
 
@@ -138,6 +202,22 @@ class Sensor(models.Model):
                        self.formatting_function.strip(),
                        bmsapp.data_util.formatCurVal)
 
+    def effective_retention_policy(self):
+        '''Returns the RetentionPolicy that applies to this sensor's readings: the
+        sensor's own policy, else the policy of its Unit, else the policy of the first
+        of its Buildings (by title) that has one.  Returns None if no policy applies.
+        The Buildings and their policies can be prefetched with
+        prefetch_related('building_set__retention_policy').
+        '''
+        if self.retention_policy:
+            return self.retention_policy
+        if self.unit.retention_policy:
+            return self.unit.retention_policy
+        bldgs = [bldg for bldg in self.building_set.all() if bldg.retention_policy_id is not None]
+        if bldgs:
+            return min(bldgs, key=lambda bldg: bldg.title).retention_policy
+        return None
+
     def is_active(self, reading_db):
         '''Returns True if the sensor has last posted within the sensor
         activity interval specified in the settings file.  'reading_db' is a sensor reading
@@ -423,6 +503,10 @@ class Building(models.Model):
     # the sensors and calculated values associated with this building
     sensors = models.ManyToManyField(Sensor, through='BldgToSensor', blank=True)
 
+    # Retention policy for the readings of this building's sensors, used for sensors
+    # that don't have a policy through the Sensor or its Unit.
+    retention_policy = models.ForeignKey(RetentionPolicy, models.SET_NULL, blank=True, null=True)
+
     def __str__(self):
         return self.title
 
@@ -900,11 +984,13 @@ class AlertCondition(models.Model):
             elif time.time() < (self.last_notified + self.wait_before_next * 3600.0):
                 # if the wait time has not been satisfied, don't notify
                 subject_msg =  None
-            elif reading_db.last_read(self.sensor.sensor_id) and (time.time() - reading_db.last_read(self.sensor.sensor_id)['ts'] > self.alert_timeout * 24. * 3600.):
-                # an alert times out if the sensor reading hasn't been updated for self.alert_timeout days.
-                subject_msg = None
             else:
-                subject_msg = self.check_condition(reading_db)
+                last_read = reading_db.last_read(self.sensor.sensor_id)
+                if last_read and (time.time() - last_read['ts'] > self.alert_timeout * 24. * 3600.):
+                    # an alert times out if the sensor reading hasn't been updated for self.alert_timeout days.
+                    subject_msg = None
+                else:
+                    subject_msg = self.check_condition(reading_db)
 
             if subject_msg:
                 alert_count = 1
@@ -3,24 +3,64 @@
 import base64
 import bz2
 import ast
+import io
 import random
 
-def extract_readings(req_data):
-    """Returns a list of sensor readings (ts, sensor_id, val) from a Notehub Route
-    request.
+import numpy as np
+import pandas as pd
+
+# Reading types whose readings can be decoded into arrays by extract_reading_arrays().
+ARRAY_READING_TYPES = ('ts_id_val_csv_bz2', )
+
+def get_reading_type(req_data):
+    """Returns the reading type of a Notehub Route request.
     'req_data' is a dictionary converted from the JSON post data of the Notehub request.
     """
-
-    # first determine the format of the Notehub message.
     if 'reading_type' in req_data:
-        reading_type = req_data['reading_type']
+        return req_data['reading_type']
     elif 'pv_monitoring' in req_data['product']:
-        reading_type = 'fields_in_body'
+        return 'fields_in_body'
     elif 'tempmonitor' in req_data['product']:
-        reading_type = 'standalone'
+        return 'standalone'
     else:
         raise ValueError(f"Unknown Blues Notehub reading type, device: {req_data['best_id']}")
 
+def decode_csv_bz2(encoded):
+    """Decodes the readings of the 'ts_id_val_csv_bz2' reading type: the base64
+    representation of bz2-compressed text with one reading per line, in the form
+    "ts,sensor_id,val".  'ts' is the Unix timestamp, which can be left empty (or 0) for
+    the time received.  The readings are decompressed and parsed as a stream, straight
+    into arrays.  Returns a four-tuple in the form returned by storereads.decode_binary():
+    the list of sensor IDs, and NumPy arrays of the sensor ID positions, timestamps
+    and values.
+    """
+    stream = bz2.BZ2File(io.BytesIO(base64.b64decode(encoded)))
+    df = pd.read_csv(stream, header=None, names=['ts', 'id', 'val'], dtype={'ts': 'float64', 'id': str, 'val': 'float64'},
+                     keep_default_na=False, na_values={'ts': [''], 'val': ['', 'nan', 'NaN', 'None']})
+    id_index, sensor_ids = pd.factorize(df['id'])
+    ts = np.nan_to_num(df['ts'].to_numpy(), nan=0.0).astype(np.int64)
+    return list(sensor_ids), id_index.astype(np.uint32), ts, df['val'].to_numpy()
+
+def extract_reading_arrays(req_data):
+    """Returns the sensor readings of a Notehub Route request whose reading type is
+    in ARRAY_READING_TYPES, as the four-tuple returned by decode_csv_bz2().
+    'req_data' is a dictionary converted from the JSON post data of the Notehub request.
+    """
+    reading_type = get_reading_type(req_data)
+    if reading_type == 'ts_id_val_csv_bz2':
+        return decode_csv_bz2(req_data['readings'])
+    else:
+        raise ValueError(f'Notehub reading type {reading_type} is not decoded into arrays')
+
+def extract_readings(req_data):
+    """Returns a list of sensor readings (ts, sensor_id, val) from a Notehub Route
+    request.
+    'req_data' is a dictionary converted from the JSON post data of the Notehub request.
+    """
+
+    # first determine the format of the Notehub message.
+    reading_type = get_reading_type(req_data)
+
     # the list that will hold the extracted readings
     readings = []
 
@@ -43,6 +83,12 @@ def extract_readings(req_data):
         data_compressed = base64.b64decode(req_data['readings'])
         data = bz2.decompress(data_compressed)
         readings = ast.literal_eval(data.decode('utf-8'))
+
+    elif reading_type in ARRAY_READING_TYPES:
+        # readings are decoded into arrays; see extract_reading_arrays().
+        sensor_ids, id_index, ts, vals = extract_reading_arrays(req_data)
+        readings = [[one_ts or None, sensor_ids[ix], val]
+                    for one_ts, ix, val in zip(ts.tolist(), id_index.tolist(), vals.tolist())]
     
     elif reading_type == 'standalone':
         # Notecard is operating stand-alone without microprocessor.
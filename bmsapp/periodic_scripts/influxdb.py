@@ -178,15 +178,15 @@ def new_records(last_rec={}, reach_back=14, chunk_size=500):
             # get the starting timestamp for this sensor
             start_ts = last_rec.get((sensor.id, bl_sens_link.id), reach_back_ts) + 1    # adding one cuz database call is inclusive
 
-            # loop through all the sensor readings
-            for rec in read_db.rowsForOneID(sensor.sensor_id, start_tm = start_ts):
-                ts = int(rec['ts'])
-                rd_list.append( (final_tags, ts, rec['val']) )
-                last_ts[(sensor.id, bl_sens_link.id)] = ts
-                if len(rd_list) == chunk_size:
-                    yield rd_list, last_ts
-                    rd_list = []
-                    last_ts = {}
+            # loop through all the sensor readings, read in chunks
+            for ts_arr, val_arr in read_db.iterArraysForOneID(sensor.sensor_id, start_ts=start_ts, chunk_rows=chunk_size):
+                for ts, val in zip(ts_arr.tolist(), val_arr.tolist()):
+                    rd_list.append( (final_tags, ts, val) )
+                    last_ts[(sensor.id, bl_sens_link.id)] = ts
+                    if len(rd_list) == chunk_size:
+                        yield rd_list, last_ts
+                        rd_list = []
+                        last_ts = {}
 
     # if any remaining records, yield them
     if len(rd_list):
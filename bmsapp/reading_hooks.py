@@ -0,0 +1,198 @@
+"""Runs the "new reading" hook, Sensor.new_reading(), for Sensors that have just
+received readings.  The hooks are run by a small pool of worker threads fed from a
+queue, instead of a new thread per stored reading.  The queue holds at most one entry
+per Sensor: a Sensor that receives more readings before its hook runs is evaluated
+once, with its newest reading.  The hook only checks the Sensor's AlertConditions, so
+Sensors without an active AlertCondition are not queued at all; the set of Sensor IDs
+that have one is cached.
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import models
+
+# Make a logger for this module
+_logger = logging.getLogger('bms.' + __name__)
+
+# Number of seconds between log messages with the hook statistics.
+STATUS_SECONDS = 600
+
+
+class AlertSensorCache:
+    """In-process cache of the set of Sensor IDs that have an active AlertCondition.
+    Saving or deleting an AlertCondition in this process clears the cache (see the
+    signal receivers below); changes made by another process are seen after 'timeout'
+    seconds.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.sensor_ids = None
+        self.load_time = 0.0
+
+    def get(self):
+        """Returns the set of Sensor IDs that have an active AlertCondition.
+        """
+        sensor_ids = self.sensor_ids
+        if sensor_ids is None or time.time() - self.load_time >= self.timeout:
+            load_time = time.time()
+            sensor_ids = set(models.AlertCondition.objects.filter(active=True).values_list(
+                'sensor__sensor_id', flat=True))
+            self.sensor_ids, self.load_time = sensor_ids, load_time
+        return sensor_ids
+
+    def clear(self):
+        """Removes the cached set.
+        """
+        self.sensor_ids = None
+
+
+class NewReadingHookPool:
+    """A queue of Sensors waiting for their new reading hook, and the pool of up to
+    'worker_count' daemon threads that run the hooks.  The threads are started when
+    the first hook is queued.  The same Sensor is never evaluated by two threads at
+    once.
+    """
+
+    def __init__(self, worker_count, alert_sensors):
+        self.worker_count = max(1, worker_count)
+        self.alert_sensors = alert_sensors
+        self.cond = threading.Condition()
+        self.pending = OrderedDict()    # sensor ID -> (ts, val, time queued), oldest first
+        self.running = set()            # sensor IDs being evaluated
+        self.workers = []
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Zeroes the counts and latencies reported by stats().
+        """
+        self.submitted = 0      # readings passed to submit()
+        self.skipped = 0        # readings of Sensors without an active AlertCondition
+        self.coalesced = 0      # readings merged into a hook already queued
+        self.evaluated = 0      # hooks run
+        self.errors = 0         # hooks that raised an exception
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.stats_start = time.time()
+
+    def submit(self, sensor_id, ts, val):
+        """Queues the new reading hook for the Sensor 'sensor_id', which has just stored
+        the reading 'ts', 'val'.
+        """
+        self.submitted += 1
+        if sensor_id not in self.alert_sensors.get():
+            self.skipped += 1
+            return
+        with self.cond:
+            queued = self.pending.get(sensor_id)
+            if queued is None:
+                self.pending[sensor_id] = (ts, val, time.time())
+            else:
+                self.coalesced += 1
+                if ts >= queued[0]:
+                    self.pending[sensor_id] = (ts, val, queued[2])
+            if len(self.workers) < self.worker_count and len(self.workers) < len(self.pending) + len(self.running):
+                worker = threading.Thread(target=self._work, name='new-reading-hook-%d' % len(self.workers))
+                worker.daemon = True
+                self.workers.append(worker)
+                worker.start()
+            self.cond.notify_all()
+
+    def _next(self):
+        """Waits for a queued Sensor that is not being evaluated, then removes it from
+        the queue and returns (sensor ID, ts, val, time queued).  Called holding 'cond'.
+        """
+        while True:
+            for sensor_id in self.pending:
+                if sensor_id not in self.running:
+                    self.running.add(sensor_id)
+                    return (sensor_id,) + self.pending.pop(sensor_id)
+            self.cond.wait()
+
+    def _work(self):
+        """Runs queued hooks, forever.
+        """
+        while True:
+            with self.cond:
+                sensor_id, ts, val, queued = self._next()
+            try:
+                sensor = models.Sensor.objects.get(sensor_id=sensor_id)
+                sensor.new_reading(ts, val)
+            except models.Sensor.DoesNotExist:
+                # this is an unassigned sensor, so no associated Sensor object
+                pass
+            except Exception:
+                self.errors += 1
+                _logger.exception('Error running the new reading hook for %s' % sensor_id)
+            finally:
+                # a long-lived thread must release its Django database connection like a request does
+                close_old_connections()
+                latency = time.time() - queued
+                with self.cond:
+                    self.running.discard(sensor_id)
+                    self.evaluated += 1
+                    self.latency_total += latency
+                    self.latency_max = max(self.latency_max, latency)
+                    # another thread may be waiting for this Sensor
+                    self.cond.notify_all()
+                    log_status = time.time() - self.stats_start >= STATUS_SECONDS
+                    if log_status:
+                        status = self.stats()
+                        self.reset_stats()
+            if log_status:
+                _logger.info('New reading hooks in the last {seconds:.0f} s: {evaluated:,} run for {submitted:,} readings '
+                             '({skipped:,} without alerts, {coalesced:,} coalesced), {errors:,} errors, latency avg '
+                             '{latency_avg:.2f} s max {latency_max:.2f} s, {queue_depth:,} queued.'.format(**status))
+
+    def stats(self):
+        """Returns a dictionary of statistics since they were last reset: 'queue_depth'
+        and 'running' are the number of Sensors waiting for and being evaluated now;
+        'submitted', 'skipped', 'coalesced', 'evaluated' and 'errors' are counts (see
+        reset_stats()); 'latency_avg' and 'latency_max' are the seconds from when a hook
+        was queued until it finished; 'seconds' is the length of the period.
+        """
+        return {
+            'queue_depth': len(self.pending),
+            'running': len(self.running),
+            'submitted': self.submitted,
+            'skipped': self.skipped,
+            'coalesced': self.coalesced,
+            'evaluated': self.evaluated,
+            'errors': self.errors,
+            'latency_avg': self.latency_total / self.evaluated if self.evaluated else 0.0,
+            'latency_max': self.latency_max,
+            'seconds': time.time() - self.stats_start,
+        }
+
+    def wait_idle(self, timeout=None):
+        """Waits until no hooks are queued or running, or until 'timeout' seconds have
+        passed.  Returns True if the pool is idle.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while self.pending or self.running:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+# The pool used by bmsdata.run_new_reading_hook().
+alert_sensors = AlertSensorCache(getattr(settings, 'BMSAPP_SENSOR_CACHE_SECONDS', 60))
+hook_pool = NewReadingHookPool(getattr(settings, 'BMSAPP_NEW_READING_HOOK_WORKERS', 4), alert_sensors)
+
+@receiver(post_save, sender=models.AlertCondition)
+@receiver(post_delete, sender=models.AlertCondition)
+@receiver(post_save, sender=models.Sensor)
+def _alerts_changed(sender, **kwargs):
+    """Clears the cached set of Sensors with alerts when an AlertCondition is saved or
+    deleted, or a Sensor is saved, which can change its Sensor ID.
+    """
+    alert_sensors.clear()
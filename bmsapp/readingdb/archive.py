@@ -0,0 +1,277 @@
+"""Archive (cold storage) tier for the Reading database.  Readings older than a
+configurable age are moved out of the SQLite Reading database into compressed
+Parquet files, one file per sensor per calendar month (UTC):
+
+    <reading db path without extension>_archive/<sensor id>/<YYYY-MM>.parquet
+
+The '_archive' table in the Reading database records, for each archived sensor,
+the timestamp that the archive covers up to ('archived_to').  Readings with
+timestamps earlier than that were moved to the archive, although readings that
+arrive late for that period are stored in SQLite until the next archive run.
+The BMSdata reading methods combine the two tiers, so callers do not need to know
+where readings are stored.  DuckDB is used to read and write the Parquet files.
+"""
+import os
+import calendar
+import shutil
+import time
+import logging
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+import duckdb
+import pandas as pd
+
+# Make a logger for this module
+_logger = logging.getLogger('bms.' + __name__)
+
+# Name of the table in the Reading database that tracks archived sensors.
+ARCHIVE_TABLE = '_archive'
+
+
+def archive_dir(db_fname):
+    """Returns the directory holding the archive files for the Reading database
+    'db_fname'.
+    """
+    return os.path.splitext(os.path.abspath(db_fname))[0] + '_archive'
+
+def sensor_dir(db_fname, sensor_id):
+    """Returns the directory holding the archive files for 'sensor_id'.  Sensor IDs
+    are case insensitive and may contain characters not allowed in file names, so
+    the lower-case ID is quoted.
+    """
+    return os.path.join(archive_dir(db_fname), quote(sensor_id.lower(), safe=''))
+
+def _month_start(ts):
+    """Returns the Unix timestamp of the start of the UTC month containing 'ts'.
+    """
+    dt = datetime.fromtimestamp(ts, tz=timezone.utc)
+    return calendar.timegm((dt.year, dt.month, 1, 0, 0, 0))
+
+def _next_month_start(ts):
+    """Returns the Unix timestamp of the start of the UTC month following the month
+    containing 'ts'.
+    """
+    dt = datetime.fromtimestamp(ts, tz=timezone.utc)
+    year, month = (dt.year + 1, 1) if dt.month == 12 else (dt.year, dt.month + 1)
+    return calendar.timegm((year, month, 1, 0, 0, 0))
+
+def _month_name(ts):
+    """Returns the 'YYYY-MM' name used for the archive file of the month containing 'ts'.
+    """
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime('%Y-%m')
+
+def _sql_str(s):
+    """Returns 's' as a quoted SQL string literal.
+    """
+    return "'%s'" % s.replace("'", "''")
+
+def month_files(db_fname, sensor_id, start_ts=None, end_ts=None):
+    """Returns a sorted list of the archive files for 'sensor_id' that cover months
+    overlapping the time range 'start_ts' to 'end_ts' (Unix timestamps, either
+    can be None for no limit).
+    """
+    s_dir = sensor_dir(db_fname, sensor_id)
+    if not os.path.isdir(s_dir):
+        return []
+    first = _month_name(start_ts) if start_ts is not None else '0000-00'
+    last = _month_name(end_ts) if end_ts is not None else '9999-99'
+    files = []
+    for fn in os.listdir(s_dir):
+        month, ext = os.path.splitext(fn)
+        if ext == '.parquet' and first <= month <= last:
+            files.append(os.path.join(s_dir, fn))
+    return sorted(files)
+
+def read_archive(db_fname, sensor_id, start_ts=None, end_ts=None, condition=None):
+    """Returns a DataFrame with 'ts' and 'val' columns holding the archived readings
+    for 'sensor_id' in the time range 'start_ts' to 'end_ts', inclusive (either can
+    be None for no limit).  If 'condition' is given, it is a SQL expression on the 'ts'
+    and 'val' columns that limits the readings returned.  The rows are in timestamp
+    order.
+    """
+    files = month_files(db_fname, sensor_id, start_ts, end_ts)
+    if len(files) == 0:
+        return pd.DataFrame({'ts': pd.Series(dtype='int64'), 'val': pd.Series(dtype='float64')})
+
+    sql = 'SELECT ts, val FROM read_parquet([%s]) WHERE 1=1' % ', '.join(_sql_str(f) for f in files)
+    if start_ts is not None:
+        sql += ' AND ts >= %d' % int(start_ts)
+    if end_ts is not None:
+        sql += ' AND ts <= %d' % int(end_ts)
+    if condition:
+        sql += ' AND (%s)' % condition
+    sql += ' ORDER BY ts'
+    con = duckdb.connect()
+    try:
+        return con.execute(sql).df()
+    finally:
+        con.close()
+
+def time_range(db_fname, sensor_id):
+    """Returns a two-tuple holding the timestamps of the first and last archived
+    readings for 'sensor_id'.  None values are returned if there are no archived
+    readings.
+    """
+    files = month_files(db_fname, sensor_id)
+    if len(files) == 0:
+        return None, None
+    con = duckdb.connect()
+    try:
+        first_ts = con.execute('SELECT min(ts) FROM read_parquet(%s)' % _sql_str(files[0])).fetchone()[0]
+        last_ts = con.execute('SELECT max(ts) FROM read_parquet(%s)' % _sql_str(files[-1])).fetchone()[0]
+        return first_ts, last_ts
+    finally:
+        con.close()
+
+def reading_count(db_fname, sensor_id, condition=None):
+    """Returns the number of archived readings for 'sensor_id'.  If 'condition' is
+    given, it is a SQL expression on the 'ts' and 'val' columns that limits the readings
+    counted.  Without a condition, the counts come from the Parquet file metadata, so no
+    readings are read.
+    """
+    files = month_files(db_fname, sensor_id)
+    if len(files) == 0:
+        return 0
+    sql = 'SELECT count(*) FROM read_parquet([%s])' % ', '.join(_sql_str(f) for f in files)
+    if condition:
+        sql += ' WHERE (%s)' % condition
+    con = duckdb.connect()
+    try:
+        return con.execute(sql).fetchone()[0]
+    finally:
+        con.close()
+
+def _write_month(path, df):
+    """Adds the readings in the DataFrame 'df' ('ts' and 'val' columns) to the monthly
+    archive file 'path', creating it if needed.  Readings in 'df' replace archived
+    readings having the same timestamp.
+    """
+    con = duckdb.connect()
+    try:
+        con.register('new_rows', df)
+        sql = 'SELECT ts, val FROM new_rows'
+        if os.path.exists(path):
+            sql = ('SELECT ts, val FROM read_parquet(%s) WHERE ts NOT IN (SELECT ts FROM new_rows) '
+                   'UNION ALL %s' % (_sql_str(path), sql))
+        # write to a temporary file so a partially written file never replaces a
+        # good one.
+        tmp_path = path + '.tmp'
+        con.execute("COPY (%s ORDER BY ts) TO %s (FORMAT PARQUET, COMPRESSION ZSTD)" % (sql, _sql_str(tmp_path)))
+        os.replace(tmp_path, path)
+    finally:
+        con.close()
+
+def create_archive_table(db):
+    """Creates the table in the BMSdata Reading database 'db' that tracks archived
+    sensors, if it does not exist.
+    """
+    if ARCHIVE_TABLE not in db.sensor_ids:
+        db.cursor.execute('CREATE TABLE IF NOT EXISTS [%s] '
+                          '(sensor_id varchar(50) primary key COLLATE NOCASE, archived_to integer)' % ARCHIVE_TABLE)
+        db.conn.commit()
+        db.add_to_sensor_id_lists(ARCHIVE_TABLE)
+
+def archived_to(db, sensor_id):
+    """Returns the timestamp that the archive for 'sensor_id' covers up to, or None if
+    the sensor has no archived readings.  'db' is a BMSdata Reading database.
+    """
+    if ARCHIVE_TABLE not in db.sensor_ids:
+        return None
+    rec = db.cursor.execute('SELECT archived_to FROM [%s] WHERE sensor_id = ?' % ARCHIVE_TABLE,
+                            (sensor_id,)).fetchone()
+    return rec[0] if rec else None
+
+def archive_sensor(db, sensor_id, cutoff_ts):
+    """Moves the readings of 'sensor_id' that have timestamps earlier than 'cutoff_ts'
+    from the BMSdata Reading database 'db' to the archive.  'cutoff_ts' must be the
+    start of a UTC month.  Each month is moved and committed separately so write locks
+    on the Reading database are short.  Returns the number of readings archived.
+    """
+    source = db.storage.source(sensor_id)
+    first_ts = db.cursor.execute('SELECT min(ts) FROM %s WHERE ts < ?' % source, (cutoff_ts,)).fetchone()[0]
+    count = 0
+    if first_ts is not None:
+        s_dir = sensor_dir(db.db_fname, sensor_id)
+        os.makedirs(s_dir, exist_ok=True)
+        month_ts = _month_start(first_ts)
+        while month_ts < cutoff_ts:
+            next_ts = _next_month_start(month_ts)
+            df = pd.read_sql_query('SELECT ts, val FROM %s WHERE ts >= %d AND ts < %d ORDER BY ts' %
+                                   (source, month_ts, next_ts), db.conn)
+            if len(df):
+                _write_month(os.path.join(s_dir, _month_name(month_ts) + '.parquet'), df)
+                db.cursor.execute(db.storage.delete_sql(sensor_id, 'ts >= %d AND ts < %d' % (month_ts, next_ts)))
+                db.conn.commit()
+                count += len(df)
+            month_ts = next_ts
+
+    db.cursor.execute('INSERT INTO [%s] (sensor_id, archived_to) VALUES (?, ?) '
+                      'ON CONFLICT(sensor_id) DO UPDATE SET archived_to=max(archived_to, excluded.archived_to)' % ARCHIVE_TABLE,
+                      (sensor_id, cutoff_ts))
+    db.conn.commit()
+    return count
+
+def archive_readings(db, age_days):
+    """Moves readings older than 'age_days' days (rounded back to the start of a UTC
+    month) from the BMSdata Reading database 'db' to the archive, for all sensors.
+    Returns a two-tuple: (number of sensors with readings archived, number of
+    readings archived).
+    """
+    create_archive_table(db)
+    cutoff_ts = _month_start(time.time() - age_days * 24 * 3600.0)
+    sensor_count = 0
+    reading_count = 0
+    for sensor_id in db.sensor_id_list():
+        try:
+            n = archive_sensor(db, sensor_id, cutoff_ts)
+            if n:
+                sensor_count += 1
+                reading_count += n
+        except Exception:
+            db.conn.rollback()
+            _logger.exception('Error archiving readings for %s' % sensor_id)
+    return sensor_count, reading_count
+
+def delete_readings(db, sensor_id, condition=None):
+    """Deletes the archived readings for 'sensor_id' in the BMSdata Reading database
+    'db' that meet the SQL 'condition' on the 'ts' and 'val' columns, or all of them if
+    'condition' is None.  Monthly files are rewritten without the deleted readings, or
+    removed if no readings are left.  If no files are left, the sensor is removed from
+    the archive table; that change is not committed.  Returns the number of readings
+    deleted.
+    """
+    files = month_files(db.db_fname, sensor_id)
+    deleted = 0
+    con = duckdb.connect()
+    try:
+        for path in files:
+            total = con.execute('SELECT count(*) FROM read_parquet(%s)' % _sql_str(path)).fetchone()[0]
+            if condition is None:
+                count = total
+            else:
+                count = con.execute('SELECT count(*) FROM read_parquet(%s) WHERE (%s)' %
+                                    (_sql_str(path), condition)).fetchone()[0]
+            if count == 0:
+                continue
+            if count == total:
+                os.remove(path)
+            else:
+                tmp_path = path + '.tmp'
+                con.execute("COPY (SELECT ts, val FROM read_parquet(%s) WHERE NOT coalesce((%s), false) ORDER BY ts) "
+                            "TO %s (FORMAT PARQUET, COMPRESSION ZSTD)" % (_sql_str(path), condition, _sql_str(tmp_path)))
+                os.replace(tmp_path, path)
+            deleted += count
+    finally:
+        con.close()
+    if files and not month_files(db.db_fname, sensor_id):
+        delete_sensor_archive(db, sensor_id)
+    return deleted
+
+def delete_sensor_archive(db, sensor_id):
+    """Deletes the archived readings for 'sensor_id' from the BMSdata Reading database
+    'db'.  The change to the archive table is not committed.
+    """
+    if ARCHIVE_TABLE in db.sensor_ids:
+        db.cursor.execute('DELETE FROM [%s] WHERE sensor_id = ?' % ARCHIVE_TABLE, (sensor_id,))
+    shutil.rmtree(sensor_dir(db.db_fname, sensor_id), ignore_errors=True)
@@ -0,0 +1,290 @@
+"""Backups of the Reading database.  A backup starts with a consistent snapshot of the
+database made with the SQLite backup API, copied a group of pages at a time while a
+read transaction pins the snapshot.  In WAL mode, readings keep being stored while
+the snapshot is made.  The snapshot is then compressed into the 'bak' directory next
+to the database, using gzip blocks compressed in parallel threads (zlib releases the
+GIL).  The result is a standard multi-member gzip file that gunzip can expand.
+
+There are two kinds of backups:
+
+    <YYYY-MM-DD-HHMMSS>.sqlite.gz       full backup: the compressed database file.
+    <YYYY-MM-DD-HHMMSS>.sqlite.pages    hashes of the pages in the full backup.
+    <YYYY-MM-DD-HHMMSS>.sqlite.inc.gz   incremental backup: the pages that changed
+                                        since the most recent full backup.
+
+restore() rebuilds a database file from either kind of backup.
+"""
+import os
+import glob
+import gzip
+import json
+import time
+import struct
+import sqlite3
+import hashlib
+import logging
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Make a logger for this module
+_logger = logging.getLogger('bms.' + __name__)
+
+# Number of database pages copied per backup API step.
+STEP_PAGES = 4096
+
+# Size of the blocks that are compressed in parallel, and the gzip compression level.
+BLOCK_SIZE = 4 * 1024 * 1024
+COMPRESS_LEVEL = 6
+
+# Number of compression threads.
+THREADS = os.cpu_count() or 1
+
+# Size of the page hashes stored for full backups.
+HASH_SIZE = 16
+
+# First line of an incremental backup file.
+INC_MAGIC = b'BMON incremental backup\n'
+
+
+def bak_dir(db_fname):
+    """Returns the directory holding the backups of the Reading database 'db_fname'.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(db_fname)), 'bak')
+
+def snapshot(db_fname, dest_fname, step_pages=STEP_PAGES):
+    """Copies the SQLite database 'db_fname' to 'dest_fname' with the backup API,
+    'step_pages' pages per step.  Returns the number of pages copied.
+    """
+    src = sqlite3.connect(db_fname, isolation_level=None)
+    dest = sqlite3.connect(dest_fname)
+    try:
+        src.execute('PRAGMA busy_timeout=30000')
+        # Hold a read transaction so every step copies from the same snapshot.  Changes
+        # committed by other connections meanwhile go to the WAL and do not restart
+        # the backup.
+        src.execute('BEGIN')
+        src.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        pages = []
+        src.backup(dest, pages=step_pages, sleep=0,
+                   progress=lambda status, remaining, total: pages.append(total))
+        src.execute('COMMIT')
+        return pages[-1] if pages else 0
+    finally:
+        src.close()
+        dest.close()
+
+def _gzip_block(data):
+    """Returns 'data' compressed as one gzip member.
+    """
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+def write_compressed(blocks, dest_fname, threads=THREADS):
+    """Writes the byte strings produced by the iterable 'blocks' to the gzip file
+    'dest_fname', compressing up to 'threads' blocks at a time in parallel.  The file
+    is written under a temporary name and renamed when complete.  Returns the size of
+    the compressed file.
+    """
+    tmp_fname = dest_fname + '.tmp'
+    with open(tmp_fname, 'wb') as out, ThreadPoolExecutor(threads) as pool:
+        pending = deque()
+        for block in blocks:
+            pending.append(pool.submit(_gzip_block, block))
+            if len(pending) > threads * 2:
+                out.write(pending.popleft().result())
+        while pending:
+            out.write(pending.popleft().result())
+    os.replace(tmp_fname, dest_fname)
+    return os.path.getsize(dest_fname)
+
+def _file_blocks(fname):
+    """Yields the contents of the file 'fname' in BLOCK_SIZE pieces.
+    """
+    with open(fname, 'rb') as f:
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+            yield block
+
+def page_hashes(fname, page_size):
+    """Returns a bytes object holding the HASH_SIZE byte hash of each 'page_size' byte
+    page of the database file 'fname'.
+    """
+    hashes = []
+    pages_per_read = max(1, BLOCK_SIZE // page_size)
+    with open(fname, 'rb') as f:
+        while True:
+            data = f.read(page_size * pages_per_read)
+            if not data:
+                break
+            for i in range(0, len(data), page_size):
+                hashes.append(hashlib.blake2b(data[i:i + page_size], digest_size=HASH_SIZE).digest())
+    return b''.join(hashes)
+
+def _page_size(fname):
+    """Returns the page size of the SQLite database file 'fname'.
+    """
+    conn = sqlite3.connect(fname)
+    try:
+        return conn.execute('PRAGMA page_size').fetchone()[0]
+    finally:
+        conn.close()
+
+def _read_manifest(fname):
+    """Returns the page size and the page hashes stored in the full backup manifest
+    'fname'.
+    """
+    with open(fname, 'rb') as f:
+        page_size = struct.unpack('>I', f.read(4))[0]
+        return page_size, f.read()
+
+def last_full_backup(db_fname):
+    """Returns the file name of the most recent full backup of the Reading database
+    'db_fname' that has a page hash manifest, or None if there is none.
+    """
+    for manifest in sorted(glob.glob(os.path.join(bak_dir(db_fname), '*.sqlite.pages')), reverse=True):
+        full_fname = manifest[:-len('.pages')] + '.gz'
+        if os.path.exists(full_fname):
+            return full_fname
+    return None
+
+def _changed_page_blocks(snap_fname, page_size, changed, page_count, base_fname):
+    """Yields the contents of an incremental backup: a header followed by the page
+    number and contents of each page of 'snap_fname' listed in 'changed'.
+    """
+    header = {'base': os.path.basename(base_fname), 'page_size': page_size, 'page_count': page_count}
+    block = [INC_MAGIC + json.dumps(header).encode() + b'\n']
+    size = len(block[0])
+    with open(snap_fname, 'rb') as f:
+        for pgno in changed:
+            f.seek(pgno * page_size)
+            block.append(struct.pack('>I', pgno) + f.read(page_size))
+            size += page_size + 4
+            if size >= BLOCK_SIZE:
+                yield b''.join(block)
+                block, size = [], 0
+    if block:
+        yield b''.join(block)
+
+def backup_db(db_fname, days_to_retain, incremental=False):
+    """Backs up the Reading database 'db_fname' to its 'bak' directory and deletes
+    backups created more than 'days_to_retain' days ago, keeping the full backups that
+    retained incremental backups are based on.  If 'incremental' is True, only the pages
+    changed since the last full backup are stored; a full backup is made if there is no
+    full backup to compare against.  Returns a dictionary describing the backup: 'file',
+    'kind', 'seconds', 'snapshot_seconds', 'compress_seconds', 'db_bytes',
+    'pages_stored', 'compressed_bytes' and 'mb_per_sec' (database MB per second).
+    """
+    start = time.time()
+    b_dir = bak_dir(db_fname)
+    os.makedirs(b_dir, exist_ok=True)
+    base_fname = os.path.join(b_dir, time.strftime('%Y-%m-%d-%H%M%S') + '.sqlite')
+    snap_fname = base_fname + '.snapshot'
+
+    full_fname = last_full_backup(db_fname) if incremental else None
+    try:
+        snapshot(db_fname, snap_fname)
+        snapshot_secs = time.time() - start
+        page_size = _page_size(snap_fname)
+        hashes = page_hashes(snap_fname, page_size)
+
+        if full_fname and _read_manifest(full_fname[:-len('.gz')] + '.pages')[0] == page_size:
+            kind = 'incremental'
+            out_fname = base_fname + '.inc.gz'
+            old_hashes = _read_manifest(full_fname[:-len('.gz')] + '.pages')[1]
+            new = np.frombuffer(hashes, dtype=np.uint8).reshape(-1, HASH_SIZE)
+            old = np.frombuffer(old_hashes, dtype=np.uint8).reshape(-1, HASH_SIZE)
+            common = min(len(new), len(old))
+            changed = np.flatnonzero((new[:common] != old[:common]).any(axis=1)).tolist() + \
+                      list(range(common, len(new)))
+            pages_stored = len(changed)
+            compressed_bytes = write_compressed(
+                _changed_page_blocks(snap_fname, page_size, changed, len(new), full_fname), out_fname)
+        else:
+            kind = 'full'
+            out_fname = base_fname + '.gz'
+            pages_stored = len(hashes) // HASH_SIZE
+            compressed_bytes = write_compressed(_file_blocks(snap_fname), out_fname)
+            with open(base_fname + '.pages', 'wb') as f:
+                f.write(struct.pack('>I', page_size))
+                f.write(hashes)
+        db_bytes = os.path.getsize(snap_fname)
+    finally:
+        if os.path.exists(snap_fname):
+            os.remove(snap_fname)
+
+    delete_old_backups(db_fname, days_to_retain)
+
+    secs = time.time() - start
+    return {
+        'file': out_fname,
+        'kind': kind,
+        'seconds': secs,
+        'snapshot_seconds': snapshot_secs,
+        'compress_seconds': secs - snapshot_secs,
+        'db_bytes': db_bytes,
+        'pages_stored': pages_stored,
+        'compressed_bytes': compressed_bytes,
+        'mb_per_sec': db_bytes / 1e6 / secs if secs > 0 else 0.0,
+    }
+
+def _incremental_header(fname):
+    """Returns the header dictionary of the incremental backup file 'fname'.
+    """
+    with gzip.open(fname, 'rb') as f:
+        if f.readline() != INC_MAGIC:
+            raise ValueError('%s is not an incremental backup file.' % fname)
+        return json.loads(f.readline())
+
+def delete_old_backups(db_fname, days_to_retain):
+    """Deletes the backup files of the Reading database 'db_fname' that were created
+    more than 'days_to_retain' days ago, other than full backups that retained
+    incremental backups are based on.
+    """
+    b_dir = bak_dir(db_fname)
+    cutoff_time = time.time() - days_to_retain * 24 * 3600.0
+    needed = set()
+    for fn in glob.glob(os.path.join(b_dir, '*.inc.gz')):
+        if os.path.getmtime(fn) >= cutoff_time:
+            try:
+                needed.add(_incremental_header(fn)['base'])
+            except Exception:
+                _logger.exception('Error reading incremental backup %s' % fn)
+    for fn in glob.glob(os.path.join(b_dir, '*.gz')) + glob.glob(os.path.join(b_dir, '*.pages')):
+        full_name = os.path.basename(fn)[:-len('.pages')] + '.gz' if fn.endswith('.pages') else os.path.basename(fn)
+        if os.path.getmtime(fn) < cutoff_time and full_name not in needed:
+            os.remove(fn)
+
+def restore(backup_fname, dest_fname):
+    """Rebuilds the database file 'dest_fname' from the full or incremental backup
+    'backup_fname'.  An incremental backup needs its full backup in the same directory.
+    """
+    base_fname = None
+    if backup_fname.endswith('.inc.gz'):
+        header = _incremental_header(backup_fname)
+        base_fname = os.path.join(os.path.dirname(backup_fname), header['base'])
+    full_fname = base_fname or backup_fname
+
+    with gzip.open(full_fname, 'rb') as src, open(dest_fname, 'wb') as dest:
+        while True:
+            block = src.read(BLOCK_SIZE)
+            if not block:
+                break
+            dest.write(block)
+
+    if base_fname:
+        page_size = header['page_size']
+        with gzip.open(backup_fname, 'rb') as src, open(dest_fname, 'r+b') as dest:
+            src.readline()
+            src.readline()
+            while True:
+                rec = src.read(4 + page_size)
+                if not rec:
+                    break
+                dest.seek(struct.unpack('>I', rec[:4])[0] * page_size)
+                dest.write(rec[4:])
+            dest.truncate(header['page_count'] * page_size)
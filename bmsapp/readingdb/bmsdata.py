@@ -6,85 +6,339 @@ import sys
 import os.path
 import time
 import logging
-import shutil
-import subprocess
-import glob
-import calendar
+import itertools
+import math
 import threading
+import zlib
+from urllib.request import pathname2url
 
-import pytz
-from dateutil import parser
 import pandas as pd
 import numpy as np
 
+from . import storage
+from . import archive
+from . import rollup
+from . import backup
+from . import retention
+from . import textimport
+
 # Make a logger for this module
 _logger = logging.getLogger('bms.' + __name__)
 
 # The path to the default Sqlite database used to store readings.
 DEFAULT_DB = os.path.join(os.path.dirname(__file__), 'data', 'bms_data.sqlite')
 
+# Maximum number of sensors read by one UNION ALL query in dataframeForMultipleIDs().
+# SQLite limits the number of terms in a compound SELECT to 500.
+MULTI_ID_QUERY_CHUNK = 200
+# Number of seconds in a day, the resolution of the '_sensor_inserts' counts.
+DAY_SECONDS = 86400
+
+# Number of rows fetched at a time when readings are read into numpy arrays.
+FETCH_ROWS = 50000
+
+# The typical spacing of a sensor's readings is the median spacing of its most recent
+# SPACING_SAMPLE readings when its statistics are refreshed.  After that, each batch of
+# readings added after the last one moves it toward the batch's average spacing, with a
+# weight of SPACING_WEIGHT per reading (at most 1).  That average is limited to
+# SPACING_MAX_RATIO times the current value, so an outage shifts it only a little.
+SPACING_SAMPLE = 1000
+SPACING_WEIGHT = 0.05
+SPACING_MAX_RATIO = 4.0
+
+# Table in the main file of a sharded Reading database listing the shard files.
+SHARD_TABLE = '_shards'
+
 def run_new_reading_hook(sensor_id, ts, val):
     """This runs the "new reading" hook for a Sensor that has just received and stored a new
-    reading. This is run in a separate Thread due some slow processing that could occur.
+    reading. The hook is queued for the worker threads in bmsapp/reading_hooks.py due to some
+    slow processing that could occur; a Sensor that receives several readings before its hook
+    runs is evaluated once.
     'sensor_id' is the sensor_id of the sensor that just received the new reading. 'ts' is
     the Unix Epoch timestamp of the new reading. 'val' is the value of the new reading.
     """
-    from bmsapp.models import Sensor    # needed to import here to avoid circular import
+    from bmsapp import reading_hooks    # needed to import here to avoid circular import
+
+    reading_hooks.hook_pool.submit(sensor_id, ts, val)
+
+
 
+def _reading_recs(ts, id, val):
+    """Returns a list of (ts, id, val) tuples from the arguments of insert_reading(),
+    which can either be lists or single values.
+    """
+    try:
+        return list(zip(ts, id, val))
+    except:
+        # they were single values, not lists
+        return [(ts, id, val)]
+
+def _setting(name, default):
+    """Returns the Django setting 'name', or 'default' if the setting is not present.
+    'default' is also returned if Django settings are not configured, so that this
+    module can be used outside of the Django project.
+    """
     try:
-        sensor = Sensor.objects.get(sensor_id=sensor_id)
-        t = threading.Thread(target=sensor.new_reading, args=(ts, val))
-        t.daemon = True
-        t.start()
+        from django.conf import settings
+        return getattr(settings, name, default)
+    except Exception:
+        return default
+
+# Holds the connections that are reused by each thread, keyed by
+# (absolute path of database file, read only flag), and the number of open BMSdata
+# objects using each of those connections.
+_thread_conns = threading.local()
+
+def _open_connection(fname, read_only):
+    """Opens and configures a new connection to the SQLite database 'fname'.  If
+    'read_only' is True, the database is opened in read-only mode.  The PRAGMA
+    values used to configure the connection come from the Django settings.
+    """
+    busy_timeout = _setting('BMSAPP_READING_DB_BUSY_TIMEOUT', 30000)    # milliseconds
+    if read_only:
+        conn = sqlite3.connect('file:%s?mode=ro' % pathname2url(os.path.abspath(fname)),
+                               uri=True, timeout=busy_timeout / 1000.0)
+    else:
+        conn = sqlite3.connect(fname, timeout=busy_timeout / 1000.0)
+        # The journal mode is stored in the database file, so only a connection
+        # that can write is able to change it.
+        journal_mode = _setting('BMSAPP_READING_DB_JOURNAL_MODE', 'WAL')
+        if journal_mode:
+            conn.execute('PRAGMA journal_mode=%s' % journal_mode)
+
+    # use the SQLite Row row_factory for all Select queries
+    conn.row_factory = sqlite3.Row
+
+    synchronous = _setting('BMSAPP_READING_DB_SYNCHRONOUS', 'NORMAL')
+    if synchronous:
+        conn.execute('PRAGMA synchronous=%s' % synchronous)
+    conn.execute('PRAGMA busy_timeout=%d' % busy_timeout)
+    conn.execute('PRAGMA mmap_size=%d' % _setting('BMSAPP_READING_DB_MMAP_SIZE', 268435456))
+    conn.execute('PRAGMA cache_size=%d' % _setting('BMSAPP_READING_DB_CACHE_SIZE', -65536))
+
+    return conn
+
+def get_connection(fname=DEFAULT_DB, read_only=False):
+    """Returns a connection to the SQLite database 'fname' that is reused by all
+    BMSdata objects created in the current thread.  SQLite connections cannot be
+    shared across threads, so each thread has its own connections.  If 'read_only'
+    is True, a separate read-only connection is returned.
+    """
+    conns = getattr(_thread_conns, 'conns', None)
+    if conns is None:
+        conns = _thread_conns.conns = {}
+    key = (os.path.abspath(fname), read_only)
+    conn = conns.get(key)
+    if conn is None:
+        conn = _open_connection(fname, read_only)
+        conns[key] = conn
+    return conn
+
+def close_connections():
+    """Closes all of the database connections that are held for the current thread.
+    Connections held for other threads are closed when those threads end.
+    """
+    conns = getattr(_thread_conns, 'conns', {})
+    for conn in conns.values():
+        conn.close()
+    conns.clear()
+    getattr(_thread_conns, 'users', {}).clear()
+
+def _add_user(conn, count):
+    """Adds 'count' to the number of open BMSdata objects in this thread that use the
+    connection 'conn', and returns the new number.
+    """
+    users = getattr(_thread_conns, 'users', None)
+    if users is None:
+        users = _thread_conns.users = {}
+    n = users.get(conn, 0) + count
+    if n > 0:
+        users[conn] = n
+    else:
+        users.pop(conn, None)
+    return n
+
+
+class _SensorTableRegistry:
+    """Process-wide record of the tables present in one reading database file.
+    Loading the table list requires a scan of 'sqlite_master', which is slow when there
+    are many thousands of sensor tables, so it is done once per process and shared by
+    all BMSdata objects that use the same file.  The SQLite 'schema_version' is saved
+    with the list so that changes made by other processes are detected cheaply.
+    """
 
-    except Sensor.DoesNotExist:
-        # this is an unassigned sensor, so no associated Sensor object
-        pass
+    def __init__(self, db_fname):
+        self.db_fname = db_fname       # absolute path of the database file
+        self.lock = threading.RLock()
+        self.schema_version = None     # (schema version, user version) when the sets were loaded
+        self.sensor_ids = set()        # all table names + sensor IDs
+        self.sensor_ids_lower = set()  # lower-case version of the above
+        self.storage = None            # storage engine object used by the database
+        self.migrated = False          # True once the schema migration has run
+        self.latest = {}               # cache of latest readings: lower-case ID -> (time cached, reading)
+        self.shard_fnames = []         # paths of the shard files, if the database is sharded
+
+    def _version(self, cursor):
+        """Returns the SQLite schema version and user version of the database.  The
+        user version is incremented by storage engines that track sensors in a table
+        rather than in the schema.
+        """
+        return (cursor.execute('PRAGMA schema_version').fetchone()[0],
+                cursor.execute('PRAGMA user_version').fetchone()[0])
 
+    def refresh(self, cursor):
+        """Reloads the table name sets through 'cursor' if the database schema has
+        changed since they were loaded.
+        """
+        with self.lock:
+            version = self._version(cursor)
+            if version != self.schema_version:
+                recs = cursor.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
+                tables = set([rec[0] for rec in recs])
+                engine = storage.detect_engine(tables)
+                if self.storage is None or self.storage.name != engine:
+                    self.storage = storage.ENGINES[engine](self)
+                self.sensor_ids = tables | self.storage.load_sensor_ids(cursor, tables)
+                # because SQLite has case insensitive table names, make a sensor ID set with lower-case names
+                self.sensor_ids_lower = {tbl.lower() for tbl in self.sensor_ids}
+                if SHARD_TABLE in tables:
+                    recs = cursor.execute('SELECT fname FROM [%s] ORDER BY shard' % SHARD_TABLE).fetchall()
+                    self.shard_fnames = [os.path.join(os.path.dirname(self.db_fname), rec[0]) for rec in recs]
+                self.schema_version = version
+                self.latest = {}
+
+    def schema_changed(self, cursor):
+        """Called after this process changes the schema or the sensor list and updates
+        the sets itself.  The saved version is advanced if no other change occurred
+        in between; otherwise, the sets will be reloaded on the next refresh().
+        """
+        with self.lock:
+            version = self._version(cursor)
+            if self.schema_version is not None:
+                schema_delta = version[0] - self.schema_version[0]
+                user_delta = version[1] - self.schema_version[1]
+                if schema_delta >= 0 and user_delta >= 0 and schema_delta + user_delta == 1:
+                    self.schema_version = version
+
+# Registries keyed by the absolute path of the reading database file
+_registries = {}
+_registries_lock = threading.Lock()
+
+def _get_registry(fname):
+    """Returns the shared _SensorTableRegistry for the database file 'fname'.
+    """
+    key = os.path.abspath(fname)
+    with _registries_lock:
+        if key not in _registries:
+            _registries[key] = _SensorTableRegistry(key)
+        return _registries[key]
+
+def _uses_shards(fname, read_only):
+    """Returns True if the Reading database 'fname' spreads its sensors across shard
+    files, or will once it is opened: a database without sensors is sharded if the
+    BMSAPP_READING_DB_SHARDS setting is more than 1 and it is not opened read-only.
+    """
+    read_only = read_only and os.path.exists(fname)
+    registry = _get_registry(fname)
+    registry.refresh(get_connection(fname, read_only).cursor())
+    if registry.shard_fnames:
+        return True
+    return (not read_only and _setting('BMSAPP_READING_DB_SHARDS', 1) > 1 and
+            not any(s_id[0] != '_' for s_id in registry.sensor_ids))
 
 
 class BMSdata:
 
+    @property
+    def storage(self):
+        """The storage engine object that determines how readings are laid out
+        in the database.  See the 'storage' module.
+        """
+        return self.registry.storage
+
+    @property
+    def sensor_ids(self):
+        """Set of all of the sensor IDs and table names (including special tables with
+        names starting with underbar) in the database.
+        """
+        return self.registry.sensor_ids
+
+    @property
+    def sensor_ids_lower(self):
+        """Lower-case version of the 'sensor_ids' set.
+        """
+        return self.registry.sensor_ids_lower
+
     def add_to_sensor_id_lists(self, sensor_id):
         """Add `sensor_id` to the two sets tracking sensor ids.
         """
-        self.sensor_ids.add(sensor_id)
-        self.sensor_ids_lower.add(sensor_id.lower())
+        with self.registry.lock:
+            self.sensor_ids.add(sensor_id)
+            self.sensor_ids_lower.add(sensor_id.lower())
+            self.registry.schema_changed(self.cursor)
 
     def remove_from_sensor_id_lists(self, sensor_id):
         """ Remove `sensor_id` from the two sets tracking sensor ids.
         """
-        if sensor_id in self.sensor_ids:
-            self.sensor_ids.remove(sensor_id)
-        if sensor_id.lower() in self.sensor_ids_lower:
-            self.sensor_ids_lower.remove(sensor_id.lower())
+        with self.registry.lock:
+            # table names are case insensitive, so remove the ID in any case.
+            lower_id = sensor_id.lower()
+            for s_id in [s_id for s_id in self.sensor_ids if s_id.lower() == lower_id]:
+                self.sensor_ids.discard(s_id)
+            self.sensor_ids_lower.discard(lower_id)
+            self.registry.schema_changed(self.cursor)
+
+    def __new__(cls, fname=DEFAULT_DB, read_only=False, storage_engine=None):
+        """Returns a ShardedBMSdata object instead if the database 'fname' spreads its
+        sensors across shard files (see ShardedBMSdata).
+        """
+        if cls is BMSdata and _uses_shards(fname, read_only):
+            cls = ShardedBMSdata
+        return super().__new__(cls)
 
-    def __init__(self, fname=DEFAULT_DB):
+    def __init__(self, fname=DEFAULT_DB, read_only=False, storage_engine=None):
         """Creates the database object.
         fname: full path to SQLite database file. If the file is not present, 
             it will be created.
+        read_only: if True, the database is opened through a read-only connection,
+            used by reports and API views that never write readings.
+        storage_engine: the name of the storage engine to use if the database is new
+            (see the 'storage' module).  If None, the BMSAPP_READING_DB_STORAGE
+            setting is used.
         """
 
         self.db_fname = fname   # save database filename.
+        self.new_storage_engine = storage_engine or _setting('BMSAPP_READING_DB_STORAGE', storage.TABLE_PER_SENSOR)
 
-        self.conn = sqlite3.connect(self.db_fname)
+        # a read-only connection cannot create a new database file.
+        self.read_only = read_only and os.path.exists(fname)
 
-        # use the SQLite Row row_factory for all Select queries
-        self.conn.row_factory = sqlite3.Row
+        # The connection is reused by all BMSdata objects in this thread.
+        self.conn = get_connection(self.db_fname, self.read_only)
+        _add_user(self.conn, 1)
 
         # now create a cursor object
         self.cursor = self.conn.cursor()
         
-        # make a set list of all of the tables (sensor IDs + special tables
-        # with names starting with underbar) in the database, so
-        # that it is fast to determine whether a sensor exists in the current
-        # database.
-        recs = self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
-        self.sensor_ids = set([rec['name'] for rec in recs])  # plus special tables
-
-        # because SQLite has case insensitive table names, make a sensor ID set with lower-case names
-        self.sensor_ids_lower = {tbl.lower() for tbl in self.sensor_ids}
-        
+        # The set of tables in the database is tracked by a registry shared across this 
+        # process, so that it is fast to determine whether a sensor exists in the current
+        # database.  Only reload it if the database schema has changed.
+        self.registry = _get_registry(self.db_fname)
+        self.registry.refresh(self.cursor)
+
+        # The first time this database is used by the process, make sure the special
+        # tables are present and up-to-date.
+        if not self.read_only:
+            with self.registry.lock:
+                if not self.registry.migrated:
+                    self.migrate_schema()
+                    self.registry.migrated = True
+
+    def migrate_schema(self):
+        """Creates the special tables used by the Reading database if they are not
+        present and updates the structure of older versions of those tables.  This
+        is run once per process for each database file.
+        """
         # Check to see if the table that stores last raw reading for cumulative
         # counter sensors exists.  If not, make it.  Make the value field a 
         # real instead of integer in case this table is needed for non counter
@@ -135,29 +389,119 @@ recipients VARCHAR(255)
                 
                 self.conn.commit()
 
+        # A new database uses the requested storage engine.
+        engine = self.new_storage_engine
+        if engine != self.storage.name:
+            if len(self.sensor_id_list()) == 0:
+                storage.ENGINES[engine](self.registry).create_schema(self.cursor)
+                self.conn.commit()
+                self.registry.refresh(self.cursor)
+            else:
+                _logger.warning('Reading database %s uses the %s storage engine, not the %s engine selected '
+                                'in settings.  Use the migrate_reading_storage script to convert it.' % 
+                                (self.db_fname, self.storage.name, engine))
+
+        # Check to see if the table holding the latest reading of each sensor exists.
+        # If not, make it and fill it from the existing readings.
+        if '_latest' not in self.sensor_ids:
+            self.cursor.execute("CREATE TABLE [_latest] (sensor_id varchar(50) primary key COLLATE NOCASE, ts integer, val real)")
+            self.add_to_sensor_id_lists('_latest')
+            for sensor_id in self.sensor_id_list():
+                self.refresh_latest(sensor_id, commit=False)
+            self.conn.commit()
+
+        # Check to see if the sensor statistics tables exist.  If not, make them and fill
+        # the '_sensor_stats' table from the existing readings.  '_sensor_inserts' counts
+        # the readings added to each sensor per UTC day, starting now.
+        if '_sensor_stats' not in self.sensor_ids:
+            self.cursor.execute("CREATE TABLE [_sensor_stats] (sensor_id varchar(50) primary key COLLATE NOCASE, "
+                                "count integer, first_ts integer, last_ts integer, spacing real)")
+            self.cursor.execute("CREATE TABLE [_sensor_inserts] (sensor_id varchar(50) COLLATE NOCASE, day integer, "
+                                "count integer, PRIMARY KEY (sensor_id, day)) WITHOUT ROWID")
+            self.add_to_sensor_id_lists('_sensor_stats')
+            self.add_to_sensor_id_lists('_sensor_inserts')
+            for sensor_id in self.sensor_id_list():
+                self.refresh_stats(sensor_id, commit=False)
+            self.conn.commit()
+
+        else:
+            # The statistics table may be from before the typical reading spacing was
+            # kept.  If so, add the column and fill it from the recent readings.
+            columns_info = self.cursor.execute("PRAGMA table_info([_sensor_stats]);").fetchall()
+            if 'spacing' not in [column[1] for column in columns_info]:
+                self.cursor.execute("ALTER TABLE [_sensor_stats] ADD COLUMN spacing real")
+                for sensor_id in self.sensor_id_list():
+                    self.cursor.execute('UPDATE [_sensor_stats] SET spacing = ? WHERE sensor_id = ?',
+                                        (self._typical_spacing(sensor_id), sensor_id))
+                self.conn.commit()
+
+        # Check to see if the rollup tables exist.  If not, make them; the rollups of
+        # existing sensors are built by the update_rollups script.
+        if rollup.HOUR_TABLE not in self.sensor_ids:
+            rollup.create_tables(self)
+
     def __del__(self):
         """Used to ensure that database is closed when this object is destroyed.
         """
-        self.close()
+        try:
+            self.close()
+        except TypeError:
+            # at interpreter exit, the module functions used by close() may be gone
+            pass
         
     def close(self):
         """Closes this database object.  This is called in the destructor for this object.
+        The underlying connection stays open for reuse by this thread.  The transaction
+        on the connection may hold work of other BMSdata objects in this thread, so
+        uncommitted changes are only rolled back when no other open object uses the
+        connection; otherwise they are left for the caller that made them to commit.
+        """
+        conn = getattr(self, 'conn', None)
+        if conn is not None:
+            self.conn = None
+            if _add_user(conn, -1) > 0:
+                return
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.ProgrammingError:
+                # connection was already closed by close_connections()
+                pass
+
+    def commit(self):
+        """Commits the changes made through this object.
+        """
+        self.conn.commit()
+
+    def shard_for(self, sensor_id):
+        """Returns the BMSdata object for the database file that holds, or will hold, the
+        readings of 'sensor_id'.  This is the object itself unless the database is sharded
+        (see ShardedBMSdata).
         """
-        self.conn.close()
+        return self
+
+    def shard_dbs(self):
+        """Returns a list of the BMSdata objects for the database files that hold sensor
+        readings: just this object unless the database is sharded (see ShardedBMSdata).
+        """
+        return [self]
 
     def sensor_id_exists(self, sensor_id):
         """Returns True if 'sensor_id' exists in the reading database, False
         otherwise.  SQLite has case insensitive table names, no need to check
         lower case version of the ID name.
         """
-        return (sensor_id.lower() in self.sensor_ids_lower - {'_last_raw', '_junk'})
+        sensor_id = sensor_id.lower()
+        return (sensor_id in self.sensor_ids_lower) and (sensor_id not in ('_last_raw', '_junk'))
 
-    def add_sensor_table(self, sensor_id):
-        """Adds a table to hold readings from a sensor with the id 'sensor_id'.  Also
-        adds the id to the set that holds sensor ids.
+    def add_sensor_table(self, sensor_id, commit=True):
+        """Adds storage to hold readings from a sensor with the id 'sensor_id'.  Also
+        adds the id to the set that holds sensor ids.  If 'commit' is False, the
+        change is left as part of the current transaction.
         """
-        self.cursor.execute("CREATE TABLE [%s] (ts integer primary key, val real)" % sensor_id)
-        self.conn.commit()
+        self.storage.add_sensor(self.cursor, sensor_id)
+        if commit:
+            self.conn.commit()
         self.add_to_sensor_id_lists(sensor_id)
 
     def insert_reading(self, ts, id, val):
@@ -166,14 +510,18 @@ recipients VARCHAR(255)
         replaced with the current time.
         If val is None, the record is not stored in the database and it is recorded as an exception.
         """
-        try:
-            recs = list(zip(ts, id, val))
-        except:
-            # they were single values, not lists
-            recs = [(ts, id, val)]
-        
+        success_count, rejected_count = self._insert_recs(_reading_recs(ts, id, val))
+        msg = '%s readings stored successfully, %s rejected.' % (success_count, rejected_count)
+        return msg
+
+    def _insert_recs(self, recs):
+        """Stores the (ts, id, val) readings in the list 'recs' for insert_reading().
+        Returns a two-tuple: (number of readings stored, number rejected).
+        """
         rejected_count = 0
         success_count = 0
+        stored = []       # (sensor_id, ts, val) of each reading stored
+        new_counts = []   # sensor statistics records of the readings added
         for one_ts, one_id, one_val in recs:
 
             # If value is None, don't insert
@@ -204,9 +552,10 @@ recipients VARCHAR(255)
                 if not self.sensor_id_exists(one_id):
                     self.add_sensor_table(one_id)
                 if one_val is not None:    # don't store None values.
-                    self.cursor.execute("INSERT INTO [%s] (ts, val) VALUES (?, ?)" % one_id, (one_ts, one_val))
+                    self.cursor.execute(self.storage.insert_sql(one_id), (one_ts, one_val))
+                    stored.append((one_id, one_ts, one_val))
+                    new_counts.append((one_id, 1, one_ts, one_ts))
                     success_count += 1
-                    run_new_reading_hook(one_id, one_ts, one_val)
                 else:
                     # No need for logger warning because one was generated earlier when
                     # the None value was created.
@@ -214,12 +563,14 @@ recipients VARCHAR(255)
             except sqlite3.IntegrityError:
                 # this record already exists (same ID and ts).  Replace the old value.
                 try:
-                    self.cursor.execute('UPDATE [%s] SET val=? WHERE ts=?' % one_id, (one_val, one_ts))
+                    self.cursor.execute(self.storage.update_sql(one_id), (one_val, one_ts))
+                    # Replacing a reading leaves the sensor's reading count and the range
+                    # of its timestamps unchanged, so the sensor statistics are too.
+                    stored.append((one_id, one_ts, one_val))
                     # This occurs a lot with, for example, the Sunny Boy portal scraper.  Make is
                     # a debug message so that it doesn't overwhelm the log file.
                     _logger.debug('Reading already in DB, updated to: ts=%s, id=%s, val=%s' % (one_ts, one_id, one_val))
                     success_count += 1
-                    run_new_reading_hook(one_id, one_ts, one_val)
                 except:
                     rejected_count += 1
                     _logger.exception('Problem updating reading already in DB: ts=%s, id=%s, val=%s' % (one_ts, one_id, one_val))
@@ -228,13 +579,155 @@ recipients VARCHAR(255)
                 rejected_count += 1
                 _logger.warn('Error storing reading %s, %s, %s: %s' % (one_ts, one_id, one_val, sys.exc_info()[1]))
 
+        self._update_latest(stored)
+        self._update_stats(new_counts)
+        rollup.mark_dirty(self, [(one_id, one_ts) for one_id, one_ts, _ in stored])
+
         # Commits take a lot of time, but Sqlite does not allow an open database reference to be
         # shared across threads.  The web server uses multiple threads to handle requests.
         self.conn.commit()
-        
+
+        # the readings are committed, so run the new reading hooks.
+        for one_id, one_ts, one_val in stored:
+            run_new_reading_hook(one_id, one_ts, one_val)
+
+        return success_count, rejected_count
+
+    def insert_reading_batch(self, ts, id, val):
+        """Bulk version of insert_reading(), used when many readings arrive in one call,
+        such as a post from a gateway.  The arguments and the returned message are the
+        same as insert_reading().  The records are grouped by sensor and each group is
+        stored with one 'executemany' upsert (a reading that is already in the database is
+        replaced).  All groups are stored in one transaction that is committed once.
+        """
+        success_count, rejected_count = self._insert_batch_recs(_reading_recs(ts, id, val))
         msg = '%s readings stored successfully, %s rejected.' % (success_count, rejected_count)
         return msg
-        
+
+    def _insert_batch_recs(self, recs):
+        """Stores the (ts, id, val) readings in the list 'recs' for insert_reading_batch().
+        Returns a two-tuple: (number of readings stored, number rejected).
+        """
+        # group the records by sensor ID, dropping the ones that can't be stored.
+        rejected_count = 0
+        groups = {}
+        now = time.time()
+        for one_ts, one_id, one_val in recs:
+
+            # If value is None, don't insert
+            if one_val is None:
+                continue
+
+            try:
+                # convert value to a float. SQLite gives error if you insert
+                # an integer.
+                one_val = float(one_val)
+            except:
+                rejected_count += 1
+                _logger.warning('Error storing reading %s, %s, %s: value is not numeric' % (one_ts, one_id, one_val))
+                continue
+
+            # Sometimes infinite values or NaNs result from calculations.  Do not insert
+            # into database.
+            if not np.isfinite(one_val):
+                continue
+
+            # substitute current time if no timestamp and convert time to integer
+            one_ts = int(now if one_ts is None else one_ts)
+
+            groups.setdefault(str(one_id), []).append((one_ts, one_val))
+
+        success_count, rejected = self._insert_groups(groups)
+        return success_count, rejected_count + rejected
+
+    def insert_reading_arrays(self, sensor_ids, id_index, ts, vals):
+        """Columnar version of insert_reading_batch() for readings held in NumPy arrays,
+        such as those decoded from a binary post.  'sensor_ids' is the list of sensor IDs
+        used by the readings; reading i is for the sensor 'sensor_ids[id_index[i]]' and has
+        the timestamp 'ts[i]' (0 for the current time) and the value 'vals[i]'.  NaN and
+        infinite values are not stored.  Returns the same message as insert_reading().
+        """
+        id_index = np.asarray(id_index, dtype=np.int64)
+        ts = np.asarray(ts, dtype=np.int64)
+        vals = np.asarray(vals, dtype=float)
+        if len(id_index) and (id_index.min() < 0 or id_index.max() >= len(sensor_ids)):
+            raise ValueError('Sensor ID index out of range.')
+
+        # Sometimes infinite values or NaNs result from calculations.  Do not insert
+        # into database.
+        keep = np.isfinite(vals)
+        id_index, ts, vals = id_index[keep], ts[keep], vals[keep]
+        ts = np.where(ts == 0, int(time.time()), ts)
+
+        # group the readings by sensor, keeping their order within each sensor
+        order = np.argsort(id_index, kind='stable')
+        id_index, ts, vals = id_index[order], ts[order], vals[order]
+        starts = np.flatnonzero(np.diff(id_index, prepend=-1))
+        groups = {}
+        for idx, ts_part, val_part in zip(id_index[starts].tolist(), np.split(ts, starts[1:]), np.split(vals, starts[1:])):
+            groups.setdefault(str(sensor_ids[idx]), []).extend(zip(ts_part.tolist(), val_part.tolist()))
+
+        success_count, rejected_count = self._insert_groups(groups)
+        msg = '%s readings stored successfully, %s rejected.' % (success_count, rejected_count)
+        return msg
+
+    def _insert_groups(self, groups):
+        """Stores the readings in 'groups', a dictionary mapping each sensor ID to a list of
+        its (ts, val) readings with integer timestamps and float values, for
+        insert_reading_batch() and insert_reading_arrays().  Each sensor's readings are
+        stored with one 'executemany' upsert, all in one transaction.  Each sensor's group
+        is stored inside a savepoint, so a group that fails part way through leaves none of
+        its readings, or its new sensor table, in the database.  Returns a two-tuple:
+        (number of readings stored, number rejected).
+        """
+        rejected_count = 0
+        success_count = 0
+        stored = []
+        new_counts = []
+        last_ts = self._last_stored_ts(list(groups.keys()))
+        # A savepoint outside of a transaction starts one that its RELEASE commits.
+        if not self.conn.in_transaction:
+            self.cursor.execute('BEGIN')
+        for one_id, rows in groups.items():
+            new_sensor = not self.sensor_id_exists(one_id)
+            self.cursor.execute('SAVEPOINT insert_group')
+            try:
+                # Check to see if sensor table exists.  If not, create it as part of
+                # this transaction.
+                if new_sensor:
+                    self.add_sensor_table(one_id, commit=False)
+                new_count = self._new_reading_count(one_id, rows, last_ts.get(one_id.lower()))
+                self.cursor.executemany(self.storage.upsert_sql(one_id), rows)
+                self.cursor.execute('RELEASE insert_group')
+                success_count += len(rows)
+                stored.append((one_id, rows))
+                new_counts.append((one_id, new_count, min(rows)[0], max(rows)[0]))
+            except:
+                rejected_count += len(rows)
+                _logger.warning('Error storing %s readings for %s: %s' % (len(rows), one_id, sys.exc_info()[1]))
+                # undo the readings of this group that were stored before the error
+                self.cursor.execute('ROLLBACK TO insert_group')
+                self.cursor.execute('RELEASE insert_group')
+                if new_sensor and self.sensor_id_exists(one_id):
+                    self.remove_from_sensor_id_lists(one_id)
+
+        # record the most recent reading of each sensor.  If a timestamp repeats, the
+        # last of those readings is the one stored.
+        latest = [(one_id,) + max(reversed(rows), key=lambda r: r[0]) for one_id, rows in stored]
+        self._update_latest(latest)
+        rollup.mark_dirty(self, [(one_id, min(rows)[0]) for one_id, rows in stored])
+        self._update_stats(new_counts)
+
+        # one commit for the whole batch
+        self.conn.commit()
+
+        # the readings are committed, so run the new reading hooks, once per sensor
+        # with its newest reading.
+        for one_id, one_ts, one_val in latest:
+            run_new_reading_hook(one_id, one_ts, one_val)
+
+        return success_count, rejected_count
+
 
     def last_read(self, sensor_id, read_count=1):
         """Returns the last reading for a particular sensor,
@@ -242,15 +735,25 @@ recipients VARCHAR(255)
         The reading is returned as a row dictionary, or a list of row
         dictionaries if read_count is more than 1.
         Returns None if no readings are available for the requested sensor.
+        A single reading is looked up in the '_latest' table (see last_reads()).
         """
         sensor_id = str(sensor_id)   # make sure ID is a string
 
+        if read_count == 1 and '_latest' in self.sensor_ids:
+            return self.last_reads([sensor_id])[sensor_id]
+
         # address case where sensor id does not exist
         if not self.sensor_id_exists(sensor_id):
             return None
 
+        return self._query_last_read(sensor_id, read_count)
+
+    def _query_last_read(self, sensor_id, read_count=1):
+        """Reads the last reading or readings for 'sensor_id' from the sensor's readings
+        rather than the '_latest' table.  The return value is the same as last_read().
+        """
         try:
-            self.cursor.execute('SELECT * FROM [%s] ORDER BY ts DESC LIMIT %s' % (sensor_id, read_count))
+            self.cursor.execute('SELECT ts, val FROM %s ORDER BY ts DESC LIMIT %s' % (self.storage.source(sensor_id), read_count))
         except:
             # just in case sensor_id list is wrong for some reason and query throws an error.
             return None
@@ -261,6 +764,239 @@ recipients VARCHAR(255)
         else:
             return [dict(row) for row in self.cursor.fetchall()]
 
+    def last_reads(self, sensor_ids):
+        """Returns the last reading for each of the sensors in the list 'sensor_ids', as
+        a dictionary keyed on Sensor ID (converted to a string).  Each value is a row
+        dictionary with 'ts' and 'val' keys, or None if no readings are available for
+        the sensor.  The readings come from the '_latest' table, which holds the last
+        reading of every sensor, so all of the sensors are read with one query.  If the
+        BMSAPP_READING_DB_LATEST_CACHE_SECONDS setting is more than zero, readings are
+        also cached in this process for that many seconds.
+        """
+        cache_secs = _setting('BMSAPP_READING_DB_LATEST_CACHE_SECONDS', 0)
+        cache = self.registry.latest
+        now = time.time()
+
+        results = {}
+        to_read = []
+        for sensor_id in map(str, sensor_ids):
+            if not self.sensor_id_exists(sensor_id):
+                results[sensor_id] = None
+                continue
+            cached = cache.get(sensor_id.lower()) if cache_secs else None
+            if cached and now - cached[0] < cache_secs:
+                results[sensor_id] = dict(cached[1]) if cached[1] else None
+            else:
+                to_read.append(sensor_id)
+
+        found = {}
+        if '_latest' in self.sensor_ids:
+            # SQLite limits the number of parameters in a query, so read in chunks.
+            for i in range(0, len(to_read), 500):
+                chunk = to_read[i:i + 500]
+                self.cursor.execute('SELECT sensor_id, ts, val FROM [_latest] WHERE sensor_id IN (%s)' %
+                                    ','.join('?' * len(chunk)), chunk)
+                for row in self.cursor.fetchall():
+                    found[row['sensor_id'].lower()] = {'ts': row['ts'], 'val': row['val']}
+
+        for sensor_id in to_read:
+            rec = found.get(sensor_id.lower())
+            if rec is None:
+                # no entry in the '_latest' table, so read the sensor's readings
+                rec = self._query_last_read(sensor_id)
+            results[sensor_id] = rec
+            if cache_secs:
+                cache[sensor_id.lower()] = (now, dict(rec) if rec else None)
+
+        return results
+
+    def _update_latest(self, recs):
+        """Records new readings in the '_latest' table.  'recs' is a list of
+        (sensor_id, ts, val) tuples; a reading replaces the stored one unless it is older.
+        The change is not committed.
+        """
+        if '_latest' in self.sensor_ids and recs:
+            self.cursor.executemany('INSERT INTO [_latest] (sensor_id, ts, val) VALUES (?, ?, ?) '
+                                    'ON CONFLICT(sensor_id) DO UPDATE SET ts=excluded.ts, val=excluded.val '
+                                    'WHERE excluded.ts >= [_latest].ts', recs)
+            for rec in recs:
+                self.registry.latest.pop(rec[0].lower(), None)
+
+    def refresh_latest(self, sensor_id, commit=True):
+        """Resets the '_latest' table entry for 'sensor_id' from the sensor's readings.
+        Used after readings are deleted or changed other than by the insert methods.  If
+        'commit' is False, the change is left as part of the current transaction.
+        """
+        if '_latest' not in self.sensor_ids:
+            return
+        self.cursor.execute('DELETE FROM [_latest] WHERE sensor_id = ?', (sensor_id,))
+        if self.sensor_id_exists(sensor_id):
+            self.cursor.execute('INSERT INTO [_latest] (sensor_id, ts, val) '
+                                'SELECT ?, ts, val FROM %s ORDER BY ts DESC LIMIT 1' % self.storage.source(sensor_id),
+                                (sensor_id,))
+        self.registry.latest.pop(sensor_id.lower(), None)
+        if commit:
+            self.conn.commit()
+
+    def _new_reading_count(self, sensor_id, rows, last_ts=None):
+        """Returns the number of the (ts, val) 'rows' for 'sensor_id' that would add a
+        reading instead of replacing one already stored.  'last_ts' is the timestamp of the
+        sensor's last stored reading, if known; readings after it are new without checking
+        the database.  Otherwise the check costs one timestamp index lookup per row.
+        """
+        ts_list = list({row[0] for row in rows})
+        existing = 0
+        if last_ts is not None and min(ts_list) > last_ts:
+            pass
+        elif self.sensor_id_exists(sensor_id):
+            source = self.storage.source(sensor_id)
+            for i in range(0, len(ts_list), 500):
+                chunk = ts_list[i:i + 500]
+                existing += self.cursor.execute('SELECT COUNT(*) FROM %s WHERE ts IN (%s)' %
+                                                (source, ','.join('?' * len(chunk))), chunk).fetchone()[0]
+        return len(ts_list) - existing
+
+    def _update_stats(self, recs):
+        """Records stored readings in the sensor statistics tables.  'recs' is a list of
+        (sensor_id, number of new readings, first ts, last ts) tuples.  The change is not
+        committed.
+        """
+        if '_sensor_stats' in self.sensor_ids and recs:
+            # The spacing of a new sensor comes from its first readings.  For a sensor
+            # with readings, readings added after the last one update the spacing (see
+            # SPACING_WEIGHT); other changes leave it alone.
+            gap = '(excluded.last_ts - last_ts) * 1.0 / excluded.count'
+            self.cursor.executemany('INSERT INTO [_sensor_stats] (sensor_id, count, first_ts, last_ts, spacing) '
+                                    'VALUES (?, ?, ?, ?, ?) '
+                                    'ON CONFLICT(sensor_id) DO UPDATE SET count=count + excluded.count, '
+                                    'first_ts=min(coalesce(first_ts, excluded.first_ts), excluded.first_ts), '
+                                    'last_ts=max(coalesce(last_ts, excluded.last_ts), excluded.last_ts), '
+                                    'spacing=CASE WHEN excluded.count > 0 AND excluded.first_ts > last_ts '
+                                    'THEN coalesce(spacing + min(%s * excluded.count, 1.0) * (min(%s, %s * spacing) - spacing), %s) '
+                                    'ELSE coalesce(spacing, excluded.spacing) END' %
+                                    (SPACING_WEIGHT, gap, SPACING_MAX_RATIO, gap),
+                                    [tuple(rec) + ((rec[3] - rec[2]) / (rec[1] - 1) if rec[1] > 1 else None,)
+                                     for rec in recs])
+            day = int(time.time()) // DAY_SECONDS * DAY_SECONDS
+            self.cursor.executemany('INSERT INTO [_sensor_inserts] (sensor_id, day, count) VALUES (?, ?, ?) '
+                                    'ON CONFLICT(sensor_id, day) DO UPDATE SET count=count + excluded.count',
+                                    [(rec[0], day, rec[1]) for rec in recs if rec[1]])
+
+    def _last_stored_ts(self, sensor_ids):
+        """Returns a dictionary giving the last reading timestamp recorded in the
+        '_sensor_stats' table for each of 'sensor_ids' that has one, keyed on the
+        lower-case Sensor ID.
+        """
+        result = {}
+        if '_sensor_stats' in self.sensor_ids:
+            for i in range(0, len(sensor_ids), 500):
+                chunk = sensor_ids[i:i + 500]
+                recs = self.cursor.execute('SELECT sensor_id, last_ts FROM [_sensor_stats] WHERE sensor_id IN (%s)' %
+                                           ','.join('?' * len(chunk)), chunk).fetchall()
+                result.update({rec[0].lower(): rec[1] for rec in recs})
+        return result
+
+    def _typical_spacing(self, sensor_id):
+        """Returns the median number of seconds between the most recent SPACING_SAMPLE
+        readings of 'sensor_id', or None if it has fewer than two readings in the
+        database.
+        """
+        recs = self.cursor.execute('SELECT ts FROM %s ORDER BY ts DESC LIMIT %d' %
+                                   (self.storage.source(sensor_id), SPACING_SAMPLE)).fetchall()
+        if len(recs) < 2:
+            return None
+        return float(np.median(-np.diff([rec[0] for rec in recs])))
+
+    def refresh_stats(self, sensor_id, commit=True):
+        """Resets the '_sensor_stats' entry for 'sensor_id' from the sensor's readings,
+        including archived readings.  Used after readings are deleted or changed other than
+        by the insert methods.  If 'commit' is False, the change is left as part of the
+        current transaction.
+        """
+        if '_sensor_stats' not in self.sensor_ids:
+            return
+        self.cursor.execute('DELETE FROM [_sensor_stats] WHERE sensor_id = ?', (sensor_id,))
+        if self.sensor_id_exists(sensor_id):
+            count, first_ts, last_ts = self.cursor.execute('SELECT COUNT(*), min(ts), max(ts) FROM %s' %
+                                                           self.storage.source(sensor_id)).fetchone()
+            if archive.archived_to(self, sensor_id) is not None:
+                arch_first, arch_last = archive.time_range(self.db_fname, sensor_id)
+                if arch_first is not None:
+                    count += archive.reading_count(self.db_fname, sensor_id)
+                    first_ts = arch_first if first_ts is None else min(first_ts, arch_first)
+                    last_ts = arch_last if last_ts is None else max(last_ts, arch_last)
+            self.cursor.execute('INSERT INTO [_sensor_stats] (sensor_id, count, first_ts, last_ts, spacing) '
+                                'VALUES (?, ?, ?, ?, ?)',
+                                (sensor_id, count, first_ts, last_ts, self._typical_spacing(sensor_id)))
+        if commit:
+            self.conn.commit()
+
+    def sensor_stats(self, sensor_ids=None):
+        """Returns a dictionary keyed on Sensor ID giving the statistics of the readings
+        of each sensor in 'sensor_ids' (all sensors if None): a dictionary with 'count',
+        'first_ts', 'last_ts' and 'spacing' keys.  Archived readings are included in the
+        count and time range.  'spacing' is the typical number of seconds between
+        readings, or None if not known (see SPACING_SAMPLE).  The values come from the
+        '_sensor_stats' table, so no readings are read.  Sensors without readings are not
+        in the returned dictionary.
+        """
+        sql = 'SELECT sensor_id, count, first_ts, last_ts, spacing FROM [_sensor_stats] WHERE count > 0'
+        if sensor_ids is None:
+            recs = self.cursor.execute(sql).fetchall()
+        else:
+            # the table is keyed case-insensitively, so map the results back to the
+            # requested IDs.
+            id_map = {str(sensor_id).lower(): str(sensor_id) for sensor_id in sensor_ids}
+            ids = list(id_map.values())
+            recs = []
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                recs += self.cursor.execute(sql + ' AND sensor_id IN (%s)' % ','.join('?' * len(chunk)), chunk).fetchall()
+            recs = [(id_map[rec[0].lower()],) + tuple(rec[1:]) for rec in recs]
+        return {rec[0]: {'count': rec[1], 'first_ts': rec[2], 'last_ts': rec[3], 'spacing': rec[4]} for rec in recs}
+
+    def coverage(self, sensor_ids, start_ts=None, end_ts=None):
+        """Returns a dictionary keyed on the Sensor IDs in 'sensor_ids' describing how
+        the readings of each sensor cover the time range from 'start_ts' to 'end_ts' (Unix
+        seconds; None for an open end).  Each value is the sensor_stats() dictionary of
+        the sensor (with None values if it has no readings) plus:
+            'span': seconds of the range between the sensor's first and last readings.
+                This is at least the span of the readings inside the range; gaps in the
+                readings are not detected.
+            'fraction': 'span' divided by the length of the range, or None if the range
+                has an open end.
+            'est_count': estimated number of readings in the range, from 'span' and the
+                typical spacing.  It is 0 only if the sensor has no readings in the range.
+        The values come from the sensor statistics, so no readings are read.
+        """
+        sensor_ids = [str(sensor_id) for sensor_id in sensor_ids]
+        if '_sensor_stats' in self.sensor_ids:
+            stats = self.sensor_stats(sensor_ids)
+        else:
+            stats = {}
+            for sensor_id in sensor_ids:
+                first_ts, last_ts = self.sensor_time_range(sensor_id)
+                if first_ts is not None:
+                    stats[sensor_id] = {'count': self.reading_count(sensor_id), 'first_ts': first_ts,
+                                        'last_ts': last_ts, 'spacing': None}
+        result = {}
+        for sensor_id in sensor_ids:
+            info = dict(stats.get(sensor_id) or {'count': 0, 'first_ts': None, 'last_ts': None, 'spacing': None})
+            span, est_count = 0, 0
+            if info['count'] and (start_ts is None or info['last_ts'] >= start_ts) and \
+                    (end_ts is None or info['first_ts'] <= end_ts):
+                span = (info['last_ts'] if end_ts is None else min(info['last_ts'], end_ts)) - \
+                       (info['first_ts'] if start_ts is None else max(info['first_ts'], start_ts))
+                est_count = info['count']
+                if info['spacing']:
+                    est_count = min(est_count, int(span / info['spacing']) + 1)
+            info['span'] = span
+            info['fraction'] = span / float(end_ts - start_ts) \
+                if start_ts is not None and end_ts is not None and end_ts > start_ts else None
+            info['est_count'] = est_count
+            result[sensor_id] = info
+        return result
+
     def rowsForOneID(self, sensor_id, start_tm=None, end_tm=None):
         """Returns a list of dictionaries, each dictionary having a 'ts' and 'val' key.  The
         rows are for a particular sensor ID, and can be further limited by a time range.
@@ -273,7 +1009,7 @@ recipients VARCHAR(255)
         if not self.sensor_id_exists(sensor_id):
             return []
 
-        sql = 'SELECT ts, val FROM [%s] WHERE 1' % sensor_id
+        sql = 'SELECT ts, val FROM %s WHERE 1' % self.storage.source(sensor_id)
         if start_tm is not None:
             sql += ' AND ts>=%s' % int(start_tm)
         if end_tm is not None:
@@ -281,7 +1017,93 @@ recipients VARCHAR(255)
         sql += ' ORDER BY ts'
 
         self.cursor.execute(sql)
-        return [dict(r) for r in self.cursor.fetchall()]
+        rows = [dict(r) for r in self.cursor.fetchall()]
+
+        # add in any readings from the archive
+        df_arch = self._archived_readings(sensor_id, start_tm, end_tm)
+        if df_arch is not None and len(df_arch):
+            df = self._combine_archive(df_arch, pd.DataFrame(rows, columns=['ts', 'val']))
+            rows = [{'ts': int(ts), 'val': float(val)} for ts, val in zip(df.ts.values, df.val.values)]
+        return rows
+
+    def arraysForOneID(self, sensor_id, start_ts=None, end_ts=None):
+        """Returns the readings for a particular sensor ID as a two-tuple of numpy arrays:
+        (int64 array of timestamps, float64 array of values).  The readings can be limited
+        by a time range; 'start_ts' and 'end_ts' are UNIX timestamps and if either are not
+        provided, no limit is imposed.  The readings are in timestamp order and readings with
+        NULL values are skipped.  Empty arrays are returned if the sensor does not exist.
+        """
+        chunks = list(self.iterArraysForOneID(sensor_id, start_ts, end_ts))
+        if len(chunks) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        elif len(chunks) == 1:
+            return chunks[0]
+        return np.concatenate([c[0] for c in chunks]), np.concatenate([c[1] for c in chunks])
+
+    def iterArraysForOneID(self, sensor_id, start_ts=None, end_ts=None, chunk_rows=FETCH_ROWS):
+        """A generator that yields the readings for a particular sensor ID in chunks of at
+        most 'chunk_rows' readings, for use with long time ranges.  Each chunk is a two-tuple
+        of numpy arrays, (int64 timestamps, float64 values), and the chunks are in timestamp
+        order.  The other parameters are the same as arraysForOneID().
+        """
+        sensor_id = str(sensor_id)   # make sure ID is a string
+
+        # address case where sensor id does not exist
+        if not self.sensor_id_exists(sensor_id):
+            return
+
+        # Readings before the end of the archive can come from both the archive and the
+        # Reading database (late arrivals), so those are read and combined first.
+        arch_to = archive.archived_to(self, sensor_id)
+        if arch_to is not None and (start_ts is None or start_ts < arch_to):
+            arch_end = arch_to - 1 if end_ts is None else min(int(end_ts), arch_to - 1)
+            ts, vals = self._fetch_arrays(sensor_id, start_ts, arch_end)
+            df = self._combine_archive(archive.read_archive(self.db_fname, sensor_id, start_ts, arch_end),
+                                       pd.DataFrame({'ts': ts, 'val': vals}))
+            df = df[df.val.notna()]
+            ts, vals = df.ts.values.astype(np.int64), df.val.values.astype(np.float64)
+            for i in range(0, len(ts), chunk_rows):
+                yield ts[i:i + chunk_rows], vals[i:i + chunk_rows]
+            start_ts = arch_to
+            if end_ts is not None and start_ts > end_ts:
+                return
+
+        cursor = self.conn.cursor()
+        cursor.row_factory = None
+        try:
+            cursor.execute(self._range_sql(sensor_id, start_ts, end_ts))
+            while True:
+                block = np.fromiter(itertools.chain.from_iterable(cursor.fetchmany(chunk_rows)),
+                                    dtype=np.float64).reshape(-1, 2)
+                if len(block) == 0:
+                    break
+                yield block[:, 0].astype(np.int64), block[:, 1].copy()
+        finally:
+            cursor.close()
+
+    def _range_sql(self, sensor_id, start_ts=None, end_ts=None):
+        """Returns SQL that selects the 'ts' and 'val' columns of the readings for
+        'sensor_id' in the time range 'start_ts' to 'end_ts', skipping NULL values.
+        The readings are in timestamp order.
+        """
+        sql = 'SELECT ts, val FROM %s WHERE val IS NOT NULL' % self.storage.source(sensor_id)
+        if start_ts is not None:
+            sql += ' AND ts>=%s' % int(start_ts)
+        if end_ts is not None:
+            sql += ' AND ts<=%s' % int(end_ts)
+        return sql + ' ORDER BY ts'
+
+    def _fetch_arrays(self, sensor_id, start_ts=None, end_ts=None):
+        """Returns the readings for 'sensor_id' in the Reading database (not the archive)
+        in the time range 'start_ts' to 'end_ts' as (int64 timestamps, float64 values)
+        numpy arrays.
+        """
+        cursor = self.conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(self._range_sql(sensor_id, start_ts, end_ts))
+        arr = np.fromiter(itertools.chain.from_iterable(cursor), dtype=np.float64).reshape(-1, 2)
+        cursor.close()
+        return arr[:, 0].astype(np.int64), arr[:, 1].copy()
 
     def dataframeForOneID(self, sensor_id, start_ts=None, end_ts=None, tz=None):
         """Returns a pandas dataframe having a 'ts' and 'val' columns.  The
@@ -292,7 +1114,7 @@ recipients VARCHAR(255)
         timezone and is naive due to resampling issues with timezone aware indexes.
         """
 
-        sql = 'SELECT ts, val FROM [%s] WHERE 1' % sensor_id
+        sql = 'SELECT ts, val FROM %s WHERE 1' % self.storage.source(sensor_id)
         if start_ts is not None:
             sql += ' AND ts>=%s' % int(start_ts)
         if end_ts is not None:
@@ -301,6 +1123,9 @@ recipients VARCHAR(255)
 
         try:
             df = pd.read_sql_query(sql,self.conn)
+            df_arch = self._archived_readings(sensor_id, start_ts, end_ts)
+            if df_arch is not None and len(df_arch):
+                df = self._combine_archive(df_arch, df)
             df.index = pd.DatetimeIndex(pd.to_datetime(df.ts, unit='s'))
             if tz:
                 # Convert the dates to the specified timezone...
@@ -314,6 +1139,37 @@ recipients VARCHAR(255)
 
         return df
 
+    def _archived_readings(self, sensor_id, start_ts=None, end_ts=None):
+        """Returns a DataFrame with 'ts' and 'val' columns holding the readings for
+        'sensor_id' that have been moved to the Parquet archive (see archive.py) and fall
+        in the time range 'start_ts' to 'end_ts'.  Returns None if the time range does not
+        reach into the archive.
+        """
+        arch_to = archive.archived_to(self, sensor_id)
+        if arch_to is None or (start_ts is not None and start_ts >= arch_to):
+            return None
+        return archive.read_archive(self.db_fname, sensor_id, start_ts, end_ts)
+
+    def _combine_archive(self, df_arch, df):
+        """Combines the archived readings in DataFrame 'df_arch' with the readings
+        'df' from the Reading database, returning a DataFrame sorted by timestamp.  If
+        both hold a reading with the same timestamp, the Reading database value is used.
+        """
+        df_arch = df_arch[~df_arch.ts.isin(df.ts)]
+        df = pd.concat([df_arch, df.astype({'ts': 'int64', 'val': 'float64'})], ignore_index=True)
+        return df.sort_values('ts', kind='stable').reset_index(drop=True)
+
+    def dataframeFromRollups(self, sensor_id, rule, offset=None, start_ts=None, end_ts=None, tz=None):
+        """Returns time-weighted averages of the readings for 'sensor_id' over the periods
+        given by the pandas offset alias 'rule' (e.g. '1H' or '1D'), built from the hourly
+        and daily rollups instead of the raw readings.  The returned DataFrame is the same
+        as the result of data_util.weighted_resample_timeseries() applied to the result
+        of dataframeForOneID() with the same 'start_ts', 'end_ts' and 'tz' parameters; 'offset'
+        is added to the index labels.  Returns None if the rollups can't be used for the
+        request, in which case the raw readings need to be used.  See rollup.py.
+        """
+        return rollup.read_averages(self, str(sensor_id), rule, offset, start_ts, end_ts, tz)
+
     def dataframeForMultipleIDs(self, sensor_id_list, column_names=None, start_ts=None, end_ts=None, tz=None):
         """Returns a Pandas Dataframe containing data from multiple sensors. The Sensor IDs of
         the desired sensors are passed into the method as a list, 'sensor_id_list'. The returned 
@@ -329,18 +1185,57 @@ recipients VARCHAR(255)
         """
         # make a list of column names
         col_names = column_names if column_names else sensor_id_list
+        if len(sensor_id_list) == 0:
+            return None
 
-        # loop through the requested sensors, creating a dataframe and merging into the
-        # final frame.
-        df_final = None
-        for sensor_id, col_name in zip(sensor_id_list, col_names):
-            df = self.dataframeForOneID(sensor_id, start_ts, end_ts)
-            df.drop('ts', axis=1, inplace=True)    # get rid of ts column
-            df.rename(columns={'val': str(col_name)}, inplace=True)
-            if df_final is None:
-                df_final = df
-            else:
-                df_final = pd.merge(df_final, df, how='outer', left_index=True, right_index=True)
+        # Read the readings of all the sensors with UNION ALL queries, tagging each row
+        # with the column number of its sensor.  Sensors not in the database are skipped
+        # and produce a column of NaN values, as do NULL values.
+        where = ' AND val IS NOT NULL'
+        if start_ts is not None:
+            where += ' AND ts>=%s' % int(start_ts)
+        if end_ts is not None:
+            where += ' AND ts<=%s' % int(end_ts)
+        selects = ['SELECT %d AS col, ts, val FROM %s WHERE 1%s' % (col, self.storage.source(str(sensor_id)), where)
+                   for col, sensor_id in enumerate(sensor_id_list) if self.sensor_id_exists(str(sensor_id))]
+
+        # The rows are fetched in blocks straight into compact column arrays, without
+        # Row objects or an intermediate DataFrame.
+        cursor = self.conn.cursor()
+        cursor.row_factory = None
+        cols, tstamps, vals = [np.empty(0, np.int32)], [np.empty(0, np.int64)], [np.empty(0)]
+        for i in range(0, len(selects), MULTI_ID_QUERY_CHUNK):
+            cursor.execute(' UNION ALL '.join(selects[i:i + MULTI_ID_QUERY_CHUNK]))
+            while True:
+                block = np.fromiter(itertools.chain.from_iterable(cursor.fetchmany(FETCH_ROWS)),
+                                    dtype=np.float64).reshape(-1, 3)
+                if len(block) == 0:
+                    break
+                cols.append(block[:, 0].astype(np.int32))
+                tstamps.append(block[:, 1].astype(np.int64))
+                vals.append(block[:, 2].copy())
+        cursor.close()
+        cols, tstamps, vals = np.concatenate(cols), np.concatenate(tstamps), np.concatenate(vals)
+
+        # add readings from the archive, skipping any that are also in the Reading database
+        for col, sensor_id in enumerate(sensor_id_list):
+            df_arch = self._archived_readings(str(sensor_id), start_ts, end_ts)
+            if df_arch is not None and len(df_arch):
+                df_arch = df_arch[~df_arch.ts.isin(tstamps[cols == col])]
+                cols = np.concatenate((cols, np.full(len(df_arch), col, dtype=np.int32)))
+                tstamps = np.concatenate((tstamps, df_arch.ts.values.astype(np.int64)))
+                vals = np.concatenate((vals, df_arch.val.values.astype(np.float64)))
+
+        # Pivot into one row per distinct timestamp.  A sensor has at most one
+        # reading per timestamp, so each reading lands in its own cell.
+        all_ts = np.unique(tstamps)
+        row_ix = np.searchsorted(all_ts, tstamps)
+        del tstamps
+        values = np.full((len(all_ts), len(sensor_id_list)), np.nan)
+        values[row_ix, cols] = vals
+        df_final = pd.DataFrame(values,
+                                index=pd.DatetimeIndex(pd.to_datetime(all_ts, unit='s'), name='ts'),
+                                columns=[str(c) for c in col_names])
 
         # convert the timezone of the index if requested
         if tz and len(df_final) > 0:
@@ -351,20 +1246,54 @@ recipients VARCHAR(255)
 
         return df_final
 
-    def readingCount(self, startTime=0):
-        """Returns the number of readings in the reading table inserted after the specified
-        'startTime' (Unix seconds) and before now (in case erroneously timestamped readings
-        are in the file).
+    def readingCount(self, startTime=0, endTime=None):
+        """Returns the number of readings in the reading database, including archived
+        readings, with timestamps after 'startTime' and before 'endTime' (Unix seconds).
+        If 'endTime' is None, it is now, in case erroneously timestamped readings are in
+        the file.  Sensors with all of their readings inside or outside of that range are
+        counted from the sensor statistics tables; only the readings of the other sensors
+        are counted.
         """
+        end_ts = time.time() if endTime is None else endTime
+        if '_sensor_stats' not in self.sensor_ids:
+            return self.storage.count_readings(self.cursor, self.sensor_id_list(), startTime, end_ts)
+
         rec_ct = 0
-        for id in self.sensor_ids:
-            try:
-                self.cursor.execute('SELECT COUNT(*) FROM [%s] WHERE ts > ? and ts < ?' % id, (startTime, time.time()))
-                rec_ct += self.cursor.fetchone()[0]
-            except:
-                # not all tables are reading tables and may error out cause no 'ts' column
-                pass
+        to_count = []
+        stats = {sensor_id.lower(): sensor_stats for sensor_id, sensor_stats in self.sensor_stats().items()}
+        for sensor_id in self.sensor_id_list():
+            sensor_stats = stats.get(sensor_id.lower())
+            if sensor_stats is None or sensor_stats['last_ts'] <= startTime or sensor_stats['first_ts'] >= end_ts:
+                continue
+            if sensor_stats['first_ts'] > startTime and sensor_stats['last_ts'] < end_ts:
+                rec_ct += sensor_stats['count']
+            else:
+                to_count.append(sensor_id)
+        if to_count:
+            rec_ct += self.storage.count_readings(self.cursor, to_count, startTime, end_ts)
+        for sensor_id in to_count:
+            arch_to = archive.archived_to(self, sensor_id)
+            if arch_to is not None and startTime < arch_to:
+                # timestamps are integers, so these are the first and last ones in the range
+                df = archive.read_archive(self.db_fname, sensor_id, math.floor(startTime) + 1, math.ceil(end_ts) - 1)
+                rec_ct += len(df)
         return rec_ct
+
+    def inserted_count(self, start_ts, end_ts=None):
+        """Returns the number of readings inserted into the reading database from the
+        Unix time 'start_ts' until 'end_ts' (now if None).  Insertions are counted per UTC
+        day, so the times are rounded down to the start of their day; only insertions
+        made since the '_sensor_inserts' table was created are counted.  Returns None if
+        the database has no '_sensor_inserts' table.
+        """
+        if '_sensor_inserts' not in self.sensor_ids:
+            return None
+        sql = 'SELECT SUM(count) FROM [_sensor_inserts] WHERE day >= ?'
+        params = (int(start_ts) // DAY_SECONDS * DAY_SECONDS,)
+        if end_ts is not None:
+            sql += ' AND day < ?'
+            params += (int(end_ts) // DAY_SECONDS * DAY_SECONDS,)
+        return self.cursor.execute(sql, params).fetchone()[0] or 0
         
     def replaceLastRaw(self, sensor_id, ts, val):
         """Replaces the last raw reading stored in the '_last_raw' table for
@@ -414,9 +1343,100 @@ recipients VARCHAR(255)
         (sensors that are not in the Django Sensor object list.
         """
         # Don't return IDs that start with underbar.
-        id_list = [sens_id for sens_id in self.sensor_ids if sens_id[0]!='_']
+        id_list = [sens_id for sens_id in list(self.sensor_ids) if sens_id[0]!='_']
         return sorted(id_list)
 
+    def sensor_time_range(self, sensor_id):
+        """Returns a two-tuple holding the timestamps of the first and last readings
+        for 'sensor_id'.  None values are returned if there are no readings.
+        """
+        if not self.sensor_id_exists(sensor_id):
+            return None, None
+        if '_sensor_stats' in self.sensor_ids:
+            stats = self.sensor_stats([sensor_id]).get(str(sensor_id))
+            return (stats['first_ts'], stats['last_ts']) if stats else (None, None)
+        self.cursor.execute('SELECT min(ts), max(ts) FROM %s' % self.storage.source(sensor_id))
+        first_ts, last_ts = self.cursor.fetchone()
+
+        # the first readings may have been moved to the archive
+        if archive.archived_to(self, sensor_id) is not None:
+            arch_first, arch_last = archive.time_range(self.db_fname, sensor_id)
+            if arch_first is not None:
+                first_ts = arch_first if first_ts is None else min(first_ts, arch_first)
+                last_ts = arch_last if last_ts is None else max(last_ts, arch_last)
+        return first_ts, last_ts
+
+    def reading_count(self, sensor_id, condition=None):
+        """Returns the number of readings for 'sensor_id', including archived readings.
+        If 'condition' is given, it is a SQL expression on the 'ts' and 'val' columns
+        that limits the readings counted, e.g. 'val > 100'.
+        """
+        sql = 'SELECT COUNT(*) FROM %s' % self.storage.source(sensor_id)
+        if condition:
+            sql += ' WHERE %s' % condition
+        self.cursor.execute(sql)
+        return self.cursor.fetchone()[0] + archive.reading_count(self.db_fname, sensor_id, condition)
+
+    def delete_readings(self, sensor_id, condition=None):
+        """Deletes the readings for 'sensor_id' that meet the SQL 'condition' on the
+        'ts' and 'val' columns, or all of the readings if 'condition' is None.  Archived
+        readings are deleted too.  The sensor remains in the database.
+        """
+        self.cursor.execute(self.storage.delete_sql(sensor_id, condition))
+        archive.delete_readings(self, sensor_id, condition)
+        self.refresh_latest(sensor_id, commit=False)
+        self.refresh_stats(sensor_id, commit=False)
+        rollup.mark_dirty(self, [(sensor_id, rollup.REBUILD)])
+        self.conn.commit()
+
+    def delete_sensor(self, sensor_id, commit=True):
+        """Removes the sensor 'sensor_id' and all of its readings from the database.
+        If 'commit' is False, the change is left as part of the current transaction.
+        """
+        self.storage.drop_sensor(self.cursor, sensor_id)
+        archive.delete_sensor_archive(self, sensor_id)
+        rollup.delete_sensor(self, sensor_id)
+        retention.delete_sensor(self, sensor_id)
+        if '_latest' in self.sensor_ids:
+            self.cursor.execute('DELETE FROM [_latest] WHERE sensor_id = ?', (sensor_id,))
+            self.registry.latest.pop(sensor_id.lower(), None)
+        if '_sensor_stats' in self.sensor_ids:
+            self.cursor.execute('DELETE FROM [_sensor_stats] WHERE sensor_id = ?', (sensor_id,))
+            self.cursor.execute('DELETE FROM [_sensor_inserts] WHERE sensor_id = ?', (sensor_id,))
+        if commit:
+            self.conn.commit()
+        self.remove_from_sensor_id_lists(sensor_id)
+
+    def merge_readings(self, from_id, to_id, condition=None):
+        """Copies the readings of sensor 'from_id' that meet the SQL 'condition'
+        on the 'ts' and 'val' columns (or all readings if 'condition' is None) into
+        the readings of sensor 'to_id'.  Archived readings of 'from_id' are copied into
+        the Reading database, to be archived again by the next archive run.  The change
+        is not committed.
+        """
+        select_sql = 'SELECT ts, val FROM %s' % self.storage.source(from_id)
+        if condition:
+            select_sql += ' WHERE %s' % condition
+        self.cursor.execute(self.storage.insert_select_sql(to_id, select_sql))
+        self.cursor.executemany(self.storage.insert_sql(to_id), self._archived_rows(from_id, condition))
+        self.refresh_latest(to_id, commit=False)
+        self.refresh_stats(to_id, commit=False)
+        rollup.mark_dirty(self, [(to_id, rollup.REBUILD)])
+
+    def _archived_rows(self, sensor_id, condition=None):
+        """Returns a list of the (ts, val) archived readings of 'sensor_id' that meet the
+        SQL 'condition' on the 'ts' and 'val' columns (all of them if None).  Readings
+        with a timestamp also in the Reading database are left out, as the value there
+        replaces the archived one.
+        """
+        df = archive.read_archive(self.db_fname, sensor_id, condition=condition)
+        if len(df) == 0:
+            return []
+        stored = {rec[0] for rec in self.cursor.execute('SELECT ts FROM %s WHERE ts >= ? AND ts <= ?' %
+                                                        self.storage.source(sensor_id),
+                                                        (int(df.ts.min()), int(df.ts.max())))}
+        return [(ts, val) for ts, val in zip(df.ts.tolist(), df.val.tolist()) if ts not in stored]
+
     def log_alert(self, alert_pk, sensor_id, message, bldg_title, recipient_names):
         """Stores a log of an alert nofification
         """
@@ -428,113 +1448,301 @@ recipients VARCHAR(255)
         self.conn.commit()
 
 
-    def backup_db(self, days_to_retain):
+    def backup_db(self, days_to_retain, incremental=False):
         """Backs up the database and compresses the backup.  Deletes old backup
-        files that were created more than 'days_to_retain' ago.
+        files that were created more than 'days_to_retain' ago.  If 'incremental' is
+        True, only the database pages changed since the last full backup are stored.
+        Returns a dictionary of backup statistics; see backup.backup_db().
         """
-        # make backup filename with current date time in 'bak' subdirectory
-        fname = os.path.join(os.path.dirname(self.db_fname), 'bak', time.strftime('%Y-%m-%d-%H%M%S') + '.sqlite')
+        return backup.backup_db(self.db_fname, days_to_retain, incremental)
 
-        # Before copying the database file, need to force a lock on it so that no
-        # write operations occur during the copying process
+    def import_text_file(self, filename, tz_name='US/Alaska', delimiter=None, progress=None):
+        """Adds the sensor reading data present in the tab- or comma-delimited 'filename' to
+        the reading database. Date/time values in the file are assumed to be in the
+        'tz_name' time zone unless they include a UTC offset.
 
-        # create a dummy table to write into.
-        try:
-            self.cursor.execute('CREATE TABLE _junk (x integer)')
-        except:
-            # table already existed
-            pass
+        The values in the first column must be date/time strings interpretable by the Python
+        dateutil parser module.  Subsequent columns must contain sensor reading values; the
+        each item can be blank or contain a value parseable by the Python float function.
+        The first non-blank row of the file must contain sensor IDs (the first column of that
+        row can contain anything, as it is the timestamp column). An exmaple of the format is
+        (white space separation between columns need to be the Tab character, or commas):
 
-        # write a value into the table to create a lock on the database
-        self.cursor.execute('INSERT INTO _junk VALUES (1)')
+            ts                 id_2341   test_alarm_code
+            4/12/2014 13:23    2.2       44.3
+            4/12/2014 13:33    3.2       41.1
 
-        # now copy database
-        shutil.copy(self.db_fname, fname)
+        'delimiter' is the column separator; by default it is a Tab if the first row has one
+        and a comma otherwise.  A reading for a sensor and timestamp already in the database
+        replaces the stored value.  The file is processed in chunks with bounded memory (see
+        textimport.py); 'progress', if given, is called after each chunk with (bytes read,
+        file size in bytes, readings stored so far).
 
-        # Rollback the Insert as we don't really need it.
-        self.conn.rollback()
+        The method returns a two tuple.  The first item is the number of readings successfully
+        stored, and the second is a list of errors, each item being an error description string.
+        """
+        return textimport.import_text_file(self, filename, tz_name, delimiter, progress)
 
-        # gzip the backup file
-        subprocess.call(['gzip', fname])
 
-        # delete any backup files more than 'days_to_retain' old.
-        cutoff_time = time.time() - days_to_retain * 24 *3600.0
-        for fn in glob.glob(os.path.join(os.path.dirname(self.db_fname), 'bak', '*.gz')):
-            if os.path.getmtime(fn) < cutoff_time:
-                os.remove(fn)
+class _ShardBMSdata(BMSdata):
+    """One shard file of a sharded Reading database (see ShardedBMSdata).  It is a
+    complete Reading database for the sensors it holds.
+    """
 
-    def import_text_file(self, filename, tz_name='US/Alaska'):
-        """Adds the sensor reading data present in the tab-delimited 'filename' to 
-        the reading database. Date/time values in the file are assumed to be in the
-        'tz_name' time zone.
 
-        The file must be tab-delimited and the values in the first column must be date/time 
-        strings interpretable by the Python dateutil parser module.  Subsequent columns 
-        must contain sensor reading values; the each item can be blank or contain a value parseable 
-        by the Python float function. The first non-blank row of the file must contain sensor IDs 
-        (the first column of that row can contain anything, as it is the timestamp column). An
-        exmaple of the format is (white space separation between columns need to be the Tab
-        character):
+class ShardedBMSdata(BMSdata):
+    """A Reading database whose sensors are spread across several shard files.  SQLite
+    allows one writer at a time per database file, so readings for sensors in different
+    shards are stored in parallel.  BMSdata() returns an object of this class for a
+    sharded database.
+
+    The main database file holds the '_shards' table listing the shard files, and the
+    '_last_raw' and '_alert_log' tables, which are not kept per sensor.  Each shard file is
+    a complete Reading database, with the '_latest', statistics, rollup, retention and
+    archive data of its own sensors, in a 'shard_NN' directory next to the main file.
+    A new sensor goes in the shard chosen by a hash of its Sensor ID, or by its building
+    if the BMSAPP_READING_DB_SHARD_BY setting is 'building'; a sensor stays in its shard.
+    Methods for one sensor are passed to the sensor's shard, and methods for several
+    sensors are split across the shards and their results combined.  Readings stored
+    in several shards by one call are committed separately in each shard.
+    """
 
-            ts                 id_2341   test_alarm_code
-            4/12/2014 13:23    2.2       44.3
-            4/12/2014 13:33    3.2       41.1
+    def __init__(self, fname=DEFAULT_DB, read_only=False, storage_engine=None):
+        """Creates the database object and opens its shard files.  The parameters are the
+        same as for BMSdata.  A database without shards is given the number of shards in
+        the BMSAPP_READING_DB_SHARDS setting.
+        """
+        self.shards = []    # the main file has no sensors of its own
+        super().__init__(fname, read_only, storage_engine)
+        if not self.registry.shard_fnames:
+            self._create_shards(_setting('BMSAPP_READING_DB_SHARDS', 1))
+        for shard_fname in self.registry.shard_fnames:
+            if not self.read_only:
+                os.makedirs(os.path.dirname(shard_fname), exist_ok=True)
+            self.shards.append(_ShardBMSdata(shard_fname, read_only, storage_engine))
+
+    def _create_shards(self, shard_count):
+        """Creates the '_shards' table listing 'shard_count' shard files.
+        """
+        self.cursor.execute('CREATE TABLE IF NOT EXISTS [%s] (shard integer primary key, fname varchar(255))' % SHARD_TABLE)
+        base_name = os.path.basename(self.db_fname)
+        self.cursor.executemany('INSERT OR IGNORE INTO [%s] (shard, fname) VALUES (?, ?)' % SHARD_TABLE,
+                                [(i, os.path.join('shard_%02d' % i, base_name)) for i in range(shard_count)])
+        self.conn.commit()
+        self.add_to_sensor_id_lists(SHARD_TABLE)
+        # another process may have created the shards first
+        self.registry.schema_version = None
+        self.registry.refresh(self.cursor)
 
-        The method returns a two tuple.  The first item is the number of readings successfully
-        stored, and the second is a list of errors, each item being an error description string.
+    def close(self):
+        """Closes this database object and its shards.
         """
+        super().close()
+        for shard in self.shards:
+            shard.close()
 
-        # make a timezone object
-        tz = pytz.timezone(tz_name)
+    def commit(self):
+        """Commits the changes made through this object in the main file and all shards.
+        """
+        self.conn.commit()
+        for shard in self.shards:
+            shard.conn.commit()
 
-        # list of errors that occurred while processing file
-        errors = []
+    def _shard_index(self, sensor_id):
+        """Returns the index of the shard that holds, or will hold, 'sensor_id'.
+        """
+        for i, shard in enumerate(self.shards):
+            if shard.sensor_id_exists(sensor_id):
+                return i
+        if _setting('BMSAPP_READING_DB_SHARD_BY', 'hash') == 'building':
+            bldg_id = _building_id(sensor_id)
+            if bldg_id is not None:
+                return bldg_id % len(self.shards)
+        # Python's hash() of a string changes from process to process
+        return zlib.crc32(sensor_id.lower().encode('utf-8')) % len(self.shards)
+
+    def _group_ids(self, sensor_ids):
+        """Returns a dictionary mapping shard index to the list of the positions in
+        'sensor_ids' of the sensors in that shard.
+        """
+        groups = {}
+        for pos, sensor_id in enumerate(sensor_ids):
+            groups.setdefault(self._shard_index(str(sensor_id)), []).append(pos)
+        return groups
 
-        first_row = True
-        vals_stored = 0
-        cur_line = 0    # current line number being processed
-        for lin in open(filename):
+    def shard_for(self, sensor_id):
+        """Returns the BMSdata object for the shard that holds, or will hold, 'sensor_id'.
+        """
+        return self.shards[self._shard_index(str(sensor_id))]
 
-            cur_line += 1
+    def shard_dbs(self):
+        """Returns a list of the BMSdata objects for the shards.
+        """
+        return list(self.shards)
 
-            # ignore blank lines
-            if len(lin.strip())==0:
-                continue
+    def sensor_id_exists(self, sensor_id):
+        """Returns True if 'sensor_id' exists in any shard.
+        """
+        return any(shard.sensor_id_exists(sensor_id) for shard in self.shards)
 
-            flds = lin.strip().split('\t')
+    def sensor_id_list(self):
+        """Returns the sorted list of the Sensor IDs in all shards.
+        """
+        return sorted(itertools.chain.from_iterable(shard.sensor_id_list() for shard in self.shards))
 
-            # Process sensor IDs in the first row
-            if first_row:
-                # get the sensor ids in this file
-                file_sensor_ids = [fld.strip() for fld in flds[1:]]
+    def add_sensor_table(self, sensor_id, commit=True):
+        return self.shard_for(sensor_id).add_sensor_table(sensor_id, commit)
 
-                # if any are not present in the database, create tables for them
-                for s_id in file_sensor_ids:
-                    if not self.sensor_id_exists(s_id):
-                        self.add_sensor_table(s_id)
-                first_row = False
-                continue
+    def _insert_recs(self, recs):
+        return self._insert_by_shard(recs, '_insert_recs')
 
-            try:
-                # get date and convert to UNIX timestamp
-                datestr = flds[0]
-                dt = parser.parse(datestr)
-                dt_aware = tz.localize(dt)
-                ts = calendar.timegm(dt_aware.utctimetuple())
-            except:
-                errors.append("Problem parsing date %s at line %s" % (datestr, cur_line))
-                continue
+    def _insert_batch_recs(self, recs):
+        return self._insert_by_shard(recs, '_insert_batch_recs')
 
-            # loop through sensor values and store
-            for s_id, val in zip(file_sensor_ids, flds[1:]):
-                try:
-                    if len(val.strip())!=0:
-                        float_val = float(val)
-                        if float_val is not None:     # sometimes find "nan" in data
-                            self.cursor.execute("INSERT INTO [%s] (ts, val) VALUES (?, ?)" % s_id, (ts, float(val)))
-                            vals_stored += 1
-                except Exception as e:
-                    errors.append("Problem storing %s: %s=%s at line %s: %s" % (datestr, s_id, val, cur_line, e))
+    def _insert_groups(self, groups):
+        """Splits the readings grouped by sensor in 'groups' (see BMSdata._insert_groups())
+        by shard and stores each shard's part.
+        """
+        success_count = rejected_count = 0
+        sensor_ids = list(groups.keys())
+        for i, positions in self._group_ids(sensor_ids).items():
+            success, rejected = self.shards[i]._insert_groups({sensor_ids[pos]: groups[sensor_ids[pos]]
+                                                               for pos in positions})
+            success_count += success
+            rejected_count += rejected
+        return success_count, rejected_count
+
+    def _insert_by_shard(self, recs, method_name):
+        """Splits the (ts, id, val) readings 'recs' by shard and stores each group with the
+        shard's 'method_name' method.  Returns a two-tuple: (number of readings stored,
+        number rejected).
+        """
+        success_count = rejected_count = 0
+        for i, positions in self._group_ids([rec[1] for rec in recs]).items():
+            success, rejected = getattr(self.shards[i], method_name)([recs[pos] for pos in positions])
+            success_count += success
+            rejected_count += rejected
+        return success_count, rejected_count
 
-        self.conn.commit()
-        return vals_stored, errors
+    def last_read(self, sensor_id, read_count=1):
+        return self.shard_for(sensor_id).last_read(sensor_id, read_count)
+
+    def last_reads(self, sensor_ids):
+        sensor_ids = [str(sensor_id) for sensor_id in sensor_ids]
+        results = {}
+        for i, positions in self._group_ids(sensor_ids).items():
+            results.update(self.shards[i].last_reads([sensor_ids[pos] for pos in positions]))
+        return {sensor_id: results[sensor_id] for sensor_id in sensor_ids}
+
+    def refresh_latest(self, sensor_id, commit=True):
+        self.shard_for(sensor_id).refresh_latest(sensor_id, commit)
+
+    def refresh_stats(self, sensor_id, commit=True):
+        self.shard_for(sensor_id).refresh_stats(sensor_id, commit)
+
+    def sensor_stats(self, sensor_ids=None):
+        results = {}
+        if sensor_ids is None:
+            for shard in self.shards:
+                results.update(shard.sensor_stats())
+        else:
+            sensor_ids = [str(sensor_id) for sensor_id in sensor_ids]
+            for i, positions in self._group_ids(sensor_ids).items():
+                results.update(self.shards[i].sensor_stats([sensor_ids[pos] for pos in positions]))
+        return results
+
+    def rowsForOneID(self, sensor_id, start_tm=None, end_tm=None):
+        return self.shard_for(sensor_id).rowsForOneID(sensor_id, start_tm, end_tm)
+
+    def arraysForOneID(self, sensor_id, start_ts=None, end_ts=None):
+        return self.shard_for(sensor_id).arraysForOneID(sensor_id, start_ts, end_ts)
+
+    def iterArraysForOneID(self, sensor_id, start_ts=None, end_ts=None, chunk_rows=FETCH_ROWS):
+        return self.shard_for(sensor_id).iterArraysForOneID(sensor_id, start_ts, end_ts, chunk_rows)
+
+    def dataframeForOneID(self, sensor_id, start_ts=None, end_ts=None, tz=None):
+        return self.shard_for(sensor_id).dataframeForOneID(sensor_id, start_ts, end_ts, tz)
+
+    def dataframeFromRollups(self, sensor_id, rule, offset=None, start_ts=None, end_ts=None, tz=None):
+        return self.shard_for(sensor_id).dataframeFromRollups(sensor_id, rule, offset, start_ts, end_ts, tz)
+
+    def dataframeForMultipleIDs(self, sensor_id_list, column_names=None, start_ts=None, end_ts=None, tz=None):
+        if len(sensor_id_list) == 0:
+            return None
+        col_names = column_names if column_names else sensor_id_list
+
+        # Read each shard's sensors into columns named by position, then line the columns
+        # up on the UTC timestamps before any time zone conversion.
+        frames = []
+        for i, positions in self._group_ids(sensor_id_list).items():
+            frames.append(self.shards[i].dataframeForMultipleIDs([sensor_id_list[pos] for pos in positions],
+                                                                 [str(pos) for pos in positions], start_ts, end_ts))
+        df_final = pd.concat(frames, axis=1).sort_index()
+        df_final = df_final[[str(pos) for pos in range(len(sensor_id_list))]]
+        df_final.columns = [str(c) for c in col_names]
+        df_final.index.name = 'ts'
+
+        if tz and len(df_final) > 0:
+            df_final.index = df_final.index.tz_localize('UTC').tz_convert(tz).tz_localize(None)
+        return df_final
+
+    def readingCount(self, startTime=0, endTime=None):
+        return sum(shard.readingCount(startTime, endTime) for shard in self.shards)
+
+    def inserted_count(self, start_ts, end_ts=None):
+        counts = [shard.inserted_count(start_ts, end_ts) for shard in self.shards]
+        return None if None in counts else sum(counts)
+
+    def sensor_time_range(self, sensor_id):
+        return self.shard_for(sensor_id).sensor_time_range(sensor_id)
+
+    def reading_count(self, sensor_id, condition=None):
+        return self.shard_for(sensor_id).reading_count(sensor_id, condition)
+
+    def delete_readings(self, sensor_id, condition=None):
+        self.shard_for(sensor_id).delete_readings(sensor_id, condition)
+
+    def delete_sensor(self, sensor_id, commit=True):
+        self.shard_for(sensor_id).delete_sensor(sensor_id, commit)
+
+    def merge_readings(self, from_id, to_id, condition=None):
+        from_db, to_db = self.shard_for(from_id), self.shard_for(to_id)
+        if from_db is to_db:
+            from_db.merge_readings(from_id, to_id, condition)
+            return
+        # the sensors are in different files, so copy the readings through Python
+        select_sql = 'SELECT ts, val FROM %s' % from_db.storage.source(from_id)
+        if condition:
+            select_sql += ' WHERE %s' % condition
+        rows = [tuple(row) for row in from_db.cursor.execute(select_sql).fetchall()]
+        rows += from_db._archived_rows(from_id, condition)
+        to_db.cursor.executemany(to_db.storage.insert_sql(to_id), rows)
+        to_db.refresh_latest(to_id, commit=False)
+        to_db.refresh_stats(to_id, commit=False)
+        rollup.mark_dirty(to_db, [(to_id, rollup.REBUILD)])
+
+    def backup_db(self, days_to_retain, incremental=False):
+        """Backs up the main file and each shard file (see BMSdata.backup_db()).  Returns
+        the statistics of the main file backup, with the sizes and times summed over
+        all of the files and a 'files' item giving the number of files backed up.
+        """
+        all_stats = [backup.backup_db(self.db_fname, days_to_retain, incremental)]
+        all_stats += [shard.backup_db(days_to_retain, incremental) for shard in self.shards]
+        stats = dict(all_stats[0])
+        for key in ('seconds', 'snapshot_seconds', 'compress_seconds', 'db_bytes', 'pages_stored', 'compressed_bytes'):
+            stats[key] = sum(s[key] for s in all_stats)
+        stats['mb_per_sec'] = stats['db_bytes'] / 1e6 / stats['seconds'] if stats['seconds'] > 0 else 0.0
+        stats['files'] = len(all_stats)
+        return stats
+
+
+def _building_id(sensor_id):
+    """Returns the ID of the first building that the Sensor with the Sensor ID 'sensor_id'
+    belongs to, or None if there is no such Sensor or it is not in a building.
+    """
+    try:
+        from bmsapp.models import BldgToSensor    # needed to import here to avoid circular import
+        return BldgToSensor.objects.filter(sensor__sensor_id=sensor_id).order_by('building_id') \
+                                   .values_list('building_id', flat=True).first()
+    except Exception:
+        return None
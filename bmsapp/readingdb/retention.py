@@ -0,0 +1,177 @@
+"""Downsampling of old readings according to retention policies.  A retention policy
+is a list of tiers, each a (age in seconds, averaging period in seconds) tuple in order
+of increasing age.  Readings older than a tier's age are replaced by one reading per
+averaging period holding the time-weighted average of the readings in that period,
+timestamped at the start of the period.  Periods are aligned to multiples of their
+length in Unix time.  For example, keeping raw readings for 90 days, then 15 minute
+averages for 2 years, then hourly averages forever is:
+
+    [(90 * DAY, 15 * 60), ((90 + 730) * DAY, 3600)]
+
+A tier with an averaging period of None deletes the readings older than its age.
+
+The averages are stored as ordinary readings, so all of the BMSdata reading methods
+work across the resolution boundaries.  The averages use the same step-hold weighting
+as the rollups (see rollup.py).  Old ranges are rewritten in chunks of about
+CHUNK_SECONDS, each in its own short write transaction.  The '_retention' table
+records, for each sensor and averaging period, the timestamp that the readings have
+been averaged up to, so each run only processes the readings that have aged into a
+tier since the last run.  Readings that have been moved to the Parquet archive are
+not downsampled.
+"""
+import time
+import logging
+
+import numpy as np
+
+from . import rollup
+from . import archive
+
+# Make a logger for this module
+_logger = logging.getLogger('bms.' + __name__)
+
+DAY = 86400
+
+# Approximate length of the time range rewritten in each transaction.
+CHUNK_SECONDS = 7 * DAY
+
+# Table tracking how far each sensor's readings have been averaged.
+RETENTION_TABLE = '_retention'
+
+# Table holding the Sensor ID of the last sensor that a compacting run finished, so the
+# next run continues with the sensor after it.
+STATUS_TABLE = '_retention_status'
+
+
+def create_table(db):
+    """Creates the table in the BMSdata Reading database 'db' that tracks the progress
+    of downsampling, if it does not exist.
+    """
+    if RETENTION_TABLE not in db.sensor_ids:
+        db.cursor.execute('CREATE TABLE IF NOT EXISTS [%s] (sensor_id varchar(50) COLLATE NOCASE, period integer, '
+                          'compacted_to integer, PRIMARY KEY (sensor_id, period)) WITHOUT ROWID' % RETENTION_TABLE)
+        db.conn.commit()
+        db.add_to_sensor_id_lists(RETENTION_TABLE)
+
+def resume_after(db):
+    """Returns the Sensor ID of the last sensor finished by the previous compacting run
+    on the BMSdata Reading database 'db', or None if there was no run.
+    """
+    if STATUS_TABLE not in db.sensor_ids:
+        return None
+    rec = db.cursor.execute('SELECT sensor_id FROM [%s] WHERE id = 0' % STATUS_TABLE).fetchone()
+    return rec[0] if rec else None
+
+def set_resume_after(db, sensor_id):
+    """Records 'sensor_id' as the last sensor finished by a compacting run on the BMSdata
+    Reading database 'db' (see resume_after()), and commits.
+    """
+    if STATUS_TABLE not in db.sensor_ids:
+        db.cursor.execute('CREATE TABLE IF NOT EXISTS [%s] (id integer primary key, sensor_id varchar(50))' % STATUS_TABLE)
+        db.add_to_sensor_id_lists(STATUS_TABLE)
+    db.cursor.execute('INSERT INTO [%s] (id, sensor_id) VALUES (0, ?) '
+                      'ON CONFLICT(id) DO UPDATE SET sensor_id=excluded.sensor_id' % STATUS_TABLE, (sensor_id,))
+    db.conn.commit()
+
+def delete_sensor(db, sensor_id):
+    """Deletes the downsampling progress for 'sensor_id'.  The change is not committed.
+    """
+    if RETENTION_TABLE in db.sensor_ids:
+        db.cursor.execute('DELETE FROM [%s] WHERE sensor_id = ?' % RETENTION_TABLE, (sensor_id,))
+
+def compacted_to(db, sensor_id, period):
+    """Returns the timestamp that the readings of 'sensor_id' have been averaged up to
+    for the averaging period 'period', or None if they have not been averaged.
+    """
+    rec = db.cursor.execute('SELECT compacted_to FROM [%s] WHERE sensor_id = ? AND period = ?' % RETENTION_TABLE,
+                            (sensor_id, period)).fetchone()
+    return rec[0] if rec else None
+
+def compact_range(db, sensor_id, start_ts, end_ts, period):
+    """Replaces the readings of 'sensor_id' from 'start_ts' up to (not including) 'end_ts'
+    with their time-weighted averages over 'period' seconds, and records the progress, in
+    one write transaction.  'start_ts' and 'end_ts' must be multiples of 'period'.  Ranges
+    that are already at this resolution or coarser are not rewritten.  If 'period' is
+    None, the readings are deleted.  Returns a two-tuple: (number of readings deleted,
+    number of averages stored).
+    """
+    if db.conn.in_transaction:
+        db.conn.commit()
+    db.cursor.execute('BEGIN IMMEDIATE')
+    try:
+        # include the readings on either side of the range that hold into it
+        ts, vals = db.arraysForOneID(sensor_id, start_ts - rollup.MAX_HOLD, end_ts + rollup.MAX_HOLD)
+        in_range = (ts >= start_ts) & (ts < end_ts)
+        deleted = added = 0
+        if period is None:
+            if in_range.any():
+                db.cursor.execute(db.storage.delete_sql(sensor_id, 'ts >= %d AND ts < %d' % (start_ts, end_ts)))
+                deleted = int(in_range.sum())
+                rollup.mark_dirty(db, [(sensor_id, rollup.REBUILD)])
+        elif in_range.any() and (ts[in_range] % period).any():
+            df = rollup.compute_periods(ts, vals, start_ts, end_ts - period, period)
+            df = df[df['count'] > 0]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                avgs = np.where(df.duration.values > 0, df.wsum.values / df.duration.values, df['mean'].values)
+            db.cursor.execute(db.storage.delete_sql(sensor_id, 'ts >= %d AND ts < %d' % (start_ts, end_ts)))
+            deleted = int(in_range.sum())
+            db.cursor.executemany(db.storage.insert_sql(sensor_id),
+                                  zip(df.ts.values.tolist(), avgs.tolist()))
+            added = len(df)
+            rollup.mark_dirty(db, [(sensor_id, start_ts)])
+
+        db.cursor.execute('INSERT INTO [%s] (sensor_id, period, compacted_to) VALUES (?, ?, ?) '
+                          'ON CONFLICT(sensor_id, period) DO UPDATE SET compacted_to=excluded.compacted_to' %
+                          RETENTION_TABLE, (sensor_id, period or 0, end_ts))
+        db.conn.commit()
+        return deleted, added
+    except:
+        db.conn.rollback()
+        raise
+
+def compact_sensor(db, sensor_id, tiers, now=None, deadline=None):
+    """Downsamples the readings of 'sensor_id' in the BMSdata Reading database 'db'
+    according to the retention policy 'tiers' (see the module docstring).  'now' is the
+    Unix time that reading ages are measured from (the current time if None).  Stops
+    after the Unix time 'deadline', if given; the next run continues where this one
+    stopped.  Returns a two-tuple: (number of readings deleted, number of averages stored).
+    """
+    create_table(db)
+    now = time.time() if now is None else now
+    stats = db.sensor_stats([sensor_id]).get(str(sensor_id))
+    if stats is None:
+        return 0, 0
+    arch_ts = archive.archived_to(db, sensor_id)
+
+    deleted = added = 0
+    # Work from the oldest tier to the newest, so readings aging past several tiers at
+    # once are averaged only once.  Each tier starts in the period holding the end of
+    # the older tier, which only has readings newer than that end left.
+    older_end = None
+    for age, period in reversed(tiers):
+        # deletion is done in whole seconds
+        step = period or 1
+        cutoff = int((now - age) // step) * step
+        start = compacted_to(db, sensor_id, period or 0)
+        if start is None:
+            start = int(stats['first_ts'] // step) * step
+        if older_end is not None:
+            start = max(start, older_end // step * step)
+        if arch_ts is not None:
+            start = max(start, -(-arch_ts // step) * step)
+        chunk = max(step, (CHUNK_SECONDS // step) * step)
+        while start < cutoff:
+            if deadline is not None and time.time() > deadline:
+                break
+            end = min(start + chunk, cutoff)
+            n_deleted, n_added = compact_range(db, sensor_id, start, end, period)
+            deleted += n_deleted
+            added += n_added
+            start = end
+        older_end = max(cutoff, older_end or cutoff)
+
+    if deleted or added:
+        # the first or last reading may have been replaced
+        db.refresh_latest(sensor_id)
+        db.refresh_stats(sensor_id)
+    return deleted, added
@@ -0,0 +1,346 @@
+"""Hourly and daily rollups of sensor readings, used to serve averaged time series
+for long time ranges without reading every raw reading.  For each sensor and UTC
+hour (or day) the rollup tables hold:
+
+    count:     the number of readings in the period
+    min, max:  the minimum and maximum reading in the period
+    mean:      the simple average of the readings in the period
+    wsum:      the time-weighted sum (value x seconds) of the readings in the period
+    duration:  the number of seconds in the period covered by readings
+
+A reading's value holds from its timestamp until the next reading, but for no more
+than MAX_HOLD seconds; the last reading of a sensor has no duration.  This is the
+same weighting used by data_util.weighted_resample_timeseries() with its default
+'pad' interpolation, so wsum / duration over a period is the time-weighted average.
+
+The rollups are updated incrementally.  Storing readings records the earliest new
+timestamp for the sensor in the '_rollup_status' table, and the update_rollups script
+(run from main_cron) recomputes the affected periods.  Periods that have not been
+recomputed yet are calculated from the raw readings when read.  A sensor without a
+'_rollup_status' row, or one waiting for a full rebuild, is not served from rollups.
+"""
+import time
+import logging
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytz
+
+from . import archive
+
+# Make a logger for this module
+_logger = logging.getLogger('bms.' + __name__)
+
+HOUR = 3600
+DAY = 86400
+
+# Maximum number of seconds a reading's value is held.
+MAX_HOLD = DAY
+
+# The tables used to store the rollups.
+STATUS_TABLE = '_rollup_status'
+HOUR_TABLE = '_rollup_hour'
+DAY_TABLE = '_rollup_day'
+TABLES = (STATUS_TABLE, HOUR_TABLE, DAY_TABLE)
+
+# 'dirty_ts' value marking a sensor whose rollups need a full rebuild
+REBUILD = 0
+
+
+def create_tables(db):
+    """Creates the rollup tables in the BMSdata Reading database 'db' and marks all
+    existing sensors for a full rebuild, which the update_rollups script performs.
+    """
+    for table in (HOUR_TABLE, DAY_TABLE):
+        db.cursor.execute('CREATE TABLE IF NOT EXISTS [%s] (sensor_id varchar(50) COLLATE NOCASE, ts integer, '
+                          'count integer, min real, max real, mean real, wsum real, duration real, '
+                          'PRIMARY KEY (sensor_id, ts)) WITHOUT ROWID' % table)
+    db.cursor.execute('CREATE TABLE IF NOT EXISTS [%s] (sensor_id varchar(50) primary key COLLATE NOCASE, '
+                      'dirty_ts integer)' % STATUS_TABLE)
+    db.cursor.executemany('INSERT OR IGNORE INTO [%s] (sensor_id, dirty_ts) VALUES (?, ?)' % STATUS_TABLE,
+                          [(sensor_id, REBUILD) for sensor_id in db.sensor_id_list()])
+    db.conn.commit()
+    for table in TABLES:
+        db.add_to_sensor_id_lists(table)
+
+def mark_dirty(db, recs):
+    """Records that readings have been stored or changed for sensors.  'recs' is a
+    list of (sensor_id, earliest timestamp changed) tuples.  The change is not
+    committed.
+    """
+    if STATUS_TABLE in db.sensor_ids and recs:
+        db.cursor.executemany('INSERT INTO [%s] (sensor_id, dirty_ts) VALUES (?, ?) '
+                              'ON CONFLICT(sensor_id) DO UPDATE SET '
+                              'dirty_ts = min(coalesce(dirty_ts, excluded.dirty_ts), excluded.dirty_ts)' % STATUS_TABLE,
+                              recs)
+
+def delete_sensor(db, sensor_id):
+    """Deletes the rollups for 'sensor_id'.  The change is not committed.
+    """
+    if STATUS_TABLE in db.sensor_ids:
+        for table in TABLES:
+            db.cursor.execute('DELETE FROM [%s] WHERE sensor_id = ?' % table, (sensor_id,))
+
+def compute_periods(ts, vals, first_ts, last_ts, period=HOUR):
+    """Returns a DataFrame of rollup values for the periods of length 'period' seconds
+    starting at 'first_ts' through the period starting at 'last_ts'.  'ts' and 'vals'
+    are the numpy arrays of the sensor's readings, in timestamp order; they must include
+    the readings before 'first_ts' that can hold into the first period.  The columns of
+    the DataFrame are 'ts' (period start) and the rollup values described in the module
+    docstring.  Only periods with readings or with covered time are included.
+    """
+    period_count = int((last_ts - first_ts) // period) + 1
+    bounds = first_ts + period * np.arange(period_count + 1, dtype=np.int64)
+
+    # The integral of the held values, and of the covered time, are piecewise linear
+    # functions of time with nodes at the start and end of each reading's hold.  Evaluate
+    # them at the period boundaries and difference to get the values for each period.
+    if len(ts) > 1:
+        starts = ts[:-1]
+        ends = np.minimum(ts[1:], ts[:-1] + MAX_HOLD)
+        held = (ends - starts).astype(np.float64)
+        nodes = np.empty(2 * len(starts))
+        nodes[0::2] = starts
+        nodes[1::2] = ends
+        cum_val = np.concatenate(([0.0], np.cumsum(vals[:-1] * held)))
+        cum_time = np.concatenate(([0.0], np.cumsum(held)))
+        int_val = np.empty(len(nodes))
+        int_val[0::2] = cum_val[:-1]
+        int_val[1::2] = cum_val[1:]
+        int_time = np.empty(len(nodes))
+        int_time[0::2] = cum_time[:-1]
+        int_time[1::2] = cum_time[1:]
+        wsum = np.diff(np.interp(bounds, nodes, int_val))
+        duration = np.diff(np.interp(bounds, nodes, int_time))
+    else:
+        wsum = np.zeros(period_count)
+        duration = np.zeros(period_count)
+
+    # statistics of the readings that fall in each period
+    in_range = (ts >= bounds[0]) & (ts < bounds[-1])
+    period_ix = ((ts[in_range] - first_ts) // period).astype(np.int64)
+    period_vals = vals[in_range]
+    count = np.bincount(period_ix, minlength=period_count)
+    total = np.bincount(period_ix, weights=period_vals, minlength=period_count)
+    min_vals = np.full(period_count, np.inf)
+    np.minimum.at(min_vals, period_ix, period_vals)
+    max_vals = np.full(period_count, -np.inf)
+    np.maximum.at(max_vals, period_ix, period_vals)
+
+    has_data = (count > 0) | (duration > 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(count > 0, total / count, np.nan)
+    return pd.DataFrame({
+        'ts': bounds[:-1][has_data],
+        'count': count[has_data],
+        'min': np.where(count > 0, min_vals, np.nan)[has_data],
+        'max': np.where(count > 0, max_vals, np.nan)[has_data],
+        'mean': mean[has_data],
+        'wsum': wsum[has_data],
+        'duration': duration[has_data],
+    })
+
+def update_sensor(db, sensor_id):
+    """Brings the rollups for 'sensor_id' up to date in the BMSdata Reading database
+    'db'.  The work is done in one write transaction so readings stored meanwhile are
+    not missed.  Returns the number of hourly periods recomputed.
+    """
+    if db.conn.in_transaction:
+        db.conn.commit()
+    db.cursor.execute('BEGIN IMMEDIATE')
+    try:
+        rec = db.cursor.execute('SELECT dirty_ts FROM [%s] WHERE sensor_id = ?' % STATUS_TABLE,
+                                (sensor_id,)).fetchone()
+        if rec is None or rec[0] is None:
+            db.conn.commit()
+            return 0
+
+        # A new reading changes the hold of the reading before it, so start far enough
+        # back to include that reading's hold.
+        dirty_ts = rec[0]
+        if dirty_ts == REBUILD:
+            ts, vals = db.arraysForOneID(sensor_id)
+            first_hour = (ts[0] // HOUR) * HOUR if len(ts) else 0
+        else:
+            first_hour = ((dirty_ts - MAX_HOLD) // HOUR) * HOUR
+            ts, vals = db.arraysForOneID(sensor_id, first_hour - MAX_HOLD)
+
+        db.cursor.execute('DELETE FROM [%s] WHERE sensor_id = ? AND ts >= ?' % HOUR_TABLE, (sensor_id, first_hour))
+        first_day = (first_hour // DAY) * DAY
+        db.cursor.execute('DELETE FROM [%s] WHERE sensor_id = ? AND ts >= ?' % DAY_TABLE, (sensor_id, first_day))
+
+        hour_count = 0
+        if len(ts) and ts[-1] >= first_hour:
+            df = compute_periods(ts, vals, first_hour, (ts[-1] // HOUR) * HOUR)
+            df.insert(0, 'sensor_id', sensor_id)
+            db.cursor.executemany('INSERT INTO [%s] (sensor_id, ts, count, min, max, mean, wsum, duration) '
+                                  'VALUES (?, ?, ?, ?, ?, ?, ?, ?)' % HOUR_TABLE,
+                                  [tuple(r) for r in df.astype(object).where(df.notna(), None).values.tolist()])
+            hour_count = len(df)
+
+            # the daily rollups are sums of the hourly rollups
+            db.cursor.execute('INSERT INTO [%s] (sensor_id, ts, count, min, max, mean, wsum, duration) '
+                              'SELECT sensor_id, (ts / %d) * %d AS day, SUM(count), MIN(min), MAX(max), '
+                              'SUM(mean * count) / SUM(count), SUM(wsum), SUM(duration) '
+                              'FROM [%s] WHERE sensor_id = ? AND ts >= ? GROUP BY day' %
+                              (DAY_TABLE, DAY, DAY, HOUR_TABLE), (sensor_id, first_day))
+
+        db.cursor.execute('UPDATE [%s] SET dirty_ts = NULL WHERE sensor_id = ?' % STATUS_TABLE, (sensor_id,))
+        db.conn.commit()
+        return hour_count
+    except:
+        db.conn.rollback()
+        raise
+
+def update_rollups(db, time_limit=None):
+    """Updates the rollups of all sensors that have new or changed readings, oldest
+    changes first.  Stops after 'time_limit' seconds if it is given; the remaining
+    sensors are updated on the next run.  Returns the number of sensors updated.
+    """
+    start = time.time()
+    recs = db.cursor.execute('SELECT sensor_id FROM [%s] WHERE dirty_ts IS NOT NULL ORDER BY dirty_ts' %
+                             STATUS_TABLE).fetchall()
+    sensor_count = 0
+    for rec in recs:
+        if time_limit is not None and time.time() - start > time_limit:
+            break
+        try:
+            update_sensor(db, rec[0])
+            sensor_count += 1
+        except Exception:
+            _logger.exception('Error updating rollups for %s' % rec[0])
+    return sensor_count
+
+def rebuild(db, sensor_ids=None):
+    """Marks the rollups of the sensors in 'sensor_ids' (all sensors if None) for a full
+    rebuild, for use after readings are backfilled.
+    """
+    if sensor_ids is None:
+        sensor_ids = db.sensor_id_list()
+    mark_dirty(db, [(sensor_id, REBUILD) for sensor_id in sensor_ids])
+    db.conn.commit()
+
+def rule_period(rule):
+    """Returns the length in seconds of the rollup periods that the pandas offset alias
+    'rule' can be built from: DAY if its periods are made of whole days, HOUR if they
+    are made of whole hours, or None if they can't be built from rollups.
+    """
+    try:
+        offset = pd.tseries.frequencies.to_offset(rule)
+    except ValueError:
+        return None
+    if isinstance(offset, pd.tseries.offsets.Tick):
+        nanos = offset.nanos
+        if nanos % (DAY * 10**9) == 0:
+            return DAY
+        return HOUR if nanos % (HOUR * 10**9) == 0 else None
+    # calendar offsets such as weeks, months and years
+    return DAY
+
+def _reading_range(db, sensor_id, start_ts=None, end_ts=None):
+    """Returns a two-tuple holding the timestamps of the first and last readings of
+    'sensor_id' in the time range 'start_ts' to 'end_ts', with None values if there
+    are no readings.  Returns None if the time range reaches into the archive after its
+    first reading, as finding those readings would mean reading the archive.
+    """
+    arch_to = archive.archived_to(db, sensor_id)
+    arch_first = None
+    if arch_to is not None and (start_ts is None or start_ts < arch_to):
+        arch_first, arch_last = archive.time_range(db.db_fname, sensor_id)
+        if arch_first is not None and ((start_ts is not None and start_ts > arch_first) or
+                                       (end_ts is not None and end_ts < arch_to)):
+            return None
+    sql = 'SELECT min(ts), max(ts) FROM %s WHERE val IS NOT NULL' % db.storage.source(sensor_id)
+    if start_ts is not None:
+        sql += ' AND ts>=%s' % int(start_ts)
+    if end_ts is not None:
+        sql += ' AND ts<=%s' % int(end_ts)
+    first_ts, last_ts = db.cursor.execute(sql).fetchone()
+    if arch_first is not None:
+        first_ts = arch_first if first_ts is None else min(first_ts, arch_first)
+        last_ts = arch_last if last_ts is None else max(last_ts, arch_last)
+    return first_ts, last_ts
+
+def read_averages(db, sensor_id, rule, offset=None, start_ts=None, end_ts=None, tz=None):
+    """Returns a DataFrame of time-weighted averages of the readings of 'sensor_id' over
+    periods given by the pandas offset alias 'rule', built from the rollups.  The
+    DataFrame matches the one produced by applying data_util.weighted_resample_timeseries()
+    with 'pad' interpolation to BMSdata.dataframeForOneID(): 'ts' and 'val' columns, a
+    naive index in the pytz timezone 'tz' (UTC if None) labeled at the start of each
+    period plus 'offset'.  Periods with no readings have NaN values.  Only the readings
+    in the time range given by the Unix timestamps 'start_ts' and 'end_ts' are used:
+    rollup periods lying between the first and last of those readings are read from the
+    rollup tables, and the partial periods at the ends of the range from the readings.
+    Returns None if the request cannot be served from the rollups.
+    """
+    if isinstance(tz, str):
+        tz = pytz.timezone(tz)
+    period = rule_period(rule)
+    if STATUS_TABLE not in db.sensor_ids or period is None:
+        return None
+    if tz is not None and (tz.utcoffset(datetime.now()).total_seconds() % HOUR) != 0:
+        # hourly rollups can't be split for time zones offset by a fraction of an hour
+        return None
+    if tz is not None and str(tz) != 'UTC':
+        # daily rollups are UTC days, so local days are built from hourly rollups
+        period = HOUR
+    table = DAY_TABLE if period == DAY else HOUR_TABLE
+    rec = db.cursor.execute('SELECT dirty_ts FROM [%s] WHERE sensor_id = ?' % STATUS_TABLE, (sensor_id,)).fetchone()
+    if rec is None or rec[0] == REBUILD:
+        return None
+    reading_range = _reading_range(db, sensor_id, start_ts, end_ts)
+    if reading_range is None:
+        return None
+    first_read, last_read = reading_range
+    if first_read is None:
+        return pd.DataFrame(columns=['ts', 'val'])
+
+    # The rollup periods that lie entirely between the first and last readings hold
+    # only the readings in the time range.  Periods from the first one affected by
+    # readings not yet rolled up are calculated from the readings as well.
+    mid_start = -(-first_read // period) * period
+    mid_end = (last_read // period) * period
+    if rec[0] is not None:
+        mid_end = min(mid_end, ((rec[0] - MAX_HOLD) // period) * period)
+    if mid_end <= mid_start:
+        mid_start = mid_end = (first_read // HOUR) * HOUR
+    df = pd.read_sql_query('SELECT ts, wsum, duration FROM [%s] WHERE sensor_id = ? AND ts >= ? AND ts < ?' % table,
+                           db.conn, params=[sensor_id, mid_start, mid_end])
+    df['length'] = period
+
+    # the hours before and after those periods, from the readings in the time range
+    pieces = [df]
+    head_start = (first_read // HOUR) * HOUR
+    if head_start < mid_start:
+        ts, vals = db.arraysForOneID(sensor_id, first_read, min(mid_start + MAX_HOLD, last_read))
+        pieces.append(compute_periods(ts, vals, head_start, mid_start - HOUR))
+    ts, vals = db.arraysForOneID(sensor_id, max(first_read, mid_end - MAX_HOLD), last_read)
+    pieces.append(compute_periods(ts, vals, mid_end, (last_read // HOUR) * HOUR))
+    for i in range(1, len(pieces)):
+        pieces[i] = pieces[i][['ts', 'wsum', 'duration']].assign(length=HOUR)
+    df = pd.concat(pieces, ignore_index=True)
+    df = df[df.duration > 0]
+
+    if len(df) == 0:
+        return pd.DataFrame(columns=['ts', 'val'])
+
+    # Sum the rollup values into the requested periods in the requested timezone.  The
+    # 'ts' column is the time-weighted average timestamp of the readings, approximated
+    # with the midpoints of the rollup periods.  Rollup rows are placed just before the
+    # end of their period and resampled like weighted_resample_timeseries() does, so
+    # calendar periods (weeks, months, years) are split the same way.
+    index = pd.to_datetime((df.ts.values + df.length.values) * 10**9 - 1, unit='ns', utc=True)
+    index = index.tz_convert(tz).tz_localize(None) if tz else index.tz_localize(None)
+    df_sums = pd.DataFrame({'tsw': (df.ts.values + df.length.values / 2) * df.duration.values,
+                            'wsum': df.wsum.values,
+                            'duration': df.duration.values}, index=index)
+    df_sums = df_sums.resample(rule, closed='right', label='left').sum()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        duration = df_sums.duration.where(df_sums.duration > 0)
+        df_avg = pd.DataFrame({'ts': df_sums.tsw / duration, 'val': df_sums.wsum / duration},
+                              index=pd.DatetimeIndex(df_sums.index, name='ts'))
+    if offset:
+        # offset the index label to the center of each period
+        df_avg.index = df_avg.index + pd.tseries.frequencies.to_offset(offset)
+    return df_avg
@@ -0,0 +1,114 @@
+"""Durable spool of incoming sensor readings.  In spool mode (see the
+BMSAPP_INGEST_SPOOL setting), the ingest views only parse the posted readings and
+append them to the spool, a small SQLite file separate from the Reading database, and
+return without waiting for the Reading database write lock.  The 'spool_writer'
+script is the single process that drains the spool into the Reading database in large
+batches.
+
+Each post is one row holding its (ts, reading_id, val) readings as JSON.  A post is
+appended in one short transaction with synchronous=FULL, so readings that were
+acknowledged to the poster survive a crash or power loss.  The writer deletes posts
+only after their readings have been committed to the Reading database.  If it stops in
+between, those posts are stored again when it restarts; storing a reading again
+replaces the identical reading, so nothing is lost or duplicated.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# The path to the default spool file.
+DEFAULT_SPOOL = os.path.join(os.path.dirname(__file__), 'data', 'ingest_spool.sqlite')
+
+# Table holding the spooled posts.
+SPOOL_TABLE = '_spool'
+
+# Milliseconds to wait for the spool write lock.
+BUSY_TIMEOUT = 30000
+
+# Holds the spool connection used by each thread, keyed by the absolute path of the
+# spool file.
+_thread_conns = threading.local()
+
+def _get_connection(fname):
+    """Returns the connection to the spool file 'fname' that is reused by the current
+    thread, creating the file and its table if needed.
+    """
+    conns = getattr(_thread_conns, 'conns', None)
+    if conns is None:
+        conns = _thread_conns.conns = {}
+    key = os.path.abspath(fname)
+    conn = conns.get(key)
+    if conn is None:
+        conn = sqlite3.connect(fname, timeout=BUSY_TIMEOUT / 1000.0)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=FULL')
+        conn.execute('PRAGMA busy_timeout=%d' % BUSY_TIMEOUT)
+        conn.execute('CREATE TABLE IF NOT EXISTS [%s] (id integer PRIMARY KEY AUTOINCREMENT, '
+                     'received real, reading_count integer, readings text)' % SPOOL_TABLE)
+        conn.commit()
+        conns[key] = conn
+    return conn
+
+
+class ReadingSpool:
+    """A queue of posted readings waiting to be stored in the Reading database.
+    """
+
+    def __init__(self, fname=DEFAULT_SPOOL):
+        """'fname' is the path to the SQLite spool file, which is created if it does not
+        exist.
+        """
+        self.fname = fname
+        self.conn = _get_connection(fname)
+
+    def append(self, readings):
+        """Durably appends the list of (ts, reading_id, val) readings 'readings' from one
+        post to the spool.  The timestamps must already be filled in, as the readings are
+        stored later.  Returns the number of readings spooled.
+        """
+        if not readings:
+            return 0
+        self.conn.execute('INSERT INTO [%s] (received, reading_count, readings) VALUES (?, ?, ?)' % SPOOL_TABLE,
+                          (time.time(), len(readings), json.dumps(readings)))
+        self.conn.commit()
+        return len(readings)
+
+    def claim(self, max_readings):
+        """Returns the oldest spooled posts holding up to 'max_readings' readings in
+        total (at least one post is returned if any are spooled), as a two-tuple: the ID
+        of the last post returned, and a list of their (ts, reading_id, val) readings in
+        the order received.  The ID is None if the spool is empty.  The posts stay in the
+        spool until they are removed by release().
+        """
+        last_id = None
+        readings = []
+        cursor = self.conn.execute('SELECT id, reading_count, readings FROM [%s] ORDER BY id' % SPOOL_TABLE)
+        for post_id, reading_count, post_readings in cursor:
+            if last_id is not None and len(readings) + reading_count > max_readings:
+                break
+            last_id = post_id
+            readings += [tuple(reading) for reading in json.loads(post_readings)]
+        cursor.close()
+        self.conn.commit()
+        return last_id, readings
+
+    def release(self, last_id):
+        """Removes the posts up to and including the ID 'last_id' from the spool, after
+        they have been stored.
+        """
+        self.conn.execute('DELETE FROM [%s] WHERE id <= ?' % SPOOL_TABLE, (last_id,))
+        self.conn.commit()
+
+    def depth(self):
+        """Returns a dictionary describing the readings waiting in the spool: 'posts' and
+        'readings' are the number of posts and readings, and 'oldest_age' is the number
+        of seconds since the oldest post was received (0.0 if the spool is empty).
+        """
+        posts, readings, oldest = self.conn.execute(
+            'SELECT COUNT(*), TOTAL(reading_count), MIN(received) FROM [%s]' % SPOOL_TABLE).fetchone()
+        self.conn.commit()
+        return {'posts': posts,
+                'readings': int(readings),
+                'oldest_age': time.time() - oldest if oldest is not None else 0.0}
@@ -0,0 +1,264 @@
+"""Storage engines used by the BMSdata class to lay out sensor readings in the
+SQLite Reading database.  BMSdata does not build SQL that references reading
+tables directly; it asks the storage engine of the database for the SQL.
+
+Two engines are available:
+
+    'table_per_sensor':  The original layout.  Each sensor has its own table
+        named with the Sensor ID, holding (ts, val) rows.
+    'single_table':  All readings are stored in one WITHOUT ROWID table, keyed by
+        (sensor_key, ts).  A dictionary table maps Sensor IDs to the integer
+        sensor keys.
+
+The engine used by an existing database is determined from the tables present
+in the file.  The BMSAPP_READING_DB_STORAGE setting determines the engine used
+for a new database.  The 'migrate_reading_storage' script converts a database
+from one engine to the other.
+"""
+
+TABLE_PER_SENSOR = 'table_per_sensor'
+SINGLE_TABLE = 'single_table'
+
+# Special tables that hold the data of the storage engines
+ENGINE_TABLES = {'_sensor', '_reading'}
+
+
+class TablePerSensorStorage:
+    """Stores the readings for each sensor in a table named with the Sensor ID.
+    """
+
+    name = TABLE_PER_SENSOR
+
+    def __init__(self, registry):
+        """'registry' is the object tracking the tables and sensors present in
+        the database.
+        """
+        self.registry = registry
+
+    def load_sensor_ids(self, cursor, tables):
+        """Returns the Sensor IDs present in the database, given the set of
+        table names, 'tables', present in the database.  Each table that is not a
+        special table (starting with an underbar) is a sensor.
+        """
+        return {tbl for tbl in tables if not tbl.startswith('_')}
+
+    def create_schema(self, cursor):
+        """Creates any tables used by this storage engine in an empty database.
+        """
+        pass
+
+    def source(self, sensor_id, schema=None):
+        """Returns SQL usable in a FROM clause that provides the 'ts' and 'val'
+        columns of the readings for 'sensor_id'.  If 'schema' is given, the
+        readings are read from that attached database.
+        """
+        prefix = '[%s].' % schema if schema else ''
+        return '%s[%s]' % (prefix, sensor_id)
+
+    def add_sensor(self, cursor, sensor_id):
+        """Adds storage for a new sensor with the ID 'sensor_id'.
+        """
+        cursor.execute('CREATE TABLE IF NOT EXISTS [%s] (ts integer primary key, val real)' % sensor_id)
+
+    def drop_sensor(self, cursor, sensor_id):
+        """Removes the sensor 'sensor_id' and all of its readings.
+        """
+        cursor.execute('DROP TABLE IF EXISTS [%s]' % sensor_id)
+
+    def insert_sql(self, sensor_id):
+        """Returns SQL to insert one reading for 'sensor_id'.  The parameters are
+        (ts, val).  The SQL fails if the reading already exists.
+        """
+        return 'INSERT INTO [%s] (ts, val) VALUES (?, ?)' % sensor_id
+
+    def update_sql(self, sensor_id):
+        """Returns SQL to replace the value of an existing reading for 'sensor_id'.
+        The parameters are (val, ts).
+        """
+        return 'UPDATE [%s] SET val=? WHERE ts=?' % sensor_id
+
+    def upsert_sql(self, sensor_id):
+        """Returns SQL to insert one reading for 'sensor_id', replacing the value of
+        a reading with the same timestamp.  The parameters are (ts, val).
+        """
+        return 'INSERT INTO [%s] (ts, val) VALUES (?, ?) ON CONFLICT(ts) DO UPDATE SET val=excluded.val' % sensor_id
+
+    def insert_select_sql(self, sensor_id, select_sql):
+        """Returns SQL that inserts the (ts, val) rows returned by 'select_sql' into
+        the readings for 'sensor_id'.
+        """
+        return 'INSERT INTO [%s] (ts, val) %s' % (sensor_id, select_sql)
+
+    def delete_sql(self, sensor_id, condition=None):
+        """Returns SQL that deletes the readings for 'sensor_id' meeting the SQL
+        'condition' on the 'ts' and 'val' columns, or all readings if 'condition'
+        is None.
+        """
+        sql = 'DELETE FROM [%s]' % sensor_id
+        if condition:
+            sql += ' WHERE %s' % condition
+        return sql
+
+    def count_readings(self, cursor, sensor_ids, start_ts, end_ts):
+        """Returns the number of readings for all of the sensors in 'sensor_ids' that
+        have timestamps after 'start_ts' and before 'end_ts'.
+        """
+        rec_ct = 0
+        for sensor_id in sensor_ids:
+            try:
+                cursor.execute('SELECT COUNT(*) FROM [%s] WHERE ts > ? and ts < ?' % sensor_id, (start_ts, end_ts))
+                rec_ct += cursor.fetchone()[0]
+            except:
+                # just in case a table is missing or has no 'ts' column
+                pass
+        return rec_ct
+
+
+class SingleTableStorage:
+    """Stores the readings for all sensors in the WITHOUT ROWID table '_reading',
+    keyed by (sensor_key, ts).  The '_sensor' table maps Sensor IDs to integer
+    sensor keys.  Because adding a sensor does not change the database schema, the
+    SQLite 'user_version' is incremented when sensors are added or removed so that
+    other processes know to reload the sensor list.
+    """
+
+    name = SINGLE_TABLE
+
+    def __init__(self, registry):
+        """'registry' is the object tracking the tables and sensors present in
+        the database.
+        """
+        self.registry = registry
+        self.sensor_keys = {}    # maps lower-case Sensor ID to sensor key
+
+    def load_sensor_ids(self, cursor, tables):
+        """Returns the Sensor IDs present in the database, read from the sensor
+        dictionary table.  'tables' is the set of table names in the database.
+        """
+        recs = cursor.execute('SELECT sensor_id, sensor_key FROM [_sensor]').fetchall()
+        self.sensor_keys = {rec[0].lower(): rec[1] for rec in recs}
+        return {rec[0] for rec in recs}
+
+    def create_schema(self, cursor):
+        """Creates the sensor dictionary and reading tables in an empty database.
+        """
+        cursor.execute('CREATE TABLE IF NOT EXISTS [_sensor] '
+                       '(sensor_key integer primary key, sensor_id varchar(50) NOT NULL UNIQUE COLLATE NOCASE)')
+        cursor.execute('CREATE TABLE IF NOT EXISTS [_reading] '
+                       '(sensor_key integer NOT NULL, ts integer NOT NULL, val real, '
+                       'PRIMARY KEY (sensor_key, ts)) WITHOUT ROWID')
+
+    def sensor_key(self, sensor_id, cursor=None):
+        """Returns the integer key for 'sensor_id', or None if the sensor is not in
+        the database.  If the key is not known to this process and 'cursor' is
+        provided, it is looked up in the sensor dictionary table.
+        """
+        key = self.sensor_keys.get(sensor_id.lower())
+        if key is None and cursor is not None:
+            rec = cursor.execute('SELECT sensor_key FROM [_sensor] WHERE sensor_id = ?', (sensor_id,)).fetchone()
+            if rec:
+                key = rec[0]
+                self.sensor_keys[sensor_id.lower()] = key
+        return key
+
+    def _key_sql(self, sensor_id):
+        """Returns the sensor key for 'sensor_id' as a SQL literal.  An unknown
+        sensor gives NULL, which matches no readings.
+        """
+        key = self.sensor_key(sensor_id)
+        return 'NULL' if key is None else '%d' % key
+
+    def _bump_user_version(self, cursor):
+        """Increments the SQLite user_version to signal a change in the sensor list.
+        """
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+        cursor.execute('PRAGMA user_version = %d' % (version + 1))
+
+    def source(self, sensor_id, schema=None):
+        """Returns SQL usable in a FROM clause that provides the 'ts' and 'val'
+        columns of the readings for 'sensor_id'.  If 'schema' is given, the
+        readings are read from that attached database.
+        """
+        prefix = '[%s].' % schema if schema else ''
+        return '(SELECT ts, val FROM %s[_reading] WHERE sensor_key = %s)' % (prefix, self._key_sql(sensor_id))
+
+    def add_sensor(self, cursor, sensor_id):
+        """Adds storage for a new sensor with the ID 'sensor_id'.
+        """
+        cursor.execute('INSERT OR IGNORE INTO [_sensor] (sensor_id) VALUES (?)', (sensor_id,))
+        if cursor.rowcount:
+            self._bump_user_version(cursor)
+        self.sensor_key(sensor_id, cursor)
+
+    def drop_sensor(self, cursor, sensor_id):
+        """Removes the sensor 'sensor_id' and all of its readings.
+        """
+        key = self.sensor_key(sensor_id, cursor)
+        if key is not None:
+            cursor.execute('DELETE FROM [_reading] WHERE sensor_key = ?', (key,))
+            cursor.execute('DELETE FROM [_sensor] WHERE sensor_key = ?', (key,))
+            self._bump_user_version(cursor)
+            self.sensor_keys.pop(sensor_id.lower(), None)
+
+    def insert_sql(self, sensor_id):
+        """Returns SQL to insert one reading for 'sensor_id'.  The parameters are
+        (ts, val).  The SQL fails if the reading already exists.
+        """
+        return 'INSERT INTO [_reading] (sensor_key, ts, val) VALUES (%s, ?, ?)' % self._key_sql(sensor_id)
+
+    def update_sql(self, sensor_id):
+        """Returns SQL to replace the value of an existing reading for 'sensor_id'.
+        The parameters are (val, ts).
+        """
+        return 'UPDATE [_reading] SET val=? WHERE sensor_key = %s AND ts=?' % self._key_sql(sensor_id)
+
+    def upsert_sql(self, sensor_id):
+        """Returns SQL to insert one reading for 'sensor_id', replacing the value of
+        a reading with the same timestamp.  The parameters are (ts, val).
+        """
+        return ('INSERT INTO [_reading] (sensor_key, ts, val) VALUES (%s, ?, ?) '
+                'ON CONFLICT(sensor_key, ts) DO UPDATE SET val=excluded.val' % self._key_sql(sensor_id))
+
+    def insert_select_sql(self, sensor_id, select_sql):
+        """Returns SQL that inserts the (ts, val) rows returned by 'select_sql' into
+        the readings for 'sensor_id'.
+        """
+        return ('INSERT INTO [_reading] (sensor_key, ts, val) SELECT %s, ts, val FROM (%s)'
+                % (self._key_sql(sensor_id), select_sql))
+
+    def delete_sql(self, sensor_id, condition=None):
+        """Returns SQL that deletes the readings for 'sensor_id' meeting the SQL
+        'condition' on the 'ts' and 'val' columns, or all readings if 'condition'
+        is None.
+        """
+        sql = 'DELETE FROM [_reading] WHERE sensor_key = %s' % self._key_sql(sensor_id)
+        if condition:
+            sql += ' AND (%s)' % condition
+        return sql
+
+    def count_readings(self, cursor, sensor_ids, start_ts, end_ts):
+        """Returns the number of readings for all of the sensors in 'sensor_ids' that
+        have timestamps after 'start_ts' and before 'end_ts'.
+        """
+        keys = [self.sensor_key(sensor_id) for sensor_id in sensor_ids]
+        keys = [key for key in keys if key is not None]
+        if len(keys) == len(self.sensor_keys):
+            # counting all sensors, so no need to filter on the sensor key
+            sql = 'SELECT COUNT(*) FROM [_reading] WHERE ts > ? and ts < ?'
+        else:
+            sql = 'SELECT COUNT(*) FROM [_reading] WHERE ts > ? and ts < ? AND sensor_key IN (%s)' % \
+                  ','.join(str(key) for key in keys)
+        return cursor.execute(sql, (start_ts, end_ts)).fetchone()[0]
+
+
+# Maps the storage engine names to the classes that implement them.
+ENGINES = {
+    TABLE_PER_SENSOR: TablePerSensorStorage,
+    SINGLE_TABLE: SingleTableStorage,
+}
+
+def detect_engine(tables):
+    """Returns the name of the storage engine used by a database that contains the
+    set of table names 'tables'.
+    """
+    return SINGLE_TABLE if '_reading' in tables else TABLE_PER_SENSOR
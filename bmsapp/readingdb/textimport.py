@@ -0,0 +1,214 @@
+"""Bulk import of sensor readings from delimited text files into the Reading database.
+The file is read in chunks of rows with pandas, so files of any size can be imported
+with bounded memory.  Each chunk's date/time column is parsed and converted from the
+file's time zone to Unix timestamps as a whole, and the readings of each sensor column
+are stored with one executemany() upsert per chunk.  A reading with the same sensor and
+timestamp as one already stored replaces it.  Each chunk is committed separately.
+
+The file format is described in BMSdata.import_text_file().
+"""
+import os
+import logging
+import calendar
+import warnings
+
+import pytz
+import numpy as np
+import pandas as pd
+from dateutil import parser
+from pandas.tseries.api import guess_datetime_format
+
+from . import rollup
+
+# Make a logger for this module
+_logger = logging.getLogger('bms.' + __name__)
+
+# Approximate number of cells (rows x columns) read from the file per chunk.
+CHUNK_CELLS = 2000000
+
+# Maximum number of error descriptions returned; further errors are only counted.
+MAX_ERRORS = 1000
+
+
+def _header(f):
+    """Reads lines from the binary file object 'f' up to and including the first
+    non-blank line, and returns that line decoded and the number of lines read.
+    """
+    line_count = 0
+    for raw in iter(f.readline, b''):
+        line_count += 1
+        line = raw.decode('utf-8-sig').strip()
+        if line:
+            return line, line_count
+    return None, line_count
+
+def _parse_one(datestr, tz):
+    """Returns the Unix timestamp of the date/time string 'datestr' in the time zone
+    'tz', parsed with the dateutil parser.  Raises an exception if it cannot be parsed.
+    """
+    dt = parser.parse(datestr)
+    if dt.tzinfo is None:
+        dt = tz.localize(dt)
+    return calendar.timegm(dt.utctimetuple())
+
+def _vector_format(datestr):
+    """Returns the strftime format of the date/time string 'datestr' to use to parse a
+    whole Series of similar strings at once, or None if the strings should be parsed one
+    at a time.  Only formats that read the date the way the dateutil parser does, year
+    first or month before day, or with a month name, are returned.
+    """
+    with warnings.catch_warnings():
+        # pandas warns when it finds a day first format
+        warnings.simplefilter('ignore')
+        fmt = guess_datetime_format(datestr, dayfirst=False)
+    if fmt is None:
+        return None
+    if '%b' in fmt or '%B' in fmt:
+        return fmt
+    if '%m' in fmt and '%d' in fmt and fmt.index('%m') < fmt.index('%d'):
+        return fmt
+    # e.g. a first string with a day above 12 gives a day first format
+    return None
+
+def parse_timestamps(datestrs, tz):
+    """Returns a float array of the Unix timestamps of the date/time strings in the
+    pandas Series 'datestrs', which are in the pytz time zone 'tz' unless they include
+    a UTC offset.  Elements that cannot be parsed are NaN.  The whole Series is parsed
+    at once using the format of its first element, if that format is year first or
+    month first; only the elements not matching that format, and local times that are
+    ambiguous or skipped at a DST change, are handled one at a time, with the same
+    results as the dateutil parser and pytz localize().
+    """
+    datestrs = datestrs.astype(str).str.strip()
+    result = np.full(len(datestrs), np.nan)
+    fmt = _vector_format(datestrs.iat[0]) if len(datestrs) else None
+    if fmt is None:
+        ok = np.zeros(len(datestrs), dtype=bool)
+    else:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            dts = pd.to_datetime(datestrs, format=fmt, errors='coerce')
+        if not pd.api.types.is_datetime64_any_dtype(dts):
+            # mixed UTC offsets
+            ok = np.zeros(len(dts), dtype=bool)
+        elif dts.dt.tz is None:
+            # localize as pytz does with is_dst=False: ambiguous times are standard time
+            local = dts.dt.tz_localize(tz, ambiguous=np.zeros(len(dts), dtype=bool), nonexistent='NaT')
+            ok = local.notna().values
+            result[ok] = local[ok].astype('int64').values // 10**9
+        else:
+            ok = dts.notna().values
+            result[ok] = dts[ok].dt.tz_convert('UTC').astype('int64').values // 10**9
+
+    parsed = {}     # the strings parsed one at a time often repeat
+    for i in np.flatnonzero(~ok):
+        datestr = datestrs.iat[i]
+        if datestr not in parsed:
+            try:
+                parsed[datestr] = _parse_one(datestr, tz)
+            except Exception:
+                parsed[datestr] = np.nan
+        result[i] = parsed[datestr]
+    return result
+
+def import_text_file(db, filename, tz_name='US/Alaska', delimiter=None, progress=None):
+    """Adds the sensor readings in the delimited text file 'filename' to the BMSdata
+    Reading database 'db'.  Date/time values without a UTC offset are in the 'tz_name'
+    time zone.  'delimiter' is the column separator; if None, it is a Tab if the header
+    row contains one and a comma otherwise.  'progress', if given, is called after each
+    chunk with (bytes read, file size in bytes, readings stored so far).
+    Returns a two tuple: the number of readings stored and a list of error description
+    strings.
+    """
+    tz = pytz.timezone(tz_name)
+    errors = []
+    error_count = 0
+    vals_stored = 0
+    file_size = os.path.getsize(filename)
+    first_ts = {}    # earliest timestamp stored for each sensor
+
+    with open(filename, 'rb') as f:
+        header, header_lines = _header(f)
+        if header is None:
+            return 0, errors
+        if delimiter is None:
+            delimiter = '\t' if '\t' in header else ','
+        file_sensor_ids = [fld.strip() for fld in header.split(delimiter)[1:]]
+        # the database file holding each sensor, which differ if the database is sharded
+        sensor_dbs = [db.shard_for(s_id) for s_id in file_sensor_ids]
+        new_ids = set()    # sensors that had no readings before this import
+        for s_id, s_db in zip(file_sensor_ids, sensor_dbs):
+            if not s_db.sensor_id_exists(s_id):
+                s_db.add_sensor_table(s_id)
+                new_ids.add(s_id.lower())
+        col_count = len(file_sensor_ids) + 1
+
+        reader = pd.read_csv(f, sep=delimiter, header=None, names=range(col_count), usecols=range(col_count),
+                             index_col=False, dtype={0: str}, skip_blank_lines=False, skipinitialspace=True,
+                             chunksize=max(1000, CHUNK_CELLS // col_count))
+        for chunk in reader:
+            # drop blank lines; the row index counts the lines after the header
+            chunk = chunk[chunk[0].notna().values]
+            if len(chunk) == 0:
+                continue
+            line_nums = chunk.index.values + header_lines + 1
+
+            ts = parse_timestamps(chunk[0], tz)
+            bad_ts = np.isnan(ts)
+            for i in np.flatnonzero(bad_ts):
+                error_count += 1
+                if len(errors) < MAX_ERRORS:
+                    errors.append('Problem parsing date %s at line %s' % (chunk[0].iat[i], line_nums[i]))
+            ts_int = np.where(bad_ts, 0, ts).astype(np.int64)
+
+            # readings newer than the last stored one need no duplicate check
+            last_ts = {s_id: -1 for s_id in new_ids}
+            for s_db in db.shard_dbs():
+                last_ts.update(s_db._last_stored_ts(file_sensor_ids))
+            stats = {}    # new reading statistics for each database file
+            for col, (s_id, s_db) in enumerate(zip(file_sensor_ids, sensor_dbs), start=1):
+                raw = chunk[col]
+                vals = pd.to_numeric(raw, errors='coerce').values.astype(float)
+                if raw.dtype == object:
+                    bad = np.flatnonzero(raw.notna().values & np.isnan(vals) & ~bad_ts &
+                                         (raw.astype(str).str.strip().str.lower() != 'nan').values)
+                    for i in bad:
+                        error_count += 1
+                        if len(errors) < MAX_ERRORS:
+                            errors.append('Problem storing %s: %s=%s at line %s: value is not numeric' %
+                                          (chunk[0].iat[i], s_id, raw.iat[i], line_nums[i]))
+                # NaN and infinite values are not stored
+                keep = np.isfinite(vals) & ~bad_ts
+                if not keep.any():
+                    continue
+                rows = list(zip(ts_int[keep].tolist(), vals[keep].tolist()))
+                try:
+                    new_count = s_db._new_reading_count(s_id, rows, last_ts.get(s_id.lower()))
+                    s_db.cursor.executemany(s_db.storage.upsert_sql(s_id), rows)
+                except Exception as e:
+                    error_count += len(rows)
+                    if len(errors) < MAX_ERRORS:
+                        errors.append('Problem storing %s readings for %s at lines %s-%s: %s' %
+                                      (len(rows), s_id, line_nums[0], line_nums[-1], e))
+                    continue
+                vals_stored += len(rows)
+                min_ts, max_ts = int(ts_int[keep].min()), int(ts_int[keep].max())
+                stats.setdefault(s_db, []).append((s_id, new_count, min_ts, max_ts))
+                first_ts[s_id] = min(min_ts, first_ts.get(s_id, min_ts))
+
+            for s_db, recs in stats.items():
+                s_db._update_stats(recs)
+            db.commit()
+            if progress:
+                progress(f.tell(), file_size, vals_stored)
+
+    for s_id, s_db in zip(file_sensor_ids, sensor_dbs):
+        s_db.refresh_latest(s_id, commit=False)
+        if s_id in first_ts:
+            rollup.mark_dirty(s_db, [(s_id, first_ts[s_id])])
+    db.commit()
+
+    if error_count > len(errors):
+        errors.append('%s more errors not listed.' % (error_count - len(errors)))
+    _logger.info('Imported %s readings from %s with %s errors.' % (vals_stored, filename, error_count))
+    return vals_stored, errors
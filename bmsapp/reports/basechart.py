@@ -169,7 +169,7 @@ class BaseChart(object):
 
         # open the reading database and save it for use by the methods of this object.
         # It is closed automatically in the destructor of the BMSdata class.
-        self.reading_db = bmsapp.readingdb.bmsdata.BMSdata()
+        self.reading_db = bmsapp.readingdb.bmsdata.BMSdata(read_only=True)
 
     def get_ts_range(self):
         """
@@ -25,13 +25,16 @@ class CurrentValues(basechart.BaseChart):
         cur_group_sensor_list = []
         sensor_list = []
         cur_time = time.time()   # needed for calculating how long ago reading occurred
-        for b_to_sen in self.building.bldgtosensor_set.all():
+        bldg_to_sensors = list(self.building.bldgtosensor_set.all())
+        # get the last reading of all the sensors with one query
+        last_reads = self.reading_db.last_reads([b_to_sen.sensor.sensor_id for b_to_sen in bldg_to_sensors])
+        for b_to_sen in bldg_to_sensors:
             if b_to_sen.sensor_group.title != cur_group:
                 if cur_group:
                     sensor_list.append((cur_group, cur_group_sensor_list))
                 cur_group = b_to_sen.sensor_group.title
                 cur_group_sensor_list = []
-            last_read = b_to_sen.sensor.last_read(self.reading_db)
+            last_read = last_reads[b_to_sen.sensor.sensor_id]
             format_function = b_to_sen.sensor.format_func()
             cur_value = format_function(last_read['val']) if last_read else ''
             minutes_ago = '%.1f' % (
@@ -40,8 +40,11 @@ class CurrentValuesMulti(basechart.BaseChart):
             #   (sensor name, most recent value, units, how many minutes ago value occurred)
             building_sensor_list = []
 
-            for b_to_sen in bldg_info.building.bldgtosensor_set.filter(sensor__sensor_id__in=sensors):
-                last_read = b_to_sen.sensor.last_read(self.reading_db)
+            bldg_to_sensors = list(bldg_info.building.bldgtosensor_set.filter(sensor__sensor_id__in=sensors))
+            # get the last reading of all the sensors with one query
+            last_reads = self.reading_db.last_reads([b_to_sen.sensor.sensor_id for b_to_sen in bldg_to_sensors])
+            for b_to_sen in bldg_to_sensors:
+                last_read = last_reads[b_to_sen.sensor.sensor_id]
                 format_function = b_to_sen.sensor.format_func()
                 cur_value = format_function(last_read['val']) if last_read else ''
                 minutes_ago = '%.1f' % ((cur_time - last_read['ts'])/60.0) if last_read else ''
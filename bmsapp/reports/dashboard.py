@@ -67,13 +67,13 @@ class Dashboard(basechart.BaseChart):
                 except Exception as e:
                     pass
 
-                db_recs = self.reading_db.rowsForOneID(dash_item.sensor.sensor.sensor_id, minTime, maxTime)
+                db_ts, db_vals = self.reading_db.arraysForOneID(dash_item.sensor.sensor.sensor_id, minTime, maxTime)
 
-                if db_recs:
-                    for rec in db_recs:
-                        times.append(datetime.fromtimestamp(rec['ts'],tz).strftime('%Y-%m-%d %H:%M:%S'))
-                        values.append(bmsapp.data_util.round4(rec['val']))
-                        labels.append(datetime.fromtimestamp(rec['ts'],tz).strftime('%I:%M %p').lstrip('0') + '</br>' + format_function(rec['val']) + ' ' + dash_item.sensor.sensor.unit.label)
+                if len(db_ts):
+                    for ts, val in zip(db_ts.tolist(), db_vals.tolist()):
+                        times.append(datetime.fromtimestamp(ts,tz).strftime('%Y-%m-%d %H:%M:%S'))
+                        values.append(bmsapp.data_util.round4(val))
+                        labels.append(datetime.fromtimestamp(ts,tz).strftime('%I:%M %p').lstrip('0') + '</br>' + format_function(val) + ' ' + dash_item.sensor.sensor.unit.label)
                     minAxis = min(minAxis, min(values))
                     maxAxis = max(maxAxis, max(values))
                     if dash_item.sensor.sensor.unit.label not in ['code','1=On 0=Off']:
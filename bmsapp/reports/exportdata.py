@@ -55,10 +55,14 @@ class ExportData(basechart.BaseChart):
             # determine the start time for selecting records and make a DataFrame from
             # the records
             st_ts, end_ts = self.get_ts_range()
-            df_new = self.reading_db.dataframeForOneID(sensor.sensor_id, st_ts, end_ts, self.timezone)
-            if not df_new.empty:
-                if averaging_hours > 0:
+            df_new = None
+            if averaging_hours > 0:
+                df_new = bmsapp.data_util.resample_from_rollups(self.reading_db, sensor.sensor_id, averaging_hours, st_ts, end_ts, self.timezone)
+            if df_new is None:
+                df_new = self.reading_db.dataframeForOneID(sensor.sensor_id, st_ts, end_ts, self.timezone)
+                if not df_new.empty and averaging_hours > 0:
                     df_new = bmsapp.data_util.resample_timeseries(df_new, averaging_hours)
+            if not df_new.empty:
                 df_new.drop('ts', axis=1, inplace=True) # drop the timestamp column
                 df_new.rename(columns = {'val': 'col%03d' % col}, inplace = True) # rename the value column
 
@@ -53,13 +53,23 @@ class NormalizedByDDbyFt2(basechart.BaseChart):
         group_id = int(self.request_params['select_group'])
         bldgs = bmsapp.view_util.buildings_for_group(group_id)
         
-        # loop through the buildings determining the Btu/ft2/dd for each building
-        for bldg_info in self.chart_info.chartbuildinginfo_set.filter(building__in=bldgs):
+        # get the name and the parameters associated with each building
+        bldg_list = [(bldg_info.building.title, yaml.load(bldg_info.parameters, Loader=yaml.FullLoader))
+                     for bldg_info in self.chart_info.chartbuildinginfo_set.filter(building__in=bldgs)]
+
+        # The sensor statistics give an upper bound on the span of each sensor's readings
+        # in the interval, without reading the readings.
+        coverage = self.reading_db.coverage([bldg_params[key] for _, bldg_params in bldg_list
+                                             for key in ('id_value', 'id_out_temp')], st_ts, end_ts)
 
-            bldg_name = bldg_info.building.title   # get the building name
+        # loop through the buildings determining the Btu/ft2/dd for each building
+        for bldg_name, bldg_params in bldg_list:
 
-            # get the parameters associated with this building
-            bldg_params = yaml.load(bldg_info.parameters, Loader=yaml.FullLoader)
+            # skip buildings whose readings cannot pass the 80% span test below.  Hourly
+            # averaging can add up to an hour to the span.
+            span = min(coverage[str(bldg_params[key])]['span'] for key in ('id_value', 'id_out_temp'))
+            if (span + 3600) / float(end_ts - st_ts) < 0.8:
+                continue
 
             # get the value records and average into one hour intervals
             df = self.reading_db.dataframeForOneID(bldg_params['id_value'], st_ts, end_ts, self.timezone)
@@ -43,30 +43,35 @@ class NormalizedByFt2(basechart.BaseChart):
         group_id = int(self.request_params['select_group'])
         bldgs = bmsapp.view_util.buildings_for_group(group_id)
         
-        # loop through the buildings determining the value per ft2 for each building
-        for bldg_info in self.chart_info.chartbuildinginfo_set.filter(building__in=bldgs):
+        # get the name and the parameters associated with each building
+        bldg_list = [(bldg_info.building.title, yaml.load(bldg_info.parameters, Loader=yaml.FullLoader))
+                     for bldg_info in self.chart_info.chartbuildinginfo_set.filter(building__in=bldgs)]
+
+        # The sensor statistics give an upper bound on the span of each value sensor's
+        # readings in the interval, without reading the readings.
+        coverage = self.reading_db.coverage([bldg_params['id_value'] for _, bldg_params in bldg_list], st_ts, end_ts)
 
-            bldg_name = bldg_info.building.title   # get the building name
+        # loop through the buildings determining the value per ft2 for each building
+        for bldg_name, bldg_params in bldg_list:
 
-            # get the parameters associated with this building
-            bldg_params = yaml.load(bldg_info.parameters, Loader=yaml.FullLoader)
+            # skip buildings whose readings cannot pass the 80% span test below
+            if coverage[str(bldg_params['id_value'])]['span'] / float(end_ts - st_ts) < 0.8:
+                continue
 
             # get the value records
-            db_recs = self.reading_db.rowsForOneID(bldg_params['id_value'], st_ts, end_ts)
-            if len(db_recs)==0:
+            db_ts, db_vals = self.reading_db.arraysForOneID(bldg_params['id_value'], st_ts, end_ts)
+            if len(db_ts)==0:
                 continue
 
             # make sure the data spans at least 80% of the requested interval.
             # if not, skip this building.
-            actual_span = db_recs[-1]['ts'] - db_recs[0]['ts']
+            actual_span = db_ts[-1] - db_ts[0]
             if actual_span / float(end_ts - st_ts) < 0.8:
                 continue
 
-            # make a list of the values
-            val_list = [rec['val'] for rec in db_recs]
-            ct = len(val_list)
+            ct = len(db_vals)
             if ct > 0:
-                normalized_val = sum(val_list) / float(ct) / bldg_params['floor_area'] * multiplier
+                normalized_val = db_vals.mean() / bldg_params['floor_area'] * multiplier
                 bldg_names.append(bldg_name)
                 values.append( round( normalized_val, 2) )
 
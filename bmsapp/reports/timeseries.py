@@ -50,12 +50,19 @@ class TimeSeries(basechart.BaseChart):
         line_width = 1 if len(sensor_list) > 1 else 2
         for sensor in sensor_list:
 
-            # get the database records
-            df = self.reading_db.dataframeForOneID(sensor.sensor_id, st_ts, end_ts,tz)
+            # long averaging periods are served from the hourly and daily rollups, if possible.
+            # The rollups hold each value until the next reading, as used for state sensors;
+            # other sensors are averaged from the raw readings with linear interpolation.
+            df = None
+            if averaging_hours and not use_rolling_averaging and sensor.unit.measure_type == 'state':
+                df = bmsapp.data_util.resample_from_rollups(self.reading_db, sensor.sensor_id, averaging_hours, st_ts, end_ts, tz, drop_na=False)
+
+            if df is None:
+                # get the database records
+                df = self.reading_db.dataframeForOneID(sensor.sensor_id, st_ts, end_ts,tz)
 
-            if not df.empty:
                 # perform average (if requested)
-                if averaging_hours:
+                if not df.empty and averaging_hours:
                     if sensor.unit.measure_type == 'state':
                         # if the sensor has defined states
                         interp_method = 'pad'
@@ -63,6 +70,7 @@ class TimeSeries(basechart.BaseChart):
                         interp_method = 'linear'
                     df = bmsapp.data_util.resample_timeseries(df,averaging_hours,use_rolling_averaging,drop_na=False,interp_method=interp_method)
 
+            if not df.empty:
                 # limit the number of points to plot
                 df = bmsapp.data_util.decimate_timeseries(df, bin_count=1000,col='val')
 
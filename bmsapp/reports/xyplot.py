@@ -40,16 +40,22 @@ class XYplot(basechart.BaseChart):
         # The list that will hold each series
         series = []
 
-        # get the X and Y sensor records and perform the requested averaging
-        dfX = self.reading_db.dataframeForOneID(sensorX.sensor_id, st_ts, end_ts, tz)
-        dfY = self.reading_db.dataframeForOneID(sensorY.sensor_id, st_ts, end_ts, tz)
+        # get the X and Y sensor records averaged as requested, from the rollups if possible
+        dfX = bmsapp.data_util.resample_from_rollups(self.reading_db, sensorX.sensor_id, averaging_hours, st_ts, end_ts, tz)
+        dfY = bmsapp.data_util.resample_from_rollups(self.reading_db, sensorY.sensor_id, averaging_hours, st_ts, end_ts, tz)
+        if dfX is None:
+            dfX = self.reading_db.dataframeForOneID(sensorX.sensor_id, st_ts, end_ts, tz)
+            if not dfX.empty:
+                dfX = bmsapp.data_util.resample_timeseries(dfX,averaging_hours)
+        if dfY is None:
+            dfY = self.reading_db.dataframeForOneID(sensorY.sensor_id, st_ts, end_ts, tz)
+            if not dfY.empty:
+                dfY = bmsapp.data_util.resample_timeseries(dfY,averaging_hours)
 
         if not dfX.empty and not dfY.empty:  # both sensors have some data, so proceed to average the data points
             
-            dfX = bmsapp.data_util.resample_timeseries(dfX,averaging_hours)
             dfX.rename(columns = {'val':'X'}, inplace = True)
 
-            dfY = bmsapp.data_util.resample_timeseries(dfY,averaging_hours)
             dfY.rename(columns = {'val':'Y','ts':'tsY'}, inplace = True)
 
             # Join the X and Y values for the overlapping time intervals and make
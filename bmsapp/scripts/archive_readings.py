@@ -0,0 +1,33 @@
+"""Script to move old readings from the BMS sensor reading database to the
+Parquet archive (see bmsapp/readingdb/archive.py).  Readings older than the
+BMSAPP_READING_ARCHIVE_DAYS setting are archived; nothing is done if that
+setting is None.  This script is run via django-extensions runscript facility:
+
+    manage.py runscript archive_readings
+
+This script is also called from the main_cron.py script.
+"""
+import logging
+
+from django.conf import settings
+
+import bmsapp.readingdb.bmsdata
+from bmsapp.readingdb import archive
+
+# Make a logger for this module
+_logger = logging.getLogger('bms.' + __name__)
+
+def run():
+    '''Method called by runscript.
+    '''
+    age_days = getattr(settings, 'BMSAPP_READING_ARCHIVE_DAYS', None)
+    if age_days is None:
+        return
+    db = bmsapp.readingdb.bmsdata.BMSdata()
+    sensor_count = reading_count = 0
+    for shard_db in db.shard_dbs():
+        n_sensors, n_readings = archive.archive_readings(shard_db, age_days)
+        sensor_count += n_sensors
+        reading_count += n_readings
+    db.close()
+    _logger.info('%s readings from %s sensors moved to the archive.' % (reading_count, sensor_count))
@@ -4,15 +4,35 @@ This script is run via django-extensions runscript facility:
 
     manage.py runscript backup_readingdb
 
+To store only the database pages changed since the last full backup, pass the
+'incremental' argument:
+
+    manage.py runscript backup_readingdb --script-args incremental
+
 This script is also called from the main_cron.py script.
 """ 
+import logging
+
 import bmsapp.readingdb.bmsdata
 
+# Make a logger for this module
+_logger = logging.getLogger('bms.' + __name__)
+
 DAYS_TO_RETAIN = 10   # days of old backup files to retain
 
-def run():
-    '''Method called by runscript.
+def summary(stats):
+    '''Returns a one line description of the backup described by the statistics
+    dictionary 'stats' returned by BMSdata.backup_db().
+    '''
+    return ('{kind} backup of {db_mb:,.1f} MB in {seconds:.1f} s ({mb_per_sec:,.1f} MB/s; snapshot {snapshot_seconds:.1f} s, '
+            'compression {compress_seconds:.1f} s): {pages_stored:,} pages stored, {compressed_mb:,.1f} MB written to {file}'.format(
+                db_mb=stats['db_bytes'] / 1e6, compressed_mb=stats['compressed_bytes'] / 1e6, **stats))
+
+def run(*args):
+    '''Method called by runscript.  Returns the backup statistics dictionary.
     '''
     db = bmsapp.readingdb.bmsdata.BMSdata()
-    db.backup_db(DAYS_TO_RETAIN)
+    stats = db.backup_db(DAYS_TO_RETAIN, incremental='incremental' in args)
     db.close()
+    _logger.info(summary(stats))
+    return stats
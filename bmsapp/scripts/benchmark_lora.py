@@ -0,0 +1,45 @@
+"""Script to benchmark decoding LoRaWAN sensor payloads with the decoders in
+bmsapp/lora.  This script is run via django-extensions runscript facility:
+
+    manage.py runscript benchmark_lora
+
+Results are printed to the console.  The shared helpers are in benchmark_readingdb.py.
+"""
+from bmsapp.lora import decoder, decode_dragino, decode_elsys
+from bmsapp.scripts.benchmark_readingdb import timed, run_benchmarks
+
+
+def bench_lora(work_dir, uplink_count=100000):
+    """Times decoding 'uplink_count' raw LoRaWAN payloads from the sample payloads in
+    the decoder modules, one uplink at a time through decode_fields() and for each
+    device at once through decode_payloads().
+    """
+    samples = (
+        ('lht65-bench', 2, [bytes.fromhex(dta) for dta, _ in decode_dragino.TEST_LHT65_CASES]),
+        ('ldds-bench', 2, [bytes.fromhex('0CF00ABC')]),
+        ('boat-lt2-bench', 2, [bytes.fromhex(dta) for dta in decode_dragino.TEST_BOAT_LT2_CASES]),
+        ('lsn50-bench', 2, [bytes.fromhex(dta) for dta in decode_dragino.TEST_LSN50_CASES]),
+        ('elsys-bench', 5, [bytes.fromhex(decode_elsys.TEST_PAYLOAD)]),
+    )
+    per_device = uplink_count // len(samples)
+    uplinks = [(dev_id, port, [payloads[i % len(payloads)] for i in range(per_device)])
+               for dev_id, port, payloads in samples]
+    print('LoRa decoding: %s uplinks per device type' % per_device)
+    for dev_id, port, payloads in uplinks:
+        single_secs, single = timed(lambda: [decoder.decode_fields(dev_id, port, p, {}) for p in payloads])
+        batch_secs, batch = timed(decoder.decode_payloads, dev_id, port, payloads)
+        assert single == batch
+        print('  %-15s one at a time %7.3f s  %9.0f/s   batch %7.3f s  %9.0f/s' %
+              (dev_id, single_secs, per_device / single_secs, batch_secs, per_device / batch_secs))
+
+
+BENCHMARKS = {
+    'decode': bench_lora,
+}
+
+
+def run(*args):
+    '''Method called by runscript.  'args' are the names of the benchmarks
+    to run; all are run if none are given.
+    '''
+    run_benchmarks(BENCHMARKS, args)
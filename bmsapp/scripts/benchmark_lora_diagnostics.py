@@ -0,0 +1,146 @@
+"""Script to benchmark storing and querying the LoRa gateway diagnostics in
+bmsapp/lora_diagnostics.  The benchmarks use temporary DuckDB files, so the
+production diagnostic database is not touched.  This script is run via
+django-extensions runscript facility:
+
+    manage.py runscript benchmark_lora_diagnostics
+
+Arguments can be passed to select particular benchmarks, for example:
+
+    manage.py runscript benchmark_lora_diagnostics --script-args writer
+
+Results are printed to the console.  The shared helpers are in benchmark_readingdb.py.
+"""
+import os
+import time
+
+import pandas as pd
+
+from bmsapp.scripts.benchmark_readingdb import timed, run_benchmarks
+
+
+def bench_lora_diag(work_dir, uplink_count=20000, gateway_count=2):
+    """Compares storing the gateway diagnostics of 'uplink_count' uplinks, each heard
+    by 'gateway_count' gateways, through the rotating gateway log file followed by a
+    COPY into DuckDB, with the in-memory DiagnosticsWriter.  Reports the time spent
+    in the request path and the total time until the records are in the database.
+    """
+    import logging
+    import duckdb
+    from concurrent_log_handler import ConcurrentTimedRotatingFileHandler
+    from bmsapp.lora_diagnostics import db_connect, things_parser, partitions, writer
+
+    gateways = [{'gateway_ids': {'gateway_id': 'gtw-%d' % i}, 'snr': 9.5, 'rssi': -80 - i}
+                for i in range(gateway_count)]
+    payloads = [{'end_device_ids': {'dev_eui': 'A81758FFFE%06X' % (i % 500)},
+                 'received_at': '2024-02-22T19:16:42.%06dZ' % i,
+                 'uplink_message': {'f_cnt': i, 'rx_metadata': gateways,
+                                    'settings': {'data_rate': {'lora': {'spreading_factor': 7, 'bandwidth': 125000}}}}}
+                for i in range(uplink_count)]
+    record_count = uplink_count * gateway_count
+
+    orig_db_path = db_connect.db_path
+    db_connect.db_path = os.path.join(work_dir, 'things.db')
+    try:
+        print('LoRa diagnostics: %s uplinks, %s gateway records' % (uplink_count, record_count))
+
+        # log file path
+        logger = logging.getLogger('bench_gateway_logger')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        log_file = os.path.join(work_dir, 'gtw.log')
+        handler = ConcurrentTimedRotatingFileHandler(filename=log_file, mode='a', when='M', interval=5)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        start = time.perf_counter()
+        for payload in payloads:
+            for rec in things_parser.parse_uplink_gateway_diagnostics(payload):
+                logger.info(rec)
+        request_secs = time.perf_counter() - start
+        logger.removeHandler(handler)
+        handler.close()
+        with db_connect.get_rw_db_conn() as conn:
+            partitions.prepare(conn)
+            partitions.store_records(conn, "COPY {table} FROM '%s';" % log_file)
+        total_secs = time.perf_counter() - start
+        print('  log file + COPY   request path %7.3f s (%6.1f us/uplink)   total %7.3f s' %
+              (request_secs, request_secs / uplink_count * 1e6, total_secs))
+
+        # buffered writer
+        fallback = []
+        diag_writer = writer.DiagnosticsWriter(fallback.extend)
+        start = time.perf_counter()
+        for payload in payloads:
+            diag_writer.put(things_parser.parse_uplink_gateway_records(payload))
+        request_secs = time.perf_counter() - start
+        diag_writer.close()
+        total_secs = time.perf_counter() - start
+        print('  buffered writer   request path %7.3f s (%6.1f us/uplink)   total %7.3f s   (%s to fallback)' %
+              (request_secs, request_secs / uplink_count * 1e6, total_secs, len(fallback)))
+
+        with duckdb.connect(db_connect.db_path, read_only=True) as conn:
+            stored = conn.execute('SELECT COUNT(*) FROM gateway').fetchone()[0]
+        assert stored == 2 * record_count - len(fallback)
+    finally:
+        db_connect.db_path = orig_db_path
+
+
+def bench_lora_partitions(work_dir, record_count=3000000, gateway_count=50, day_count=120):
+    """Compares the single gateway table of the LoRa diagnostic database with the day
+    partitioned tables: removing records older than the retention period, and the
+    inoperative gateway and gateway location queries.  'record_count' records from
+    'gateway_count' gateways are spread over the last 'day_count' days.
+    """
+    import duckdb
+    from bmsapp.lora_diagnostics import db_sql, partitions
+
+    load_sql = f"""
+        INSERT INTO {{table}}
+        SELECT now() - to_seconds(i * {day_count * 86400 / record_count}), 'EUI' || (i % 500), i,
+               'gtw-' || (i % {gateway_count}), 9.5, -40 - (i * 7919) % 80, 'SF7BW125'
+        FROM range({record_count}) t(i)
+    """
+    eui_to_bldgs = pd.DataFrame({'device_eui': ['EUI%d' % i for i in range(0, 500, 3)]})
+    eui_to_bldgs['building_list'] = 'Building ' + eui_to_bldgs['device_eui']
+    location_sql = db_sql.sql_gtw_to_bldg.format(recent_gateway='{source}', recent_records=db_sql.GTW_RECENT_RECORDS) + \
+        "SELECT gateway_id, building_list FROM gtw_to_bldg ORDER BY gateway_id"
+    inoperative_sql = "SELECT gateway_id, now() - max({ts}) AS time_since_last FROM {source} GROUP BY gateway_id " \
+                      "HAVING time_since_last > INTERVAL '1 hours'"
+    print('LoRa diagnostic partitions: %s records, %s gateways, %s days' % (record_count, gateway_count, day_count))
+
+    with duckdb.connect(os.path.join(work_dir, 'things_single.db')) as conn:
+        conn.execute(f"CREATE TABLE gateway ({partitions.GATEWAY_COLUMNS_SQL})")
+        conn.execute(load_sql.format(table='gateway'))
+        conn.register('eui_to_bldgs', eui_to_bldgs)
+        delete_secs, _ = timed(conn.execute, f"DELETE FROM gateway WHERE ts < now() - INTERVAL '{partitions.DB_RETENTION} days'")
+        inop_secs, _ = timed(lambda: conn.sql(inoperative_sql.format(ts='ts', source='gateway')).df())
+        loc_secs, single_loc = timed(lambda: conn.sql(location_sql.format(source='SELECT * FROM gateway')).df())
+    print('  single table   retention %7.3f s   inoperative %6.3f s   location %6.3f s' % (delete_secs, inop_secs, loc_secs))
+
+    with duckdb.connect(os.path.join(work_dir, 'things_days.db')) as conn:
+        partitions.prepare(conn)
+        partitions.store_records(conn, load_sql)
+        conn.register('eui_to_bldgs', eui_to_bldgs)
+        drop_secs, _ = timed(partitions.drop_old_partitions, conn)
+        inop_secs, _ = timed(lambda: conn.sql(inoperative_sql.format(ts='last_ts', source='gateway_daily')).df())
+
+        def location():
+            cutoff = conn.execute(db_sql.sql_recent_cutoff).fetchone()[0]
+            days = [day for day in partitions.partitions(conn) if day >= cutoff]
+            return conn.sql(location_sql.format(source=partitions.union_sql(days))).df()
+        loc_secs, days_loc = timed(location)
+    print('  day tables     retention %7.3f s   inoperative %6.3f s   location %6.3f s' % (drop_secs, inop_secs, loc_secs))
+    print('  same gateway locations: %s' % single_loc['gateway_id'].equals(days_loc['gateway_id']))
+
+
+BENCHMARKS = {
+    'writer': bench_lora_diag,
+    'partitions': bench_lora_partitions,
+}
+
+
+def run(*args):
+    '''Method called by runscript.  'args' are the names of the benchmarks
+    to run; all are run if none are given.
+    '''
+    run_benchmarks(BENCHMARKS, args)
@@ -0,0 +1,65 @@
+"""Script to benchmark decoding Notehub posts (see bmsapp/notehub.py) and storing
+their readings in a temporary Reading database.  This script is run via
+django-extensions runscript facility:
+
+    manage.py runscript benchmark_notehub
+
+Results are printed to the console.  The shared helpers are in benchmark_readingdb.py.
+"""
+import os
+import tracemalloc
+
+import bmsapp.readingdb.bmsdata as bmsdata
+from bmsapp import notehub
+from bmsapp import storereads
+from bmsapp.scripts.benchmark_readingdb import SENSOR_COUNT, make_readings, timed, run_benchmarks
+
+
+def bench_notehub(work_dir, reading_count=50000):
+    """Compares decoding a Notehub post of 'reading_count' readings in the
+    'ts_id_val_bz2' reading type, a Python literal evaluated with ast.literal_eval,
+    with the 'ts_id_val_csv_bz2' reading type that is parsed into arrays, and then
+    storing the readings in a new database.  Reports the time and the peak memory
+    allocated while decoding.
+    """
+    import base64
+    import bz2
+
+    ts, ids, vals = make_readings(reading_count)
+    ts, ids, vals = [int(t) for t in ts], [str(i) for i in ids], [round(float(val), 3) for val in vals]
+    posts = (
+        ('literal', 'ts_id_val_bz2', str([[t, i, v] for t, i, v in zip(ts, ids, vals)])),
+        ('csv', 'ts_id_val_csv_bz2', ''.join('%s,%s,%s\n' % reading for reading in zip(ts, ids, vals))),
+    )
+    print('Notehub posts: %s readings, %s sensors' % (reading_count, SENSOR_COUNT))
+    for label, reading_type, text in posts:
+        req_data = {'reading_type': reading_type,
+                    'readings': base64.b64encode(bz2.compress(text.encode('utf-8'))).decode('ascii')}
+        if reading_type in notehub.ARRAY_READING_TYPES:
+            decode = notehub.extract_reading_arrays
+            store = lambda arrays, db: storereads.store_arrays(*arrays, db=db)
+        else:
+            decode = notehub.extract_readings
+            store = lambda readings, db: storereads.store_raw_readings(
+                storereads.parse_readings({'readings': readings}), db)
+        tracemalloc.start()
+        decode_secs, decoded = timed(decode, req_data)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        db = bmsdata.BMSdata(os.path.join(work_dir, 'notehub_%s.sqlite' % label))
+        store_secs, msg = timed(store, decoded, db)
+        db.close()
+        print('  %-8s %7.0f kB posted   decode %6.3f s  %7.1f MB peak   store %6.3f s  (%s)' %
+              (label, len(req_data['readings']) / 1000, decode_secs, peak / 1e6, store_secs, msg))
+
+
+BENCHMARKS = {
+    'decode': bench_notehub,
+}
+
+
+def run(*args):
+    '''Method called by runscript.  'args' are the names of the benchmarks
+    to run; all are run if none are given.
+    '''
+    run_benchmarks(BENCHMARKS, args)
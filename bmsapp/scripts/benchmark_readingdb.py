@@ -0,0 +1,691 @@
+"""Script to benchmark operations on the sensor reading database.  The benchmarks
+are run against temporary database files, so the production reading database is
+not touched.  This script is run via django-extensions runscript facility:
+
+    manage.py runscript benchmark_readingdb
+
+Arguments can be passed to select particular benchmarks, for example:
+
+    manage.py runscript benchmark_readingdb --script-args insert
+
+Results are printed to the console.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+import bmsapp.readingdb.bmsdata as bmsdata
+from bmsapp.readingdb import storage
+from bmsapp.readingdb import rollup
+from bmsapp.readingdb import backup
+from bmsapp.scripts import backup_readingdb
+from bmsapp import data_util
+from bmsapp import models
+from bmsapp import storereads
+from bmsapp.calcs import transforms
+
+SENSOR_COUNT = 500     # number of sensors the benchmark readings are spread across
+
+
+def make_readings(reading_count, sensor_count=SENSOR_COUNT):
+    """Returns lists of timestamps, sensor IDs and values for 'reading_count' readings
+    spread evenly across 'sensor_count' sensors.  Each sensor gets readings spaced 5
+    minutes apart.
+    """
+    ids = ['bench_%03d' % (i % sensor_count) for i in range(reading_count)]
+    ts = [1500000000 + (i // sensor_count) * 300 for i in range(reading_count)]
+    vals = list(np.random.random(reading_count) * 100.0)
+    return ts, ids, vals
+
+
+def timed(func, *args):
+    """Runs func(*args) and returns the elapsed seconds and the function result.
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def bench_insert(work_dir):
+    """Compares the row-by-row insert_reading() path with the batched
+    insert_reading_batch() path.
+    """
+    print('Insert: row-by-row vs. batched upsert, %s sensors' % SENSOR_COUNT)
+    for reading_count in (10000, 100000, 1000000):
+        ts, ids, vals = make_readings(reading_count)
+        for method_name in ('insert_reading', 'insert_reading_batch'):
+            db = bmsdata.BMSdata(os.path.join(work_dir, '%s_%s.sqlite' % (method_name, reading_count)))
+            secs, msg = timed(getattr(db, method_name), ts, ids, vals)
+            db.close()
+            print('  %9d readings  %-22s %8.2f s  %10.0f readings/s  (%s)' %
+                  (reading_count, method_name, secs, reading_count / secs, msg))
+
+
+def bench_contention(work_dir, reader_count=4, writer_count=2, duration=10.0):
+    """Runs concurrent reader and writer threads against one database for 'duration'
+    seconds, first in the rollback journal mode and then in WAL mode.  Readers fetch
+    a day of readings for a random sensor; writers store batches of 500 readings.
+    """
+    print('Contention: %s readers, %s writers, %.0f s per journal mode' % (reader_count, writer_count, duration))
+    save_mode = getattr(settings, 'BMSAPP_READING_DB_JOURNAL_MODE', 'WAL')
+    for journal_mode in ('DELETE', 'WAL'):
+        settings.BMSAPP_READING_DB_JOURNAL_MODE = journal_mode
+        fname = os.path.join(work_dir, 'contention_%s.sqlite' % journal_mode)
+
+        # seed the database with 100k readings
+        db = bmsdata.BMSdata(fname)
+        ts, ids, vals = make_readings(100000)
+        db.insert_reading_batch(ts, ids, vals)
+        db.close()
+        last_ts = ts[-1]
+
+        read_times = []
+        write_times = []
+        errors = []
+        stop = threading.Event()
+
+        def reader():
+            rdb = bmsdata.BMSdata(fname, read_only=True)
+            while not stop.is_set():
+                sensor_id = 'bench_%03d' % np.random.randint(SENSOR_COUNT)
+                try:
+                    secs, _ = timed(rdb.rowsForOneID, sensor_id, last_ts - 86400, last_ts)
+                    read_times.append(secs)
+                except Exception as e:
+                    errors.append(e)
+            rdb.close()
+            bmsdata.close_connections()
+
+        def writer(writer_num):
+            wdb = bmsdata.BMSdata(fname)
+            batch = 0
+            while not stop.is_set():
+                batch += 1
+                start_ts = last_ts + (batch * writer_count + writer_num) * 300
+                w_ts = [start_ts] * 500
+                w_ids = ['bench_%03d' % i for i in range(500)]
+                try:
+                    secs, _ = timed(wdb.insert_reading_batch, w_ts, w_ids, list(np.random.random(500)))
+                    write_times.append(secs)
+                except Exception as e:
+                    errors.append(e)
+            wdb.close()
+            bmsdata.close_connections()
+
+        threads = [threading.Thread(target=reader) for i in range(reader_count)]
+        threads += [threading.Thread(target=writer, args=(i,)) for i in range(writer_count)]
+        for t in threads:
+            t.start()
+        time.sleep(duration)
+        stop.set()
+        for t in threads:
+            t.join()
+
+        for label, times in (('reads', read_times), ('writes', write_times)):
+            if times:
+                print('  %-7s %-6s %7d done  %8.1f/s  p50 %7.1f ms  p95 %7.1f ms  max %7.1f ms' %
+                      (journal_mode, label, len(times), len(times) / duration,
+                       np.percentile(times, 50) * 1000, np.percentile(times, 95) * 1000, max(times) * 1000))
+        if errors:
+            print('  %-7s %d errors, first: %s' % (journal_mode, len(errors), errors[0]))
+
+    settings.BMSAPP_READING_DB_JOURNAL_MODE = save_mode
+
+
+def bench_storage(work_dir, reading_count=1000000):
+    """Runs the same operations against the per-table and single-table storage
+    engines, timing each and checking that both engines return the same results.
+    """
+    print('Storage engines: %s readings over %s sensors' % (reading_count, SENSOR_COUNT))
+    ts, ids, vals = make_readings(reading_count)
+    sensor_ids = sorted(set(ids))
+    mid_ts = ts[len(ts) // 2]
+    operations = (
+        ('insert_reading_batch', lambda db: db.insert_reading_batch(ts, ids, vals)),
+        ('rowsForOneID x500', lambda db: [db.rowsForOneID(s, mid_ts, mid_ts + 86400) for s in sensor_ids]),
+        ('last_read x500', lambda db: [db.last_read(s) for s in sensor_ids]),
+        ('dataframeForMultipleIDs', lambda db: db.dataframeForMultipleIDs(sensor_ids[:20], start_ts=mid_ts)),
+        ('readingCount', lambda db: db.readingCount()),
+        ('sensor_time_range x500', lambda db: [db.sensor_time_range(s) for s in sensor_ids]),
+    )
+    results = {}
+    for engine in (storage.TABLE_PER_SENSOR, storage.SINGLE_TABLE):
+        db = bmsdata.BMSdata(os.path.join(work_dir, 'storage_%s.sqlite' % engine), storage_engine=engine)
+        for op_name, op in operations:
+            secs, result = timed(op, db)
+            results[(engine, op_name)] = result
+            print('  %-17s %-24s %8.3f s' % (engine, op_name, secs))
+        db.close()
+        print('  %-17s file size %.1f MB' % (engine, os.path.getsize(db.db_fname) / 1e6))
+
+    for op_name, op in operations:
+        r1 = results[(storage.TABLE_PER_SENSOR, op_name)]
+        r2 = results[(storage.SINGLE_TABLE, op_name)]
+        same = r1.equals(r2) if hasattr(r1, 'equals') else r1 == r2
+        print('  %-24s results %s' % (op_name, 'match' if same else 'DIFFER'))
+
+
+def merge_frames(db, sensor_ids, start_ts=None, end_ts=None):
+    """The original dataframeForMultipleIDs() method: one query per sensor with the
+    frames joined by a chain of outer merges.  Used as the baseline for bench_multi().
+    """
+    df_final = None
+    for sensor_id in sensor_ids:
+        df = db.dataframeForOneID(sensor_id, start_ts, end_ts)
+        df.drop('ts', axis=1, inplace=True)
+        df.rename(columns={'val': sensor_id}, inplace=True)
+        if df_final is None:
+            df_final = df
+        else:
+            df_final = pd.merge(df_final, df, how='outer', left_index=True, right_index=True)
+    return df_final
+
+
+def bench_multi(work_dir, interval=600):
+    """Compares the latency and peak Python memory of the single pass
+    dataframeForMultipleIDs() with the original merge chain, for 10, 50 and 200
+    sensors holding a year of readings spaced 'interval' seconds apart.  Alternate
+    sensors are offset by half an interval so the timestamps do not all align.
+    """
+    sensor_counts = (10, 50, 200)
+    start_ts = 1500000000
+    ts_year = np.arange(start_ts, start_ts + 365 * 86400, interval)
+    print('Multiple sensor read: one year of readings every %s s (%s per sensor)' % (interval, len(ts_year)))
+
+    db = bmsdata.BMSdata(os.path.join(work_dir, 'multi.sqlite'))
+    for i in range(max(sensor_counts)):
+        sensor_ts = ts_year + (interval // 2) * (i % 2)
+        db.insert_reading_batch(list(sensor_ts), ['multi_%03d' % i] * len(sensor_ts),
+                                list(np.random.random(len(sensor_ts))))
+
+    for sensor_count in sensor_counts:
+        sensor_ids = ['multi_%03d' % i for i in range(sensor_count)]
+        results = []
+        for label, func in (('merge chain', merge_frames), ('single pass', bmsdata.BMSdata.dataframeForMultipleIDs)):
+            secs, df = timed(func, db, sensor_ids)
+            results.append(df)
+            del df
+            # tracemalloc slows allocation, so measure memory in a separate run
+            tracemalloc.start()
+            func(db, sensor_ids)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print('  %3d sensors  %-12s %8.2f s  peak memory %8.1f MB  %s' %
+                  (sensor_count, label, secs, peak / 1e6, results[-1].shape))
+        same = results[0].index.equals(results[1].index) and np.allclose(
+            results[0].values, results[1].values, equal_nan=True)
+        print('  %3d sensors  results %s' % (sensor_count, 'match' if same else 'DIFFER'))
+    db.close()
+
+
+def bench_arrays(work_dir, reading_count=1000000):
+    """Times a fetch of 'reading_count' readings for one sensor as a list of row
+    dictionaries (rowsForOneID), as numpy arrays (arraysForOneID), and as numpy
+    arrays read in chunks (iterArraysForOneID).
+    """
+    print('Single sensor fetch: %s readings' % reading_count)
+    db = bmsdata.BMSdata(os.path.join(work_dir, 'arrays.sqlite'))
+    ts, ids, vals = make_readings(reading_count, sensor_count=1)
+    db.insert_reading_batch(ts, ids, vals)
+
+    for label, func in (('rowsForOneID', lambda: db.rowsForOneID('bench_000')),
+                        ('arraysForOneID', lambda: db.arraysForOneID('bench_000')),
+                        ('iterArraysForOneID', lambda: sum(len(c[0]) for c in db.iterArraysForOneID('bench_000')))):
+        secs, _ = timed(func)
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('  %-20s %8.3f s  peak memory %8.1f MB' % (label, secs, peak / 1e6))
+
+    rows = db.rowsForOneID('bench_000')
+    arr_ts, arr_vals = db.arraysForOneID('bench_000')
+    same = np.array_equal(arr_ts, [r['ts'] for r in rows]) and np.array_equal(arr_vals, [r['val'] for r in rows])
+    print('  results %s' % ('match' if same else 'DIFFER'))
+    db.close()
+
+
+def bench_latest(work_dir, reading_count=1000000):
+    """Times reading the last reading of every sensor: the original ORDER BY query on
+    each sensor's readings, last_read() on each sensor using the '_latest' table, and
+    one last_reads() call for all sensors.
+    """
+    print('Latest readings: %s sensors, %s readings' % (SENSOR_COUNT, reading_count))
+    db = bmsdata.BMSdata(os.path.join(work_dir, 'latest.sqlite'))
+    ts, ids, vals = make_readings(reading_count)
+    db.insert_reading_batch(ts, ids, vals)
+    sensor_ids = db.sensor_id_list()
+
+    results = []
+    for label, func in (('ORDER BY query x%s' % len(sensor_ids), lambda: [db._query_last_read(s) for s in sensor_ids]),
+                        ('last_read x%s' % len(sensor_ids), lambda: [db.last_read(s) for s in sensor_ids]),
+                        ('last_reads', lambda: list(db.last_reads(sensor_ids).values()))):
+        secs, result = timed(func)
+        results.append(result)
+        print('  %-22s %8.4f s' % (label, secs))
+    print('  results %s' % ('match' if results[0] == results[1] == results[2] else 'DIFFER'))
+    db.close()
+
+
+def bench_rollup(work_dir, years=2, interval=60):
+    """Times daily and weekly averaging of one sensor with a reading every 'interval'
+    seconds for 'years' years: resampling the raw readings versus reading the
+    hourly and daily rollups.  Also times building the rollups.
+    """
+    db = bmsdata.BMSdata(os.path.join(work_dir, 'rollup.sqlite'))
+    ts = np.arange(1500000000, 1500000000 + int(years * 365 * 86400), interval)
+    print('Rollups: one sensor, %s readings' % len(ts))
+    db.insert_reading_batch(ts.tolist(), ['bench_rollup'] * len(ts), list(np.random.random(len(ts)) * 100.0))
+    secs, _ = timed(rollup.update_rollups, db)
+    print('  build rollups          %8.2f s' % secs)
+
+    for hours in (24, 168):
+        secs_raw, df_raw = timed(lambda: data_util.resample_timeseries(db.dataframeForOneID('bench_rollup'), hours))
+        secs_rollup, df_rollup = timed(data_util.resample_from_rollups, db, 'bench_rollup', hours)
+        df_both = df_raw.join(df_rollup, rsuffix='_rollup', how='inner')
+        print('  %4s hour averages  raw %8.3f s  rollups %8.3f s  max difference %.4f' %
+              (hours, secs_raw, secs_rollup, (df_both.val - df_both.val_rollup).abs().max()))
+    db.close()
+
+
+def bench_stats(work_dir, reading_count=2000000):
+    """Times the daily_status reading counts, the sensor time ranges and a coverage
+    test: scanning the readings versus the sensor statistics tables.
+    """
+    print('Sensor statistics: %s sensors, %s readings' % (SENSOR_COUNT, reading_count))
+    db = bmsdata.BMSdata(os.path.join(work_dir, 'stats.sqlite'))
+    ts, ids, vals = make_readings(reading_count)
+    secs, _ = timed(db.insert_reading_batch, ts, ids, vals)
+    print('  %-34s %8.3f s' % ('insert_reading_batch', secs))
+    sensor_ids = db.sensor_id_list()
+    now = time.time()
+    for label, func in (
+            ('scan count, last day + total', lambda: (db.storage.count_readings(db.cursor, sensor_ids, now - 86400, now),
+                                                      db.storage.count_readings(db.cursor, sensor_ids, 0, now))),
+            ('readingCount, last day + total', lambda: (db.readingCount(now - 86400), db.readingCount())),
+            ('inserted_count, last day', lambda: db.inserted_count(now - 86400)),
+            ('scan min/max ts x%s' % len(sensor_ids), lambda: [tuple(db.cursor.execute('SELECT min(ts), max(ts) FROM %s' %
+                                                                db.storage.source(s)).fetchone()) for s in sensor_ids]),
+            ('sensor_time_range x%s' % len(sensor_ids), lambda: [db.sensor_time_range(s) for s in sensor_ids]),
+            ('read 30 days for span test x%s' % len(sensor_ids),
+             lambda: sum(len(db.arraysForOneID(s, ts[-1] - 30 * 86400, ts[-1])[0]) for s in sensor_ids)),
+            ('coverage, 30 days, %s sensors' % len(sensor_ids),
+             lambda: sum(c['est_count'] for c in db.coverage(sensor_ids, ts[-1] - 30 * 86400, ts[-1]).values()))):
+        secs, result = timed(func)
+        print('  %-34s %8.3f s  %s' % (label, secs, str(result)[:40]))
+    db.close()
+
+
+def bench_backup(work_dir, reading_count=4000000):
+    """Times a full backup while another connection keeps storing readings, reporting
+    the slowest store, then an incremental backup after more readings are stored.
+    """
+    print('Backups: %s readings over %s sensors, %s compression threads' % (reading_count, SENSOR_COUNT, backup.THREADS))
+    db_fname = os.path.join(work_dir, 'backup.sqlite')
+    db = bmsdata.BMSdata(db_fname)
+    ts, ids, vals = make_readings(reading_count)
+    db.insert_reading_batch(ts, ids, vals)
+
+    stop = threading.Event()
+    store_secs = []
+    def writer():
+        w_db = bmsdata.BMSdata(db_fname)
+        i = 0
+        while not stop.is_set():
+            secs, _ = timed(w_db.insert_reading_batch, [2000000000 + i] * 10, ['bench_w%d' % k for k in range(10)], [1.0] * 10)
+            store_secs.append(secs)
+            i += 1
+            time.sleep(0.01)
+        w_db.close()
+    thread = threading.Thread(target=writer)
+    thread.start()
+    stats = db.backup_db(10)
+    stop.set()
+    thread.join()
+    print('  %s' % backup_readingdb.summary(stats))
+    print('  %s batches stored during the backup, slowest %.3f s' % (len(store_secs), max(store_secs)))
+
+    db.insert_reading_batch([t + 10**8 for t in ts[:20000]], ids[:20000], vals[:20000])
+    print('  %s' % backup_readingdb.summary(db.backup_db(10, incremental=True)))
+    db.close()
+
+
+def bench_import(work_dir, row_count=200000, column_count=20):
+    """Times import_text_file() on tab- and comma-delimited files of 1-minute readings,
+    and re-importing the tab-delimited file, where every reading replaces a stored one.
+    Then reports the peak Python memory used by imports of files of two sizes.
+    """
+    print('Text file import: %s rows x %s sensors' % (row_count, column_count))
+
+    def write_file(fname, rows, sep):
+        times = pd.date_range('2015-01-01', periods=rows, freq='min').strftime('%m/%d/%Y %H:%M')
+        df = pd.DataFrame(np.random.random((rows, column_count)) * 100.0,
+                          columns=['imp_%02d' % i for i in range(column_count)])
+        df.insert(0, 'ts', times)
+        df.to_csv(fname, sep=sep, index=False, float_format='%.3f')
+
+    for label, sep in (('tab', '\t'), ('comma', ',')):
+        fname = os.path.join(work_dir, 'import_%s.txt' % label)
+        write_file(fname, row_count, sep)
+        db = bmsdata.BMSdata(os.path.join(work_dir, 'import_%s.sqlite' % label))
+        runs = ('first import', 're-import') if label == 'tab' else ('first import',)
+        for run_label in runs:
+            secs, (count, errors) = timed(db.import_text_file, fname)
+            print('  %-5s %-12s %5.1f MB file  %8.1f s  %9.0f readings/s  %s errors' %
+                  (label, run_label, os.path.getsize(fname) / 1e6, secs, count / secs, len(errors)))
+        db.close()
+
+    # tracing allocations slows the import several times, so it is measured separately
+    for rows in (row_count // 2, row_count):
+        fname = os.path.join(work_dir, 'import_mem_%s.txt' % rows)
+        write_file(fname, rows, '\t')
+        db = bmsdata.BMSdata(os.path.join(work_dir, 'import_mem_%s.sqlite' % rows))
+        tracemalloc.start()
+        db.import_text_file(fname)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('  %8s rows: peak memory %5.1f MB' % (rows, peak / 1e6))
+        db.close()
+
+
+def bench_shards(work_dir, shard_count=4, hold_secs=2.0, post_count=20):
+    """Measures how long small posts of readings wait while another connection holds a
+    long write transaction (like a large import or merge) on one sensor, with all
+    sensors in one file and then with the sensors spread across 'shard_count' shards.
+    The posts are for sensors in other shards than the busy sensor.
+    """
+    print('Shards: posts while a %.1f s write transaction is open, 1 file vs. %s shards' % (hold_secs, shard_count))
+    save_shards = getattr(settings, 'BMSAPP_READING_DB_SHARDS', 1)
+    for shards in (1, shard_count):
+        settings.BMSAPP_READING_DB_SHARDS = shards
+        fname = os.path.join(work_dir, 'shards_%s.sqlite' % shards)
+        db = bmsdata.BMSdata(fname)
+        ts, ids, vals = make_readings(100000)
+        db.insert_reading_batch(ts, ids, vals)
+        busy_db = db.shard_for('bench_busy')
+        post_ids = [s_id for s_id in sorted(set(ids)) if db.shard_for(s_id) is not busy_db or shards == 1][:50]
+
+        started = threading.Event()
+        def long_writer():
+            w_main = bmsdata.BMSdata(fname)
+            w_db = w_main.shard_for('bench_busy')
+            # take the write lock of the busy sensor's file
+            w_db.cursor.execute('BEGIN IMMEDIATE')
+            started.set()
+            time.sleep(hold_secs)
+            w_db.conn.commit()
+            w_main.close()
+            bmsdata.close_connections()
+        thread = threading.Thread(target=long_writer)
+        thread.start()
+        started.wait()
+        post_secs = []
+        for i in range(post_count):
+            secs, _ = timed(db.insert_reading_batch, [ts[-1] + (i + 1) * 300] * len(post_ids), post_ids,
+                            [1.0] * len(post_ids))
+            post_secs.append(secs)
+        thread.join()
+        print('  %s file(s): %s posts of %s readings, p50 %7.1f ms  max %7.1f ms  total %6.2f s' %
+              (len(db.shard_dbs()), post_count, len(post_ids),
+               np.percentile(post_secs, 50) * 1000, max(post_secs) * 1000, sum(post_secs)))
+        db.close()
+    settings.BMSAPP_READING_DB_SHARDS = save_shards
+
+
+def bench_convert(work_dir, reading_count=1000):
+    """Times storereads.convert_val() on a batch of readings for the Sensors in the
+    Django database (and unassigned sensor IDs if there are few), counting the Django
+    queries: with the transform cache disabled, which queries once per reading as
+    before the cache, cold and then warm.  The Django database is only read.
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    sensor_ids = list(models.Sensor.objects.values_list('sensor_id', flat=True)[:SENSOR_COUNT])
+    sensor_ids += ['bench_%03d' % i for i in range(max(0, 50 - len(sensor_ids)))]
+    readings = [(1500000000 + i, sensor_ids[i % len(sensor_ids)], 1.0) for i in range(reading_count)]
+    print('Sensor transform cache: %s readings for %s sensor IDs' % (reading_count, len(sensor_ids)))
+    db = bmsdata.BMSdata(os.path.join(work_dir, 'convert.sqlite'))
+    cache = storereads.transform_cache
+    save_timeout = cache.timeout
+    def convert():
+        cache.load(reading[1] for reading in readings)
+        return [storereads.convert_val(ts, s_id, val, db) for ts, s_id, val in readings]
+    for label, timeout in (('no cache', 0), ('cold cache', save_timeout), ('warm cache', save_timeout)):
+        cache.timeout = timeout
+        if label == 'cold cache':
+            cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            secs, _ = timed(convert)
+        print('  %-12s %8.3f s  %5d queries' % (label, secs, len(queries)))
+    cache.timeout = save_timeout
+    print('  %s' % cache.stats())
+    db.close()
+
+
+def bench_transform(work_dir, reading_count=100000):
+    """Times transforming the values of 'reading_count' readings of one sensor: one
+    reading at a time with the parameter parsing and expression compiling repeated
+    for every reading (as before they were cached), one reading at a time with the
+    cached parameters and code, and as one batch with Transformer.transform_values().
+    """
+    print('Transforms: %s readings of one sensor' % reading_count)
+    ts = list(range(1500000000, 1500000000 + reading_count * 60, 60))
+    vals = (np.random.random(reading_count) * 100.0).tolist()
+    trans = transforms.Transformer()
+    cached_funcs = (transforms.load_params, transforms.compile_expression)
+    for func, params in (('linear', 'slope: 1.8\noffset: 32'), ('val * 1.8 + 32', ''), ('sqrt(val) * 2', '')):
+        results = []
+        for label in ('uncached', 'cached', 'batch'):
+            if label == 'uncached':
+                transforms.load_params, transforms.compile_expression = [f.__wrapped__ for f in cached_funcs]
+            try:
+                if label == 'batch':
+                    secs, out = timed(trans.transform_values, ts, 'bench', vals, func, params)
+                else:
+                    secs, out = timed(lambda: [trans.transform_value(t, 'bench', v, func, params) for t, v in zip(ts, vals)])
+            finally:
+                transforms.load_params, transforms.compile_expression = cached_funcs
+            results.append(out)
+            print('  %-16s %-9s %8.3f s' % (func, label, secs))
+        diff = max(abs(a[2] - b[2]) for a, b in zip(results[0], results[2]))
+        print('  %-16s batch vs. per reading max difference %.2e' % (func, diff))
+
+
+def bench_spool(work_dir, post_count=200, post_size=50, hold_secs=2.0):
+    """Times 'post_count' posts of 'post_size' readings, stored during the request as
+    before and appended to the ingest spool, while another connection holds a
+    'hold_secs' write transaction on the Reading database (like a large import or
+    merge).  Then times the writer draining the spool in batches.
+    """
+    from bmsapp.readingdb import spool
+
+    print('Ingest spool: %s posts of %s readings during a %.1f s write transaction' % (post_count, post_size, hold_secs))
+    fname = os.path.join(work_dir, 'spool_db.sqlite')
+    db = bmsdata.BMSdata(fname)
+    ts, ids, vals = make_readings(100000)
+    db.insert_reading_batch(ts, ids, vals)
+    posts = []
+    for i in range(post_count):
+        post_ts = ts[-1] + (i + 1) * 300
+        posts.append([(post_ts, 'bench_%03d' % ((i * post_size + j) % SENSOR_COUNT), float(j)) for j in range(post_size)])
+    reading_spool = spool.ReadingSpool(os.path.join(work_dir, 'spool.sqlite'))
+
+    def hold_lock(started):
+        w_db = bmsdata.BMSdata(fname)
+        w_db.cursor.execute('BEGIN IMMEDIATE')
+        started.set()
+        time.sleep(hold_secs)
+        w_db.conn.commit()
+        w_db.close()
+        bmsdata.close_connections()
+
+    for label, store in (('direct', lambda readings: storereads.store_raw_readings(readings, db)),
+                         ('spooled', reading_spool.append)):
+        started = threading.Event()
+        thread = threading.Thread(target=hold_lock, args=(started,))
+        thread.start()
+        started.wait()
+        post_secs = [timed(store, readings)[0] for readings in posts]
+        thread.join()
+        print('  %-8s p50 %7.2f ms  p99 %7.2f ms  max %7.1f ms  total %6.2f s' %
+              (label, np.percentile(post_secs, 50) * 1000, np.percentile(post_secs, 99) * 1000,
+               max(post_secs) * 1000, sum(post_secs)))
+
+    depth = reading_spool.depth()
+    secs, _ = timed(lambda: [timed(storereads.store_raw_readings, r, db) for r in posts])
+    print('  storing the posts one at a time: %6.2f s' % secs)
+    for flush_readings in (1000, 5000):
+        for readings in posts:
+            reading_spool.append(readings)
+        def drain():
+            while reading_spool.depth()['posts']:
+                last_id, readings = reading_spool.claim(flush_readings)
+                storereads.store_raw_readings(readings, db)
+                reading_spool.release(last_id)
+        secs, _ = timed(drain)
+        print('  writer, batches of %5d readings: %6.2f s  (%s readings in %s posts were queued)' %
+              (flush_readings, secs, depth['readings'], depth['posts']))
+    db.close()
+
+
+def bench_hooks(work_dir, reading_count=10000, eval_secs=0.002):
+    """Times storing 'reading_count' readings with insert_reading_batch() and running
+    their new reading hooks: a thread per reading, as before the hook worker pool, and
+    the worker pool.  The readings are for the Sensors in the Django database (and
+    unassigned sensor IDs if there are few), and all of the Sensors are treated as
+    having alerts.  Sensor.new_reading() is replaced by a 'eval_secs' sleep, so no
+    alerts are checked or sent.  The Django database is only read.
+    """
+    from bmsapp import reading_hooks
+
+    sensor_ids = list(models.Sensor.objects.values_list('sensor_id', flat=True)[:SENSOR_COUNT])
+    sensor_ids += ['bench_%03d' % i for i in range(max(0, 50 - len(sensor_ids)))]
+    ts = [1500000000 + (i // len(sensor_ids)) * 300 for i in range(reading_count)]
+    ids = [sensor_ids[i % len(sensor_ids)] for i in range(reading_count)]
+    vals = [1.0] * reading_count
+    print('New reading hooks: %s readings for %s sensor IDs' % (reading_count, len(sensor_ids)))
+
+    threads = []
+    def thread_per_reading(sensor_id, ts, val):
+        # the hook before the worker pool
+        try:
+            sensor = models.Sensor.objects.get(sensor_id=sensor_id)
+            t = threading.Thread(target=sensor.new_reading, args=(ts, val))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        except models.Sensor.DoesNotExist:
+            pass
+    def store_thread_per_reading(db):
+        # the batch insert called the hook for every reading, not once per sensor
+        db.insert_reading_batch(ts, ids, vals)
+        for one_ts, one_id, one_val in zip(ts, ids, vals):
+            thread_per_reading(one_id, one_ts, one_val)
+
+    pool = reading_hooks.hook_pool
+    save_alerts = pool.alert_sensors
+    save_new_reading = models.Sensor.new_reading
+    save_hook = bmsdata.run_new_reading_hook
+    pool.alert_sensors = type('AllSensors', (), {'get': lambda self: set(sensor_ids)})()
+    models.Sensor.new_reading = lambda self, ts, val: time.sleep(eval_secs)
+    try:
+        for label in ('thread per reading', 'worker pool'):
+            db = bmsdata.BMSdata(os.path.join(work_dir, 'hooks_%s.sqlite' % label.replace(' ', '_')))
+            start = time.perf_counter()
+            if label == 'thread per reading':
+                store_thread_per_reading(db)
+                store_secs = time.perf_counter() - start
+                for t in threads:
+                    t.join()
+                hook_count = len(threads)
+            else:
+                bmsdata.run_new_reading_hook = pool.submit
+                pool.reset_stats()
+                db.insert_reading_batch(ts, ids, vals)
+                store_secs = time.perf_counter() - start
+                pool.wait_idle()
+                hook_count = pool.stats()['evaluated']
+            total_secs = time.perf_counter() - start
+            db.close()
+            print('  %-20s store %7.2f s  hooks done %7.2f s  %6d hooks run' % (label, store_secs, total_secs, hook_count))
+        print('  %s' % pool.stats())
+    finally:
+        bmsdata.run_new_reading_hook = save_hook
+        pool.alert_sensors = save_alerts
+        models.Sensor.new_reading = save_new_reading
+
+
+def bench_binary(work_dir, reading_count=100000):
+    """Times storing a post of 'reading_count' readings sent as JSON to the store/
+    endpoint and in the binary format of the store-binary/ endpoint, from decoding the
+    post body through storing the readings in a new database.
+    """
+    import json
+
+    ts, ids, vals = make_readings(reading_count)
+    json_body = json.dumps({'readings': list(zip(ts, ids, vals))}).encode('utf-8')
+    bin_body = storereads.encode_binary(ts, ids, vals)
+    print('Binary posts: %s readings, %s sensors' % (reading_count, SENSOR_COUNT))
+    for label, body, store in (
+            ('JSON', json_body, lambda body, db: storereads.store_raw_readings(
+                storereads.parse_readings(json.loads(body)), db)),
+            ('binary', bin_body, lambda body, db: storereads.store_arrays(*storereads.decode_binary(body), db=db))):
+        db = bmsdata.BMSdata(os.path.join(work_dir, 'binary_%s.sqlite' % label))
+        secs, msg = timed(store, body, db)
+        db.close()
+        print('  %-7s %9.0f kB  %7.3f s  %10.0f readings/s  (%s)' %
+              (label, len(body) / 1000, secs, reading_count / secs, msg))
+
+
+BENCHMARKS = {
+    'insert': bench_insert,
+    'contention': bench_contention,
+    'storage': bench_storage,
+    'multi': bench_multi,
+    'arrays': bench_arrays,
+    'latest': bench_latest,
+    'rollup': bench_rollup,
+    'stats': bench_stats,
+    'backup': bench_backup,
+    'import': bench_import,
+    'shards': bench_shards,
+    'convert': bench_convert,
+    'transform': bench_transform,
+    'spool': bench_spool,
+    'hooks': bench_hooks,
+    'binary': bench_binary,
+}
+
+
+def run_benchmarks(benchmarks, names):
+    '''Runs the benchmarks named in 'names' (all of them if empty) from the dictionary
+    'benchmarks', which maps names to benchmark functions taking a temporary work
+    directory.  Also used by the other benchmark scripts.
+    '''
+    # The new reading hook does a Django query for every stored reading, which
+    # would swamp the database timings.  Disable it while benchmarking.
+    save_hook = bmsdata.run_new_reading_hook
+    bmsdata.run_new_reading_hook = lambda sensor_id, ts, val: None
+
+    work_dir = tempfile.mkdtemp(prefix='bmon_bench_')
+    try:
+        for name in (names or benchmarks.keys()):
+            benchmarks[name](work_dir)
+    finally:
+        bmsdata.run_new_reading_hook = save_hook
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run(*args):
+    '''Method called by runscript.  'args' are the names of the benchmarks
+    to run; all are run if none are given.
+    '''
+    run_benchmarks(BENCHMARKS, args)
@@ -0,0 +1,73 @@
+"""Script to benchmark parsing the date/time strings received by the ingest
+endpoints (see bmsapp/timestamps.py).  This script is run via django-extensions
+runscript facility:
+
+    manage.py runscript benchmark_timestamps
+
+Results are printed to the console.  The shared helpers are in benchmark_readingdb.py.
+"""
+import pandas as pd
+
+from bmsapp import timestamps
+from bmsapp.scripts.benchmark_readingdb import timed, run_benchmarks
+
+
+def bench_timestamps(work_dir, message_count=20000):
+    """Compares dateutil with the timestamps module for parsing the date/time strings
+    of 'message_count' messages in the formats received by the ingest endpoints, each
+    message with a different time.  The timestamps module is timed with an empty cache,
+    and for strings repeated many times, as when many readings share a message time.
+    """
+    import calendar
+    import dateutil.parser
+
+    start = 1700000000
+    epoch_dt = pd.Timestamp(start, unit='s')
+    times = [epoch_dt + pd.Timedelta(seconds=i * 61, microseconds=i * 7919 % 1000000) for i in range(message_count)]
+    formats = (
+        # (endpoint, strftime format, conversion)
+        ('store ts', '%Y-%m-%d %H:%M:%S', 'utc_seconds'),
+        ('Monnit', '%Y/%m/%d %H:%M:%S', 'utc_seconds'),
+        ('Particle', '%Y-%m-%dT%H:%M:%S.%f', 'utc_seconds'),
+        ('Things v2/v3', '%Y-%m-%dT%H:%M:%S.%f', 'timestamp'),
+    )
+    old_funcs = {
+        'utc_seconds': lambda s: int(calendar.timegm(dateutil.parser.parse(s).timetuple())),
+        'timestamp': lambda s: dateutil.parser.parse(s).timestamp(),
+    }
+    print('Timestamp parsing: %s messages' % message_count)
+    for endpoint, fmt, conversion in formats:
+        if fmt.endswith('%f'):
+            # Particle sends milliseconds, the Things Network nanoseconds, and both end with Z
+            digits = 3 if endpoint == 'Particle' else 9
+            strs = [t.strftime(fmt)[:-6] + ('%09d' % (t.microsecond * 1000))[:digits] + 'Z' for t in times]
+        else:
+            strs = [t.strftime(fmt) for t in times]
+        old_func = old_funcs[conversion]
+        new_func = getattr(timestamps, conversion)
+        old_secs, old_results = timed(lambda: [old_func(s) for s in strs])
+        new_func.cache_clear()
+        new_secs, new_results = timed(lambda: [new_func(s) for s in strs])
+        # readings of a post sharing 100 message times
+        repeated = strs[:100] * (message_count // 100)
+        cached_secs, _ = timed(lambda: [new_func(s) for s in repeated])
+        assert old_results == new_results
+        line = '  %-13s dateutil %6.3f s   fast path %6.3f s   cached %6.3f s' % (endpoint, old_secs, new_secs, cached_secs)
+        if conversion == 'utc_seconds':
+            new_func.cache_clear()
+            many_secs, many_results = timed(timestamps.utc_seconds_many, strs)
+            assert many_results == old_results
+            line += '   batch %6.3f s' % many_secs
+        print(line)
+
+
+BENCHMARKS = {
+    'parse': bench_timestamps,
+}
+
+
+def run(*args):
+    '''Method called by runscript.  'args' are the names of the benchmarks
+    to run; all are run if none are given.
+    '''
+    run_benchmarks(BENCHMARKS, args)
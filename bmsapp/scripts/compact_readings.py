@@ -0,0 +1,60 @@
+"""Script to downsample old sensor readings according to the Retention Policies
+assigned to Sensors, Units and Buildings (see bmsapp/readingdb/retention.py).
+Sensors without a Retention Policy keep all of their readings.  This script is run
+via django-extensions runscript facility:
+
+    manage.py runscript compact_readings
+
+This script is also called from the main_cron.py script.
+"""
+import time
+import logging
+import itertools
+
+import bmsapp.models
+import bmsapp.readingdb.bmsdata
+from bmsapp.readingdb import retention
+
+# Make a logger for this module
+_logger = logging.getLogger('bms.' + __name__)
+
+# Maximum number of seconds to spend on one run.  Work not finished is continued
+# on the next run, starting with the sensor that was not finished.
+TIME_LIMIT = 240
+
+# Maximum number of seconds to spend on a run from main_cron.py, which runs this
+# script on every pass after its time-sensitive tasks.
+CRON_TIME_LIMIT = 30
+
+def run(time_limit=TIME_LIMIT):
+    '''Method called by runscript.  Compacting stops after 'time_limit' seconds.  The
+    sensors are compacted in Sensor ID order, starting after the last sensor finished by
+    the previous run and continuing from the first sensor after the last one.
+    '''
+    deadline = time.time() + time_limit
+    db = bmsapp.readingdb.bmsdata.BMSdata()
+    deleted = added = 0
+    sensors = bmsapp.models.Sensor.objects.select_related('retention_policy', 'unit__retention_policy') \
+                                          .prefetch_related('building_set__retention_policy').order_by('sensor_id')
+    last_id = retention.resume_after(db)
+    if last_id is not None:
+        sensors = itertools.chain(sensors.filter(sensor_id__gt=last_id), sensors.filter(sensor_id__lte=last_id))
+    for sensor in sensors:
+        if time.time() > deadline:
+            break
+        policy = sensor.effective_retention_policy()
+        if policy is None or not db.sensor_id_exists(sensor.sensor_id):
+            continue
+        try:
+            n_deleted, n_added = retention.compact_sensor(db.shard_for(sensor.sensor_id), sensor.sensor_id, policy.tiers(), deadline=deadline)
+            deleted += n_deleted
+            added += n_added
+        except Exception:
+            _logger.exception('Error compacting readings for %s' % sensor.sensor_id)
+        if time.time() > deadline:
+            # the sensor may not be finished; the next run starts with it
+            break
+        retention.set_resume_after(db, sensor.sensor_id)
+    db.close()
+    if deleted or added:
+        _logger.info('%s old readings replaced by %s averages.' % (deleted, added))
@@ -8,6 +8,7 @@ This script is also called from the main_cron.py script.
 import logging 
 import time
 import bmsapp.readingdb.bmsdata
+from bmsapp import storereads
 
 
 def run():
@@ -18,5 +19,16 @@ def run():
 
     # get a BMSdata object for the sensor reading database.
     reading_db = bmsapp.readingdb.bmsdata.BMSdata()
-    logger.info( '{:,} readings inserted in last day. {:,} total readings.'.format(reading_db.readingCount(time.time() - 3600*24), reading_db.readingCount()) )
+    # count the readings inserted during the previous UTC day.  The counts come from
+    # the sensor statistics tables, so this is quick.
+    today = int(time.time()) // 86400 * 86400
+    inserted = reading_db.inserted_count(today - 86400, today)
+    if inserted is None:
+        inserted = reading_db.readingCount(time.time() - 3600*24)
+    logger.info( '{:,} readings inserted in last day. {:,} total readings.'.format(inserted, reading_db.readingCount()) )
     reading_db.close()
+
+    # report the readings waiting to be stored if the ingest spool is used
+    if storereads.spool_enabled():
+        depth = storereads.get_spool().depth()
+        logger.info( '{:,} readings in {:,} posts waiting in the ingest spool, oldest {:.1f} s.'.format(depth['readings'], depth['posts'], depth['oldest_age']) )
@@ -14,13 +14,13 @@ You can use the 'files' subdirectory to store import files and instead execute:
 The script uses the bmsapp.readingdb.bmsdata.BMSdata.import_text_file() method,
 so the text file must comply with the format required by that method, which is:
 
-The file must be tab-delimited and the values in the first column must be date/time 
+The file must be tab- or comma-delimited and the values in the first column must be date/time 
 strings interpretable by the Python dateutil parser module.  Subsequent columns 
 must contain sensor reading values; the each item can be blank or contain a value parseable 
 by the Python float function. The first non-blank row of the file must contain sensor IDs 
 (the first column of that row can contain anything, as it is the timestamp column). An
 exmaple of the format is (white space separation between columns need to be the Tab
-character):
+character, or commas):
 
     ts                 id_2341   test_alarm_code
     4/12/2014 13:23    2.2       44.3
@@ -38,8 +38,16 @@ import readingdb.bmsdata
 # Open reading database object
 db = readingdb.bmsdata.BMSdata()
 
+def show_progress(bytes_read, file_size, readings_stored):
+    '''Prints the progress of an import on one console line.
+    '''
+    sys.stdout.write('\r%3.0f%% of file processed, %s readings stored' %
+                     (100.0 * bytes_read / max(file_size, 1), readings_stored))
+    sys.stdout.flush()
+
 for filename in glob.glob(sys.argv[1]):
-    success_count, errors = db.import_text_file(filename)
+    print('Importing %s' % filename)
+    success_count, errors = db.import_text_file(filename, progress=show_progress)
     print('\n%s readings successfully stored and %s errors.' % (success_count, len(errors)))
     if len(errors):
         for err_desc in errors:
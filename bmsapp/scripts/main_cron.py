@@ -8,13 +8,19 @@ cron tasks.  It should be run using the django-extensions runscript facility:
 from datetime import datetime
 import time
 
+from bmsapp import storereads
+
 from . import calc_readings
 from . import daily_status
 from . import backup_django_db
 from . import backup_readingdb
+from . import archive_readings
+from . import update_rollups
+from . import compact_readings
 from . import check_alerts
 from . import run_periodic_scripts
 from . import terminate_old_cron
+from . import spool_writer
 
 def suppress_errors(func):
     '''Runs the function 'func' and suppresses all errors.
@@ -53,6 +59,11 @@ def run():
     # run periodic scripts.  They all run on some multiple of five minutes.
     suppress_errors(run_periodic_scripts.run)
 
+    # in spool mode, store any spooled readings left waiting because the spool_writer
+    # service is not running.  This returns right away if the service is running.
+    if storereads.spool_enabled():
+        suppress_errors(lambda: spool_writer.run('once'))
+
     # at 15 and 45 minute marks in hour (roughly), run the calculate readings
     # script
     if hr_div in (3, 9):
@@ -63,17 +74,33 @@ def run():
     # so fresh readings are available.
     # suppress_errors(check_alerts.run)
 
-    # run the daily status script 5 minutes after midnight each day
-    # ** Decided to eliminate this because it is CPU intensive and it is buried
-    # in the log file.
-    #if hr == 0 and hr_div == 1:
-    #    suppress_errors(daily_status.run)
+    # run the daily status script 5 minutes after midnight each day.  The reading
+    # counts come from the sensor statistics tables, so it is no longer CPU intensive.
+    if hr == 0 and hr_div == 1:
+        suppress_errors(daily_status.run)
 
     # run the Django DB backup twice a day, after points in the day when there was
     # likely to be configuration activity.
     if (hr, hr_div) in ((12, 5), (18, 5)):
         suppress_errors(backup_django_db.run)
 
-    # run the sensor reading database backup every 3 days
-    if (yr_day % 3) == 0 and hr == 2 and hr_div == 6:
-        suppress_errors(backup_readingdb.run)
+    # run a full sensor reading database backup every 3 days, and an incremental
+    # backup of the pages changed since then on the other days.
+    if hr == 2 and hr_div == 6:
+        if (yr_day % 3) == 0:
+            suppress_errors(backup_readingdb.run)
+        else:
+            suppress_errors(lambda: backup_readingdb.run('incremental'))
+
+    # move old readings to the archive once a day, ahead of the reading database
+    # backup so the backup is smaller.
+    if hr == 1 and hr_div == 6:
+        suppress_errors(archive_readings.run)
+
+    # Reading database maintenance runs last, after the time-sensitive tasks above, with
+    # a small time budget on every pass.  Work not finished continues on the next pass.
+    # Bring the hourly and daily reading rollups up to date.
+    suppress_errors(lambda: update_rollups.run(time_limit=update_rollups.CRON_TIME_LIMIT))
+
+    # downsample old readings according to the Retention Policies.
+    suppress_errors(lambda: compact_readings.run(time_limit=compact_readings.CRON_TIME_LIMIT))
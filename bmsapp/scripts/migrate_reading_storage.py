@@ -0,0 +1,130 @@
+"""Script to convert the sensor reading database to a different storage engine
+(see bmsapp/readingdb/storage.py).  The readings are copied into a new database
+file; the existing database file is not changed.  After copying, the readings
+of each sensor in the new file are checked against the original.
+This script is run via django-extensions runscript facility:
+
+    manage.py runscript migrate_reading_storage --script-args single_table
+
+The first script argument is the name of the target storage engine,
+'single_table' or 'table_per_sensor'.  Optional second and third arguments give
+the path to the source database (default is the standard reading database) and
+the path to the new database (default is the source path with the engine name
+added before the extension).
+
+If the BMSAPP_READING_DB_SHARDS setting is more than 1, the new database spreads
+its sensors across that many shard files, in 'shard_NN' directories next to the
+new file (see ShardedBMSdata in bmsapp/readingdb/bmsdata.py).  Readings that have
+been moved to the Parquet archive are not copied to a sharded database.
+
+To put the new database into service, stop the web server and cron jobs, move
+the new file (and any shard directories) into the place of the original reading
+database, and set BMSAPP_READING_DB_STORAGE in settings.py to the new engine name.
+"""
+import os
+import time
+
+from bmsapp.readingdb import bmsdata, storage, rollup
+
+SENSORS_PER_COMMIT = 200    # number of sensors copied per transaction
+
+# Special tables copied to the main file of a sharded database.  The other special
+# tables hold per-sensor data that is rebuilt in each shard.
+SHARDED_MAIN_TABLES = ('_last_raw', '_alert_log')
+
+
+def copy_special_tables(src_db, dest_db):
+    """Copies the special tables (names starting with underbar) other than those used by
+    the storage engines from the attached source database to the destination database.
+    """
+    cursor = dest_db.cursor
+    tables = cursor.execute("SELECT name, sql FROM [src].sqlite_master WHERE type='table'").fetchall()
+    for name, create_sql in tables:
+        if not name.startswith('_') or name in storage.ENGINE_TABLES or name == '_junk':
+            continue
+        if dest_db.shard_dbs() != [dest_db] and name not in SHARDED_MAIN_TABLES:
+            continue
+        if name in dest_db.sensor_ids:
+            cursor.execute('DELETE FROM [main].[%s]' % name)
+        else:
+            cursor.execute(create_sql)
+        cursor.execute('INSERT INTO [main].[%s] SELECT * FROM [src].[%s]' % (name, name))
+        print('  copied special table %s' % name)
+    dest_db.conn.commit()
+
+
+def copy_sensors(src_db, dest_db):
+    """Copies the readings of all sensors from the attached source database to the
+    destination database.
+    """
+    sensor_ids = src_db.sensor_id_list()
+    sharded = dest_db.shard_dbs() != [dest_db]
+    start = time.time()
+    for i, sensor_id in enumerate(sensor_ids):
+        shard_db = dest_db.shard_for(sensor_id)
+        shard_db.add_sensor_table(sensor_id, commit=False)
+        select_sql = 'SELECT ts, val FROM %s' % src_db.storage.source(sensor_id, 'src')
+        shard_db.cursor.execute(shard_db.storage.insert_select_sql(sensor_id, select_sql))
+        if sharded:
+            # the per-sensor special tables were not copied
+            shard_db.refresh_latest(sensor_id, commit=False)
+            shard_db.refresh_stats(sensor_id, commit=False)
+            rollup.mark_dirty(shard_db, [(sensor_id, rollup.REBUILD)])
+        if (i + 1) % SENSORS_PER_COMMIT == 0 or i == len(sensor_ids) - 1:
+            dest_db.commit()
+            print('  %d of %d sensors copied, %.0f s elapsed' % (i + 1, len(sensor_ids), time.time() - start))
+
+
+def verify_sensors(src_db, dest_db):
+    """Compares the readings of each sensor in the destination database with the
+    attached source database.  Returns a list of the sensor IDs that do not match.
+    """
+    summary_sql = 'SELECT COUNT(*), MIN(ts), MAX(ts), TOTAL(ts), TOTAL(val) FROM %s'
+    mismatches = []
+    for sensor_id in src_db.sensor_id_list():
+        shard_db = dest_db.shard_for(sensor_id)
+        src = shard_db.cursor.execute(summary_sql % src_db.storage.source(sensor_id, 'src')).fetchone()
+        dest = shard_db.cursor.execute(summary_sql % shard_db.storage.source(sensor_id)).fetchone()
+        if tuple(src[:4]) != tuple(dest[:4]) or abs(src[4] - dest[4]) > 1e-6 * max(1.0, abs(src[4])):
+            mismatches.append(sensor_id)
+    return mismatches
+
+
+def run(*args):
+    '''Method called by runscript.
+    '''
+    if len(args) == 0 or args[0] not in storage.ENGINES:
+        print('The first argument must be the target storage engine: %s' % ', '.join(storage.ENGINES.keys()))
+        return
+    engine = args[0]
+    src_fname = args[1] if len(args) > 1 else bmsdata.DEFAULT_DB
+    dest_fname = args[2] if len(args) > 2 else '%s.%s.sqlite' % (os.path.splitext(src_fname)[0], engine)
+
+    if os.path.exists(dest_fname):
+        print('%s already exists.  Remove it or give a different destination.' % dest_fname)
+        return
+
+    src_db = bmsdata.BMSdata(src_fname, read_only=True)
+    print('Converting %s (%s engine, %d sensors) to %s (%s engine)' %
+          (src_fname, src_db.storage.name, len(src_db.sensor_id_list()), dest_fname, engine))
+
+    dest_db = bmsdata.BMSdata(dest_fname, storage_engine=engine)
+    # each destination file reads the source through its own connection
+    dest_files = [dest_db] + [shard_db for shard_db in dest_db.shard_dbs() if shard_db is not dest_db]
+    for file_db in dest_files:
+        file_db.cursor.execute('ATTACH DATABASE ? AS src', (src_fname,))
+    try:
+        copy_special_tables(src_db, dest_db)
+        copy_sensors(src_db, dest_db)
+
+        print('Verifying readings...')
+        mismatches = verify_sensors(src_db, dest_db)
+        if mismatches:
+            print('  %d sensors do not match: %s' % (len(mismatches), ', '.join(mismatches)))
+        else:
+            print('  All sensors match.')
+    finally:
+        for file_db in dest_files:
+            file_db.cursor.execute('DETACH DATABASE src')
+        dest_db.close()
+        src_db.close()
@@ -0,0 +1,101 @@
+"""Script that stores the readings waiting in the ingest spool (see
+bmsapp/readingdb/spool.py) in the Reading database.  When the BMSAPP_INGEST_SPOOL
+setting is True, this is the single process that writes posted readings, and it
+should be run as a long-running service via the django-extensions runscript facility:
+
+    manage.py runscript spool_writer
+
+To store the readings that are waiting and then exit, pass the 'once' argument:
+
+    manage.py runscript spool_writer --script-args once
+
+This script is also called with 'once' from the main_cron.py script, so the spool is
+drained even if the service is not running.  Only one writer runs at a time; others
+return right away.
+"""
+import time
+import fcntl
+import logging
+
+from django.conf import settings
+
+from bmsapp import storereads
+
+# Make a logger for this module
+_logger = logging.getLogger('bms.' + __name__)
+
+# Maximum number of seconds between checks of the spool.
+POLL_SECONDS = 0.2
+
+# Number of seconds between log messages with the spool depth and the readings stored.
+STATUS_SECONDS = 600
+
+# Number of seconds to wait before retrying a batch that could not be stored.
+RETRY_SECONDS = 5.0
+
+def flush(reading_spool, max_readings):
+    '''Stores the oldest posts in the ReadingSpool 'reading_spool', holding up to
+    'max_readings' readings, in the Reading database and removes them from the spool.
+    Returns the number of readings taken from the spool.
+    '''
+    last_id, readings = reading_spool.claim(max_readings)
+    if last_id is None:
+        return 0
+    msg = storereads.store_raw_readings(readings)
+    reading_spool.release(last_id)
+    _logger.debug('Spooled readings through post %s: %s' % (last_id, msg))
+    return len(readings)
+
+def run(*args):
+    '''Method called by runscript.  Returns the number of readings taken from the spool.
+    '''
+    flush_readings = getattr(settings, 'BMSAPP_INGEST_SPOOL_FLUSH_READINGS', 5000)
+    flush_seconds = getattr(settings, 'BMSAPP_INGEST_SPOOL_FLUSH_SECONDS', 2.0)
+    once = 'once' in args
+
+    reading_spool = storereads.get_spool()
+    lock_file = open(reading_spool.fname + '.lock', 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        # another writer is draining the spool
+        lock_file.close()
+        return 0
+
+    total = 0
+    period_count = 0
+    last_status = time.time()
+    try:
+        while True:
+            depth = reading_spool.depth()
+            if depth['posts'] and (once or depth['readings'] >= flush_readings or
+                                   depth['oldest_age'] >= flush_seconds):
+                try:
+                    count = flush(reading_spool, flush_readings)
+                except Exception:
+                    # the posts stay in the spool and are tried again
+                    _logger.exception('Error storing spooled readings')
+                    if once:
+                        break
+                    time.sleep(RETRY_SECONDS)
+                    continue
+                total += count
+                period_count += count
+                continue
+
+            if once:
+                break
+
+            if time.time() - last_status >= STATUS_SECONDS:
+                _logger.info('{:,} spooled readings stored in the last {:.0f} s. {:,} readings in {:,} posts waiting, '
+                             'oldest {:.1f} s.'.format(period_count, time.time() - last_status, depth['readings'],
+                                                       depth['posts'], depth['oldest_age']))
+                period_count = 0
+                last_status = time.time()
+
+            wait = flush_seconds - depth['oldest_age'] if depth['posts'] else POLL_SECONDS
+            time.sleep(min(max(wait, 0.0), POLL_SECONDS))
+    finally:
+        lock_file.close()
+
+    return total
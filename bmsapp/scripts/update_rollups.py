@@ -0,0 +1,52 @@
+"""Script to bring the hourly and daily rollups of sensor readings up to date (see
+bmsapp/readingdb/rollup.py).  This script is run via django-extensions runscript
+facility:
+
+    manage.py runscript update_rollups
+
+To rebuild the rollups from scratch after readings have been backfilled, pass the
+'rebuild' argument, optionally followed by the Sensor IDs to rebuild (all sensors
+are rebuilt if none are given):
+
+    manage.py runscript update_rollups --script-args rebuild [sensor_id ...]
+
+This script is also called from the main_cron.py script.
+"""
+import time
+import logging
+
+import bmsapp.readingdb.bmsdata
+from bmsapp.readingdb import rollup
+
+# Make a logger for this module
+_logger = logging.getLogger('bms.' + __name__)
+
+# Maximum number of seconds to spend on one run.  Sensors not reached are
+# updated on the next run.
+TIME_LIMIT = 120
+
+# Maximum number of seconds to spend on a run from main_cron.py, which runs this
+# script on every pass after its time-sensitive tasks.
+CRON_TIME_LIMIT = 30
+
+def run(*args, time_limit=TIME_LIMIT):
+    '''Method called by runscript.  Updating stops after 'time_limit' seconds.
+    '''
+    db = bmsapp.readingdb.bmsdata.BMSdata()
+    start = time.time()
+    sensor_count = 0
+    # a sharded database keeps the rollups of each shard's sensors in the shard
+    for shard_db in db.shard_dbs():
+        if len(args) and args[0] == 'rebuild':
+            sensor_ids = [s_id for s_id in args[1:] if shard_db.sensor_id_exists(s_id)]
+            if len(args) == 1 or sensor_ids:
+                rollup.rebuild(shard_db, sensor_ids or None)
+            sensor_count += rollup.update_rollups(shard_db)
+        else:
+            time_left = time_limit - (time.time() - start)
+            if time_left <= 0:
+                break
+            sensor_count += rollup.update_rollups(shard_db, time_left)
+    db.close()
+    if sensor_count:
+        _logger.info('Rollups updated for %s sensors.' % sensor_count)
@@ -2,41 +2,143 @@
 Module used to store incoming sensor readings in the database.
 '''
 
-import dateutil.parser
-import calendar
 import re
 import time
+import zlib
+import struct
 import logging
+import threading
+
+import numpy as np
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 
 from . import models
+from . import timestamps
 from .readingdb import bmsdata
+from .readingdb import spool
 from .calcs import transforms
 
 # Make a logger for this module
 _logger = logging.getLogger('bms.' + __name__)
 
-def convert_val(ts, reading_id, val, db):
-    """Takes a raw reading values 'ts', 'reading_id', and 'val' and converts them
-    to a form suitable for storage in the reading database.  If a transform 
-    function applies to the reading_id, it is applied.  Also, non-numerical 
-    string 'val's are converted to numeric values suitable for storage as a float.
-    'db' is a bmsdata.BMSdata reading database object.
-    Returned is the tuple (ts, reading_id, val) as any of these could be
-    transformed by the transform function.
+
+class SensorTransformCache:
+    """In-process cache of the Sensor fields that convert_val() needs, keyed on Sensor
+    ID: the (is_calculated, tran_calc_function, function_parameters) tuple, or None for
+    an ID that has no Sensor object (an unassigned sensor).  Saving or deleting a Sensor
+    in this process clears the cache (see the signal receivers below).  Sensors changed
+    by another process are seen when their entries expire after 'timeout' seconds.
+    'hits' and 'misses' count the lookups answered from the cache and from the
+    database.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.entries = {}    # Sensor ID -> (time loaded, fields tuple or None)
+        self.generation = 0  # incremented by clear()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _store(self, sensor_ids, load_time):
+        """Loads the fields of the Sensors in 'sensor_ids' from the database with one
+        query and caches them, along with None entries for the IDs without a Sensor.
+        Returns a dictionary of the loaded entries keyed on Sensor ID.  The entries are
+        not cached if the cache was cleared while they were loaded, as they may be stale.
+        """
+        generation = self.generation
+        recs = models.Sensor.objects.filter(sensor_id__in=sensor_ids).values_list(
+            'sensor_id', 'is_calculated', 'tran_calc_function', 'function_parameters')
+        found = {rec[0]: rec[1:] for rec in recs}
+        loaded = {sensor_id: (load_time, found.get(sensor_id)) for sensor_id in sensor_ids}
+        with self.lock:
+            if generation == self.generation:
+                self.entries.update(loaded)
+        return loaded
+
+    def _fresh(self, sensor_id, now):
+        """Returns the cache entry for 'sensor_id' if present and not expired, else None.
+        """
+        entry = self.entries.get(sensor_id)
+        if entry is not None and now - entry[0] < self.timeout:
+            return entry
+        return None
+
+    def load(self, sensor_ids):
+        """Loads the Sensors in the iterable 'sensor_ids' that are not cached with one
+        database query, so a batch of readings needs no query per reading.  An error,
+        such as a malformed reading producing the IDs, is logged and the Sensors are
+        then loaded one at a time by get().
+        """
+        now = time.time()
+        try:
+            missing = list({str(sensor_id) for sensor_id in sensor_ids if self._fresh(str(sensor_id), now) is None})
+            # keep the number of query parameters within the database limits
+            for i in range(0, len(missing), 500):
+                self._store(missing[i:i + 500], now)
+        except Exception:
+            _logger.exception('Error loading the Sensor transform cache')
+
+    def get(self, sensor_id):
+        """Returns the (is_calculated, tran_calc_function, function_parameters) tuple
+        of the Sensor with the ID 'sensor_id', or None if there is no such Sensor.
+        """
+        sensor_id = str(sensor_id)
+        now = time.time()
+        entry = self._fresh(sensor_id, now)
+        if entry is None:
+            self.misses += 1
+            entry = self._store([sensor_id], now)[sensor_id]
+        else:
+            self.hits += 1
+        return entry[1]
+
+    def clear(self):
+        """Removes all of the cache entries.
+        """
+        with self.lock:
+            self.entries = {}
+            self.generation += 1
+
+    def stats(self):
+        """Returns a dictionary with the number of cached entries and the hit and
+        miss counts.
+        """
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+# The cache used by convert_val().
+transform_cache = SensorTransformCache(getattr(settings, 'BMSAPP_SENSOR_CACHE_SECONDS', 60))
+
+@receiver(post_save, sender=models.Sensor)
+@receiver(post_delete, sender=models.Sensor)
+def _sensor_changed(sender, **kwargs):
+    """Clears the transform cache when a Sensor is saved or deleted.  The whole cache
+    is cleared because a save can change the Sensor ID.
     """
+    transform_cache.clear()
 
-    # get the Sensor object, if available, to see if there is a transform function
-    sensors = models.Sensor.objects.filter( sensor_id=reading_id )
+def transform_settings(reading_id):
+    """Returns the transform function name and the transform parameters of the Sensor
+    'reading_id', as a two-tuple of strings.  The strings are empty if there is no
+    Sensor or it is a calculated field.
+    """
+    # get the Sensor fields, if available, to see if there is a transform function
+    sensor = transform_cache.get(reading_id)
+    if sensor is not None:
+        # Don't do a transform if this is a calculated field
+        is_calculated, tran_calc_function, function_parameters = sensor
+        if not is_calculated:
+            return tran_calc_function, function_parameters
     # default to no transformation
-    transform_func = ''
-    transform_params = ''
-    if len(sensors) > 0: 
-        # look at the first sensor (there only should be one).  Don't do a transform if this
-        # is a calculated field
-        if not sensors[0].is_calculated:
-            transform_func = sensors[0].tran_calc_function
-            transform_params = sensors[0].function_parameters
+    return '', ''
 
+def decode_val(val):
+    """Returns the reading value 'val', with a non-numerical string converted to a
+    float value.  Other values are returned unchanged.
+    """
     # If val is a string, decode it into a float value
     if type(val) in (str, str):
         if ('True' in val) or ('Closed' in val) or ('On' in val) or (val.startswith('Motion') or (val.startswith('Light')) or (val.startswith('Voltage'))):
@@ -47,6 +149,19 @@ def convert_val(ts, reading_id, val, db):
             # convert to float the first decimal number
             parts = re.match(r'(-?\d+)\.?(\d+)?', val).groups('0')
             val = float( parts[0] + '.' + parts[1] )
+    return val
+
+def convert_val(ts, reading_id, val, db):
+    """Takes a raw reading values 'ts', 'reading_id', and 'val' and converts them
+    to a form suitable for storage in the reading database.  If a transform 
+    function applies to the reading_id, it is applied.  Also, non-numerical 
+    string 'val's are converted to numeric values suitable for storage as a float.
+    'db' is a bmsdata.BMSdata reading database object.
+    Returned is the tuple (ts, reading_id, val) as any of these could be
+    transformed by the transform function.
+    """
+    transform_func, transform_params = transform_settings(reading_id)
+    val = decode_val(val)
 
     # if there is a transform function passed, use it to convert the reading values
     if len(transform_func.strip()):
@@ -55,6 +170,60 @@ def convert_val(ts, reading_id, val, db):
 
     return ts, reading_id, val
 
+def convert_vals(readings, db):
+    """Batch version of convert_val() for the list of (ts, reading_id, val) tuples
+    'readings'.  Returns a list of the converted (ts, reading_id, val) tuples.  The
+    readings of each sensor with a transform function are transformed together by
+    Transformer.transform_values(), in their original order, and are returned after
+    the readings without a transform.  A reading that can't be converted is logged
+    and left out.
+    """
+    # load the transform settings of all the sensors with one query
+    transform_cache.load(reading[1] for reading in readings)
+
+    converted = []
+    groups = {}    # reading_id -> (transform function, parameters, ts list, val list)
+    for ts, reading_id, val in readings:
+        try:
+            transform_func, transform_params = transform_settings(reading_id)
+            val = decode_val(val)
+        except Exception:
+            _logger.exception('Error storing %s, %s, %s' % (ts, reading_id, val))
+            continue
+        if len(transform_func.strip()):
+            group = groups.setdefault(reading_id, (transform_func, transform_params, [], []))
+            group[2].append(ts)
+            group[3].append(val)
+        else:
+            converted.append((ts, reading_id, val))
+
+    trans = transforms.Transformer(db)
+    for reading_id, (transform_func, transform_params, ts_list, val_list) in groups.items():
+        try:
+            converted += trans.transform_values(ts_list, reading_id, val_list, transform_func, transform_params)
+        except Exception:
+            _logger.exception('Error transforming the readings of %s' % reading_id)
+    return converted
+
+def spool_enabled():
+    """Returns True if incoming readings are appended to the ingest spool for the
+    'spool_writer' script to store, instead of being stored during the request.
+    """
+    return getattr(settings, 'BMSAPP_INGEST_SPOOL', False)
+
+def get_spool():
+    """Returns the ReadingSpool that incoming readings are appended to in spool mode.
+    """
+    return spool.ReadingSpool(getattr(settings, 'BMSAPP_INGEST_SPOOL_FILE', None) or spool.DEFAULT_SPOOL)
+
+def spool_readings(raw_readings):
+    """Appends the list of unconverted (ts, reading_id, val) readings 'raw_readings' to
+    the ingest spool.  Returns a message like the one returned by the database insert
+    methods.
+    """
+    count = get_spool().append(raw_readings)
+    return '%s readings queued for storage.' % count
+
 def store(reading_id, request_data):
     """Stores a reading into the Reading database.
     'reading_id' is the ID of the sensor or calculated reading to store.
@@ -63,16 +232,14 @@ def store(reading_id, request_data):
             for various formats that 'val' can take.
         The optional 'ts' key holds a date/time string in UTC for the timestamp 
             of the reading. If not present, the current time is used.
+    In spool mode, the reading is appended to the ingest spool instead.
     Returns the message returned by the database insert method.
     """
 
-    # open the database 
-    db = bmsdata.BMSdata()
-    
     # parse the date into a datetime object and then into Unix seconds. Convert to
     # integer.
     if 'ts' in request_data:
-        ts = int( calendar.timegm(dateutil.parser.parse(request_data['ts']).timetuple()) )
+        ts = timestamps.utc_seconds(request_data['ts'])
     else:
         # no timestamp in query parameters, so assume the timestamp is now.
         ts = int(time.time())
@@ -80,6 +247,12 @@ def store(reading_id, request_data):
     # Get the value from the request
     val = request_data['val']
 
+    if spool_enabled():
+        return spool_readings([(ts, reading_id, val)])
+
+    # open the database 
+    db = bmsdata.BMSdata()
+
     # Convert/transform the fields for storage.
     ts, reading_id, val = convert_val(ts, reading_id, val, db)
     
@@ -100,15 +273,21 @@ def store_many(req_data):
     'format' = 'particle': format used by Webhook calls generated by Particle
     Photon and Electron devices.
 
+    In spool mode, the readings are appended to the ingest spool instead.
     Returns the message returned by the database insert method.
     """
-
-    # open the reading database 
-    db = bmsdata.BMSdata()
-
-    ts_lst = []
-    reading_id_lst = []
-    val_lst = []
+    raw_readings = parse_readings(req_data)
+    if spool_enabled():
+        return spool_readings(raw_readings)
+    return store_raw_readings(raw_readings)
+
+def parse_readings(req_data):
+    """Returns the list of (ts, reading_id, val) readings held in the store_many()
+    request data 'req_data', before they are converted for storage.  Missing timestamps
+    are filled in with the current time.
+    """
+    # the (ts, reading_id, val) readings before conversion
+    raw_readings = []
 
     if not ('format' in req_data):
         # No 'format' key present.  This is conventional Mini-Monitor style data
@@ -117,18 +296,13 @@ def store_many(req_data):
         #     1:  Unix timestamp of the reading.
         #         If None, the current time is substituted.
         #     2:  The reading id.
-        #     3:  The reading value.  convert_val() is used to convert/transform
+        #     3:  The reading value.  convert_vals() is used to convert/transform
         #         the value before storage.
 
         for ts, reading_id, val in req_data['readings']:
             try:
                 ts = int(ts) if ts is not None else int(time.time())
-
-                # Convert/transform the fields for storage.
-                ts, reading_id, val = convert_val(ts, reading_id, val, db)
-                ts_lst.append(ts)
-                reading_id_lst.append(reading_id)
-                val_lst.append(val)  # could be None, but insert_reading() will ignore it
+                raw_readings.append((ts, reading_id, val))
             except Exception as e:
                 _logger.exception('Error storing %s, %s, %s' % (ts, reading_id, val))
 
@@ -138,23 +312,21 @@ def store_many(req_data):
 
         if 'sensorMessages' in req_data:
             # loop through and insert all of the sensor readings present in the
-            # data payload
-            for reading in req_data['sensorMessages']:
+            # data payload.  The message dates are parsed together first.
+            messages = req_data['sensorMessages']
+            message_ts = timestamps.utc_seconds_many(
+                [reading.get('messageDate') if isinstance(reading, dict) else None for reading in messages])
+            for reading, ts in zip(messages, message_ts):
                 try:
-                    ts = int(calendar.timegm(dateutil.parser.parse(reading['messageDate']).timetuple()))
+                    if ts is None:
+                        raise ValueError('Invalid messageDate')
 
                     # sometimes multiple plot values are encoded by separating with the pipe character
                     # This happens with the CO sensor and the two channel relay.  Use the first value.
                     val = reading['plotValues'].split('|')[0]
 
                     reading_id = reading['sensorID']
-
-                    # apply any requested conversions
-                    ts, reading_id, val = convert_val(ts, reading_id, val, db)
-
-                    ts_lst.append(ts)
-                    val_lst.append(val)
-                    reading_id_lst.append(reading_id)
+                    raw_readings.append((ts, reading_id, val))
 
                 except Exception as e:
                     _logger.exception('Error storing %s' % reading)
@@ -184,7 +356,7 @@ def store_many(req_data):
         #              period.  The 'a' adjustment can be used to produce this midpoint timestamp.
 
         # get the timestamp and convert to UNIX epoch format.
-        ts_base = int( calendar.timegm(dateutil.parser.parse(req_data['published_at']).timetuple()) )
+        ts_base = timestamps.utc_seconds(req_data['published_at'])
 
         # get the base for the sensor id, which is the coreid of the Particle board
         base_id = req_data['coreid']
@@ -214,18 +386,156 @@ def store_many(req_data):
                 else:
                     ts = ts_base
                     val = float(val)
-
-                # Convert/transform the fields for storage.
-                ts, reading_id, val = convert_val(ts, reading_id, val, db)
-                ts_lst.append(ts)
-                reading_id_lst.append(reading_id)
-                val_lst.append(val)  # could be None, but insert_reading() will ignore it
+                raw_readings.append((ts, reading_id, val))
 
             except Exception as e:
                 _logger.exception('Error storing %s, %s' % (reading_id, val))
 
+    return raw_readings
+
+def store_raw_readings(raw_readings, db=None):
+    """Converts the list of (ts, reading_id, val) readings 'raw_readings' returned by
+    parse_readings() and stores them with one batch insert in the BMSdata Reading
+    database 'db', or the standard Reading database if 'db' is None.
+    Returns the message returned by the database insert method.
+    """
+    # open the reading database 
+    own_db = db is None
+    if own_db:
+        db = bmsdata.BMSdata()
+
+    # Convert/transform the readings for storage, a sensor at a time.  A value could
+    # be None, but insert_reading_batch() will ignore it.
+    readings = convert_vals(raw_readings, db)
+
     # insert the readings into the database
-    msg = db.insert_reading(ts_lst, reading_id_lst, val_lst)
-    db.close()
+    msg = db.insert_reading_batch([r[0] for r in readings], [r[1] for r in readings], [r[2] for r in readings])
+    if own_db:
+        db.close()
+
+    return msg
 
+# First bytes of a post in the binary format (see decode_binary()).
+BINARY_MAGIC = b'BMR1'
+# Header of a post in the binary format, after BINARY_MAGIC: the number of sensor IDs,
+# the number of readings and the length of the sensor ID block.
+BINARY_HEADER = struct.Struct('<III')
+
+def decode_binary(data):
+    """Decodes the bytes 'data' of a post in the compact binary format used by
+    high-volume gateways, which holds the readings as columns.  All numbers are
+    little-endian:
+
+        4 bytes            b'BMR1'
+        uint32             number of sensor IDs, N
+        uint32             number of readings, R
+        uint32             length in bytes of the sensor ID block, L
+        L bytes            the N sensor IDs, UTF-8 encoded and separated by newlines
+        R x uint32         position in the sensor ID list of each reading's sensor
+        R x int64          Unix timestamp of each reading, 0 for the time received
+        R x float64        value of each reading
+
+    The whole post may be compressed with zlib or gzip.  Returns a four-tuple: the list
+    of sensor IDs, and NumPy arrays of the sensor ID positions, timestamps and values.
+    Raises ValueError if the data is not in this format.
+    """
+    if not data.startswith(BINARY_MAGIC):
+        try:
+            # accepts either a zlib or a gzip header
+            data = zlib.decompress(data, 47)
+        except zlib.error:
+            raise ValueError('Post is not in the binary reading format.')
+        if not data.startswith(BINARY_MAGIC):
+            raise ValueError('Post is not in the binary reading format.')
+    pos = len(BINARY_MAGIC)
+    if len(data) < pos + BINARY_HEADER.size:
+        raise ValueError('Binary reading post is truncated.')
+    id_count, reading_count, id_bytes = BINARY_HEADER.unpack_from(data, pos)
+    pos += BINARY_HEADER.size
+    if len(data) != pos + id_bytes + reading_count * 20:
+        raise ValueError('Binary reading post has the wrong length.')
+    sensor_ids = data[pos:pos + id_bytes].decode('utf-8').split('\n') if id_count else []
+    if len(sensor_ids) != id_count:
+        raise ValueError('Binary reading post has the wrong number of sensor IDs.')
+    pos += id_bytes
+    id_index = np.frombuffer(data, dtype='<u4', count=reading_count, offset=pos)
+    ts = np.frombuffer(data, dtype='<i8', count=reading_count, offset=pos + reading_count * 4)
+    vals = np.frombuffer(data, dtype='<f8', count=reading_count, offset=pos + reading_count * 12)
+    if reading_count and id_index.max() >= id_count:
+        raise ValueError('Binary reading post has a sensor ID position out of range.')
+    return sensor_ids, id_index, ts, vals
+
+def encode_binary(ts, ids, vals, compress=True):
+    """Returns the lists of timestamps, sensor IDs and values 'ts', 'ids' and 'vals'
+    encoded in the binary format read by decode_binary(), compressed with zlib if
+    'compress' is True.  A timestamp of None is encoded as 0, the time received.
+    """
+    sensor_ids = list(dict.fromkeys(str(one_id) for one_id in ids))
+    positions = {sensor_id: i for i, sensor_id in enumerate(sensor_ids)}
+    id_block = '\n'.join(sensor_ids).encode('utf-8')
+    data = b''.join([
+        BINARY_MAGIC,
+        BINARY_HEADER.pack(len(sensor_ids), len(ts), len(id_block)),
+        id_block,
+        np.array([positions[str(one_id)] for one_id in ids], dtype='<u4').tobytes(),
+        np.array([0 if one_ts is None else one_ts for one_ts in ts], dtype='<i8').tobytes(),
+        np.array(vals, dtype='<f8').tobytes(),
+    ])
+    return zlib.compress(data) if compress else data
+
+def store_arrays(sensor_ids, id_index, ts, vals, db=None):
+    """Stores the readings returned by decode_binary() in the BMSdata Reading database
+    'db', or the standard Reading database if 'db' is None.  Reading i is for the sensor
+    'sensor_ids[id_index[i]]' and has the timestamp 'ts[i]' (0 for the current time)
+    and value 'vals[i]'.  The readings of sensors with a transform function are
+    transformed a sensor at a time, and all are stored with one insert from the arrays.
+    In spool mode, the readings are appended to the ingest spool instead.
+    Returns the message returned by the database insert method.
+    """
+    ts = np.where(ts == 0, int(time.time()), ts)
+    if spool_enabled():
+        return spool_readings(list(zip(ts.tolist(), [sensor_ids[i] for i in id_index.tolist()], vals.tolist())))
+
+    # open the reading database 
+    own_db = db is None
+    if own_db:
+        db = bmsdata.BMSdata()
+
+    # transform the readings of the sensors with a transform function, adding their
+    # results to the end of the arrays.
+    transform_cache.load(sensor_ids)
+    transformed = [i for i, sensor_id in enumerate(sensor_ids) if len(transform_settings(sensor_id)[0].strip())]
+    if transformed:
+        sensor_ids = list(sensor_ids)
+        positions = {sensor_id: i for i, sensor_id in enumerate(sensor_ids)}
+        keep = ~np.isin(id_index, transformed)
+        new_index, new_ts, new_vals = [], [], []
+        trans = transforms.Transformer(db)
+        for i in transformed:
+            in_sensor = id_index == i
+            if not in_sensor.any():
+                continue
+            transform_func, transform_params = transform_settings(sensor_ids[i])
+            try:
+                results = trans.transform_values(ts[in_sensor], sensor_ids[i], vals[in_sensor],
+                                                 transform_func, transform_params)
+            except Exception:
+                _logger.exception('Error transforming the readings of %s' % sensor_ids[i])
+                continue
+            for one_ts, reading_id, val in results:
+                if val is None:
+                    continue
+                if reading_id not in positions:
+                    positions[reading_id] = len(sensor_ids)
+                    sensor_ids.append(reading_id)
+                new_index.append(positions[reading_id])
+                new_ts.append(one_ts)
+                new_vals.append(val)
+        id_index = np.concatenate([id_index[keep], np.array(new_index, dtype=np.int64)])
+        ts = np.concatenate([ts[keep], np.array(new_ts, dtype=np.int64)])
+        vals = np.concatenate([vals[keep], np.array(new_vals, dtype=float)])
+
+    msg = db.insert_reading_arrays(sensor_ids, id_index, ts, vals)
+    if own_db:
+        db.close()
     return msg
@@ -0,0 +1,325 @@
+"""Tests of the BMSdata Reading database in bmsapp/readingdb/bmsdata.py.  The tests in
+ReadingDbTests are run against each of the storage engines in bmsapp/readingdb/storage.py.
+"""
+import os
+import sqlite3
+import tempfile
+import time
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pytz
+from django.test import SimpleTestCase, override_settings
+
+from bmsapp.readingdb import bmsdata, storage, archive, retention
+
+# Start of a UTC month, used for archive tests.
+MONTH_TS = 1580515200     # 2020-02-01 00:00:00 UTC
+
+
+class ReadingDbTests:
+    """Tests of a Reading database using the storage engine 'engine'.  Mixed into a
+    SimpleTestCase for each storage engine below.
+    """
+
+    engine = None
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.fname = os.path.join(self.dir.name, 'readings.sqlite')
+        test_settings = override_settings(BMSAPP_READING_DB_SHARDS=1, BMSAPP_READING_DB_LATEST_CACHE_SECONDS=0)
+        test_settings.enable()
+        self.addCleanup(test_settings.disable)
+        # the new reading hooks need the Django database
+        patcher = mock.patch.object(bmsdata, 'run_new_reading_hook')
+        self.hook = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.db = bmsdata.BMSdata(self.fname, storage_engine=self.engine)
+
+    def tearDown(self):
+        self.db.close()
+        bmsdata.close_connections()
+        self.dir.cleanup()
+
+    def readings(self, sensor_id, db=None):
+        """Returns the readings of 'sensor_id' as a list of (ts, val) tuples.
+        """
+        return [(r['ts'], r['val']) for r in (db or self.db).rowsForOneID(sensor_id)]
+
+    def test_engine(self):
+        self.assertEqual(self.db.storage.name, self.engine)
+        self.db.insert_reading(10, 'temp', 1.0)
+        self.db.close()
+        bmsdata.close_connections()
+        # an existing database keeps its engine whatever the requested one
+        other = [e for e in storage.ENGINES if e != self.engine][0]
+        self.db = bmsdata.BMSdata(self.fname, storage_engine=other)
+        self.assertEqual(self.db.storage.name, self.engine)
+        self.assertEqual(self.readings('temp'), [(10, 1.0)])
+
+    def test_insert_reading(self):
+        msg = self.db.insert_reading([30, 10, 20, 40, 50], ['temp'] * 5, [3, 1.0, 2.0, None, float('nan')])
+        self.assertEqual(msg, '3 readings stored successfully, 0 rejected.')
+        self.assertEqual(self.readings('temp'), [(10, 1.0), (20, 2.0), (30, 3.0)])
+        ts, vals = self.db.arraysForOneID('temp', 15, 30)
+        self.assertEqual(ts.tolist(), [20, 30])
+        self.assertEqual(vals.tolist(), [2.0, 3.0])
+
+    def test_insert_reading_records(self):
+        self.db.insert_reading([10, 30, 20], ['temp', 'temp', 'rh'], [1.0, 3.0, 50.0])
+        # a reading replacing a stored one
+        self.db.insert_reading(30, 'temp', 4.0)
+        self.assertEqual(self.db.last_reads(['temp', 'rh']),
+                         {'temp': {'ts': 30, 'val': 4.0}, 'rh': {'ts': 20, 'val': 50.0}})
+        stats = self.db.sensor_stats()
+        self.assertEqual({s_id: (rec['count'], rec['first_ts'], rec['last_ts']) for s_id, rec in stats.items()},
+                         {'temp': (2, 10, 30), 'rh': (1, 20, 20)})
+        self.assertEqual(self.hook.call_args_list,
+                         [mock.call('temp', 10, 1.0), mock.call('temp', 30, 3.0), mock.call('rh', 20, 50.0),
+                          mock.call('temp', 30, 4.0)])
+
+    def test_upsert_conflicts(self):
+        self.db.insert_reading(10, 'temp', 1.0)
+        self.db.insert_reading(10, 'temp', 2.0)
+        self.assertEqual(self.readings('temp'), [(10, 2.0)])
+
+        # within a batch, the last reading with a timestamp is kept
+        msg = self.db.insert_reading_batch([10, 20, 20], ['temp'] * 3, [3.0, 4.0, 5.0])
+        self.assertEqual(msg, '3 readings stored successfully, 0 rejected.')
+        self.assertEqual(self.readings('temp'), [(10, 3.0), (20, 5.0)])
+
+        self.db.insert_reading_arrays(['temp', 'rh'], [0, 1, 0], [20, 20, 30], [6.0, 50.0, 7.0])
+        self.assertEqual(self.readings('temp'), [(10, 3.0), (20, 6.0), (30, 7.0)])
+        self.assertEqual(self.readings('rh'), [(20, 50.0)])
+        self.assertEqual(self.db.reading_count('temp'), 3)
+        self.assertEqual(self.db.last_read('temp'), {'ts': 30, 'val': 7.0})
+
+    def test_rejected_values(self):
+        msg = self.db.insert_reading_batch([10, 20], ['temp', 'temp'], [1.0, 'abc'])
+        self.assertEqual(msg, '1 readings stored successfully, 1 rejected.')
+        self.assertEqual(self.readings('temp'), [(10, 1.0)])
+
+    def test_failed_group_rolled_back(self):
+        self.db.insert_reading(5, 'temp', 0.5)
+        # the second reading of each failing group can't be stored after the first is
+        with self.assertLogs('bms.bmsapp.readingdb.bmsdata', 'WARNING'):
+            counts = self.db._insert_groups({'temp': [(10, 1.0), (20, object())],
+                                             'rh': [(10, 50.0)],
+                                             'new': [(10, 1.0), (20, object())]})
+        self.assertEqual(counts, (1, 4))
+        self.assertEqual(self.readings('temp'), [(5, 0.5)])
+        self.assertEqual(self.readings('rh'), [(10, 50.0)])
+        self.assertFalse(self.db.sensor_id_exists('new'))
+        self.assertNotIn('new', self.db.sensor_id_list())
+        self.assertEqual(self.db.last_read('temp'), {'ts': 5, 'val': 0.5})
+
+    def test_case_insensitive_ids(self):
+        self.db.insert_reading(10, 'Temp_A', 1.0)
+        self.db.insert_reading_batch([20], ['temp_a'], [2.0])
+        self.assertTrue(self.db.sensor_id_exists('TEMP_A'))
+        self.assertEqual(self.db.sensor_id_list(), ['Temp_A'])
+        self.assertEqual(self.readings('temp_a'), [(10, 1.0), (20, 2.0)])
+        self.assertEqual(self.readings('TEMP_A'), [(10, 1.0), (20, 2.0)])
+        self.assertEqual(self.db.last_read('tEmP_a'), {'ts': 20, 'val': 2.0})
+
+    def test_merge_readings(self):
+        self.db.insert_reading_batch([10, 20, 30], ['old'] * 3, [1.0, 2.0, 3.0])
+        self.db.insert_reading_batch([20, 40], ['new'] * 2, [20.0, 40.0])
+        self.db.merge_readings('old', 'new', 'ts < 20')
+        self.db.commit()
+        self.assertEqual(self.readings('new'), [(10, 1.0), (20, 20.0), (40, 40.0)])
+        self.assertEqual(self.readings('old'), [(10, 1.0), (20, 2.0), (30, 3.0)])
+        self.assertEqual(self.db.last_read('new'), {'ts': 40, 'val': 40.0})
+        self.assertEqual(self.db.sensor_time_range('new'), (10, 40))
+
+        # readings with timestamps already in the destination are not merged
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.db.merge_readings('old', 'new')
+        self.db.conn.rollback()
+        self.assertEqual(self.readings('new'), [(10, 1.0), (20, 20.0), (40, 40.0)])
+
+    def test_merge_then_delete_sensor(self):
+        # the sequence used by the merge sensors view: nothing is committed until the end
+        self.db.insert_reading_batch([10, 20], ['old'] * 2, [1.0, 2.0])
+        self.db.insert_reading_batch([30], ['new'], [3.0])
+        self.db.merge_readings('old', 'new')
+        self.db.delete_sensor('old', commit=False)
+        self.db.commit()
+        self.db.close()
+        db = bmsdata.BMSdata(self.fname)
+        self.assertFalse(db.sensor_id_exists('old'))
+        self.assertEqual(self.readings('new', db), [(10, 1.0), (20, 2.0), (30, 3.0)])
+
+    def test_delete_readings(self):
+        self.db.insert_reading_batch([10, 20, 30], ['temp'] * 3, [1.0, 2.0, 3.0])
+        self.db.delete_readings('temp', 'ts > 15')
+        self.assertEqual(self.readings('temp'), [(10, 1.0)])
+        self.assertEqual(self.db.last_read('temp'), {'ts': 10, 'val': 1.0})
+        self.assertEqual(self.db.sensor_time_range('temp'), (10, 10))
+        self.db.delete_readings('temp')
+        self.assertTrue(self.db.sensor_id_exists('temp'))
+        self.assertEqual(self.readings('temp'), [])
+        self.assertIsNone(self.db.last_read('temp'))
+
+    def test_delete_sensor(self):
+        self.db.insert_reading_batch([10, 20], ['temp', 'rh'], [1.0, 50.0])
+        self.db.delete_sensor('TEMP')
+        self.assertFalse(self.db.sensor_id_exists('temp'))
+        self.assertEqual(self.db.sensor_id_list(), ['rh'])
+        self.assertEqual(self.readings('temp'), [])
+        self.assertEqual(self.db.last_reads(['temp', 'rh']), {'temp': None, 'rh': {'ts': 20, 'val': 50.0}})
+        # the sensor can be added again
+        self.db.insert_reading(30, 'temp', 3.0)
+        self.assertEqual(self.readings('temp'), [(30, 3.0)])
+
+    def test_last_reads(self):
+        self.db.insert_reading_batch([10, 20, 30, 15], ['temp', 'temp', 'temp', 'rh'], [1.0, 2.0, 3.0, 50.0])
+        self.assertEqual(self.db.last_reads(['temp', 'RH', 'missing']),
+                         {'temp': {'ts': 30, 'val': 3.0}, 'RH': {'ts': 15, 'val': 50.0}, 'missing': None})
+        self.assertEqual(self.db.last_read('temp', read_count=2), [{'ts': 30, 'val': 3.0}, {'ts': 20, 'val': 2.0}])
+        self.assertIsNone(self.db.last_read('missing'))
+        # an older reading does not replace the last reading
+        self.db.insert_reading_batch([5], ['temp'], [0.5])
+        self.assertEqual(self.db.last_read('temp'), {'ts': 30, 'val': 3.0})
+
+    def test_reading_count(self):
+        future_ts = int(time.time()) + 86400
+        self.db.insert_reading_batch([10, 20, 30, 100, future_ts], ['a', 'a', 'a', 'b', 'b'], [1.0] * 5)
+        # readings are selected by their timestamps, not when they were inserted
+        self.assertEqual(self.db.readingCount(), 4)
+        self.assertEqual(self.db.readingCount(15), 3)
+        self.assertEqual(self.db.readingCount(10, 30), 1)
+        self.assertEqual(self.db.readingCount(100), 0)
+        self.assertEqual(self.db.readingCount(0, future_ts + 1), 5)
+        self.assertEqual(self.db.inserted_count(time.time() - 86400), 5)
+        self.assertEqual(self.db.inserted_count(time.time() - 2 * 86400, time.time() - 86400), 0)
+
+    def test_dataframe_for_multiple_ids(self):
+        self.db.insert_reading_batch([10, 20, 20, 30], ['a', 'a', 'b', 'b'], [1.0, 2.0, 20.0, 30.0])
+        df = self.db.dataframeForMultipleIDs(['b', 'missing', 'A'], ['col_b', 'col_m', 'col_a'])
+        self.assertEqual(list(df.columns), ['col_b', 'col_m', 'col_a'])
+        self.assertEqual(list(df.index), list(pd.to_datetime([10, 20, 30], unit='s')))
+        np.testing.assert_array_equal(df.values, [[np.nan, np.nan, 1.0], [20.0, np.nan, 2.0], [30.0, np.nan, np.nan]])
+
+        df = self.db.dataframeForMultipleIDs(['a', 'b'], start_ts=15, end_ts=25, tz=pytz.timezone('US/Alaska'))
+        self.assertEqual(list(df.index), [pd.Timestamp('1969-12-31 14:00:20')])
+        self.assertEqual(df.values.tolist(), [[2.0, 20.0]])
+        self.assertIsNone(self.db.dataframeForMultipleIDs([]))
+
+    def test_archive(self):
+        day = 86400
+        ts = [MONTH_TS - 40 * day, MONTH_TS - 5 * day, MONTH_TS, MONTH_TS + 5 * day]
+        self.db.insert_reading_batch(ts, ['temp'] * 4, [1.0, 2.0, 3.0, 4.0])
+        self.db.insert_reading_batch([MONTH_TS], ['rh'], [50.0])
+        archive.create_archive_table(self.db)
+        self.assertEqual(archive.archive_sensor(self.db, 'temp', MONTH_TS), 2)
+        self.assertEqual(self.db.reading_count('temp'), 4)
+        self.assertEqual(self.db.reading_count('temp', 'val < 3'), 2)
+
+        # archived readings are still returned by the read methods
+        expected = list(zip(ts, [1.0, 2.0, 3.0, 4.0]))
+        self.assertEqual(self.readings('temp'), expected)
+        arr_ts, arr_vals = self.db.arraysForOneID('temp')
+        self.assertEqual(list(zip(arr_ts.tolist(), arr_vals.tolist())), expected)
+        self.assertEqual(self.db.sensor_time_range('temp'), (ts[0], ts[-1]))
+        self.assertEqual(self.db.readingCount(), 5)
+        self.assertEqual(self.db.readingCount(ts[0]), 4)
+        df = self.db.dataframeForMultipleIDs(['temp', 'rh'], start_ts=MONTH_TS - 10 * day)
+        self.assertEqual(df['temp'].tolist(), [2.0, 3.0, 4.0])
+        self.assertEqual(df['rh'].fillna(0).tolist(), [0, 50.0, 0])
+
+        # a late reading stored in the database replaces the archived one
+        self.db.insert_reading_batch([MONTH_TS - 5 * day], ['temp'], [2.5])
+        self.assertEqual(self.readings('temp')[1], (MONTH_TS - 5 * day, 2.5))
+
+        self.db.delete_sensor('temp')
+        self.assertIsNone(archive.archived_to(self.db, 'temp'))
+        self.assertEqual(self.readings('temp'), [])
+
+    def archived_sensor(self, sensor_id):
+        """Stores readings for 'sensor_id' before and after MONTH_TS and archives the
+        earlier ones.  Returns the (ts, val) readings stored.
+        """
+        day = 86400
+        rows = [(MONTH_TS - 40 * day, 1.0), (MONTH_TS - 5 * day, 2.0), (MONTH_TS + 5 * day, 3.0)]
+        self.db.insert_reading_batch([r[0] for r in rows], [sensor_id] * len(rows), [r[1] for r in rows])
+        archive.create_archive_table(self.db)
+        archive.archive_sensor(self.db, sensor_id, MONTH_TS)
+        return rows
+
+    def test_merge_archived_sensor(self):
+        rows = self.archived_sensor('old')
+        self.db.insert_reading_batch([MONTH_TS + 10 * 86400], ['new'], [4.0])
+        # the sequence used by the merge sensors view with 'delete' on
+        self.db.merge_readings('old', 'new')
+        self.db.delete_sensor('old', commit=False)
+        self.db.commit()
+        self.assertEqual(self.readings('new'), rows + [(MONTH_TS + 10 * 86400, 4.0)])
+        self.assertEqual(self.db.reading_count('new'), 4)
+        self.assertEqual(self.db.sensor_time_range('new'), (rows[0][0], MONTH_TS + 10 * 86400))
+
+    def test_delete_archived_readings(self):
+        rows = self.archived_sensor('temp')
+        self.assertEqual(self.db.reading_count('temp', 'val > 1'), 2)
+        self.db.delete_readings('temp', 'val > 1')
+        self.assertEqual(self.readings('temp'), rows[:1])
+        self.assertEqual(self.db.reading_count('temp'), 1)
+        self.assertEqual(self.db.sensor_stats(['temp'])['temp']['count'], 1)
+
+        # with no archived readings left, the sensor has no archive
+        self.db.delete_readings('temp')
+        self.assertEqual(self.readings('temp'), [])
+        self.assertIsNone(archive.archived_to(self.db, 'temp'))
+        self.assertEqual(archive.month_files(self.db.db_fname, 'temp'), [])
+
+    def test_retention_resume(self):
+        self.assertIsNone(retention.resume_after(self.db))
+        retention.set_resume_after(self.db, 'temp_a')
+        retention.set_resume_after(self.db, 'temp_b')
+        self.assertEqual(retention.resume_after(self.db), 'temp_b')
+        self.assertNotIn(retention.STATUS_TABLE, self.db.sensor_id_list())
+
+
+class SharedConnectionTest(SimpleTestCase):
+    """Tests of the connection shared by the BMSdata objects in a thread.
+    """
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.fname = os.path.join(self.dir.name, 'readings.sqlite')
+        patcher = mock.patch.object(bmsdata, 'run_new_reading_hook')
+        self.hook = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        bmsdata.close_connections()
+        self.dir.cleanup()
+
+    def test_close_keeps_other_objects_work(self):
+        a = bmsdata.BMSdata(self.fname)
+        a.insert_reading(10, 'temp', 1.0)
+        b = bmsdata.BMSdata(self.fname)
+        self.assertIs(a.conn, b.conn)
+        a.cursor.execute(a.storage.insert_sql('temp'), (20, 2.0))
+        b.close()
+        a.commit()
+        self.assertEqual(len(a.rowsForOneID('temp')), 2)
+        a.close()
+
+    def test_last_close_rolls_back(self):
+        a = bmsdata.BMSdata(self.fname)
+        a.insert_reading(10, 'temp', 1.0)
+        a.cursor.execute(a.storage.insert_sql('temp'), (20, 2.0))
+        a.close()
+        b = bmsdata.BMSdata(self.fname)
+        self.assertEqual(len(b.rowsForOneID('temp')), 1)
+        b.close()
+
+
+class TablePerSensorTest(ReadingDbTests, SimpleTestCase):
+    engine = storage.TABLE_PER_SENSOR
+
+
+class SingleTableTest(ReadingDbTests, SimpleTestCase):
+    engine = storage.SINGLE_TABLE
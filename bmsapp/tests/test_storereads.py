@@ -0,0 +1,33 @@
+"""Tests of the Sensor transform cache in bmsapp/storereads.py.
+"""
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from bmsapp import storereads
+
+
+class SensorTransformCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = storereads.SensorTransformCache(60)
+        patcher = mock.patch.object(storereads.models.Sensor, 'objects')
+        self.objects = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.objects.filter.return_value.values_list.return_value = [('temp', False, 'val * 2', '')]
+
+    def test_get(self):
+        self.assertEqual(self.cache.get('temp'), (False, 'val * 2', ''))
+        self.assertIsNone(self.cache.get('missing'))
+        self.assertEqual(self.cache.get('temp'), (False, 'val * 2', ''))
+        self.assertEqual(self.cache.stats(), {'entries': 2, 'hits': 1, 'misses': 2})
+
+    def test_cleared_while_loading(self):
+        # a Sensor saved by another thread while the cache loads it
+        def clear_then_query(**kwargs):
+            self.cache.clear()
+            return mock.DEFAULT
+        self.objects.filter.side_effect = clear_then_query
+        self.assertEqual(self.cache.get('temp'), (False, 'val * 2', ''))
+        # the possibly stale entry is not cached
+        self.assertEqual(self.cache.entries, {})
@@ -0,0 +1,65 @@
+"""Tests of the bulk text file importer in bmsapp/readingdb/textimport.py.
+"""
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytz
+from django.test import SimpleTestCase
+
+from bmsapp.readingdb import bmsdata, textimport
+
+
+class ParseTimestampsTest(SimpleTestCase):
+
+    def check_same_as_dateutil(self, datestrs, tz_name='US/Alaska'):
+        """Checks that parse_timestamps() gives the same results as parsing each of the
+        strings in the list 'datestrs' with the dateutil parser.
+        """
+        tz = pytz.timezone(tz_name)
+        expected = []
+        for datestr in datestrs:
+            try:
+                expected.append(textimport._parse_one(datestr, tz))
+            except Exception:
+                expected.append(np.nan)
+        result = textimport.parse_timestamps(pd.Series(datestrs), tz)
+        np.testing.assert_array_equal(result, np.array(expected, dtype=float))
+
+    def test_first_day_above_12(self):
+        # the first string must not make the rest of the strings be read day first
+        result = textimport.parse_timestamps(pd.Series(['13/04/2014 10:00', '04/12/2014 10:00']), pytz.utc)
+        self.assertEqual(result.tolist(), [1397383200, 1397296800])
+        self.check_same_as_dateutil(['13/04/2014 10:00', '04/12/2014 10:00', '05/01/2014 08:30'])
+
+    def test_month_first(self):
+        self.check_same_as_dateutil(['04/12/2014 10:00', '13/04/2014 10:00', '12/31/2014 23:59', 'bad date'])
+
+    def test_iso(self):
+        self.check_same_as_dateutil(['2014-04-12 10:00:00', '2014-04-13T11:00:00-08:00', '4/14/2014 1:00 PM'])
+
+    def test_dst_change(self):
+        # ambiguous and skipped local times
+        self.check_same_as_dateutil(['2014-11-02 01:30:00', '2014-03-09 02:30:00', '2014-03-09 03:30:00'])
+
+
+class ImportTextFileTest(SimpleTestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db = bmsdata.BMSdata(os.path.join(self.dir.name, 'readings.sqlite'))
+
+    def tearDown(self):
+        self.db.close()
+        bmsdata.close_connections()
+        self.dir.cleanup()
+
+    def test_first_day_above_12(self):
+        fname = os.path.join(self.dir.name, 'readings.csv')
+        with open(fname, 'w') as f:
+            f.write('timestamp,temp\n13/04/2014 10:00,1.0\n04/12/2014 10:00,2.0\n')
+        count, errors = self.db.import_text_file(fname, tz_name='UTC')
+        self.assertEqual((count, errors), (2, []))
+        self.assertEqual([(r['ts'], r['val']) for r in self.db.rowsForOneID('temp')],
+                         [(1397296800, 2.0), (1397383200, 1.0)])
@@ -0,0 +1,77 @@
+"""Tests of the batch sensor reading transforms in bmsapp/calcs/transforms.py.
+"""
+import math
+from contextlib import nullcontext
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from bmsapp.calcs import transforms
+
+
+class TransformValuesTest(SimpleTestCase):
+
+    TS = [1000, 1060, 1120, 1180, 1240, 1300]
+    VALS = [4.0, 0.0, -4.0, float('nan'), 2.5, -0.0]
+
+    def setUp(self):
+        self.trans = transforms.Transformer()
+
+    def one_at_a_time(self, ts, vals, trans_func, trans_params):
+        """Returns the readings transformed one at a time with transform_value(), leaving
+        out the ones that raise, as transform_values() does.
+        """
+        results = []
+        for one_ts, one_val in zip(ts, vals):
+            try:
+                results.append(self.trans.transform_value(one_ts, 'id', one_val, trans_func, trans_params))
+            except Exception:
+                pass
+        return results
+
+    def check_same(self, trans_func, trans_params='', raises=False):
+        """Checks that transform_values() gives the same readings as transforming them one
+        at a time, for zero, negative and NaN values.  'raises' is True if transforming
+        some of the readings raises, which transform_values() logs.
+        """
+        with self.assertLogs('bms.bmsapp.calcs.transforms', 'ERROR') if raises else nullcontext():
+            result = self.trans.transform_values(np.array(self.TS), 'id', np.array(self.VALS),
+                                                 trans_func, trans_params)
+        expected = self.one_at_a_time(self.TS, self.VALS, trans_func, trans_params)
+        self.assertEqual(len(result), len(expected))
+        for (ts, id, val), (exp_ts, exp_id, exp_val) in zip(result, expected):
+            self.assertEqual((ts, id), (exp_ts, exp_id))
+            if math.isnan(exp_val):
+                self.assertTrue(math.isnan(val))
+            else:
+                self.assertEqual(val, exp_val)
+        return result
+
+    def test_linear(self):
+        self.check_same('linear', 'slope: 2.0\noffset: 1.0')
+
+    def test_expression(self):
+        self.check_same('val * 1.8 + 32')
+
+    def test_divide_by_zero(self):
+        result = self.check_same('1/val', raises=True)
+        # 1/0 and 1/-0.0 raise in the one at a time path
+        self.assertEqual(len(result), 4)
+
+    def test_sqrt_negative(self):
+        result = self.check_same('sqrt(val)', raises=True)
+        self.assertEqual(len(result), 5)
+
+    def test_log_zero(self):
+        self.check_same('log(val)', raises=True)
+
+    def test_default_params(self):
+        self.check_same('val + rollover')
+
+    def test_known_params(self):
+        self.check_same('val * 2', 'max_rate: 10.0')
+
+    def test_unknown_params(self):
+        result = self.check_same('val * slope', 'slope: 2.0', raises=True)
+        self.assertEqual(result, [])
+
@@ -0,0 +1,104 @@
+'''Parses the date/time strings received by the reading ingest paths into Unix
+timestamps.  Strings in the ISO 8601 style used by most senders, e.g.
+"2021-02-22T19:16:42.697091883Z", "2015-11-24 06:21:16" or "2013/01/01 12:00:00",
+are parsed directly; any other string is parsed by dateutil.  Results are cached, as
+many readings in a post, and many posts, share the same date/time string.
+'''
+import re
+import calendar
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+import dateutil.parser
+import numpy as np
+import pandas as pd
+
+# Number of date/time strings whose parsed result is cached.
+CACHE_SIZE = 4096
+
+# Matches the ISO 8601 style date/time strings handled without dateutil.  The groups
+# are year, month, day, hour, minute, second, fraction of a second and UTC offset.
+ISO_PATTERN = re.compile(
+    r'\s*(\d{4})([-/])(\d\d)\2(\d\d)[T ](\d\d):(\d\d)(?::(\d\d)(?:[.,](\d+))?)?\s*(Z|[+-]\d\d(?::?\d\d)?)?\s*$'
+)
+
+def _iso_fields(datestr):
+    '''Returns a two-tuple for the ISO 8601 style 'datestr': a naive datetime holding
+    its date and time (fractions of a second truncated to microseconds, like dateutil),
+    and its tzinfo, which is None if the string has no UTC offset.  Returns None if
+    'datestr' is not in that style.
+    '''
+    m = ISO_PATTERN.match(datestr)
+    if m is None:
+        return None
+    year, _, month, day, hour, minute, second, fraction, offset = m.groups()
+    try:
+        dt = datetime(int(year), int(month), int(day), int(hour), int(minute), int(second or 0),
+                      int(fraction[:6].ljust(6, '0')) if fraction else 0)
+    except ValueError:
+        # e.g. hour 24, which dateutil does not accept either
+        return None
+    return dt, _tzinfo(offset)
+
+@lru_cache(maxsize=64)
+def _tzinfo(offset):
+    '''Returns the tzinfo for the UTC offset string 'offset' ("Z", "+hh", "+hhmm" or
+    "+hh:mm"), or None if 'offset' is None.
+    '''
+    if offset is None:
+        return None
+    if offset == 'Z':
+        return timezone.utc
+    digits = offset[1:].replace(':', '')
+    delta = timedelta(hours=int(digits[:2]), minutes=int(digits[2:] or 0))
+    return timezone(-delta if offset[0] == '-' else delta)
+
+@lru_cache(maxsize=CACHE_SIZE)
+def utc_seconds(datestr):
+    '''Returns the integer Unix timestamp of the date/time string 'datestr', taking
+    the date and time as UTC: a UTC offset in the string is ignored, and fractions of
+    a second are dropped.  Raises ValueError if the string cannot be parsed.
+    '''
+    fields = _iso_fields(datestr)
+    dt = fields[0] if fields else dateutil.parser.parse(datestr)
+    return int(calendar.timegm(dt.timetuple()))
+
+@lru_cache(maxsize=CACHE_SIZE)
+def timestamp(datestr):
+    '''Returns the Unix timestamp, in float seconds, of the date/time string 'datestr'.
+    A string without a UTC offset is in the local time of the server.  Raises
+    ValueError if the string cannot be parsed.
+    '''
+    fields = _iso_fields(datestr)
+    if fields is None:
+        return dateutil.parser.parse(datestr).timestamp()
+    dt, tzinfo = fields
+    return dt.replace(tzinfo=tzinfo).timestamp()
+
+def utc_seconds_many(datestrs):
+    '''Returns a list of the utc_seconds() results for the sequence of date/time strings
+    'datestrs', with None for a string that cannot be parsed.  ISO 8601 strings are
+    parsed together by pandas if all the strings are in that style; otherwise each
+    distinct string is parsed once.
+    '''
+    datestrs = pd.Series(datestrs, dtype=object)
+    if len(datestrs) == 0:
+        return []
+    try:
+        if not datestrs.str.match(ISO_PATTERN).all():
+            raise ValueError('Not all ISO 8601 date/time strings')
+        # drop the UTC offsets, which are ignored, and parse the rest all at once.
+        wall_clock = datestrs.str.replace(r'\s*(Z|[+-]\d\d(:?\d\d)?)\s*$', '', regex=True)
+        parsed = pd.to_datetime(wall_clock, format='ISO8601')
+        if parsed.dt.tz is None and not parsed.isna().any():
+            return (parsed.to_numpy().astype('datetime64[s]').astype(np.int64)).tolist()
+    except (ValueError, TypeError, AttributeError):
+        pass
+
+    results = {}
+    for datestr in datestrs.unique():
+        try:
+            results[datestr] = utc_seconds(datestr)
+        except (ValueError, TypeError, OverflowError):
+            results[datestr] = None
+    return [results[datestr] for datestr in datestrs]
@@ -20,6 +20,8 @@ urlpatterns = [
             views.store_readings_radio_bridge),
     re_path(r'^readingdb/reading/store-beaded/$', views.store_readings_beaded),
     re_path(r'^readingdb/reading/store-notehub/$', views.store_readings_notehub),
+    # URL to store readings posted in the compact binary format
+    re_path(r'^readingdb/reading/store-binary/$', views.store_readings_binary),
     # Old URL pattern for storing.  Shouldn't be used for new sensors.
     re_path(r'^st8(\w+)/', views.store_reading_old),
     # gets all readings for one reading ID.
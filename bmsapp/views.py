@@ -7,8 +7,6 @@ import time
 from datetime import datetime, timedelta
 import xml.etree.ElementTree as ET
 
-import dateutil.parser
-
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render_to_response, redirect, render
 from django.contrib.auth.decorators import login_required
@@ -30,6 +28,7 @@ from bmsapp.periodic_scripts import ecobee
 import bmsapp.scripts.backup_readingdb
 from .lora import decoder
 from . import notehub
+from . import timestamps
 from bmsapp.lora_diagnostics import inoperative_gateways, gateway_location
 
 # Make a logger for this module
@@ -377,8 +376,7 @@ def store_readings_radio_bridge(request):
 
         if store_key_is_valid(storeKey):
             readings = []
-            ts = dateutil.parser.parse(
-                req_data['metadata']['time']).timestamp()
+            ts = timestamps.timestamp(req_data['metadata']['time'])
             hdw_serial = req_data['hardware_serial']
 
             pf = req_data['payload_fields']
@@ -480,6 +478,29 @@ def store_readings_beaded(request):
         _logger.exception('Error Storing Reading')
         return HttpResponse(sys.exc_info()[1])
 
+@csrf_exempt
+def store_readings_binary(request):
+    '''
+    Stores a set of sensor readings posted in the compact binary format used by
+    high-volume gateways; see 'storereads.decode_binary' for the format.  The storage
+    key is in the 'storeKey' query parameter.
+    '''
+    try:
+        # Test for a valid key for storing readings.  Key should be unique for each
+        # installation.
+        storeKey = request.GET.get('storeKey', 'bad')
+        if store_key_is_valid(storeKey):
+            msg = storereads.store_arrays(*storereads.decode_binary(request.body))
+            return HttpResponse(msg)
+        else:
+            _logger.warning(
+                'Invalid Storage Key in Reading Post: %s', storeKey)
+            return HttpResponse('Invalid Key')
+
+    except:
+        _logger.exception('Error Storing Reading')
+        return HttpResponse(sys.exc_info()[1])
+
 @csrf_exempt
 def store_readings_notehub(request):
     '''
@@ -499,8 +520,11 @@ def store_readings_notehub(request):
 
         if store_key_is_valid(storeKey):
 
-            readings = notehub.extract_readings(req_data)
-            msg = storereads.store_many({'readings': readings})
+            if notehub.get_reading_type(req_data) in notehub.ARRAY_READING_TYPES:
+                msg = storereads.store_arrays(*notehub.extract_reading_arrays(req_data))
+            else:
+                readings = notehub.extract_readings(req_data)
+                msg = storereads.store_many({'readings': readings})
             return HttpResponse(msg)
 
         else:
@@ -611,7 +635,7 @@ def get_readings(request, reading_id):
     """
 
     # open the database
-    db = bmsdata.BMSdata()
+    db = bmsdata.BMSdata(read_only=True)
     result = db.rowsForOneID(reading_id)
 
     return HttpResponse(json.dumps(result), content_type="application/json")
@@ -788,17 +812,22 @@ def merge_sensors(request):
     db = bmsdata.BMSdata()
 
     try:
-        db.cursor.execute(
-            f'SELECT min(ts) FROM [{params["sensor_to"]}]')
-        where_clause = f' WHERE ts < {db.cursor.fetchone()[0]}'
+        # only the readings earlier than the first reading of 'sensor_to' are merged;
+        # the sensor statistics give the time ranges without reading the readings.
+        stats = db.sensor_stats([sensor_from, sensor_to])
+        first_ts = stats[sensor_to]['first_ts'] if sensor_to in stats else None
+        condition = f'ts < {first_ts}' if first_ts is not None else None
     except Exception as e:
         return HttpResponse(e, status=500)
 
     if action == 'query':
         try:
-            db.cursor.execute(
-                f'SELECT COUNT(*) FROM [{params["sensor_from"]}]' + where_clause)
-            rec_ct = db.cursor.fetchone()[0]
+            if sensor_from not in stats:
+                rec_ct = 0
+            elif first_ts is None or stats[sensor_from]['last_ts'] < first_ts:
+                rec_ct = stats[sensor_from]['count']
+            else:
+                rec_ct = db.reading_count(sensor_from, condition)
         except Exception as e:
             return HttpResponse(e, status=500)
         if rec_ct == 0:
@@ -811,15 +840,14 @@ def merge_sensors(request):
             return HttpResponse(response_text)
     else:
         try:
-            db.cursor.execute(
-                f'INSERT INTO [{sensor_to}] (ts, val) SELECT ts, val FROM [{sensor_from}]' + where_clause)
+            db.merge_readings(sensor_from, sensor_to, condition)
             if delete_sensor == 'on':
-                db.cursor.execute(f'DROP TABLE [{sensor_from}]')
+                db.delete_sensor(sensor_from, commit=False)
                 qs = models.Sensor.objects.filter(
                     sensor_id=params['sensor_from'])
                 if len(qs) > 0:
                     qs[0].delete()
-            db.conn.commit()
+            db.commit()
         except Exception as e:
             return HttpResponse(e, status=500)
         return HttpResponse('Records Merged')
@@ -841,26 +869,28 @@ def delete_sensor_values(request):
     db = bmsdata.BMSdata()
     # qs = models.Sensor.objects.filter(sensor_id=params['sensor_from'])[0]
 
-    where_clause = ''
+    condition = None
 
     if delete_where == 'all_values':
         pass
     elif delete_where == 'value_equals':
-        where_clause = f'WHERE val = {where_value}'
+        condition = f'val = {where_value}'
     elif delete_where == 'values_gt':
-        where_clause = f'WHERE val > {where_value}'
+        condition = f'val > {where_value}'
     elif delete_where == 'values_lt':
-        where_clause = f'WHERE val < {where_value}'
+        condition = f'val < {where_value}'
     elif delete_where == 'dates_between':
-        where_clause = f'WHERE ts > {bmsapp.data_util.datestr_to_ts(where_start_date)} and ts < {bmsapp.data_util.datestr_to_ts(where_end_date)}'
+        condition = f'ts > {bmsapp.data_util.datestr_to_ts(where_start_date)} and ts < {bmsapp.data_util.datestr_to_ts(where_end_date)}'
     else:
         return HttpResponse(f'Invalid parameter: {delete_where}', status=406)
 
     if action == 'query':
         try:
-            db.cursor.execute(
-                f'SELECT COUNT(*) FROM [{sensor_id}] {where_clause}')
-            rec_ct = db.cursor.fetchone()[0]
+            if condition is None:
+                # all of the readings; the count is in the sensor statistics
+                rec_ct = db.sensor_stats([sensor_id]).get(sensor_id, {'count': 0})['count']
+            else:
+                rec_ct = db.reading_count(sensor_id, condition)
         except Exception as e:
             return HttpResponse(e, status=500)
         if rec_ct == 0:
@@ -869,15 +899,14 @@ def delete_sensor_values(request):
             return HttpResponse(f'Do you really want to delete {rec_ct:,} records from {sensor_id}?')
     else:
         try:
-            db.cursor.execute(
-                f'DELETE FROM [{sensor_id}] {where_clause}')
             if delete_where == 'all_values':
-                db.cursor.execute(f'DROP TABLE [{sensor_id}]')
+                db.delete_sensor(sensor_id)
                 qs = models.Sensor.objects.filter(
                     sensor_id=sensor_id)
                 if len(qs) > 0:
                     qs[0].delete()
-            db.conn.commit()
+            else:
+                db.delete_readings(sensor_id, condition)
         except Exception as e:
             return HttpResponse(repr(e), status=500)
         return HttpResponse('Records Deleted')
@@ -887,15 +916,16 @@ def delete_sensor_values(request):
 def unassigned_sensors(request):
     """Shows sensors that are in the Reading Database but not assigned to a building.
     """
-    db = bmsdata.BMSdata()
+    db = bmsdata.BMSdata(read_only=True)
     sensors_in_db = set(db.sensor_id_list())
     sensors_in_gui = set([s.sensor_id for s in models.Sensor.objects.all()])
     unassigned = sensors_in_db - sensors_in_gui
     unassigned_recs = []
+    last_reads = db.last_reads(unassigned)
     for sens_id in unassigned:
         sensor_info = {'id': sens_id, 'cur_value': '', 'minutes_ago': ''}
 
-        last_read = db.last_read(sens_id)
+        last_read = last_reads[sens_id]
         if last_read:
             val = last_read['val']
             sensor_info['cur_value'] = '%.5g' % val if abs(val) < 1e5 else str(val)
@@ -918,12 +948,11 @@ def delete_unassigned_sensor_ids(request):
         delete_count = 0
         for sensor_id in row_ids:
             try:
-                db.cursor.execute(f'DROP TABLE [{sensor_id}]')
-                db.remove_from_sensor_id_lists(sensor_id)
+                db.delete_sensor(sensor_id, commit=False)
                 delete_count += 1
             except:
                 pass
-        db.conn.commit()
+        db.commit()
     except Exception as e:
         return HttpResponse(e, status=500)
     
@@ -1066,10 +1095,13 @@ def lora_gateway_to_location(request):
 
 @login_required(login_url='../admin/login/')
 def backup_reading_db(request):
-    """Causes a backup of the sensor reading database to occur.
+    """Causes a backup of the sensor reading database to occur.  If the 'incremental'
+    query parameter is present, only the pages changed since the last full backup
+    are stored.
     """
-    bmsapp.scripts.backup_readingdb.run()
-    return HttpResponse('Sensor Reading Backup Complete!')
+    args = ('incremental',) if 'incremental' in request.GET else ()
+    stats = bmsapp.scripts.backup_readingdb.run(*args)
+    return HttpResponse('Sensor Reading Backup Complete!  %s' % bmsapp.scripts.backup_readingdb.summary(stats))
 
 def test_alert_notifications(request):
     """Send test notifications
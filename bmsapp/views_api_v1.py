@@ -241,7 +241,7 @@ def sensor_readings(request, sensor_id):
     if available.
     """
     try:
-        db = bmsdata.BMSdata()  # reading database
+        db = bmsdata.BMSdata(read_only=True)  # reading database
 
         messages = {}   # used to store input validity messages.
 
@@ -347,7 +347,7 @@ def sensor_list(request):
         if messages:
             return fail_payload(messages)
 
-        db = bmsdata.BMSdata()  # reading database
+        db = bmsdata.BMSdata(read_only=True)  # reading database
         sensors = [sensor_info(sensor_id) for sensor_id in db.sensor_id_list()]
 
         result = {
@@ -5,6 +5,7 @@ from collections import Counter
 
 import pytz
 
+import numpy as np
 import pandas as pd
 
 from django.http import JsonResponse
@@ -94,7 +95,7 @@ def sensor_readings(request):
     """
     try:
 
-        db = bmsdata.BMSdata()  # reading database
+        db = bmsdata.BMSdata(read_only=True)  # reading database
 
         messages = {}   # used to store input validity messages.
 
@@ -158,14 +159,28 @@ def sensor_readings(request):
         
         # get the sensor readings
         if averaging:
+            # the sensor statistics show which sensors have no readings in the time range
+            coverage = db.coverage(sensor_ids, int(start_ts) if start_ts else None, int(end_ts) if end_ts else None)
+
             # need to pull each column separately so we don't introduce nulls from mismatched timestamp indices
             df = pd.DataFrame()
             for sensor_id in sensor_ids:
-                df_sensor = db.dataframeForOneID(sensor_id, start_ts=start_ts, end_ts=end_ts, tz=timezone)
-                df_sensor.drop('ts', axis=1, inplace=True)    # get rid of ts column
-                df_sensor.rename(columns={'val': str(sensor_id)}, inplace=True)
-                if len(df_sensor) > 0:
-                    df_sensor = weighted_resample_timeseries(df_sensor,averaging,label_offset).dropna(how='all')
+                if coverage[str(sensor_id)]['est_count'] == 0:
+                    # no readings to average, so the column is empty
+                    df[str(sensor_id)] = np.nan
+                    continue
+                # averages of an hour or more come from the rollups, if possible
+                df_sensor = db.dataframeFromRollups(sensor_id, averaging, label_offset, start_ts=start_ts, end_ts=end_ts, tz=timezone)
+                if df_sensor is not None:
+                    df_sensor.drop('ts', axis=1, inplace=True)    # get rid of ts column
+                    df_sensor.rename(columns={'val': str(sensor_id)}, inplace=True)
+                    df_sensor = df_sensor.dropna(how='all')
+                else:
+                    df_sensor = db.dataframeForOneID(sensor_id, start_ts=start_ts, end_ts=end_ts, tz=timezone)
+                    df_sensor.drop('ts', axis=1, inplace=True)    # get rid of ts column
+                    df_sensor.rename(columns={'val': str(sensor_id)}, inplace=True)
+                    if len(df_sensor) > 0:
+                        df_sensor = weighted_resample_timeseries(df_sensor,averaging,label_offset).dropna(how='all')
                 df = df.merge(df_sensor,how='outer',left_index=True,right_index=True)
         else:
             df = db.dataframeForMultipleIDs(sensor_ids, start_ts=start_ts, end_ts=end_ts, tz=timezone)
@@ -215,7 +230,7 @@ def sensors(request):
         #------ Check the query parameters
         messages = invalid_query_params(request, ['sensor_id'])
         # get a list of all the Sensor IDs in the reading database
-        db = bmsdata.BMSdata()  # reading database
+        db = bmsdata.BMSdata(read_only=True)  # reading database
         all_sensor_ids = db.sensor_id_list()
 
         # determine the list of Sensor IDs requested by this call